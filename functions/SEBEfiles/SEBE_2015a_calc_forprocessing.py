@@ -2,14 +2,25 @@ from builtins import range
 import numpy as np
 from ...util.SEBESOLWEIGCommonFiles.shadowingfunction_wallheight_13 import shadowingfunction_wallheight_13
 from ...util.SEBESOLWEIGCommonFiles.shadowingfunction_wallheight_23 import shadowingfunction_wallheight_23
+from ...util.SEBESOLWEIGCommonFiles.shadow_cache import ShadowCache
+from ...util import parallel
+from concurrent.futures import ProcessPoolExecutor
 import linecache
 import sys
 
 def SEBE_2015a_calc(a, scale, slope, aspect, voxelheight, sizey, sizex, vegdem, vegdem2, walls, dirwalls, albedo, psi, 
-                radmatI, radmatD, radmatR, usevegdem, feedback, wallmaxheight):
+                radmatI, radmatD, radmatR, usevegdem, feedback, wallmaxheight, shadowcache=None, timebins=0, workers=1):
+    '''
+    timebins: number of time bins in radmatI, radmatD and radmatR (columns 3 onwards, see sunmapcreator_2015a).
+    Irradiance of each time bin is accumulated from the same shadows as the annual irradiance and returned as
+    Energyroofbins (rows x cols x timebins) and Energywallbins (row, col and mean irradiance of the wall
+    sections in each time bin).
+    '''
 
     # Parameters
     deg2rad = np.pi/180
+    if shadowcache is None:
+        shadowcache = ShadowCache(None)
     Knight = np.zeros((sizex, sizey))
     Energyyearroof = np.copy(Knight)
 
@@ -29,6 +40,8 @@ def SEBE_2015a_calc(a, scale, slope, aspect, voxelheight, sizey, sizex, vegdem,
         bush = np.logical_not((vegdem2*vegdem))*vegdem
     else:
         psi = 1
+        amaxvalue = 0
+        bush = None
 
     # Creating wallmatrix (1 meter interval)
     wallcol, wallrow = np.where(np.transpose(walls) > 0)    # row and col for each wall pixel
@@ -43,12 +56,15 @@ def SEBE_2015a_calc(a, scale, slope, aspect, voxelheight, sizey, sizex, vegdem,
     wallmatrix = np.zeros((np.shape(wallrow)[0], int(wallsections)))
     Energyyearwall = np.copy(wallmatrix)
 
+    # Time bins
+    Energyroofbins = np.zeros((sizex, sizey, timebins))
+    Energywallbins = np.zeros((np.shape(wallrow)[0], timebins))
+
     # Main loop - Creating skyvault of patches of constant radians (Tregeneza and Sharples, 1993)
     skyvaultaltint = np.array([6, 18, 30, 42, 54, 66, 78, 90])
     aziinterval = np.array([30, 30, 24, 24, 18, 12, 6, 1])
 
     if usevegdem == 1:
-        wallshve = np.zeros(np.shape(a))
         vegrow, vegcol = np.where(vegdem > 0)  # row and col for each veg pixel
         vegdata = np.zeros((np.shape(vegrow)[0], 3))
         for i in range(0, vegrow.shape[0] - 1):
@@ -58,88 +74,84 @@ def SEBE_2015a_calc(a, scale, slope, aspect, voxelheight, sizey, sizex, vegdem,
     else:
         vegdata = 0
 
-    index = 0
-    for i in range(skyvaultaltint.size):
-        for j in range(aziinterval[i]):
-
-            feedback.setProgress(int(index * (100. / 145.)))
-
-            if feedback.isCanceled():
-                feedback.setProgressText("Calculation cancelled")
-                break
-
-            #################### SOLAR RADIATION POSITIONS ###################
-            #Solar Incidence angle (Roofs)
-            suniroof = np.sin(slope) * np.cos(radmatI[index, 0] * deg2rad) * \
-                        np.cos((radmatI[index, 1]*deg2rad)-aspect) + \
-                        np.cos(slope) * np.sin((radmatI[index, 0] * deg2rad))
-
-            suniroof[suniroof < 0] = 0
-
-            # Solar Incidence angle (Walls)
-            suniwall = np.abs(np.sin(np.pi/2) * np.cos(radmatI[index, 0] * deg2rad) *
-                                np.cos((radmatI[index, 1] * deg2rad) - dirwalls*deg2rad) + np.cos(np.pi/2) *
-                                np.sin((radmatI[index, 0] * deg2rad)))
-
-            # Shadow image
-            if usevegdem == 1:
-                vegsh, sh, _, wallsh, wallsun, wallshve, _, facesun = shadowingfunction_wallheight_23(a,
-                                    vegdem, vegdem2, radmatI[index, 1], radmatI[index, 0], scale, amaxvalue,
-                                                                                bush, walls, dirwalls * deg2rad)
-                shadow = np.copy(sh-(1.-vegsh)*(1.-psi))
-            else:
-                sh, wallsh, wallsun, facesh, facesun = shadowingfunction_wallheight_13(a, radmatI[index, 1],
-                                                            radmatI[index, 0], scale, walls, dirwalls * deg2rad)
-                shadow = np.copy(sh)
-
-            # roof irradiance calculation
-            # direct radiation
-            if radmatI[index, 2] > 0:
-                I = shadow * radmatI[index, 2] * suniroof
-            else:
-                I = np.copy(Knight)
-
-            # roof diffuse and reflected radiation
-            D = radmatD[index, 2] * shadow
-            R = radmatR[index, 2] * (shadow*-1 + 1)
-
-            Energyyearroof = np.copy(Energyyearroof+D+R+I)
-
-            # WALL IRRADIANCE
-            # direct radiation
-            if radmatI[index, 2] > 0:
-                Iw = radmatI[index, 2] * suniwall    # wall
-            else:
-                Iw = np.copy(Knight)
-
-            # wall diffuse and reflected radiation
-            Dw = radmatD[index, 2] * facesun
-            Rw = radmatR[index, 2] * facesun
-
-            # for each wall level (voxelheight interval)
-            wallsun = np.floor(wallsun*(1/voxelheight)) * voxelheight
-            wallsh = np.floor(wallsh*(1/voxelheight)) * voxelheight
-            if usevegdem == 1:
-                wallshve = np.floor(wallshve*(1/voxelheight)) * voxelheight
-
-            wallmatrix = wallmatrix * 0
-
-            for p in range(np.shape(wallmatrix)[0]):
-                if wallsun[wallrow[p], wallcol[p]] > 0:    # Sections in sun
-                    if wallsun[int(wallrow[p]), int(wallcol[p])] == wallstot[int(wallrow[p]), int(wallcol[p])]:  # All sections in sun
-                        wallmatrix[p, 0:int(wallstot[int(wallrow[p]), int(wallcol[p])] / voxelheight)] = Iw[wallrow[p], wallcol[p]] + Dw[wallrow[p], wallcol[p]] + Rw[wallrow[p], wallcol[p]]
-                    else:
-                        wallmatrix[p, int((wallstot[wallrow[p], wallcol[p]] - wallsun[wallrow[p], wallcol[p]]) / voxelheight) - 1:int(wallstot[wallrow[p], wallcol[p]] / voxelheight)] = Iw[wallrow[p], wallcol[p]] + Dw[wallrow[p], wallcol[p]] + Rw[wallrow[p], wallcol[p]]
-
-                if usevegdem == 1 and wallshve[wallrow[p], wallcol[p]] > 0:    # sections in vegetation shade
-                    wallmatrix[p, 0:int((wallshve[int(wallrow[p]), int(wallcol[p])] + wallsh[int(wallrow[p]), int(wallcol[p])]) / voxelheight)] = (Iw[wallrow[p], wallcol[p]] + Dw[wallrow[p], wallcol[p]])*psi
-
-                if wallsh[wallrow[p], wallcol[p]] > 0:    # sections in building shade
-                    wallmatrix[p, 0:int(wallsh[wallrow[p], wallcol[p]] / voxelheight)] = Rw[wallrow[p], wallcol[p]]
-
-            Energyyearwall = Energyyearwall + np.copy(wallmatrix)
-
-            index = index + 1
+    # Shadows and wall sections of each patch, cast in a process pool if workers > 1
+    npatches = int(np.sum(aziinterval))
+    shadowargs = (a, vegdem, vegdem2, scale, amaxvalue, bush, walls, dirwalls, psi, usevegdem, voxelheight, wallrow,
+                  wallcol, wallstot, wallmatrix.shape[1], shadowcache)
+    if workers > 1:
+        patchshadows = sebe_shadows_parallel(radmatI[:npatches, 1], radmatI[:npatches, 0], workers, *shadowargs)
+    else:
+        patchshadows = ((index, *sebe_patch_shadows(radmatI[index, 1], radmatI[index, 0], *shadowargs))
+                        for index in range(npatches))
+
+    for index, shadow, facesun, sections in patchshadows:
+
+        feedback.setProgress(int(index * (100. / 145.)))
+
+        if feedback.isCanceled():
+            feedback.setProgressText("Calculation cancelled")
+            break
+
+        #################### SOLAR RADIATION POSITIONS ###################
+        #Solar Incidence angle (Roofs)
+        suniroof = np.sin(slope) * np.cos(radmatI[index, 0] * deg2rad) * \
+                    np.cos((radmatI[index, 1]*deg2rad)-aspect) + \
+                    np.cos(slope) * np.sin((radmatI[index, 0] * deg2rad))
+
+        suniroof[suniroof < 0] = 0
+
+        # Solar Incidence angle (Walls)
+        suniwall = np.abs(np.sin(np.pi/2) * np.cos(radmatI[index, 0] * deg2rad) *
+                            np.cos((radmatI[index, 1] * deg2rad) - dirwalls*deg2rad) + np.cos(np.pi/2) *
+                            np.sin((radmatI[index, 0] * deg2rad)))
+
+        # roof irradiance calculation
+        # direct radiation
+        if radmatI[index, 2] > 0:
+            I = shadow * radmatI[index, 2] * suniroof
+        else:
+            I = np.copy(Knight)
+
+        # roof diffuse and reflected radiation
+        D = radmatD[index, 2] * shadow
+        R = radmatR[index, 2] * (shadow*-1 + 1)
+
+        Energyyearroof = np.copy(Energyyearroof+D+R+I)
+
+        # WALL IRRADIANCE
+        # direct radiation
+        if radmatI[index, 2] > 0:
+            Iw = radmatI[index, 2] * suniwall    # wall
+        else:
+            Iw = np.copy(Knight)
+
+        # wall diffuse and reflected radiation
+        Dw = radmatD[index, 2] * facesun
+        Rw = radmatR[index, 2] * facesun
+
+        wallmatrix = wall_voxels(sections, Iw[wallrow, wallcol], Dw[wallrow, wallcol], Rw[wallrow, wallcol], psi)
+
+        Energyyearwall = Energyyearwall + np.copy(wallmatrix)
+
+        # Time bins, from the same shadows
+        if timebins > 0:
+            binI = np.maximum(radmatI[index, 3:3 + timebins], 0)
+            binD = radmatD[index, 3:3 + timebins]
+            binR = radmatR[index, 3:3 + timebins]
+
+            Energyroofbins += (shadow * suniroof)[:, :, np.newaxis] * binI + shadow[:, :, np.newaxis] * binD + \
+                              (shadow * -1 + 1)[:, :, np.newaxis] * binR
+
+            # Number of sunlit, vegetation shaded and building shaded sections of each wall pixel
+            sunlit = np.count_nonzero(sections == 1, axis=1)[:, np.newaxis]
+            vegshaded = np.count_nonzero(sections == 2, axis=1)[:, np.newaxis]
+            shaded = np.count_nonzero(sections == 3, axis=1)[:, np.newaxis]
+            Iwbin = suniwall[wallrow, wallcol][:, np.newaxis] * binI
+            Dwbin = facesun[wallrow, wallcol][:, np.newaxis] * binD
+            Rwbin = facesun[wallrow, wallcol][:, np.newaxis] * binR
+            Energywallbins += sunlit * (Iwbin + Dwbin + Rwbin) + vegshaded * (Iwbin + Dwbin) * psi + shaded * Rwbin
+
+    patchshadows.close()  # shuts down the process pool of a parallel run, also after cancelling
 
     # Including radiation from ground on walls as well as removing pixels high than walls
     # fix_print_with_import
@@ -152,4 +164,195 @@ def SEBE_2015a_calc(a, scale, slope, aspect, voxelheight, sizey, sizex, vegdem,
 
     seberesult = {'Energyyearroof': Energyyearroof, 'Energyyearwall': Energyyearwall, 'vegdata': vegdata}
 
-    return seberesult
\ No newline at end of file
+    if timebins > 0:
+        # Mean of the wall sections (the same sections as Energyyearwall), including radiation from ground
+        wallsectionstot = np.sum(wallmatrixbol, axis=1)[:, np.newaxis]
+        Energywallbins = Energywallbins + wallsectionstot * (np.sum(radmatR[:, 3:3 + timebins], axis=0) * albedo) / 2
+        Energywallbins = np.divide(Energywallbins, wallsectionstot, out=np.zeros(Energywallbins.shape),
+                                   where=wallsectionstot > 0)
+
+        seberesult['Energyroofbins'] = Energyroofbins / 1000
+        seberesult['Energywallbins'] = np.hstack((wallrow[:, np.newaxis] + 1, wallcol[:, np.newaxis] + 1,
+                                                  Energywallbins / 1000))
+
+    return seberesult
+
+
+def sebe_patch_shadows(azimuth, altitude, a, vegdem, vegdem2, scale, amaxvalue, bush, walls, dirwalls, psi,
+                       usevegdem, voxelheight, wallrow, wallcol, wallstot, wallsections, shadowcache):
+    # Shadow, sunlit wall faces and wall sections (see wall_sections) for one sky patch
+    sh, vegsh, facesun, sections = sebe_patch_masks(azimuth, altitude, a, vegdem, vegdem2, scale, amaxvalue, bush,
+                                                    walls, dirwalls, usevegdem, voxelheight, wallrow, wallcol,
+                                                    wallstot, wallsections, shadowcache)
+    return patch_shadow(sh, vegsh, psi), facesun, sections
+
+
+def patch_shadow(sh, vegsh, psi):
+    # Shadow image, vegetation shadows weighted by the transmissivity psi
+    if vegsh is None:
+        return np.copy(sh)
+    else:
+        return np.copy(sh-(1.-vegsh)*(1.-psi))
+
+
+def sebe_patch_masks(azimuth, altitude, a, vegdem, vegdem2, scale, amaxvalue, bush, walls, dirwalls, usevegdem,
+                     voxelheight, wallrow, wallcol, wallstot, wallsections, shadowcache):
+    # Building and vegetation shadows (None without vegetation), sunlit wall faces (all 0 or 1) and wall sections
+    # for one sky patch
+    deg2rad = np.pi/180
+
+    if usevegdem == 1:
+        vegsh, sh, _, wallsh, wallsun, wallshve, _, facesun = shadowcache.shadowingfunction_wallheight_23(a,
+                            vegdem, vegdem2, azimuth, altitude, scale, amaxvalue, bush, walls, dirwalls * deg2rad)
+    else:
+        sh, wallsh, wallsun, facesh, facesun = shadowcache.shadowingfunction_wallheight_13(a, azimuth, altitude,
+                                                    scale, walls, dirwalls * deg2rad)
+        vegsh = None
+
+    # for each wall level (voxelheight interval)
+    wallsun = np.floor(wallsun*(1/voxelheight)) * voxelheight
+    wallsh = np.floor(wallsh*(1/voxelheight)) * voxelheight
+    if usevegdem == 1:
+        wallshve = np.floor(wallshve*(1/voxelheight)) * voxelheight
+
+    sections = wall_sections(wallsun[wallrow, wallcol], wallsh[wallrow, wallcol], wallstot[wallrow, wallcol],
+                             voxelheight, wallsections, wallshve[wallrow, wallcol] if usevegdem == 1 else None)
+
+    return sh, vegsh, facesun, sections
+
+
+# Worker state for parallel SEBE, set by _sebe_worker_init in each worker process
+_sebe_worker = {}
+
+
+def _sebe_worker_init(grid_specs, out_specs, args):
+    blocks = []
+    grids = []
+    for spec in grid_specs:
+        if spec is None:
+            grids.append(None)
+        else:
+            shm, grid = parallel.attach_array(spec)
+            blocks.append(shm)
+            grids.append(grid)
+    outs = []
+    for spec in out_specs:
+        shm, out = parallel.attach_array(spec)
+        blocks.append(shm)
+        outs.append(out)
+    _sebe_worker['blocks'] = blocks
+    _sebe_worker['grids'] = grids
+    _sebe_worker['out'] = outs
+    _sebe_worker['args'] = args
+
+
+def _sebe_worker_task(half, slots, azimuths, altitudes):
+    # Casts shadows for a group of patches and writes them into the shared output slots
+    a, vegdem, vegdem2, bush, walls, dirwalls = _sebe_worker['grids']
+    scale, amaxvalue, usevegdem, voxelheight, wallrow, wallcol, wallstot, wallsections, shadowcache = \
+        _sebe_worker['args']
+    masksout, sectionsout = _sebe_worker['out']
+    for slot, azimuth, altitude in zip(slots, azimuths, altitudes):
+        sh, vegsh, facesun, sections = sebe_patch_masks(azimuth, altitude, a, vegdem, vegdem2, scale, amaxvalue, bush,
+                                                        walls, dirwalls, usevegdem, voxelheight, wallrow, wallcol,
+                                                        wallstot, wallsections, shadowcache)
+        masksout[half, 0, slot] = sh
+        masksout[half, 1, slot] = facesun
+        if vegsh is not None:
+            masksout[half, 2, slot] = vegsh
+        sectionsout[half, slot] = sections
+
+
+def sebe_shadows_parallel(azimuths, altitudes, workers, a, vegdem, vegdem2, scale, amaxvalue, bush, walls, dirwalls,
+                          psi, usevegdem, voxelheight, wallrow, wallcol, wallstot, wallsections, shadowcache):
+    """
+    Process-pool version of sebe_patch_shadows for all sky patches.
+
+    DSM, vegetation and wall grids are shared with the workers through shared memory. Patches are cast in
+    rounds of a few per worker (see parallel.rounds) and yielded in patch order as (index, shadow, facesun,
+    sections), so the irradiance is summed in the same order as in a serial run and results are bit-identical.
+    The workers pass back the building and vegetation shadows and sunlit wall faces as uint8 and the shadow
+    image is made from them here.
+    """
+    rows = a.shape[0]
+    cols = a.shape[1]
+    npatches = len(azimuths)
+    nlayers = 3 if usevegdem == 1 else 2
+    roundsize = parallel.round_size(workers, npatches, nlayers * rows * cols + wallrow.shape[0] * int(wallsections))
+
+    blocks = []
+    grid_specs = []
+    for grid, shared in ((a, True), (vegdem, usevegdem == 1), (vegdem2, usevegdem == 1), (bush, usevegdem == 1),
+                         (walls, True), (dirwalls, True)):
+        if shared:
+            shm, _, spec = parallel.share_array(grid)
+            blocks.append(shm)
+            grid_specs.append(spec)
+        else:
+            grid_specs.append(None)
+    outs = []
+    out_specs = []
+    # Building shadows, sunlit wall faces and vegetation shadows, and wall sections
+    for shape, dtype in (((2, nlayers, roundsize, rows, cols), np.uint8),
+                         ((2, roundsize, wallrow.shape[0], int(wallsections)), np.int8)):
+        shm, out, spec = parallel.empty_shared_array(shape, dtype)
+        blocks.append(shm)
+        outs.append(out)
+        out_specs.append(spec)
+    masksout, sectionsout = outs
+
+    args = (scale, amaxvalue, usevegdem, voxelheight, wallrow, wallcol, wallstot, wallsections, shadowcache)
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=parallel.process_context(),
+                               initializer=_sebe_worker_init, initargs=(grid_specs, out_specs, args))
+    try:
+        for half, start, stop in parallel.rounds(pool, _sebe_worker_task, npatches, roundsize, workers, azimuths,
+                                                 altitudes):
+            for index in range(start, stop):
+                sh = masksout[half, 0, index - start].astype(float)
+                vegsh = masksout[half, 2, index - start].astype(float) if usevegdem == 1 else None
+                yield index, patch_shadow(sh, vegsh, psi), masksout[half, 1, index - start].astype(float), \
+                      sectionsout[half, index - start].copy()
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+        del masksout, sectionsout, outs
+        parallel.release_shared(blocks)
+
+
+def wall_sections(wallsun, wallsh, wallstot, voxelheight, wallsections, wallshve=None):
+    # Sections (voxelheight intervals) of all wall pixels (wall pixels x sections) that are sunlit (1), in
+    # vegetation shade (2) or in building shade (3). The heights are converted to index ranges along the wall and
+    # assigned in that order, as in the original loop over wall pixels.
+    levels = np.arange(wallsections)
+
+    def ranges(start, stop):
+        # Sections of wallmatrix[p, start:stop], start and stop as in Python slicing
+        start = np.where(start < 0, np.maximum(start + wallsections, 0), np.minimum(start, wallsections))
+        stop = np.where(stop < 0, np.maximum(stop + wallsections, 0), np.minimum(stop, wallsections))
+        return (levels >= start[:, np.newaxis]) & (levels < stop[:, np.newaxis])
+
+    def index(height):
+        # int() of the number of sections
+        return np.trunc(height / voxelheight).astype(np.int64)
+
+    top = index(wallstot)
+    sections = np.zeros((wallstot.shape[0], int(wallsections)), dtype=np.int8)
+
+    # Sections in sun, all sections or from the top of the building shade
+    start = np.where(wallsun == wallstot, 0, index(wallstot - wallsun) - 1)
+    sections[ranges(start, top) & (wallsun > 0)[:, np.newaxis]] = 1
+
+    # Sections in vegetation shade
+    if wallshve is not None:
+        sections[ranges(np.zeros_like(top), index(wallshve + wallsh)) & (wallshve > 0)[:, np.newaxis]] = 2
+
+    # Sections in building shade
+    sections[ranges(np.zeros_like(top), index(wallsh)) & (wallsh > 0)[:, np.newaxis]] = 3
+
+    return sections
+
+
+def wall_voxels(sections, Iw, Dw, Rw, psi=1.):
+    # Irradiance on each wall section (wall pixels x sections, see wall_sections). Sunlit sections get
+    # Iw + Dw + Rw, sections in vegetation shade (Iw + Dw) * psi and sections in building shade Rw.
+    irradiance = np.stack((np.zeros(Iw.shape), Iw + Dw + Rw, (Iw + Dw) * psi, Rw), axis=1)
+    return np.take_along_axis(irradiance, sections.astype(np.intp), axis=1)
@@ -1,6 +1,7 @@
 from __future__ import division
 from __future__ import absolute_import
 from builtins import range
+import datetime
 import numpy as np
 from ...util.SEBESOLWEIGCommonFiles.diffusefraction import diffusefraction
 from ...util.SEBESOLWEIGCommonFiles.Perez_v3 import Perez_v3
@@ -12,6 +13,10 @@ def sunmapcreator_2015a(met, altitude, azimuth, onlyglobal, output, jday, albedo
     """
     % This function creates a sun map based on hourly values of solar radiation.
 
+    Column 2 of radmatI, radmatD and radmatR is the irradiance of the whole period. Columns 3 onwards are time
+    bins: months if output['energymonth'] == 1 or hours of the day if output['energyhour'] == 1 (see
+    sunmap_timebins).
+
     :param met:
     :param altitude: 2D array
     :param azimuth:
@@ -54,9 +59,12 @@ def sunmapcreator_2015a(met, altitude, azimuth, onlyglobal, output, jday, albedo
     for j in range(len(aziinterval)):
         iangle2 = np.append(iangle2, skyvaultaltint[j] * np.ones([1, aziinterval[j]]))
 
-    radmatI = np.transpose(np.vstack((iangle2, skyvaultazi, np.zeros((13, len(iangle2))))))
-    radmatD = np.transpose(np.vstack((iangle2, skyvaultazi, np.zeros((13, len(iangle2))))))
-    radmatR = np.transpose(np.vstack((iangle2, skyvaultazi, np.zeros((13, len(iangle2))))))
+    # Time bin of each time step
+    timebin, timebins = sunmap_timebins(met, output)
+
+    radmatI = np.transpose(np.vstack((iangle2, skyvaultazi, np.zeros((1 + timebins, len(iangle2))))))
+    radmatD = np.transpose(np.vstack((iangle2, skyvaultazi, np.zeros((1 + timebins, len(iangle2))))))
+    radmatR = np.transpose(np.vstack((iangle2, skyvaultazi, np.zeros((1 + timebins, len(iangle2))))))
 
     iazimuth = skyvaultazi
     # Ta = met[:, 11]
@@ -99,10 +107,10 @@ def sunmapcreator_2015a(met, altitude, azimuth, onlyglobal, output, jday, albedo
             #         Gyear=Gyear+(G*sin(altitude(i)*(pi/180)));
             #         Dyear=Dyear+D;
 
-            if output['energymonth'] == 1:
-                radmatI[azipos2, met[i, 1] + 2] = radmatI[azipos2, met[i, 1] + 2] + I
-                radmatD[:, met[i, 1] + 2] = radmatD[:, met[i, 1] + 2] + D*lv[:, 2]
-                radmatR[:, met[i, 1] + 2] = radmatR[:, met[i, 1] + 2] + G*(1/145)*albedo
+            if timebin is not None:
+                radmatI[azipos2, timebin[i] + 3] = radmatI[azipos2, timebin[i] + 3] + I
+                radmatD[:, timebin[i] + 3] = radmatD[:, timebin[i] + 3] + D*lv[:, 2]
+                radmatR[:, timebin[i] + 3] = radmatR[:, timebin[i] + 3] + G*(1/145)*albedo
                 #             Gmonth(met(i,2))=Gmonth(met(i,2))+(G*sin(altitude(i)*(pi/180)));
                 #             Dmonth(met(i,2))=Dmonth(met(i,2))+D;
 
@@ -115,9 +123,9 @@ def sunmapcreator_2015a(met, altitude, azimuth, onlyglobal, output, jday, albedo
 
     if np.shape(met)[0] > 8760:
         multiyear = np.shape(met)[0]/8760
-        radmatI[:, 2:15] = radmatI[:, 2:15]/multiyear
-        radmatD[:, 2:15] = radmatD[:, 2:15]/multiyear
-        radmatR[:, 2:15] = radmatR[:, 2:15]/multiyear
+        radmatI[:, 2:] = radmatI[:, 2:]/multiyear
+        radmatD[:, 2:] = radmatD[:, 2:]/multiyear
+        radmatR[:, 2:] = radmatR[:, 2:]/multiyear
 
     #     Gyear=Gyear/multiyear;
     #     Dyear=Dyear/multiyear;
@@ -151,3 +159,19 @@ def sunmapcreator_2015a(met, altitude, azimuth, onlyglobal, output, jday, albedo
     # radmat=[iangle2;iazimuth;zeros(13,length(iangle2))]';
 
     return radmatI, radmatD, radmatR
+
+
+def sunmap_timebins(met, output):
+    """
+    Time bin of each time step in met (None if no time bins are used) and the number of time bins.
+    Months (0-11) if output['energymonth'] == 1, hours of the day (0-23) if output['energyhour'] == 1.
+    Without time bins, 12 empty columns are kept as before.
+    """
+    if output.get('energyhour', 0) == 1:
+        return np.mod(met[:, 2].astype(int), 24), 24
+    elif output.get('energymonth', 0) == 1:
+        months = [(datetime.date(int(year), 1, 1) + datetime.timedelta(int(doy) - 1)).month - 1
+                  for year, doy in zip(met[:, 0], met[:, 1])]
+        return np.array(months, dtype=int), 12
+    else:
+        return None, 12
@@ -8,7 +8,7 @@ def Kside_veg_v2022a(radI,radD,radG,
                     azimuth,altitude,psi,t,albedo,F_sh,
                     KupE,KupS,KupW,KupN,
                     cyl,lv,anisotropic_diffuse,diffsh,rows,cols,asvf,
-                    shmat, vegshmat, vbshvegshmat):
+                    shmat, vegshmat, vbshvegshmat, geometry=None):
 
     # New reflection equation 2012-05-25
     vikttot=4.4897
@@ -66,16 +66,23 @@ def Kside_veg_v2022a(radI,radD,radG,
         KsideI=shadow*0
 
     ### Diffuse and reflected radiation ###
-    [viktveg,viktwall]=Kvikt_veg(svfE,svfEveg,vikttot)
+    # weights from svf, precalculated for the run in geometry (SolweigGeometry)
+    if geometry is None:
+        kvikt = [Kvikt_veg(svfE,svfEveg,vikttot), Kvikt_veg(svfS,svfSveg,vikttot), Kvikt_veg(svfW,svfWveg,vikttot),
+                 Kvikt_veg(svfN,svfNveg,vikttot)]
+    else:
+        kvikt = geometry.kvikt
+
+    [viktveg,viktwall]=kvikt[0]
     svfviktbuvegE=(viktwall+(viktveg)*(1-psi))
 
-    [viktveg,viktwall]=Kvikt_veg(svfS,svfSveg,vikttot)
+    [viktveg,viktwall]=kvikt[1]
     svfviktbuvegS=(viktwall+(viktveg)*(1-psi))
 
-    [viktveg,viktwall]=Kvikt_veg(svfW,svfWveg,vikttot)
+    [viktveg,viktwall]=kvikt[2]
     svfviktbuvegW=(viktwall+(viktveg)*(1-psi))
 
-    [viktveg,viktwall]=Kvikt_veg(svfN,svfNveg,vikttot)
+    [viktveg,viktwall]=kvikt[3]
     svfviktbuvegN=(viktwall+(viktveg)*(1-psi))
 
     ### Anisotropic Diffuse Radiation after Perez et al. 1993 ###
@@ -2,17 +2,26 @@ from __future__ import absolute_import
 import numpy as np
 from .Lvikt_veg import Lvikt_veg
 
-def Lside_veg_v2022a(svfS,svfW,svfN,svfE,svfEveg,svfSveg,svfWveg,svfNveg,svfEaveg,svfSaveg,svfWaveg,svfNaveg,azimuth,altitude,Ta,Tw,SBC,ewall,Ldown,esky,t,F_sh,CI,LupE,LupS,LupW,LupN,anisotropic_longwave):
+def Lside_veg_v2022a(svfS,svfW,svfN,svfE,svfEveg,svfSveg,svfWveg,svfNveg,svfEaveg,svfSaveg,svfWaveg,svfNaveg,azimuth,altitude,Ta,Tw,SBC,ewall,Ldown,esky,t,F_sh,CI,LupE,LupS,LupW,LupN,anisotropic_longwave,geometry=None):
 
     # This m-file is the current one that estimates L from the four cardinal points 20100414
     
-    #Building height angle from svf
-    svfalfaE=np.arcsin(np.exp((np.log(1-svfE))/2))
-    svfalfaS=np.arcsin(np.exp((np.log(1-svfS))/2))
-    svfalfaW=np.arcsin(np.exp((np.log(1-svfW))/2))
-    svfalfaN=np.arcsin(np.exp((np.log(1-svfN))/2))
-    
     vikttot=4.4897
+
+    # weights from svf and building height angle from svf, precalculated for the run in geometry (SolweigGeometry)
+    if geometry is None:
+        svfalfaE=np.arcsin(np.exp((np.log(1-svfE))/2))
+        svfalfaS=np.arcsin(np.exp((np.log(1-svfS))/2))
+        svfalfaW=np.arcsin(np.exp((np.log(1-svfW))/2))
+        svfalfaN=np.arcsin(np.exp((np.log(1-svfN))/2))
+        lvikt = [Lvikt_veg(svfE, svfEveg, svfEaveg, vikttot), Lvikt_veg(svfS, svfSveg, svfSaveg, vikttot),
+                 Lvikt_veg(svfW, svfWveg, svfWaveg, vikttot), Lvikt_veg(svfN, svfNveg, svfNaveg, vikttot)]
+        alfaBs = [np.arctan(svfalfaE), np.arctan(svfalfaS), np.arctan(svfalfaW), np.arctan(svfalfaN)]
+    else:
+        svfalfaE, svfalfaS, svfalfaW, svfalfaN = geometry.svfalfaside
+        lvikt = geometry.lvikt
+        alfaBs = geometry.alfaB
+    
     aziW=azimuth+t
     aziN=azimuth-90+t
     aziE=azimuth-180+t
@@ -24,10 +33,10 @@ def Lside_veg_v2022a(svfS,svfW,svfN,svfE,svfEveg,svfSveg,svfWveg,svfNveg,svfEave
     Lsky_allsky = esky*SBC*((Ta+273.15)**4)*(1-c)+c*SBC*((Ta+273.15)**4)
     
     ## Least
-    [viktveg, viktwall, viktsky, viktrefl] = Lvikt_veg(svfE, svfEveg, svfEaveg, vikttot)
+    [viktveg, viktwall, viktsky, viktrefl] = lvikt[0]
     
     if altitude > 0:  # daytime
-        alfaB=np.arctan(svfalfaE)
+        alfaB=alfaBs[0]
         betaB=np.arctan(np.tan((svfalfaE)*F_sh))
         betasun=((alfaB-betaB)/2)+betaB
         # betasun = np.arctan(0.5*np.tan(svfalfaE)*(1+F_sh)) #TODO This should be considered in future versions
@@ -56,10 +65,10 @@ def Lside_veg_v2022a(svfS,svfW,svfN,svfE,svfEveg,svfSveg,svfWveg,svfNveg,svfEave
     # clear alfaB betaB betasun Lsky Lwallsh Lwallsun Lveg Lground Lrefl viktveg viktwall viktsky
     
     ## Lsouth
-    [viktveg,viktwall,viktsky,viktrefl]=Lvikt_veg(svfS,svfSveg,svfSaveg,vikttot)
+    [viktveg,viktwall,viktsky,viktrefl]=lvikt[1]
     
     if altitude>0: # daytime
-        alfaB=np.arctan(svfalfaS)
+        alfaB=alfaBs[1]
         betaB=np.arctan(np.tan((svfalfaS)*F_sh))
         betasun=((alfaB-betaB)/2)+betaB
         # betasun = np.arctan(0.5*np.tan(svfalfaS)*(1+F_sh))
@@ -88,10 +97,10 @@ def Lside_veg_v2022a(svfS,svfW,svfN,svfE,svfEveg,svfSveg,svfWveg,svfNveg,svfEave
     # clear alfaB betaB betasun Lsky Lwallsh Lwallsun Lveg Lground Lrefl viktveg viktwall viktsky
     
     ## Lwest
-    [viktveg,viktwall,viktsky,viktrefl]=Lvikt_veg(svfW,svfWveg,svfWaveg,vikttot)
+    [viktveg,viktwall,viktsky,viktrefl]=lvikt[2]
     
     if altitude>0: # daytime
-        alfaB=np.arctan(svfalfaW)
+        alfaB=alfaBs[2]
         betaB=np.arctan(np.tan((svfalfaW)*F_sh))
         betasun=((alfaB-betaB)/2)+betaB
         # betasun = np.arctan(0.5*np.tan(svfalfaW)*(1+F_sh))
@@ -120,10 +129,10 @@ def Lside_veg_v2022a(svfS,svfW,svfN,svfE,svfEveg,svfSveg,svfWveg,svfNveg,svfEave
     # clear alfaB betaB betasun Lsky Lwallsh Lwallsun Lveg Lground Lrefl viktveg viktwall viktsky
     
     ## Lnorth
-    [viktveg,viktwall,viktsky,viktrefl]=Lvikt_veg(svfN,svfNveg,svfNaveg,vikttot)
+    [viktveg,viktwall,viktsky,viktrefl]=lvikt[3]
     
     if altitude>0: # daytime
-        alfaB=np.arctan(svfalfaN)
+        alfaB=alfaBs[3]
         betaB=np.arctan(np.tan((svfalfaN)*F_sh))
         betasun=((alfaB-betaB)/2)+betaB
         # betasun = np.arctan(0.5*np.tan(svfalfaN)*(1+F_sh))
@@ -18,29 +18,26 @@ def calculate_PET_index(Ta, Pa, Tmrt, va, pet):
         for x in range(pet_index.shape[1]):
             pet_index[y,y]=_PET(Ta[x],Pa[x],Tmrt[x][y],va[x][y],mbody,age,height,activity,clo,sex)
 
-def calculate_PET_grid(Ta, RH, Tmrt, va, pet, feedback):
-    mbody=pet.mbody
-    age=pet.age
-    height=pet.height
-    activity=pet.activity
-    sex=pet.sex
-    clo=pet.clo
-    pet_index=np.zeros_like(Tmrt)
-    total = 100. / (int(pet_index.shape[0] * pet_index.shape[1]))
-    index = 0
-    # print(Tmrt.shape)
-    # print(va.shape)
-    for y in range(pet_index.shape[0]):
+def calculate_PET_grid(Ta, RH, Tmrt, va, pet, feedback, chunksize=250000):
+    """
+    PET for a grid of Tmrt and wind speed. PET is solved for all pixels with va > 0 at once
+    (in chunks of chunksize pixels) by _PET_array. Other pixels are set to -9999.
+    """
+    pet_index = np.full(Tmrt.shape, -9999, dtype=Tmrt.dtype)
+    select = np.flatnonzero(va > 0)
+    Tmrt = Tmrt.ravel()
+    va = va.ravel()
+    pet_flat = pet_index.reshape(-1)
+
+    nchunks = int(np.ceil(select.shape[0] / chunksize))
+    for chunk in range(nchunks):
         if feedback.isCanceled():
             feedback.setProgressText("Calculation cancelled")
             break
-        for x in range(pet_index.shape[1]):
-            if va[y, x] > 0:
-                index = index + 1
-                feedback.setProgress(int(index * total))
-                pet_index[y,x]=_PET(Ta,RH,Tmrt[y,x],va[y,x],mbody,age,height,activity,clo,sex)
-            else:
-                pet_index[y, x] = -9999
+        feedback.setProgress(int(chunk * 100. / nchunks))
+        pixels = select[chunk * chunksize:(chunk + 1) * chunksize]
+        pet_flat[pixels] = _PET_array(Ta, RH, Tmrt[pixels], va[pixels], pet.mbody, pet.age, pet.height,
+                                      pet.activity, pet.clo, pet.sex)
 
     return pet_index
 
@@ -367,4 +364,267 @@ def _PET(ta,RH,tmrt,v,mbody,age,ht,work,icl,sex):
         count1 = count1 + 1
         enbal2 = 0
 
-    return tx
\ No newline at end of file
+    return tx
+
+
+def _PET_array(ta, RH, tmrt, v, mbody, age, ht, work, icl, sex, max_iterations=100000):
+    """
+    Array version of _PET. The energy balance of all elements is iterated at once,
+    each element with its own convergence mask, following exactly the iteration
+    scheme of _PET. ta, RH, tmrt and v are scalars or arrays of the same shape.
+    max_iterations only guards against elements that would never converge in _PET.
+    Returns PET with the broadcast shape of the input.
+    """
+    shape = np.broadcast(ta, RH, tmrt, v).shape
+    ta, RH, tmrt, v = [np.broadcast_to(np.asarray(x, dtype=float), shape).ravel() for x in (ta, RH, tmrt, v)]
+    n = ta.shape[0]
+
+    # humidity conversion
+    vps = 6.107 * (10. ** (7.5 * ta / (238. + ta)))
+    vpa = RH * vps / 100  # water vapour presure, kPa
+
+    po = 1013.25  # Pressure
+    p = 1013.25  # Pressure
+    rob = 1.06
+    cb = 3.64 * 1000
+    food = 0
+    emsk = 0.99
+    emcl = 0.95
+    evap = 2.42e6
+    sigma = 5.67e-8
+    cair = 1.01 * 1000
+
+    eta = 0  # No idea what eta is
+
+    # INBODY
+    metbf = 3.19 * mbody ** (3 / 4) * (1 + 0.004 * (30 - age) + 0.018 * ((ht * 100 / (mbody ** (1 / 3))) - 42.1))
+    metbm = 3.45 * mbody ** (3 / 4) * (1 + 0.004 * (30 - age) + 0.010 * ((ht * 100 / (mbody ** (1 / 3))) - 43.4))
+    if sex == 1:
+        met = metbm + work
+    else:
+        met = metbf + work
+
+    h = met * (1 - eta)
+    rtv = 1.44e-6 * met
+
+    # sensible respiration energy
+    tex = 0.47 * ta + 21.0
+    eres = cair * (ta - tex) * rtv
+
+    # latent respiration energy
+    vpex = 6.11 * 10 ** (7.45 * tex / (235 + tex))
+    erel = 0.623 * evap / p * (vpa - vpex) * rtv
+    # sum of the results
+    ere = eres + erel
+
+    # calcul constants
+    feff = 0.725
+    adu = 0.203 * mbody ** 0.425 * ht ** 0.725
+    facl = (-2.36 + 173.51 * icl - 100.76 * icl * icl + 19.28 * (icl ** 3)) / 100
+    if facl > 1:
+        facl = 1
+    rcl = (icl / 6.45) / facl
+    y = 1
+
+    if icl < 2:
+        y = (ht-0.2) / ht
+    if icl <= 0.6:
+        y = 0.5
+    if icl <= 0.3:
+        y = 0.1
+
+    fcl = 1 + 0.15 * icl
+    r2 = adu * (fcl - 1. + facl) / (2 * 3.14 * ht * y)
+    r1 = facl * adu / (2 * 3.14 * ht * y)
+    di = r2 - r1
+    acl = adu * facl + adu * (fcl - 1)
+
+    hc = 2.67 + 6.5 * v ** 0.67
+    hc = hc * (p / po) ** 0.55
+    c_1 = h + ere
+    he = 0.633 * hc / (p * cair)
+    fec = 1 / (1 + 0.92 * hc * rcl)
+    htcl = 6.28 * ht * y * di / (rcl * np.log(r2 / r1) * acl)
+    aeff = adu * feff
+    c_2 = adu * rob * cb
+    c_5 = 0.0208 * c_2
+    c_6 = 0.76075 * c_2
+    rdsk = 0.79 * 10 ** 7
+    rdcl = 0
+
+    # State of each element, kept between the j iterations as in _PET
+    tcore = np.zeros((8, n))
+    tsk = np.zeros(n)
+    tcl = np.zeros(n)
+    wetsk = np.zeros(n)
+    esw = np.zeros(n)
+    vpts = np.zeros(n)
+    vb = np.zeros(n)
+    c_9 = np.zeros(n)
+    c_11 = np.zeros(n)
+    count2 = np.zeros(n, dtype=bool)
+
+    j = 1
+    while j < 7 and not count2.all():
+        # Elements that have not found a valid core temperature solution yet
+        a = np.flatnonzero(~count2)
+        tsk[a] = 34
+        tcl[a] = (ta[a] + tmrt[a] + tsk[a]) / 3
+        count3 = np.ones(n, dtype=int)
+        enbal2 = np.zeros(n)
+        enbal = np.zeros(n)
+
+        for count1, xx in enumerate((1, 0.1, 0.01, 0.001)):
+            enbal[a] = 0
+            run = np.zeros(n, dtype=bool)
+            run[a] = (enbal[a] * enbal2[a] >= 0) & (count3[a] < 200)
+            while run.any():
+                r = np.flatnonzero(run)
+                enbal2[r] = enbal[r]
+                tar = ta[r]
+                tmrtr = tmrt[r]
+                hcr = hc[r]
+                c_1r = c_1[r]
+                tclr = tcl[r]
+                # 20
+                rclo2 = emcl * sigma * ((tclr + 273.2) ** 4 - (tmrtr + 273.2) ** 4) * feff
+                tskr = 1 / htcl * (hcr * (tclr - tar) + rclo2) + tclr
+
+                # radiation balance
+                rbare = aeff * (1 - facl) * emsk * sigma * ((tmrtr + 273.2) ** 4 - (tskr + 273.2) ** 4)
+                rclo = feff * acl * emcl * sigma * ((tmrtr + 273.2) ** 4 - (tclr + 273.2) ** 4)
+                rsum = rbare + rclo
+
+                # convection
+                cbare = hcr * (tar - tskr) * adu * (1 - facl)
+                cclo = hcr * (tar - tclr) * acl
+                csum = cbare + cclo
+
+                # core temperature
+                c_3 = 18 - 0.5 * tskr
+                c_4 = 5.28 * adu * c_3
+                c_7 = c_4 - c_6 - tskr * c_5
+                c_8 = -c_1r * c_3 - tskr * c_4 + tskr * c_6
+                c_9r = c_7 * c_7 - 4. * c_5 * c_8
+                c_10 = 5.28 * adu - c_6 - c_5 * tskr
+                c_11r = c_10 * c_10 - 4 * c_5 * (c_6 * tskr - c_1r - 5.28 * adu * tskr)
+                tskr[tskr == 36] = 36.01
+
+                tcorer = tcore[:, r]
+                tcorer[7] = c_1r / (5.28 * adu + c_2 * 6.3 / 3600) + tskr
+                tcorer[3] = c_1r / (5.28 * adu + (c_2 * 6.3 / 3600) / (1 + 0.5 * (34 - tskr))) + tskr
+                m = c_11r >= 0
+                tcorer[6, m] = (-c_10[m]-c_11r[m] ** 0.5) / (2 * c_5)
+                tcorer[1, m] = (-c_10[m]+c_11r[m] ** 0.5) / (2 * c_5)
+                m = c_9r >= 0
+                tcorer[2, m] = (-c_7[m]+abs(c_9r[m]) ** 0.5) / (2 * c_5)
+                tcorer[5, m] = (-c_7[m]-abs(c_9r[m]) ** 0.5) / (2 * c_5)
+                tcorer[4] = c_1r / (5.28 * adu + c_2 * 1 / 40) + tskr
+
+                # transpiration
+                tbody = 0.1 * tskr + 0.9 * tcorer[j]
+                sw = 304.94 * (tbody - 36.6) * adu / 3600000
+                vptsr = 6.11 * 10 ** (7.45 * tskr / (235. + tskr))
+                sw[tbody <= 36.6] = 0
+                if sex == 2:
+                    sw = 0.7 * sw
+                eswphy = -sw * evap
+
+                eswpot = he[r] * (vpa[r] - vptsr) * adu * evap * fec[r]
+                wetskr = eswphy / eswpot
+                wetskr[wetskr > 1] = 1
+                eswdif = eswphy - eswpot
+                eswr = np.where(eswdif <= 0, eswpot, eswphy)
+                eswr[eswr > 0] = 0
+
+                # diffusion
+                ed = evap / (rdsk + rdcl) * adu * (1 - wetskr) * (vpa[r] - vptsr)
+
+                # MAX VB
+                vb1 = 34 - tskr
+                vb2 = tcorer[j] - 36.6
+                vb2[vb2 < 0] = 0
+                vb1[vb1 < 0] = 0
+                vb[r] = (6.3 + 75 * vb2) / (1 + 0.5 * vb1)
+
+                # energy balance
+                enbal[r] = h + ed + ere[r] + eswr + csum + rsum + food
+
+                # clothing's temperature
+                tcl[r] = np.where(enbal[r] > 0, tclr + xx, tclr - xx)
+
+                tsk[r] = tskr
+                tcore[:, r] = tcorer
+                c_9[r] = c_9r
+                c_11[r] = c_11r
+                vpts[r] = vptsr
+                wetsk[r] = wetskr
+                esw[r] = eswr
+                count3[r] = count3[r] + 1
+                run[r] = (enbal[r] * enbal2[r] >= 0) & (count3[r] < 200)
+            enbal2[a] = 0
+
+        # Accept the solution of core temperature j (see _PET)
+        if j == 2 or j == 5:
+            done = (c_9[a] >= 0) & (tcore[j, a] >= 36.6) & (tsk[a] <= 34.050) & ~(vb[a] >= 91)
+        elif j == 6 or j == 1:
+            done = (c_11[a] > 0) & (tcore[j, a] >= 36.6) & (tsk[a] > 33.850) & ~(vb[a] >= 91)
+        elif j == 3:
+            done = (tcore[j, a] < 36.6) & (tsk[a] <= 34.000) & ~(vb[a] >= 91)
+        else:
+            done = ~(vb[a] < 89)
+        count2[a] = done
+
+        j = j + 1
+
+    # PET_cal
+    tx = ta.copy()
+    enbal2 = np.zeros(n)
+    enbal = np.zeros(n)
+
+    hc = 2.67 + 6.5 * 0.1 ** 0.67
+    hc = hc * (p / po) ** 0.55
+
+    iterations = 0
+    for count1, xx in enumerate((1, 0.1, 0.01, 0.001)):
+        run = (enbal * enbal2) >= 0
+        while run.any() and iterations < max_iterations:
+            r = np.flatnonzero(run)
+            enbal2[r] = enbal[r]
+            txr = tx[r]
+            tskr = tsk[r]
+            tclr = tcl[r]
+
+            # radiation balance
+            rbare = aeff * (1 - facl) * emsk * sigma * ((txr + 273.2) ** 4 - (tskr + 273.2) ** 4)
+            rclo = feff * acl * emcl * sigma * ((txr + 273.2) ** 4 - (tclr + 273.2) ** 4)
+            rsum = rbare + rclo
+
+            # convection
+            cbare = hc * (txr - tskr) * adu * (1 - facl)
+            cclo = hc * (txr - tclr) * acl
+            csum = cbare + cclo
+
+            # diffusion
+            ed = evap / (rdsk + rdcl) * adu * (1 - wetsk[r]) * (12 - vpts[r])
+
+            # respiration
+            tex = 0.47 * txr + 21
+            eres = cair * (txr - tex) * rtv
+            vpex = 6.11 * 10 ** (7.45 * tex / (235 + tex))
+            erel = 0.623 * evap / p * (12 - vpex) * rtv
+            ere = eres + erel
+
+            # energy balance
+            enbal[r] = h + ed + ere + esw[r] + csum + rsum
+
+            # iteration concerning Tx
+            txr = np.where(enbal[r] > 0, txr - xx, txr)
+            txr = np.where(enbal[r] < 0, txr + xx, txr)
+            tx[r] = txr
+
+            run[r] = (enbal[r] * enbal2[r]) >= 0
+            iterations = iterations + 1
+        enbal2[:] = 0
+
+    return tx.reshape(shape)
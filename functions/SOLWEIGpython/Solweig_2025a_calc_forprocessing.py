@@ -6,8 +6,11 @@ from ...util.SEBESOLWEIGCommonFiles.clearnessindex_2013b import clearnessindex_2
 from ...util.SEBESOLWEIGCommonFiles.diffusefraction import diffusefraction
 from ...util.SEBESOLWEIGCommonFiles.shadowingfunction_wallheight_13 import shadowingfunction_wallheight_13
 from ...util.SEBESOLWEIGCommonFiles.shadowingfunction_wallheight_23 import shadowingfunction_wallheight_23
+from ...util.SEBESOLWEIGCommonFiles.shadow_cache import ShadowCache
 from .gvf_2018a import gvf_2018a
+from .gvf_geometry import gvf_2018a_geometry
 from .cylindric_wedge import cylindric_wedge
+from .solweig_geometry import cylindric_wedge_geometry
 from .TsWaveDelay_2015a import TsWaveDelay_2015a
 from .Kup_veg_2015a import Kup_veg_2015a
 # from .Lside_veg_v2015a import Lside_veg_v2015a
@@ -20,6 +23,7 @@ from ...util.SEBESOLWEIGCommonFiles.create_patches import create_patches
 from .Lcyl_v2022a import Lcyl_v2022a
 from .Lside_veg_v2022a import Lside_veg_v2022a
 from .anisotropic_sky import anisotropic_sky as ani_sky
+from .anisotropic_sky_geometry import anisotropic_sky_geometry as ani_sky_geometry
 from .patch_radiation import patch_steradians
 from copy import deepcopy
 import time
@@ -34,7 +38,8 @@ def Solweig_2025a_calc(i, dsm, scale, rows, cols, svf, svfN, svfW, svfE, svfS, s
                        amaxvalue, bush, Twater, TgK, Tstart, alb_grid, emis_grid, TgK_wall, Tstart_wall, TmaxLST,
                        TmaxLST_wall, first, second, svfalfa, svfbuveg, firstdaytime, timeadd, timestepdec, Tgmap1, 
                        Tgmap1E, Tgmap1S, Tgmap1W, Tgmap1N, CI, TgOut1, diffsh, shmat, vegshmat, vbshvegshmat, anisotropic_sky, asvf, patch_option,
-                       voxelMaps, voxelTable, ws, wallScheme, timeStep, steradians, walls_scheme, dirwalls_scheme):
+                       voxelMaps, voxelTable, ws, wallScheme, timeStep, steradians, walls_scheme, dirwalls_scheme,
+                       gvfgeometry=None, skygeometry=None, solweiggeometry=None, shadowcache=None):
 
 #def Solweig_2021a_calc(i, dsm, scale, rows, cols, svf, svfN, svfW, svfE, svfS, svfveg, svfNveg, svfEveg, svfSveg,
 #                       svfWveg, svfaveg, svfEaveg, svfSaveg, svfWaveg, svfNaveg, vegdem, vegdem2, albedo_b, absK, absL,
@@ -157,12 +162,14 @@ def Solweig_2025a_calc(i, dsm, scale, rows, cols, svf, svfN, svfW, svfE, svfS, s
             lv = None
 
         # Shadow  images
+        if shadowcache is None:
+            shadowcache = ShadowCache(None)
         if usevegdem == 1:
-            vegsh, sh, _, wallsh, wallsun, wallshve, _, facesun, wallsh_ = shadowingfunction_wallheight_23(dsm, vegdem, vegdem2,
+            vegsh, sh, _, wallsh, wallsun, wallshve, _, facesun, wallsh_ = shadowcache.shadowingfunction_wallheight_23(dsm, vegdem, vegdem2,
                                         azimuth, altitude, scale, amaxvalue, bush, walls, dirwalls * np.pi / 180., walls_scheme, dirwalls_scheme * np.pi/180.)
             shadow = sh - (1 - vegsh) * (1 - psi)
         else:
-            sh, wallsh, wallsun, facesh, facesun, wallsh_ = shadowingfunction_wallheight_13(dsm, azimuth, altitude, scale,
+            sh, wallsh, wallsun, facesh, facesun, wallsh_ = shadowcache.shadowingfunction_wallheight_13(dsm, azimuth, altitude, scale,
                                                                                    walls, dirwalls * np.pi / 180., walls_scheme, dirwalls_scheme * np.pi/180.)
             shadow = sh
 
@@ -199,10 +206,16 @@ def Solweig_2025a_calc(i, dsm, scale, rows, cols, svf, svfN, svfW, svfE, svfS, s
             Tg[Tg < 0] = 0  # temporary for removing low Tg during morning 20130205
 
         # # # # Ground View Factors # # # #
-        gvfLup, gvfalb, gvfalbnosh, gvfLupE, gvfalbE, gvfalbnoshE, gvfLupS, gvfalbS, gvfalbnoshS, gvfLupW, gvfalbW,\
-        gvfalbnoshW, gvfLupN, gvfalbN, gvfalbnoshN, gvfSum, gvfNorm = gvf_2018a(wallsun, walls, buildings, scale, shadow, first,
-                second, dirwalls, Tg, Tgwall, Ta, emis_grid, ewall, alb_grid, SBC, albedo_b, rows, cols,
-                                                                 Twater, lc_grid, landcover)
+        if gvfgeometry is not None:
+            # march geometry precomputed for the run (GvfGeometry)
+            gvfLup, gvfalb, gvfalbnosh, gvfLupE, gvfalbE, gvfalbnoshE, gvfLupS, gvfalbS, gvfalbnoshS, gvfLupW, gvfalbW,\
+            gvfalbnoshW, gvfLupN, gvfalbN, gvfalbnoshN, gvfSum, gvfNorm = gvf_2018a_geometry(gvfgeometry, wallsun, shadow,
+                Tg, Tgwall, Ta, emis_grid, ewall, alb_grid, SBC, albedo_b, Twater, lc_grid, landcover)
+        else:
+            gvfLup, gvfalb, gvfalbnosh, gvfLupE, gvfalbE, gvfalbnoshE, gvfLupS, gvfalbS, gvfalbnoshS, gvfLupW, gvfalbW,\
+            gvfalbnoshW, gvfLupN, gvfalbN, gvfalbnoshN, gvfSum, gvfNorm = gvf_2018a(wallsun, walls, buildings, scale, shadow, first,
+                    second, dirwalls, Tg, Tgwall, Ta, emis_grid, ewall, alb_grid, SBC, albedo_b, rows, cols,
+                                                                     Twater, lc_grid, landcover)
 
         # # # # Lup, daytime # # # #
         # Surface temperature wave delay - new as from 2014a
@@ -217,7 +230,10 @@ def Solweig_2025a_calc(i, dsm, scale, rows, cols, svf, svfN, svfW, svfE, svfS, s
         TgOut, timeadd, TgOut1 = TsWaveDelay_2015a(TgTemp, firstdaytime, timeadd, timestepdec, TgOut1) #timeadd only here v2021a
 
         # Building height angle from svf
-        F_sh = cylindric_wedge(zen, svfalfa, rows, cols)  # Fraction shadow on building walls based on sun alt and svf
+        if solweiggeometry is not None:
+            F_sh = cylindric_wedge_geometry(solweiggeometry, zen)  # Fraction shadow on building walls based on sun alt and svf
+        else:
+            F_sh = cylindric_wedge(zen, svfalfa, rows, cols)  # Fraction shadow on building walls based on sun alt and svf
         F_sh[np.isnan(F_sh)] = 0.5
 
         # # # # # # # Calculation of shortwave daytime radiative fluxes # # # # # # #
@@ -227,9 +243,12 @@ def Solweig_2025a_calc(i, dsm, scale, rows, cols, svf, svfN, svfW, svfE, svfS, s
         Kup, KupE, KupS, KupW, KupN = Kup_veg_2015a(radI, radD, radG, altitude, svfbuveg, albedo_b, F_sh, gvfalb,
                     gvfalbE, gvfalbS, gvfalbW, gvfalbN, gvfalbnosh, gvfalbnoshE, gvfalbnoshS, gvfalbnoshW, gvfalbnoshN)
 
-        Keast, Ksouth, Kwest, Knorth, KsideI, KsideD, Kside = Kside_veg_v2022a(radI, radD, radG, shadow, svfS, svfW, svfN, svfE,
-                    svfEveg, svfSveg, svfWveg, svfNveg, azimuth, altitude, psi, t, albedo_b, F_sh, KupE, KupS, KupW,
-                    KupN, cyl, lv, anisotropic_sky, diffsh, rows, cols, asvf, shmat, vegshmat, vbshvegshmat)
+        # With the anisotropic sky, Kside is calculated by ani_sky below
+        if anisotropic_sky != 1:
+            Keast, Ksouth, Kwest, Knorth, KsideI, KsideD, Kside = Kside_veg_v2022a(radI, radD, radG, shadow, svfS, svfW, svfN, svfE,
+                        svfEveg, svfSveg, svfWveg, svfNveg, azimuth, altitude, psi, t, albedo_b, F_sh, KupE, KupS, KupW,
+                        KupN, cyl, lv, anisotropic_sky, diffsh, rows, cols, asvf, shmat, vegshmat, vbshvegshmat,
+                        geometry=solweiggeometry)
         
         firstdaytime = 0
 
@@ -274,21 +293,32 @@ def Solweig_2025a_calc(i, dsm, scale, rows, cols, svf, svfN, svfW, svfE, svfS, s
         firstdaytime = 1
 
     # # # # Ldown # # # #
-    Ldown = (svf + svfveg - 1) * esky * SBC * ((Ta + 273.15) ** 4) + (2 - svfveg - svfaveg) * ewall * SBC * \
-                ((Ta + 273.15) ** 4) + (svfaveg - svf) * ewall * SBC * ((Ta + 273.15 + Tgwall) ** 4) + \
-                (2 - svf - svfveg) * (1 - ewall) * esky * SBC * ((Ta + 273.15) ** 4)  # Jonsson et al.(2006)
+    if solweiggeometry is not None:
+        svfsky = solweiggeometry.svfsky
+        svfvegwall = solweiggeometry.svfvegwall
+        svfwall = solweiggeometry.svfwall
+        svfrefl = solweiggeometry.svfrefl
+    else:
+        svfsky = svf + svfveg - 1
+        svfvegwall = 2 - svfveg - svfaveg
+        svfwall = svfaveg - svf
+        svfrefl = 2 - svf - svfveg
+    Ldown = svfsky * esky * SBC * ((Ta + 273.15) ** 4) + svfvegwall * ewall * SBC * \
+                ((Ta + 273.15) ** 4) + svfwall * ewall * SBC * ((Ta + 273.15 + Tgwall) ** 4) + \
+                svfrefl * (1 - ewall) * esky * SBC * ((Ta + 273.15) ** 4)  # Jonsson et al.(2006)
     # Ldown = Ldown - 25 # Shown by Jonsson et al.(2006) and Duarte et al.(2006)
 
     if CI < 0.95:  # non - clear conditions
         c = 1 - CI
-        Ldown = Ldown * (1 - c) + c * ((svf + svfveg - 1) * SBC * ((Ta + 273.15) ** 4) + (2 - svfveg - svfaveg) *
-                ewall * SBC * ((Ta + 273.15) ** 4) + (svfaveg - svf) * ewall * SBC * ((Ta + 273.15 + Tgwall) ** 4) +
-                (2 - svf - svfveg) * (1 - ewall) * SBC * ((Ta + 273.15) ** 4))  # NOT REALLY TESTED!!! BUT MORE CORRECT?
+        Ldown = Ldown * (1 - c) + c * (svfsky * SBC * ((Ta + 273.15) ** 4) + svfvegwall *
+                ewall * SBC * ((Ta + 273.15) ** 4) + svfwall * ewall * SBC * ((Ta + 273.15 + Tgwall) ** 4) +
+                svfrefl * (1 - ewall) * SBC * ((Ta + 273.15) ** 4))  # NOT REALLY TESTED!!! BUT MORE CORRECT?
 
     # # # # Lside # # # #
     Least, Lsouth, Lwest, Lnorth = Lside_veg_v2022a(svfS, svfW, svfN, svfE, svfEveg, svfSveg, svfWveg, svfNveg,
                     svfEaveg, svfSaveg, svfWaveg, svfNaveg, azimuth, altitude, Ta, Tgwall, SBC, ewall, Ldown,
-                                                      esky, t, F_sh, CI, LupE, LupS, LupW, LupN, anisotropic_sky)
+                                                      esky, t, F_sh, CI, LupE, LupS, LupW, LupN, anisotropic_sky,
+                                                      geometry=solweiggeometry)
 
     # New parameterization scheme for wall temperatures
     if wallScheme == 1:
@@ -327,10 +357,16 @@ def Solweig_2025a_calc(i, dsm, scale, rows, cols, svf, svfN, svfW, svfE, svfS, s
             esky_c = CI * esky + (1 - CI) * 1.
             esky = esky_c
 
-        Ldown, Lside, Lside_sky, Lside_veg, Lside_sh, Lside_sun, Lside_ref, Least_, Lwest_, Lnorth_, Lsouth_, \
-           Keast, Ksouth, Kwest, Knorth, KsideI, KsideD, Kside, steradians, skyalt = ani_sky(shmat, vegshmat, vbshvegshmat, altitude, azimuth, asvf, cyl, esky,
-                                                                                     L_patches, wallScheme, voxelTable, voxelMaps, steradians, Ta, Tgwall, ewall, Lup, radI, radD, radG, lv, 
-                                                                                     albedo_b, 0, diffsh, shadow, KupE, KupS, KupW, KupN, i)
+        if (skygeometry is not None) and (cyl == 1) and (wallScheme == 0):
+            # patch geometry precomputed for the run (AnisotropicSkyGeometry)
+            Ldown, Lside, Lside_sky, Lside_veg, Lside_sh, Lside_sun, Lside_ref, Least_, Lwest_, Lnorth_, Lsouth_, \
+               Keast, Ksouth, Kwest, Knorth, KsideI, KsideD, Kside, steradians, skyalt = ani_sky_geometry(skygeometry, altitude, azimuth, esky,
+                                                                                         Ta, Tgwall, ewall, Lup, radI, radD, lv, albedo_b, shadow, KupE, KupS, KupW, KupN)
+        else:
+            Ldown, Lside, Lside_sky, Lside_veg, Lside_sh, Lside_sun, Lside_ref, Least_, Lwest_, Lnorth_, Lsouth_, \
+               Keast, Ksouth, Kwest, Knorth, KsideI, KsideD, Kside, steradians, skyalt = ani_sky(shmat, vegshmat, vbshvegshmat, altitude, azimuth, asvf, cyl, esky,
+                                                                                         L_patches, wallScheme, voxelTable, voxelMaps, steradians, Ta, Tgwall, ewall, Lup, radI, radD, radG, lv, 
+                                                                                         albedo_b, 0, diffsh, shadow, KupE, KupS, KupW, KupN, i)
     else:
         Lside = np.zeros((rows, cols))
         L_patches = None
@@ -9,6 +9,7 @@ from __future__ import absolute_import
 from ...util.umep_solweig_export_component import read_solweig_config
 from ...util.SEBESOLWEIGCommonFiles.Solweig_v2015_metdata_noload import Solweig_2015a_metdata_noload
 from ...util.SEBESOLWEIGCommonFiles.clearnessindex_2013b import clearnessindex_2013b
+from ...util.SEBESOLWEIGCommonFiles.shadowmatrices import load_shadowmatrices, DiffuseShadowMatrix
 
 from ...functions.SOLWEIGpython import Solweig_2025a_calc_forprocessing as so
 #from ...functions.SOLWEIGpython import WriteMetadataSOLWEIG # Not needed anymore?
@@ -20,6 +21,11 @@ from ...functions.SOLWEIGpython.wallOfInterest import pointOfInterest
 from ...functions.SOLWEIGpython.patch_characteristics import hemispheric_image
 from ...functions.SOLWEIGpython.wallsAsNetCDF import walls_as_netcdf
 from ...functions.SOLWEIGpython.Tgmaps_v1 import Tgmaps_v1
+from ...functions.SOLWEIGpython.gvf_geometry import GvfGeometry
+from ...functions.SOLWEIGpython.anisotropic_sky_geometry import AnisotropicSkyGeometry
+from ...functions.SOLWEIGpython.solweig_geometry import SolweigGeometry
+from ...functions.SOLWEIGpython.output_writer import SolweigOutputWriter, solweig_output_times
+from ...util.SEBESOLWEIGCommonFiles.shadow_cache import ShadowCache
 from ...functions import wallalgorithms as wa
 
 import numpy as np
@@ -396,14 +402,10 @@ def solweig_run(configPath, feedback):
     # Import shadow matrices (Anisotropic sky)
     anisotropic_sky = int(configDict['aniso'])
     if anisotropic_sky == 1:  #UseAniso
-        data = np.load(configDict['input_aniso'])
-        shmat = data['shadowmat']
-        vegshmat = data['vegshadowmat']
-        vbshvegshmat = data['vbshmat']
+        # Bit-packed matrices are unpacked one patch at a time when used
+        shmat, vegshmat, vbshvegshmat = load_shadowmatrices(configDict['input_aniso'])
         if usevegdem == 1:
-            diffsh = np.zeros((rows, cols, shmat.shape[2]))
-            for i in range(0, shmat.shape[2]):
-                diffsh[:, :, i] = shmat[:, :, i] - (1 - vegshmat[:, :, i]) * (1 - transVeg) # changes in psi not implemented yet
+            diffsh = DiffuseShadowMatrix(shmat, vegshmat, transVeg)
         else:
             diffsh = shmat
 
@@ -544,261 +546,279 @@ def solweig_run(configPath, feedback):
     if standAlone == 1:
         progress = tqdm(total=Ta.__len__())
 
-    for i in np.arange(0, Ta.__len__()):
-        if feedback is not None:
-            feedback.setProgress(int(i * (100. / Ta.__len__()))) # move progressbar forward
-            if feedback.isCanceled():
-                feedback.setProgressText("Calculation cancelled")
-                break
-        else:
-            progress.update(1)
-
-        # Daily water body temperature
-        if landcover == 1:
-            if ((dectime[i] - np.floor(dectime[i]))) == 0 or (i == 0):
-                Twater = np.mean(Ta[jday[0] == np.floor(dectime[i])])
-        # Nocturnal cloudfraction from Offerle et al. 2003
-        if (dectime[i] - np.floor(dectime[i])) == 0:
-            daylines = np.where(np.floor(dectime) == dectime[i])
-            if daylines.__len__() > 1:
-                alt = altitude[0][daylines]
-                alt2 = np.where(alt > 1)
-                rise = alt2[0][0]
-                [_, CI, _, _, _] = clearnessindex_2013b(zen[0, i + rise + 1], jday[0, i + rise + 1],
-                                                        Ta[i + rise + 1],
-                                                        RH[i + rise + 1] / 100., radG[i + rise + 1], location,
-                                                        P[i + rise + 1])
-                if (CI > 1.) or (CI == np.inf):
-                    CI = 1.
-            else:
-                CI = 1.
-
-        # Only if Kdir is derived from horizontal global shortwave and horizontal diffuse shortwave
-        # if altitude[0][i] > 0:
-        #     radI[i] = radI[i]/np.sin(altitude[0][i] * np.pi/180)
-        # else:
-        #     radG[i] = 0.
-        #     radD[i] = 0.
-        #     radI[i] = 0.
-
-
-        Tmrt, Kdown, Kup, Ldown, Lup, Tg, ea, esky, I0, CI, shadow, firstdaytime, timestepdec, timeadd, \
-                Tgmap1, Tgmap1E, Tgmap1S, Tgmap1W, Tgmap1N, Keast, Ksouth, Kwest, Knorth, Least, \
-                Lsouth, Lwest, Lnorth, KsideI, TgOut1, TgOut, radIout, radDout, \
-                Lside, Lsky_patch_characteristics, CI_Tg, CI_TgG, KsideD, \
-                    dRad, Kside, steradians, voxelTable = so.Solweig_2025a_calc(
-                    i, dsm, scale, rows, cols, svf, svfN, svfW, svfE, svfS, svfveg,
-                    svfNveg, svfEveg, svfSveg, svfWveg, svfaveg, svfEaveg, svfSaveg, svfWaveg, svfNaveg, \
-                    vegdsm, vegdsm2, albedo_b, absK, absL, ewall, Fside, Fup, Fcyl, altitude[0][i],
-                    azimuth[0][i], zen[0][i], jday[0][i], usevegdem, onlyglobal, buildings, location,
-                    psi[0][i], landcover, lcgrid, dectime[i], altmax[0][i], wallaspect,
-                    wallheight, cyl, elvis, Ta[i], RH[i], radG[i], radD[i], radI[i], P[i], amaxvalue,
-                    bush, Twater, TgK, Tstart, alb_grid, emis_grid, TgK_wall, Tstart_wall, TmaxLST,
-                    TmaxLST_wall, first, second, svfalfa, svfbuveg, firstdaytime, timeadd, timestepdec, 
-                    Tgmap1, Tgmap1E, Tgmap1S, Tgmap1W, Tgmap1N, CI, TgOut1, diffsh, shmat, vegshmat, vbshvegshmat, 
-                    anisotropic_sky, asvf, patch_option, voxelMaps, voxelTable, Ws[i], wallScheme, timeStep, steradians, walls_scheme, dirwalls_scheme)
-
-        # Save I0 for I0 vs. Kdown output plot to check if UTC is off
-        # if i == (first_unique_day.shape[0] - 1):
-        #     # Output I0 vs. Kglobal plot
-        #     radG_for_plot = radG[DOY == first_unique_day[0]]
-        #     # hours_for_plot = hours[DOY == first_unique_day[0]]
-        #     dectime_for_plot = dectime[DOY == first_unique_day[0]]
-        #     fig, ax = plt.subplots()
-        #     ax.plot(dectime_for_plot, I0_array, label='I0')
-        #     ax.plot(dectime_for_plot, radG_for_plot, label='Kglobal')
-        #     ax.set_ylabel('Shortwave radiation [$Wm^{-2}$]')
-        #     ax.set_xlabel('Decimal time')
-        #     ax.set_title('UTC' + str(configDict['utc']))
-        #     ax.legend()
-        #     fig.savefig(configDict['output_dir'] + '/metCheck.png', dpi=150)
-        # elif i < (first_unique_day.shape[0] - 1):
-        #     I0_array[i] = I0
-
-        # Save I0 for I0 vs. Kdown output plot to check if UTC is off
-        if i < first_unique_day.shape[0]:
-            I0_array[i] = I0
-        elif i == first_unique_day.shape[0]:
-            # Output I0 vs. Kglobal plot
-            radG_for_plot = radG[DOY == first_unique_day[0]]
-            # hours_for_plot = hours[DOY == first_unique_day[0]]
-            dectime_for_plot = dectime[DOY == first_unique_day[0]]
-            fig, ax = plt.subplots()
-            ax.plot(dectime_for_plot, I0_array, label='I0')
-            ax.plot(dectime_for_plot, radG_for_plot, label='Kglobal')
-            ax.set_ylabel('Shortwave radiation [$Wm^{-2}$]')
-            ax.set_xlabel('Decimal time')
-            ax.set_title('UTC' + str(configDict['utc']))
-            ax.legend()
-            fig.savefig(configDict['output_dir'] + '/metCheck.png', dpi=150)
-
-        tmrtplot = tmrtplot + Tmrt
-
-        if altitude[0][i] > 0:
-            w = 'D'
-        else:
-            w = 'N'
-
-        # Write to POIs
-        if not poisxy is None:              
-            for k in range(0, poisxy.shape[0]):
-                poi_save = np.zeros((1, 41))
-                poi_save[0, 0] = YYYY[0][i]
-                poi_save[0, 1] = jday[0][i]
-                poi_save[0, 2] = hours[i]
-                poi_save[0, 3] = minu[i]
-                poi_save[0, 4] = dectime[i]
-                poi_save[0, 5] = altitude[0][i]
-                poi_save[0, 6] = azimuth[0][i]
-                poi_save[0, 7] = radIout
-                poi_save[0, 8] = radDout
-                poi_save[0, 9] = radG[i]
-                poi_save[0, 10] = Kdown[int(poisxy[k, 2]), int(poisxy[k, 1])]
-                poi_save[0, 11] = Kup[int(poisxy[k, 2]), int(poisxy[k, 1])]
-                poi_save[0, 12] = Keast[int(poisxy[k, 2]), int(poisxy[k, 1])]
-                poi_save[0, 13] = Ksouth[int(poisxy[k, 2]), int(poisxy[k, 1])]
-                poi_save[0, 14] = Kwest[int(poisxy[k, 2]), int(poisxy[k, 1])]
-                poi_save[0, 15] = Knorth[int(poisxy[k, 2]), int(poisxy[k, 1])]
-                poi_save[0, 16] = Ldown[int(poisxy[k, 2]), int(poisxy[k, 1])]
-                poi_save[0, 17] = Lup[int(poisxy[k, 2]), int(poisxy[k, 1])]
-                poi_save[0, 18] = Least[int(poisxy[k, 2]), int(poisxy[k, 1])]
-                poi_save[0, 19] = Lsouth[int(poisxy[k, 2]), int(poisxy[k, 1])]
-                poi_save[0, 20] = Lwest[int(poisxy[k, 2]), int(poisxy[k, 1])]
-                poi_save[0, 21] = Lnorth[int(poisxy[k, 2]), int(poisxy[k, 1])]
-                poi_save[0, 22] = Ta[i]
-                poi_save[0, 23] = TgOut[int(poisxy[k, 2]), int(poisxy[k, 1])]
-                poi_save[0, 24] = RH[i]
-                poi_save[0, 25] = esky
-                poi_save[0, 26] = Tmrt[int(poisxy[k, 2]), int(poisxy[k, 1])]
-                poi_save[0, 27] = I0
-                poi_save[0, 28] = CI
-                poi_save[0, 29] = shadow[int(poisxy[k, 2]), int(poisxy[k, 1])]
-                poi_save[0, 30] = svf[int(poisxy[k, 2]), int(poisxy[k, 1])]
-                poi_save[0, 31] = svfbuveg[int(poisxy[k, 2]), int(poisxy[k, 1])]
-                poi_save[0, 32] = KsideI[int(poisxy[k, 2]), int(poisxy[k, 1])]
-                # Recalculating wind speed based on powerlaw
-                WsPET = (1.1 / sensorheight) ** 0.2 * Ws[i]
-                WsUTCI = (10. / sensorheight) ** 0.2 * Ws[i]
-                resultPET = p._PET(Ta[i], RH[i], Tmrt[int(poisxy[k, 2]), int(poisxy[k, 1])], WsPET,
-                                    mbody, age, ht, activity, clo, sex)
-                poi_save[0, 33] = resultPET
-                resultUTCI = utci.utci_calculator(Ta[i], RH[i], Tmrt[int(poisxy[k, 2]), int(poisxy[k, 1])],
-                                                    WsUTCI)
-                poi_save[0, 34] = resultUTCI
-                poi_save[0, 35] = CI_Tg
-                poi_save[0, 36] = CI_TgG
-                poi_save[0, 37] = KsideD[int(poisxy[k, 2]), int(poisxy[k, 1])]
-                poi_save[0, 38] = Lside[int(poisxy[k, 2]), int(poisxy[k, 1])]
-                poi_save[0, 39] = dRad[int(poisxy[k, 2]), int(poisxy[k, 1])]
-                poi_save[0, 40] = Kside[int(poisxy[k, 2]), int(poisxy[k, 1])]
-                data_out = configDict['output_dir'] + '/POI_' + str(poiname[k]) + '.txt'
-                # f_handle = file(data_out, 'a')
-                f_handle = open(data_out, 'ab')
-                np.savetxt(f_handle, poi_save, fmt=numformat)
-                f_handle.close()
-
-        # If wall temperature parameterization scheme is in use
-        if configDict['wallscheme'] == 1: # folderWallScheme: TODO: Fix for standalone
-            # Store wall data for output
-            if not woisxy is None:
-                for k in range(0, woisxy.shape[0]):
-                    temp_wall = voxelTable.loc[((voxelTable['ypos'] == woisxy[k, 2]) & (voxelTable['xpos'] == woisxy[k, 1])), 'wallTemperature'].to_numpy()
-                    K_in = voxelTable.loc[((voxelTable['ypos'] == woisxy[k, 2]) & (voxelTable['xpos'] == woisxy[k, 1])), 'K_in'].to_numpy()
-                    L_in = voxelTable.loc[((voxelTable['ypos'] == woisxy[k, 2]) & (voxelTable['xpos'] == woisxy[k, 1])), 'L_in'].to_numpy()
-                    wallShade = voxelTable.loc[((voxelTable['ypos'] == woisxy[k, 2]) & (voxelTable['xpos'] == woisxy[k, 1])), 'wallShade'].to_numpy()
-                    temp_all = np.concatenate([temp_wall, K_in, L_in, wallShade])
-                    # temp_all = np.concatenate([temp_wall])
-                    # wall_data = np.zeros((1, 7 + temp_wall.shape[0]))
-                    wall_data = np.zeros((1, 7 + temp_all.shape[0]))
-                    # Part of file name (wallid), i.e. WOI_wallid.txt
-                    data_out = configDict['output_dir'] + '/WOI_' + str(woiname[k]) + '.txt'                    
-                    if i == 0:
-                        # Output file header
-                        #header = 'yyyy id   it imin dectime Ta  SVF Ts'
-                        header = 'yyyy id   it imin dectime Ta  SVF' + ' Ts' * temp_wall.shape[0] + ' Kin' * K_in.shape[0] + ' Lin' * L_in.shape[0] + ' shade' * wallShade.shape[0]
-                        # Part of file name (wallid), i.e. WOI_wallid.txt
-                        # woiname = voxelTable.loc[((voxelTable['ypos'] == woisxy[k, 2]) & (voxelTable['xpos'] == woisxy[k, 1])), 'wallId'].to_numpy()[0]
-                        woi_save = []  # 
-                        np.savetxt(data_out, woi_save,  delimiter=' ', header=header, comments='')                        
-                    # Fill wall_data with variables
-                    wall_data[0, 0] = YYYY[0][i] 
-                    wall_data[0, 1] = jday[0][i]
-                    wall_data[0, 2] = hours[i]
-                    wall_data[0, 3] = minu[i]
-                    wall_data[0, 4] = dectime[i]
-                    wall_data[0, 5] = Ta[i]
-                    wall_data[0, 6] = svf[int(woisxy[k, 2]), int(woisxy[k, 1])]
-                    wall_data[0, 7:] = temp_all
-
-                    # Num format for output file data
-                    woi_numformat = '%d %d %d %d %.5f %.2f %.2f' + ' %.2f' * temp_all.shape[0]
-                    # Open file, add data, save
-                    f_handle = open(data_out, 'ab')
-                    np.savetxt(f_handle, wall_data, fmt=woi_numformat)
-                    f_handle.close()                
+    # Output rasters are written in a background thread, overlapping with the next time step
+    outputformat = int(configDict.get('outputformat', 0))
+    outputtimes = solweig_output_times(YYYY[0], DOY, hours, minu)
+    if standAlone == 0:
+        writer = SolweigOutputWriter(configDict['output_dir'], outputformat, outputtimes, rows, cols,
+                                     gdal_dsm.GetGeoTransform(), gdal_dsm.GetProjection(),
+                                     lambda filename, grid: saveraster(gdal_dsm, filename, grid))
+    else:
+        writer = SolweigOutputWriter(configDict['output_dir'], outputformat, outputtimes, rows, cols,
+                                     dsm_transf.to_gdal(), pyproj.CRS(dsm_crs).to_wkt(),
+                                     lambda filename, grid: common.save_raster(filename, grid, dsm_transf, dsm_crs))
 
-            # Save wall temperature/radiation as NetCDF TODO: fix for standAlone?
-            if configDict['wallnetcdf'] == 1: # wallNetCDF:
-                netcdf_output = configDict['output_dir'] + '/walls.nc'
-                walls_as_netcdf(voxelTable, rows, cols, met_for_xarray, i, dsm, configDict['filepath_dsm'], netcdf_output)
+    # Sky view factor derived grids, the same for all time steps
+    solweiggeometry = SolweigGeometry(svf, svfveg, svfaveg, svfE, svfS, svfW, svfN, svfEveg, svfSveg, svfWveg, svfNveg,
+                                      svfEaveg, svfSaveg, svfWaveg, svfNaveg, svfalfa, rows, cols)
 
-        if hours[i] < 10:
-            XH = '0'
-        else:
-            XH = ''
-        if minu[i] < 10:
-            XM = '0'
-        else:
-            XM = ''
+    # Geometry of the Ground View Factor march is the same for all time steps (requires a 0/1 building raster)
+    if np.all((buildings == 0) | (buildings == 1)):
+        gvfgeometry = GvfGeometry(buildings, wallheight, wallaspect, scale, first, second, alb_grid, albedo_b)
+    else:
+        gvfgeometry = None
 
-        time_code = (str(int(YYYY[0, i])) + "_" + str(int(DOY[i])) + "_" + XH + str(int(hours[i])) + XM + str(int(minu[i])) + w)
+    # Patch geometry of the anisotropic sky (cylindric person without the wall scheme)
+    if anisotropic_sky == 1 and cyl == 1 and wallScheme == 0:
+        skygeometry = AnisotropicSkyGeometry(shmat, vegshmat, vbshvegshmat, asvf, patch_option)
+    else:
+        skygeometry = None
 
-        if configDict['outputtmrt'] == '1':
-            if standAlone == 0:
-                saveraster(gdal_dsm, configDict['output_dir'] + '/Tmrt_' + time_code + '.tif', Tmrt)
-            else:
-                common.save_raster(configDict['output_dir'] + '/Tmrt_' + time_code + '.tif', Tmrt, dsm_transf, dsm_crs)
-        if configDict['outputkup'] == '1':
-            if standAlone == 0:           
-                saveraster(gdal_dsm, configDict['output_dir'] + '/Kup_' + time_code + '.tif', Kup)
-            else:
-                common.save_raster(configDict['output_dir'] + '/Kup_' + time_code + '.tif', Kup, dsm_transf, dsm_crs)
-        if configDict['outputkdown'] == '1':
-            if standAlone == 0:
-                saveraster(gdal_dsm, configDict['output_dir'] + '/Kdown_' + time_code + '.tif', Kdown)
-            else:
-                common.save_raster(configDict['output_dir'] + '/Kdown_' + time_code + '.tif', Kdown, dsm_transf, dsm_crs)
-        if configDict['outputlup'] == '1':
-            if standAlone == 0:
-                saveraster(gdal_dsm, configDict['output_dir'] + '/Lup_' + time_code + '.tif', Lup)
+    # Shadows cached on disk for later runs on the same grids (advanced option shadowcache in configsolweig.ini)
+    if int(configDict.get('shadowcache', 0)) == 1:
+        shadowcache = ShadowCache()
+    else:
+        shadowcache = None
+
+    # The writer thread and its files are closed also when the time loop fails
+    try:
+        for i in np.arange(0, Ta.__len__()):
+            if feedback is not None:
+                feedback.setProgress(int(i * (100. / Ta.__len__()))) # move progressbar forward
+                if feedback.isCanceled():
+                    feedback.setProgressText("Calculation cancelled")
+                    break
             else:
-                common.save_raster(configDict['output_dir'] + '/Lup_' + time_code + '.tif', Lup, dsm_transf, dsm_crs)
-        if configDict['outputldown'] == '1':
-            if standAlone == 0:
-                saveraster(gdal_dsm, configDict['output_dir'] + '/Ldown_' + time_code + '.tif', Ldown)
+                progress.update(1)
+
+            # Daily water body temperature
+            if landcover == 1:
+                if ((dectime[i] - np.floor(dectime[i]))) == 0 or (i == 0):
+                    Twater = np.mean(Ta[jday[0] == np.floor(dectime[i])])
+            # Nocturnal cloudfraction from Offerle et al. 2003
+            if (dectime[i] - np.floor(dectime[i])) == 0:
+                daylines = np.where(np.floor(dectime) == dectime[i])
+                if daylines.__len__() > 1:
+                    alt = altitude[0][daylines]
+                    alt2 = np.where(alt > 1)
+                    rise = alt2[0][0]
+                    [_, CI, _, _, _] = clearnessindex_2013b(zen[0, i + rise + 1], jday[0, i + rise + 1],
+                                                            Ta[i + rise + 1],
+                                                            RH[i + rise + 1] / 100., radG[i + rise + 1], location,
+                                                            P[i + rise + 1])
+                    if (CI > 1.) or (CI == np.inf):
+                        CI = 1.
+                else:
+                    CI = 1.
+
+            # Only if Kdir is derived from horizontal global shortwave and horizontal diffuse shortwave
+            # if altitude[0][i] > 0:
+            #     radI[i] = radI[i]/np.sin(altitude[0][i] * np.pi/180)
+            # else:
+            #     radG[i] = 0.
+            #     radD[i] = 0.
+            #     radI[i] = 0.
+
+
+            Tmrt, Kdown, Kup, Ldown, Lup, Tg, ea, esky, I0, CI, shadow, firstdaytime, timestepdec, timeadd, \
+                    Tgmap1, Tgmap1E, Tgmap1S, Tgmap1W, Tgmap1N, Keast, Ksouth, Kwest, Knorth, Least, \
+                    Lsouth, Lwest, Lnorth, KsideI, TgOut1, TgOut, radIout, radDout, \
+                    Lside, Lsky_patch_characteristics, CI_Tg, CI_TgG, KsideD, \
+                        dRad, Kside, steradians, voxelTable = so.Solweig_2025a_calc(
+                        i, dsm, scale, rows, cols, svf, svfN, svfW, svfE, svfS, svfveg,
+                        svfNveg, svfEveg, svfSveg, svfWveg, svfaveg, svfEaveg, svfSaveg, svfWaveg, svfNaveg, \
+                        vegdsm, vegdsm2, albedo_b, absK, absL, ewall, Fside, Fup, Fcyl, altitude[0][i],
+                        azimuth[0][i], zen[0][i], jday[0][i], usevegdem, onlyglobal, buildings, location,
+                        psi[0][i], landcover, lcgrid, dectime[i], altmax[0][i], wallaspect,
+                        wallheight, cyl, elvis, Ta[i], RH[i], radG[i], radD[i], radI[i], P[i], amaxvalue,
+                        bush, Twater, TgK, Tstart, alb_grid, emis_grid, TgK_wall, Tstart_wall, TmaxLST,
+                        TmaxLST_wall, first, second, svfalfa, svfbuveg, firstdaytime, timeadd, timestepdec, 
+                        Tgmap1, Tgmap1E, Tgmap1S, Tgmap1W, Tgmap1N, CI, TgOut1, diffsh, shmat, vegshmat, vbshvegshmat, 
+                        anisotropic_sky, asvf, patch_option, voxelMaps, voxelTable, Ws[i], wallScheme, timeStep, steradians, walls_scheme, dirwalls_scheme,
+                        gvfgeometry=gvfgeometry, skygeometry=skygeometry,
+                        solweiggeometry=solweiggeometry, shadowcache=shadowcache)
+
+            # Save I0 for I0 vs. Kdown output plot to check if UTC is off
+            # if i == (first_unique_day.shape[0] - 1):
+            #     # Output I0 vs. Kglobal plot
+            #     radG_for_plot = radG[DOY == first_unique_day[0]]
+            #     # hours_for_plot = hours[DOY == first_unique_day[0]]
+            #     dectime_for_plot = dectime[DOY == first_unique_day[0]]
+            #     fig, ax = plt.subplots()
+            #     ax.plot(dectime_for_plot, I0_array, label='I0')
+            #     ax.plot(dectime_for_plot, radG_for_plot, label='Kglobal')
+            #     ax.set_ylabel('Shortwave radiation [$Wm^{-2}$]')
+            #     ax.set_xlabel('Decimal time')
+            #     ax.set_title('UTC' + str(configDict['utc']))
+            #     ax.legend()
+            #     fig.savefig(configDict['output_dir'] + '/metCheck.png', dpi=150)
+            # elif i < (first_unique_day.shape[0] - 1):
+            #     I0_array[i] = I0
+
+            # Save I0 for I0 vs. Kdown output plot to check if UTC is off
+            if i < first_unique_day.shape[0]:
+                I0_array[i] = I0
+            elif i == first_unique_day.shape[0]:
+                # Output I0 vs. Kglobal plot
+                radG_for_plot = radG[DOY == first_unique_day[0]]
+                # hours_for_plot = hours[DOY == first_unique_day[0]]
+                dectime_for_plot = dectime[DOY == first_unique_day[0]]
+                fig, ax = plt.subplots()
+                ax.plot(dectime_for_plot, I0_array, label='I0')
+                ax.plot(dectime_for_plot, radG_for_plot, label='Kglobal')
+                ax.set_ylabel('Shortwave radiation [$Wm^{-2}$]')
+                ax.set_xlabel('Decimal time')
+                ax.set_title('UTC' + str(configDict['utc']))
+                ax.legend()
+                fig.savefig(configDict['output_dir'] + '/metCheck.png', dpi=150)
+
+            tmrtplot = tmrtplot + Tmrt
+
+            if altitude[0][i] > 0:
+                w = 'D'
             else:
-                common.save_raster(configDict['output_dir'] + '/Ldown_' + time_code + '.tif', Ldown, dsm_transf, dsm_crs)
-        if configDict['outputsh'] == '1':
-            if standAlone == 0:
-                saveraster(gdal_dsm, configDict['output_dir'] + '/Shadow_' + time_code + '.tif', shadow)
+                w = 'N'
+
+            # Write to POIs
+            if not poisxy is None:              
+                # UTCI and PET for all points of interest at once
+                WsUTCI = (10. / sensorheight) ** 0.2 * Ws[i]
+                resultUTCI = utci.utci_calculator_array(Ta[i], RH[i], Tmrt[poisxy[:, 2].astype(int), poisxy[:, 1].astype(int)], WsUTCI)
+                # Recalculating wind speed based on powerlaw
+                WsPET = (1.1 / sensorheight) ** 0.2 * Ws[i]
+                resultPET = p._PET_array(Ta[i], RH[i], Tmrt[poisxy[:, 2].astype(int), poisxy[:, 1].astype(int)], WsPET,
+                                         mbody, age, ht, activity, clo, sex)
+                for k in range(0, poisxy.shape[0]):
+                    poi_save = np.zeros((1, 41))
+                    poi_save[0, 0] = YYYY[0][i]
+                    poi_save[0, 1] = jday[0][i]
+                    poi_save[0, 2] = hours[i]
+                    poi_save[0, 3] = minu[i]
+                    poi_save[0, 4] = dectime[i]
+                    poi_save[0, 5] = altitude[0][i]
+                    poi_save[0, 6] = azimuth[0][i]
+                    poi_save[0, 7] = radIout
+                    poi_save[0, 8] = radDout
+                    poi_save[0, 9] = radG[i]
+                    poi_save[0, 10] = Kdown[int(poisxy[k, 2]), int(poisxy[k, 1])]
+                    poi_save[0, 11] = Kup[int(poisxy[k, 2]), int(poisxy[k, 1])]
+                    poi_save[0, 12] = Keast[int(poisxy[k, 2]), int(poisxy[k, 1])]
+                    poi_save[0, 13] = Ksouth[int(poisxy[k, 2]), int(poisxy[k, 1])]
+                    poi_save[0, 14] = Kwest[int(poisxy[k, 2]), int(poisxy[k, 1])]
+                    poi_save[0, 15] = Knorth[int(poisxy[k, 2]), int(poisxy[k, 1])]
+                    poi_save[0, 16] = Ldown[int(poisxy[k, 2]), int(poisxy[k, 1])]
+                    poi_save[0, 17] = Lup[int(poisxy[k, 2]), int(poisxy[k, 1])]
+                    poi_save[0, 18] = Least[int(poisxy[k, 2]), int(poisxy[k, 1])]
+                    poi_save[0, 19] = Lsouth[int(poisxy[k, 2]), int(poisxy[k, 1])]
+                    poi_save[0, 20] = Lwest[int(poisxy[k, 2]), int(poisxy[k, 1])]
+                    poi_save[0, 21] = Lnorth[int(poisxy[k, 2]), int(poisxy[k, 1])]
+                    poi_save[0, 22] = Ta[i]
+                    poi_save[0, 23] = TgOut[int(poisxy[k, 2]), int(poisxy[k, 1])]
+                    poi_save[0, 24] = RH[i]
+                    poi_save[0, 25] = esky
+                    poi_save[0, 26] = Tmrt[int(poisxy[k, 2]), int(poisxy[k, 1])]
+                    poi_save[0, 27] = I0
+                    poi_save[0, 28] = CI
+                    poi_save[0, 29] = shadow[int(poisxy[k, 2]), int(poisxy[k, 1])]
+                    poi_save[0, 30] = svf[int(poisxy[k, 2]), int(poisxy[k, 1])]
+                    poi_save[0, 31] = svfbuveg[int(poisxy[k, 2]), int(poisxy[k, 1])]
+                    poi_save[0, 32] = KsideI[int(poisxy[k, 2]), int(poisxy[k, 1])]
+                    poi_save[0, 33] = resultPET[k]
+                    poi_save[0, 34] = resultUTCI[k]
+                    poi_save[0, 35] = CI_Tg
+                    poi_save[0, 36] = CI_TgG
+                    poi_save[0, 37] = KsideD[int(poisxy[k, 2]), int(poisxy[k, 1])]
+                    poi_save[0, 38] = Lside[int(poisxy[k, 2]), int(poisxy[k, 1])]
+                    poi_save[0, 39] = dRad[int(poisxy[k, 2]), int(poisxy[k, 1])]
+                    poi_save[0, 40] = Kside[int(poisxy[k, 2]), int(poisxy[k, 1])]
+                    data_out = configDict['output_dir'] + '/POI_' + str(poiname[k]) + '.txt'
+                    # f_handle = file(data_out, 'a')
+                    f_handle = open(data_out, 'ab')
+                    np.savetxt(f_handle, poi_save, fmt=numformat)
+                    f_handle.close()
+
+            # If wall temperature parameterization scheme is in use
+            if configDict['wallscheme'] == 1: # folderWallScheme: TODO: Fix for standalone
+                # Store wall data for output
+                if not woisxy is None:
+                    for k in range(0, woisxy.shape[0]):
+                        temp_wall = voxelTable.loc[((voxelTable['ypos'] == woisxy[k, 2]) & (voxelTable['xpos'] == woisxy[k, 1])), 'wallTemperature'].to_numpy()
+                        K_in = voxelTable.loc[((voxelTable['ypos'] == woisxy[k, 2]) & (voxelTable['xpos'] == woisxy[k, 1])), 'K_in'].to_numpy()
+                        L_in = voxelTable.loc[((voxelTable['ypos'] == woisxy[k, 2]) & (voxelTable['xpos'] == woisxy[k, 1])), 'L_in'].to_numpy()
+                        wallShade = voxelTable.loc[((voxelTable['ypos'] == woisxy[k, 2]) & (voxelTable['xpos'] == woisxy[k, 1])), 'wallShade'].to_numpy()
+                        temp_all = np.concatenate([temp_wall, K_in, L_in, wallShade])
+                        # temp_all = np.concatenate([temp_wall])
+                        # wall_data = np.zeros((1, 7 + temp_wall.shape[0]))
+                        wall_data = np.zeros((1, 7 + temp_all.shape[0]))
+                        # Part of file name (wallid), i.e. WOI_wallid.txt
+                        data_out = configDict['output_dir'] + '/WOI_' + str(woiname[k]) + '.txt'                    
+                        if i == 0:
+                            # Output file header
+                            #header = 'yyyy id   it imin dectime Ta  SVF Ts'
+                            header = 'yyyy id   it imin dectime Ta  SVF' + ' Ts' * temp_wall.shape[0] + ' Kin' * K_in.shape[0] + ' Lin' * L_in.shape[0] + ' shade' * wallShade.shape[0]
+                            # Part of file name (wallid), i.e. WOI_wallid.txt
+                            # woiname = voxelTable.loc[((voxelTable['ypos'] == woisxy[k, 2]) & (voxelTable['xpos'] == woisxy[k, 1])), 'wallId'].to_numpy()[0]
+                            woi_save = []  # 
+                            np.savetxt(data_out, woi_save,  delimiter=' ', header=header, comments='')                        
+                        # Fill wall_data with variables
+                        wall_data[0, 0] = YYYY[0][i] 
+                        wall_data[0, 1] = jday[0][i]
+                        wall_data[0, 2] = hours[i]
+                        wall_data[0, 3] = minu[i]
+                        wall_data[0, 4] = dectime[i]
+                        wall_data[0, 5] = Ta[i]
+                        wall_data[0, 6] = svf[int(woisxy[k, 2]), int(woisxy[k, 1])]
+                        wall_data[0, 7:] = temp_all
+
+                        # Num format for output file data
+                        woi_numformat = '%d %d %d %d %.5f %.2f %.2f' + ' %.2f' * temp_all.shape[0]
+                        # Open file, add data, save
+                        f_handle = open(data_out, 'ab')
+                        np.savetxt(f_handle, wall_data, fmt=woi_numformat)
+                        f_handle.close()                
+
+                # Save wall temperature/radiation as NetCDF TODO: fix for standAlone?
+                if configDict['wallnetcdf'] == 1: # wallNetCDF:
+                    netcdf_output = configDict['output_dir'] + '/walls.nc'
+                    walls_as_netcdf(voxelTable, rows, cols, met_for_xarray, i, dsm, configDict['filepath_dsm'], netcdf_output)
+
+            if hours[i] < 10:
+                XH = '0'
             else:
-                common.save_raster(configDict['output_dir'] + '/Shadow_' + time_code + '.tif', shadow, dsm_transf, dsm_crs)
-            
-        if configDict['outputkdiff'] == '1':
-            if standAlone == 0:
-                saveraster(gdal_dsm, configDict['output_dir'] + '/Kdiff_' + time_code + '.tif', dRad)  
+                XH = ''
+            if minu[i] < 10:
+                XM = '0'
             else:
-                common.save_raster(configDict['output_dir'] + '/Kdiff_' + time_code + '.tif', dRad, dsm_transf, dsm_crs)         
-
-        # Sky view image of patches
-        if ((anisotropic_sky == 1) & (i == 0) & (not poisxy is None)):
-                for k in range(poisxy.shape[0]):
-                    Lsky_patch_characteristics[:,2] = patch_characteristics[:,k]
-                    skyviewimage_out = configDict['output_dir'] + '/POI_' + str(poiname[k]) + '.png'
-                    PolarBarPlot(Lsky_patch_characteristics, altitude[0][i], azimuth[0][i], 'Hemisphere partitioning', skyviewimage_out, 0, 5, 0)
+                XM = ''
+
+            time_code = (str(int(YYYY[0, i])) + "_" + str(int(DOY[i])) + "_" + XH + str(int(hours[i])) + XM + str(int(minu[i])) + w)
+
+            if int(configDict['outputtmrt']) == 1:
+                writer.write('Tmrt', i, time_code, Tmrt)
+            if int(configDict['outputkup']) == 1:
+                writer.write('Kup', i, time_code, Kup)
+            if int(configDict['outputkdown']) == 1:
+                writer.write('Kdown', i, time_code, Kdown)
+            if int(configDict['outputlup']) == 1:
+                writer.write('Lup', i, time_code, Lup)
+            if int(configDict['outputldown']) == 1:
+                writer.write('Ldown', i, time_code, Ldown)
+            if int(configDict['outputsh']) == 1:
+                writer.write('Shadow', i, time_code, shadow)
+            if int(configDict['outputkdiff']) == 1:
+                writer.write('Kdiff', i, time_code, dRad)
+
+            # Sky view image of patches
+            if ((anisotropic_sky == 1) & (i == 0) & (not poisxy is None)):
+                    for k in range(poisxy.shape[0]):
+                        Lsky_patch_characteristics[:,2] = patch_characteristics[:,k]
+                        skyviewimage_out = configDict['output_dir'] + '/POI_' + str(poiname[k]) + '.png'
+                        PolarBarPlot(Lsky_patch_characteristics, altitude[0][i], azimuth[0][i], 'Hemisphere partitioning', skyviewimage_out, 0, 5, 0)
+    finally:
+        writer.close()
 
     # Save files for Tree Planter
-    if configDict['outputtreeplanter'] == '1': # outputTreeplanter:
+    if int(configDict['outputtreeplanter']) == 1: # outputTreeplanter:
         if feedback is not None:
             feedback.setProgressText("Saving files for Tree Planter tool")
         # Save DSM
@@ -250,7 +250,68 @@ def utci_calculator(Ta, RH, Tmrt, va10m):
 
     return UTCI_approx
 
-def utci_calculator_grid(Ta, RH, Tmrt, va10m, feedback):
+def utci_vapour_pressure(Ta, RH):
+    # Vapour pressure in kPa from air temperature (degC) and relative humidity (%)
+    # saturation vapour pressure (es)
+    g = np.array([-2.8365744E3, - 6.028076559E3, 1.954263612E1, - 2.737830188E-2,
+                  1.6261698E-5, 7.0229056E-10, - 1.8680009E-13, 2.7150305])
+
+    tk = Ta + 273.15  # ! air temp in K
+    es = g[7] * np.log(tk)
+    for i in range(0, 7):
+        es = es + g[i] * tk ** (i + 1 - 3.)
+
+    es = np.exp(es) * 0.01
+
+    ehPa = es * RH / 100.
+    Pa = ehPa / 10.0  # use vapour pressure in kPa
+
+    return Pa
+
+def utci_polynomial_array(Ta, Pa, Tmrt, va, out, select, float32=False, chunksize=1000000, feedback=None):
+    # Evaluates utci_polynomial for the pixels in select (flat indices) and writes them to out.
+    # Done in chunks of chunksize pixels to cap the size of the temporary arrays of the polynomial.
+    # With float32=True the polynomial is evaluated in single precision.
+    if float32:
+        Ta = np.float32(Ta)
+        Pa = np.float32(Pa)
+        dtype = np.float32
+    else:
+        dtype = float
+
+    Tmrt = Tmrt.ravel()
+    va = va.ravel()
+    outflat = out.reshape(-1)
+    nchunks = int(np.ceil(select.shape[0] / chunksize))
+    for chunk in range(nchunks):
+        if feedback is not None:
+            if feedback.isCanceled():
+                feedback.setProgressText("Calculation cancelled")
+                break
+            feedback.setProgress(int(chunk * 100. / nchunks))
+        pixels = select[chunk * chunksize:(chunk + 1) * chunksize]
+        D_Tmrt = Tmrt[pixels].astype(dtype) - Ta
+        outflat[pixels] = utci_polynomial(D_Tmrt, Ta, va[pixels].astype(dtype), Pa)
+
+    return out
+
+def utci_calculator_array(Ta, RH, Tmrt, va10m):
+    # Array version of utci_calculator (e.g. for all points of interest at once), with the same
+    # handling of missing values (-999 if any input is missing).
+    Tmrt = np.asarray(Tmrt, dtype=float)
+    va10m = np.broadcast_to(np.asarray(va10m, dtype=float), Tmrt.shape)
+    UTCI_approx = np.ones(Tmrt.shape) * -999
+
+    if Ta <= -999 or RH <= -999:
+        return UTCI_approx
+
+    Pa = utci_vapour_pressure(Ta, RH)
+    select = np.flatnonzero(~((Tmrt <= -999) | (va10m <= -999)))
+    utci_polynomial_array(Ta, Pa, Tmrt, va10m, UTCI_approx, select)
+
+    return UTCI_approx
+
+def utci_calculator_grid(Ta, RH, Tmrt, va10m, feedback, float32=False, chunksize=1000000):
     # Program for calculating UTCI Temperature (UTCI)
     # released for public use after termination of COST Action 730
 
@@ -258,53 +319,31 @@ def utci_calculator_grid(Ta, RH, Tmrt, va10m, feedback):
     # UTCI, Version a 0.002, October 2009
     # Copyright (C) 2009  Peter Broede
 
+    # The polynomial is evaluated for all pixels at once (in chunks of chunksize pixels),
+    # optionally in single precision (float32=True).
+
     rows = Tmrt.shape[0]
     cols = Tmrt.shape[1]
+    va10m = np.broadcast_to(va10m, (rows, cols))
 
     # If Tair or relative humidity is NaN, set all UTCI to -999
     if Ta <= -999 or RH <= -999:
         UTCI_approx = np.ones((rows, cols)) * -999
     # Else, create an empty raster for UTCI and start estimating UTCI
     else:
-        UTCI_approx = np.zeros((rows, cols))
+        if float32:
+            UTCI_approx = np.zeros((rows, cols), dtype=np.float32)
+        else:
+            UTCI_approx = np.zeros((rows, cols))
 
-        # saturation vapour pressure (es)
-        g = np.array([-2.8365744E3, - 6.028076559E3, 1.954263612E1, - 2.737830188E-2,
-                      1.6261698E-5, 7.0229056E-10, - 1.8680009E-13, 2.7150305])
+        Pa = utci_vapour_pressure(Ta, RH)
 
-        tk = Ta + 273.15  # ! air temp in K
-        es = g[7] * np.log(tk)
-        for i in range(0, 7):
-            es = es + g[i] * tk ** (i + 1 - 3.)
+        # Set UTCI to NaN (-9999) if Tmrt or wind speed is NaN
+        nodata = (Tmrt <= -999) | (va10m <= -999)
+        UTCI_approx[nodata] = -9999
 
-        es = np.exp(es) * 0.01
+        # Calculate 6th order polynomial as approximation if wind speed is above zero
+        select = np.flatnonzero(~nodata & (va10m > 0))
+        utci_polynomial_array(Ta, Pa, Tmrt, va10m, UTCI_approx, select, float32, chunksize, feedback)
 
-        ehPa = es * RH / 100.
-        Pa = ehPa / 10.0  # use vapour pressure in kPa
-
-        # For progress counter
-        index = 0
-        total = 100. / (rows * cols)
-
-        # Start UTCI approximation
-        for iy in np.arange(rows):
-            if feedback.isCanceled():
-                feedback.setProgressText("Calculation cancelled")
-                break
-            for ix in np.arange(cols):
-
-                D_Tmrt = Tmrt[iy, ix] - Ta
-                # va = va10m[iy, ix]
-                
-                # Set UTCI to NaN (-999) if Tmrt or wind speed is NaN
-                if Tmrt[iy, ix] <= -999 or va10m[iy, ix] <= -999:
-                    UTCI_approx[iy, ix] = -9999
-                # Calculate 6th order polynomial as approximation if wind speed is above zero
-                elif va10m[iy, ix] > 0:
-                    UTCI_approx[iy, ix] = utci_polynomial(D_Tmrt, Ta, va10m[iy, ix], Pa)
-
-                # Progress counter
-                index = index + 1
-                feedback.setProgress(int(index * total))
-
-    return UTCI_approx
\ No newline at end of file
+    return UTCI_approx
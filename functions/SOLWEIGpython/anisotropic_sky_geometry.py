@@ -0,0 +1,209 @@
+import numpy as np
+
+from . import emissivity_models
+from .patch_radiation import patch_steradians
+from ...util.SEBESOLWEIGCommonFiles.create_patches import create_patches
+
+# Anisotropic sky (anisotropic_sky) for a cylindric person with the patch geometry calculated once per run.
+# Which patches are seen as sky, vegetation, buildings or reflecting surfaces from each pixel only depends on the
+# shadow matrices. Vegetation and reflected longwave radiation are the same for all patches and are summed per
+# pixel here. Sky and buildings depend on the luminance, emissivity and sun position of each patch and are stored
+# bit-packed (pixels x patches), so that each time step is a few matrix products over blocks of pixels.
+
+
+def patch_weights(patch_altitude, patch_azimuth, steradians):
+    # Steradian weights of each patch (patches x 6) for a vertical (side) and horizontal (down) surface and the
+    # portions into cardinal directions (east, south, west, north), as in patch_radiation
+    deg2rad = np.pi / 180
+    angle_of_incidence = np.cos(patch_altitude * deg2rad) * np.cos(0)
+    angle_of_incidence_h = np.sin(patch_altitude * deg2rad)
+
+    east = np.where((patch_azimuth > 360) | (patch_azimuth < 180), np.cos((90 - patch_azimuth) * deg2rad), 0)
+    south = np.where((patch_azimuth > 90) & (patch_azimuth < 270), np.cos((180 - patch_azimuth) * deg2rad), 0)
+    west = np.where((patch_azimuth > 180) & (patch_azimuth < 360), np.cos((270 - patch_azimuth) * deg2rad), 0)
+    north = np.where((patch_azimuth > 270) | (patch_azimuth < 90), np.cos((0 - patch_azimuth) * deg2rad), 0)
+
+    side = steradians * angle_of_incidence
+    return np.stack((side, steradians * angle_of_incidence_h, side * east, side * south, side * west, side * north),
+                    axis=1)
+
+
+class AnisotropicSkyGeometry:
+    """
+    Patch geometry of the anisotropic sky for all pixels.
+
+    shmat, vegshmat, vbshvegshmat: shadow matrices (rows x cols x patches), float or PackedShadowMatrix
+    asvf: angle of the sky view factor, used for sunlit and shaded building patches
+    patch_option: sky vault of create_patches
+    blockpixels: pixels x patches evaluated at once in the matrix products
+    """
+
+    def __init__(self, shmat, vegshmat, vbshvegshmat, asvf, patch_option, blockpixels=2 ** 21):
+        rows, cols, patches = shmat.shape
+        self.rows = rows
+        self.cols = cols
+
+        skyvaultalt, skyvaultazi, _, _, _, _, _ = create_patches(patch_option)
+        self.L_patches = np.stack((skyvaultalt, skyvaultazi, np.zeros(skyvaultalt.shape[0])), axis=1)
+        self.steradians, _, _ = patch_steradians(self.L_patches)
+        self.patch_altitude = self.L_patches[:, 0]
+        self.patch_azimuth = self.L_patches[:, 1]
+        self.skyalt, self.band = np.unique(self.patch_altitude, return_inverse=True)
+        self.weights = patch_weights(self.patch_altitude, self.patch_azimuth, self.steradians)
+        self.tan_altitude = np.tan(self.patch_altitude * (np.pi / 180))
+        self.hsvf = np.tan(asvf).ravel()
+        self.blockpixels = max(1, blockpixels // patches)
+
+        # Patches seen as sky and as buildings, one bit per patch (np.packbits order)
+        self.sky = np.zeros((rows * cols, (patches + 7) // 8), dtype=np.uint8)
+        self.building = np.zeros((rows * cols, (patches + 7) // 8), dtype=np.uint8)
+        # Steradian weighted sums of vegetation and reflecting patches (6 x rows x cols, see patch_weights)
+        self.vegetation = np.zeros((6, rows, cols))
+        self.reflecting = np.zeros((6, rows, cols))
+
+        for i in range(patches):
+            sh = shmat[:, :, i]
+            vegsh = vegshmat[:, :, i]
+            vbsh = vbshvegshmat[:, :, i]
+            bit = np.uint8(7 - (i & 7))
+            self.sky[:, i >> 3] |= ((sh == 1) & (vegsh == 1)).ravel().astype(np.uint8) << bit
+            self.building[:, i >> 3] |= (((1 - sh) * vbsh) == 1).ravel().astype(np.uint8) << bit
+            self.vegetation += ((vegsh == 0) | (vbsh == 0))[np.newaxis] * self.weights[i][:, np.newaxis, np.newaxis]
+            self.reflecting += ((sh == 0) | (vegsh == 0) | (vbsh == 0))[np.newaxis] * \
+                               self.weights[i][:, np.newaxis, np.newaxis]
+
+    def blocks(self):
+        # Pixel slices and unpacked (pixels x patches) sky and building patches
+        patches = self.L_patches.shape[0]
+        for start in range(0, self.sky.shape[0], self.blockpixels):
+            block = slice(start, min(start + self.blockpixels, self.sky.shape[0]))
+            sky = np.unpackbits(self.sky[block], axis=1, count=patches).astype(float)
+            building = np.unpackbits(self.building[block], axis=1, count=patches).astype(float)
+            yield block, sky, building
+
+
+def anisotropic_sky_geometry(geometry, solar_altitude, solar_azimuth, esky, Ta, Tgwall, ewall, Lup, radI, radD,
+                             lv, albedo, shadow, KupE, KupS, KupW, KupN):
+    '''Same as anisotropic_sky for a cylindric person (cyl = 1) without the wall scheme, using the patch geometry
+    of AnisotropicSkyGeometry. Returns the same grids as anisotropic_sky.'''
+    # Stefan-Boltzmann's Constant
+    SBC = 5.67051e-8
+
+    # Degrees to radians
+    deg2rad = np.pi / 180
+
+    rows = geometry.rows
+    cols = geometry.cols
+    patch_altitude = geometry.patch_altitude
+    patch_azimuth = geometry.patch_azimuth
+    steradians = geometry.steradians
+    weights = geometry.weights
+
+    # Longwave radiation from the sky in each patch, Martin & Berdahl (1984) emissivity per band of altitudes
+    _, esky_band = emissivity_models.model2(geometry.L_patches, esky, Ta)
+    Lnormal = ((esky_band[geometry.band] * SBC * ((Ta + 273.15) ** 4)) / np.pi)
+
+    # Sunlit and shaded surfaces of vegetation and buildings
+    vegetation_surface = ((ewall * SBC * ((Ta + 273.15) ** 4)) / np.pi)
+    sunlit_surface = ((ewall * SBC * ((Ta + Tgwall + 273.15) ** 4)) / np.pi)
+    shaded_surface = ((ewall * SBC * ((Ta + 273.15) ** 4)) / np.pi)
+
+    # Building patches that can be sunlit (longwave) and the sky view factor angle where a patch is in shade,
+    # see sunlit_shaded_patches
+    azimuth_difference = np.abs(solar_azimuth - patch_azimuth)
+    sunlit_side = (azimuth_difference > 90) & (azimuth_difference < 270) & (solar_altitude > 0)
+    yi = 2 * np.cos(azimuth_difference * deg2rad) * np.tan(solar_altitude * deg2rad)
+    yi[yi > 0] = 0
+
+    # Columns of the matrix products: side, down, east, south, west, north and KsideD (sky) or Kref (buildings)
+    sky_weights = np.zeros((patch_altitude.shape[0], 7))
+    sky_weights[:, :6] = weights * Lnormal[:, np.newaxis]
+    sunlit_weights = np.zeros((patch_altitude.shape[0], 7))
+    sunlit_weights[:, :6] = weights * sunlit_side[:, np.newaxis]
+    shaded_weights = np.zeros((patch_altitude.shape[0], 7))
+    shaded_weights[:, :6] = weights * sunlit_side[:, np.newaxis]
+    building_weights = weights * ~sunlit_side[:, np.newaxis]
+
+    if solar_altitude > 0:
+        # Patch luminance
+        patch_luminance = lv[:, 2]
+        # Radiance fraction normalization
+        radTot = np.zeros(1)
+        for i in np.arange(patch_altitude.shape[0]):
+            radTot += (patch_luminance[i] * steradians[i] * np.sin(patch_altitude[i] * deg2rad))
+        lumChi = (patch_luminance * radD) / radTot
+        sky_weights[:, 6] = lumChi * weights[:, 0]
+        sunlit_weights[:, 6] = weights[:, 0]
+        shaded_weights[:, 6] = weights[:, 0]
+
+    sky = np.zeros((rows * cols, 7))
+    sunlit = np.zeros((rows * cols, 7))
+    shaded = np.zeros((rows * cols, 7))
+    for block, skyp, buildingp in geometry.blocks():
+        hsvf = geometry.hsvf[block, np.newaxis] + yi[np.newaxis, :]
+        sky[block] = skyp @ sky_weights
+        sunlit[block] = (buildingp * (hsvf < geometry.tan_altitude)) @ sunlit_weights
+        shaded[block] = (buildingp * (hsvf > geometry.tan_altitude)) @ shaded_weights + \
+                        np.pad(buildingp @ building_weights, ((0, 0), (0, 1)))
+    sky = sky.T.reshape((7, rows, cols))
+    sunlit = sunlit.T.reshape((7, rows, cols))
+    shaded = shaded.T.reshape((7, rows, cols))
+
+    # Longwave radiation from sky, vegetation, sunlit and shaded buildings
+    Lside_sky = sky[0]
+    Ldown_sky = sky[1]
+    Lside_veg = vegetation_surface * geometry.vegetation[0]
+    Ldown_veg = vegetation_surface * geometry.vegetation[1]
+    Lside_sun = sunlit_surface * sunlit[0]
+    Ldown_sun = sunlit_surface * sunlit[1]
+    Lside_sh = shaded_surface * shaded[0]
+    Ldown_sh = shaded_surface * shaded[1]
+
+    # Reflected longwave radiation
+    reflected_radiation = (((Ldown_sky + Lup) * (1 - ewall) * 0.5) / np.pi)
+    Lside_ref = reflected_radiation * geometry.reflecting[0]
+    Ldown_ref = reflected_radiation * geometry.reflecting[1]
+
+    # Portion into cardinal directions
+    Least, Lsouth, Lwest, Lnorth = sky[2:6] + vegetation_surface * geometry.vegetation[2:] + \
+                                   sunlit_surface * sunlit[2:6] + shaded_surface * shaded[2:6] + \
+                                   reflected_radiation * geometry.reflecting[2:]
+
+    # Sum of all Lside components (sky, vegetation, sunlit and shaded buildings, reflected)
+    Lside = Lside_sky + Lside_veg + Lside_sh + Lside_sun + Lside_ref
+
+    # Sum of all Ldown components (sky, vegetation, sunlit and shaded buildings, reflected)
+    Ldown = Ldown_sky + Ldown_veg + Ldown_sh + Ldown_sun + Ldown_ref
+
+    KsideD = np.zeros((rows, cols))
+    Kside = np.zeros((rows, cols))
+    Keast = np.zeros((rows, cols))
+    Kwest = np.zeros((rows, cols))
+    Knorth = np.zeros((rows, cols))
+    Ksouth = np.zeros((rows, cols))
+
+    ### Direct radiation ###
+    KsideI = shadow * radI * np.cos(solar_altitude * deg2rad)
+
+    if solar_altitude > 0:
+        # Shortwave radiation from sky
+        KsideD = sky[6]
+
+        # Shortwave reflected on sunlit surfaces
+        sunlit_surface = ((albedo * (radI * np.cos(solar_altitude * deg2rad)) + (radD * 0.5)) / np.pi)
+        # Shortwave reflected on shaded surfaces and vegetation
+        shaded_surface = ((albedo * radD * 0.5) / np.pi)
+
+        Kref_veg = shaded_surface * geometry.vegetation[0]
+        Kref_sun = sunlit_surface * sunlit[6]
+        Kref_sh = shaded_surface * shaded[6]
+
+        Kside = KsideI + KsideD + Kref_sun + Kref_sh + Kref_veg
+
+        Keast = (KupE * 0.5)
+        Kwest = (KupW * 0.5)
+        Knorth = (KupN * 0.5)
+        Ksouth = (KupS * 0.5)
+
+    return Ldown, Lside, Lside_sky, Lside_veg, Lside_sh, Lside_sun, Lside_ref, Least, Lwest, Lnorth, Lsouth, \
+           Keast, Ksouth, Kwest, Knorth, KsideI, KsideD, Kside, steradians, geometry.skyalt
@@ -0,0 +1,329 @@
+import numpy as np
+
+# Ground View Factors (gvf_2018a) with the geometry of the 18 search directions computed once per run.
+# sunonsurface_2018a marches shifted copies of the grids away from each pixel. Where the march is stopped by
+# buildings, which pixels are shifted in each step and which walls face away from the search direction only
+# depend on buildings, walls and wall aspect. Per time step only the radiation fields (shadow, Lup, albedo in
+# shadow, sunlit walls) are shifted and summed. Results are identical to gvf_2018a.
+
+
+def gvf_azimuths():
+    return np.arange(5, 359, 20)  # Search directions for Ground View Factors (GVF)
+
+
+def gvf_march(azimuth, second, sizex, sizey):
+    # Target and source slices of the grids shifted in each step of the march in direction azimuth (radians),
+    # as in sunonsurface_2018a
+    pibyfour = np.pi / 4
+    threetimespibyfour = 3 * pibyfour
+    fivetimespibyfour = 5 * pibyfour
+    seventimespibyfour = 7 * pibyfour
+    sinazimuth = np.sin(azimuth)
+    cosazimuth = np.cos(azimuth)
+    tanazimuth = np.tan(azimuth)
+    signsinazimuth = np.sign(sinazimuth)
+    signcosazimuth = np.sign(cosazimuth)
+
+    steps = []
+    for index in np.arange(0, second):
+        if (pibyfour <= azimuth and azimuth < threetimespibyfour) or (
+                fivetimespibyfour <= azimuth and azimuth < seventimespibyfour):
+            dy = signsinazimuth * index
+            dx = -1 * signcosazimuth * np.abs(np.round(index / tanazimuth))
+        else:
+            dy = signsinazimuth * abs(round(index * tanazimuth))
+            dx = -1 * signcosazimuth * index
+
+        absdx = np.abs(dx)
+        absdy = np.abs(dy)
+
+        xc1 = ((dx + absdx) / 2)
+        xc2 = (sizex + (dx - absdx) / 2)
+        yc1 = ((dy + absdy) / 2)
+        yc2 = (sizey + (dy - absdy) / 2)
+
+        xp1 = -((dx - absdx) / 2)
+        xp2 = (sizex - (dx + absdx) / 2)
+        yp1 = -((dy - absdy) / 2)
+        yp2 = (sizey - (dy + absdy) / 2)
+
+        steps.append(((slice(int(xp1), int(xp2)), slice(int(yp1), int(yp2))),
+                      (slice(int(xc1), int(xc2)), slice(int(yc1), int(yc2)))))
+
+    return steps
+
+
+def gvf_facesh(azimuth, aspect, wallbol):
+    # Walls in shadow due to selfshadowing, as in sunonsurface_2018a
+    azilow = azimuth - np.pi / 2
+    azihigh = azimuth + np.pi / 2
+    if azilow >= 0 and azihigh < 2 * np.pi:  # 90 to 270  (SHADOW)
+        facesh = (np.logical_or(aspect < azilow, aspect >= azihigh).astype(float) - wallbol + 1)
+    elif azilow < 0 and azihigh <= 2 * np.pi:  # 0 to 90
+        azilow = azilow + 2 * np.pi
+        facesh = np.logical_or(aspect > azilow, aspect <= azihigh) * -1 + 1  # (SHADOW)    # check for the -1
+    elif azilow > 0 and azihigh >= 2 * np.pi:  # 270 to 360
+        azihigh = azihigh - 2 * np.pi
+        facesh = np.logical_or(aspect > azilow, aspect <= azihigh) * -1 + 1  # (SHADOW)
+
+    return facesh
+
+
+class GvfGeometry:
+    """
+    Geometry of the Ground View Factor march for all search directions of gvf_2018a.
+
+    buildings: 0 for buildings, 1 for ground
+    walls, dirwalls: wall height and wall aspect (degrees)
+    first, second: radiative surface influence (m), as given to gvf_2018a
+
+    For each direction the march is stopped at the first building in the search direction. stop holds the
+    step at which this happens for each pixel, so that the buildings do not have to be marched again for each
+    time step. gvfalbnosh (and the E, S, W, N parts) only depends on the geometry and albedo and is calculated here.
+    """
+
+    def __init__(self, buildings, walls, dirwalls, scale, first, second, alb_grid, albedo_b):
+        self.azimuthA = gvf_azimuths()
+        self.buildings = buildings
+        self.walls = walls
+        rows, cols = buildings.shape
+
+        first = np.round(first * scale)
+        if first < 1:
+            first = 1
+        second = np.round(second * scale)
+        self.first = first
+        self.second = second
+
+        aspect = dirwalls * np.pi / 180
+        wallbol = (walls > 0) * 1
+
+        self.steps = []
+        stoptype = np.int16 if second < np.iinfo(np.int16).max else np.int32
+        self.stop = np.zeros((self.azimuthA.shape[0], rows, cols), dtype=stoptype)
+        self.facezero = np.zeros((self.azimuthA.shape[0], rows, cols), dtype=bool)
+
+        gvfalbnosh = np.zeros((rows, cols))
+        gvfalbnoshE = np.zeros((rows, cols))
+        gvfalbnoshS = np.zeros((rows, cols))
+        gvfalbnoshW = np.zeros((rows, cols))
+        gvfalbnoshN = np.zeros((rows, cols))
+
+        for j in range(self.azimuthA.shape[0]):
+            azimuth = self.azimuthA[j] * (np.pi / 180)
+            steps = gvf_march(azimuth, second, rows, cols)
+            self.steps.append(steps)
+
+            stop = self.stop[j]
+            stop[:, :] = len(steps)
+            f = buildings
+            tempbu = np.zeros((rows, cols))
+            tempalbnosh = np.zeros((rows, cols))
+            tempbubwall = np.zeros((rows, cols))
+            weightsumalbnosh = np.zeros((rows, cols))
+            weightsumalbwallnosh = np.zeros((rows, cols))
+            for n, (target, source) in enumerate(steps):
+                tempbu[target] = buildings[source]  # moving building
+                tempalbnosh[target] = alb_grid[source]  # moving Albedo
+                f = np.min([f, tempbu], axis=0)  # utsmetning av buildings
+                stop[(f == 0) & (stop == len(steps))] = n
+
+                albnosh = tempalbnosh * f
+                weightsumalbnosh = weightsumalbnosh + albnosh
+
+                tempbwall = f * -1 + 1
+                tempbubwall = ((tempbwall + tempbubwall) > 0) * 1
+                weightsumalbwallnosh = weightsumalbwallnosh + tempbubwall * albedo_b
+
+                if (n + 1) <= first:
+                    weightsumalbwallnosh_first = weightsumalbwallnosh / 1  # *albedo_b
+                    weightsumalbnosh_first = weightsumalbnosh / 1
+                    wallinfluence_first = weightsumalbwallnosh_first > 0
+
+            wallinfluence_second = weightsumalbwallnosh > 0
+            self.facezero[j] = gvf_facesh(azimuth, aspect, wallbol) == 0
+
+            # gvf from albedo only
+            gvfalbnosh1 = ((weightsumalbwallnosh_first + weightsumalbnosh_first) / (first + 1)) * wallinfluence_first + \
+                          (weightsumalbnosh_first) / (first) * (wallinfluence_first * -1 + 1)  #
+            gvfalbnosh2 = ((weightsumalbwallnosh + weightsumalbnosh) / (second)) * wallinfluence_second + \
+                          (weightsumalbnosh) / (second) * (wallinfluence_second * -1 + 1)
+            gvfalbnoshi = (gvfalbnosh1 * 0.5 + gvfalbnosh2 * 0.4) / 0.9
+            gvfalbnoshi = gvfalbnoshi * buildings + alb_grid * (buildings * -1 + 1)
+
+            gvfalbnosh = gvfalbnosh + gvfalbnoshi
+            if (self.azimuthA[j] >= 0) and (self.azimuthA[j] < 180):
+                gvfalbnoshE = gvfalbnoshE + gvfalbnoshi
+            if (self.azimuthA[j] >= 90) and (self.azimuthA[j] < 270):
+                gvfalbnoshS = gvfalbnoshS + gvfalbnoshi
+            if (self.azimuthA[j] >= 180) and (self.azimuthA[j] < 360):
+                gvfalbnoshW = gvfalbnoshW + gvfalbnoshi
+            if (self.azimuthA[j] >= 270) or (self.azimuthA[j] < 90):
+                gvfalbnoshN = gvfalbnoshN + gvfalbnoshi
+
+        self.gvfalbnosh = gvfalbnosh / self.azimuthA.__len__()
+        self.gvfalbnoshE = gvfalbnoshE / (self.azimuthA.__len__() / 2)
+        self.gvfalbnoshS = gvfalbnoshS / (self.azimuthA.__len__() / 2)
+        self.gvfalbnoshW = gvfalbnoshW / (self.azimuthA.__len__() / 2)
+        self.gvfalbnoshN = gvfalbnoshN / (self.azimuthA.__len__() / 2)
+
+
+def gvf_2018a_geometry(geometry, wallsun, shadow, Tg, Tgwall, Ta, emis_grid, ewall, alb_grid, SBC, albedo_b,
+                       Twater, lc_grid, landcover):
+    # Same as gvf_2018a(wallsun, geometry.walls, geometry.buildings, ...) but using the geometry of GvfGeometry.
+    # Returns the same grids as gvf_2018a.
+    buildings = geometry.buildings
+    walls = geometry.walls
+    first = geometry.first
+    second = geometry.second
+    azimuthA = geometry.azimuthA
+    rows, cols = buildings.shape
+
+    gvfLup = np.zeros((rows, cols))
+    gvfalb = np.zeros((rows, cols))
+    gvfLupE = np.zeros((rows, cols))
+    gvfLupS = np.zeros((rows, cols))
+    gvfLupW = np.zeros((rows, cols))
+    gvfLupN = np.zeros((rows, cols))
+    gvfalbE = np.zeros((rows, cols))
+    gvfalbS = np.zeros((rows, cols))
+    gvfalbW = np.zeros((rows, cols))
+    gvfalbN = np.zeros((rows, cols))
+    gvfSum = np.zeros((rows, cols))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sunwall = (wallsun / walls * buildings) == 1  # new as from 2015a
+
+    # Radiation fields, the same for all directions. As in sunonsurface_2018a, the water temperature is set
+    # in Tg after Lup has been calculated for the first direction.
+    Lup = SBC * emis_grid * (Tg * shadow + Ta + 273.15) ** 4 - SBC * emis_grid * (Ta + 273.15) ** 4  # +Ta
+    sources = np.stack((shadow, Lup, alb_grid * shadow))
+    if landcover == 1:
+        Tg[lc_grid == 3] = Twater - Ta  # Setting water temperature
+        Lup = SBC * emis_grid * (Tg * shadow + Ta + 273.15) ** 4 - SBC * emis_grid * (Ta + 273.15) ** 4  # +Ta
+    Lupground = Lup * (buildings * -1 + 1)
+    Lwall = SBC * ewall * (Tgwall + Ta + 273.15) ** 4 - SBC * ewall * (Ta + 273.15) ** 4  # +Ta
+    albground = alb_grid * (buildings * -1 + 1) * shadow
+
+    # Buffers shared by all directions: shifted shadow, Lup and albedo in shadow, sunlit walls seen (tempbub) with
+    # their number, Lwall and albedo, and the sums over the march
+    wallsources = np.stack((np.ones((rows, cols)), np.broadcast_to(Lwall, (rows, cols)), np.full((rows, cols), albedo_b)))
+    temp = np.zeros((3, rows, cols))
+    weighted = np.zeros((3, rows, cols))
+    weightsum = np.zeros((3, rows, cols))
+    tempwallsun = np.zeros((rows, cols), dtype=bool)
+    tempb = np.zeros((rows, cols), dtype=bool)
+    tempbub = np.zeros((rows, cols), dtype=bool)
+    wallweighted = np.zeros((3, rows, cols))
+    wallsum = np.zeros((3, rows, cols))
+
+    for j in range(azimuthA.shape[0]):
+        steps = geometry.steps[j]
+        stop = geometry.stop[j]
+        temp[:] = 0
+        weightsum[:] = 0
+        tempwallsun[:] = False
+        tempbub[:] = False
+        wallsum[:] = 0
+
+        for n, (target, source) in enumerate(steps):
+            f = stop > n
+            temp[:, target[0], target[1]] = sources[:, source[0], source[1]]  # moving shadow, Lup/shadow and Albedo/shadow
+            np.multiply(temp, f, out=weighted)
+            np.add(weightsum, weighted, out=weightsum)
+
+            tempwallsun[target] = sunwall[source]  # moving buildingwall insun image
+            np.logical_and(tempwallsun, f, out=tempb)
+            np.logical_or(tempb, tempbub, out=tempbub)
+            np.multiply(wallsources, tempbub, out=wallweighted)
+            np.add(wallsum, wallweighted, out=wallsum)
+
+            if (n + 1) <= first:
+                weightsumwall_first = wallsum[0] / 1
+                weightsumsh_first = weightsum[0] / 1
+                wallsuninfluence_first = weightsumwall_first > 0
+                weightsumLwall_first = wallsum[1] / 1  # *Lwall
+                weightsumLupsh_first = weightsum[1] / 1
+                weightsumalbwall_first = wallsum[2] / 1  # *albedo_b
+                weightsumalbsh_first = weightsum[2] / 1
+
+        if j == 0:
+            sources[1] = Lup
+
+        weightsumsh = weightsum[0]
+        weightsumLupsh = weightsum[1]
+        weightsumalbsh = weightsum[2]
+        weightsumwall = wallsum[0]
+        weightsumLwall = wallsum[1]
+        weightsumalbwall = wallsum[2]
+        wallsuninfluence_second = weightsumwall > 0
+
+        # removing walls in self shadoing
+        keep = (weightsumwall == second) & geometry.facezero[j]
+
+        # gvf from shadow only
+        weightsumwall[keep] = 0
+        gvf2 = ((weightsumwall + weightsumsh) / (second + 1)) * wallsuninfluence_second + \
+               (weightsumsh) / (second) * (wallsuninfluence_second * -1 + 1)
+
+        gvf2[gvf2 > 1.] = 1.
+
+        # gvf from shadow and Lup
+        gvfLup1 = ((weightsumLwall_first + weightsumLupsh_first) / (first + 1)) * wallsuninfluence_first + \
+                  (weightsumLupsh_first) / (first) * (wallsuninfluence_first * -1 + 1)
+        weightsumLwall[keep] = 0
+        gvfLup2 = ((weightsumLwall + weightsumLupsh) / (second + 1)) * wallsuninfluence_second + \
+                  (weightsumLupsh) / (second) * (wallsuninfluence_second * -1 + 1)
+
+        # gvf from shadow and albedo
+        gvfalb1 = ((weightsumalbwall_first + weightsumalbsh_first) / (first + 1)) * wallsuninfluence_first + \
+                  (weightsumalbsh_first) / (first) * (wallsuninfluence_first * -1 + 1)
+        weightsumalbwall[keep] = 0
+        gvfalb2 = ((weightsumalbwall + weightsumalbsh) / (second + 1)) * wallsuninfluence_second + \
+                  (weightsumalbsh) / (second) * (wallsuninfluence_second * -1 + 1)
+
+        # Weighting
+        gvfLupi = (gvfLup1 * 0.5 + gvfLup2 * 0.4) / 0.9
+        gvfLupi = gvfLupi + Lupground
+        gvfalbi = (gvfalb1 * 0.5 + gvfalb2 * 0.4) / 0.9
+        gvfalbi = gvfalbi + albground
+
+        gvfLup = gvfLup + gvfLupi
+        gvfalb = gvfalb + gvfalbi
+        gvfSum = gvfSum + gvf2
+
+        if (azimuthA[j] >= 0) and (azimuthA[j] < 180):
+            gvfLupE = gvfLupE + gvfLupi
+            gvfalbE = gvfalbE + gvfalbi
+
+        if (azimuthA[j] >= 90) and (azimuthA[j] < 270):
+            gvfLupS = gvfLupS + gvfLupi
+            gvfalbS = gvfalbS + gvfalbi
+
+        if (azimuthA[j] >= 180) and (azimuthA[j] < 360):
+            gvfLupW = gvfLupW + gvfLupi
+            gvfalbW = gvfalbW + gvfalbi
+
+        if (azimuthA[j] >= 270) or (azimuthA[j] < 90):
+            gvfLupN = gvfLupN + gvfLupi
+            gvfalbN = gvfalbN + gvfalbi
+
+    gvfLup = gvfLup / azimuthA.__len__() + SBC * emis_grid * (Ta + 273.15) ** 4
+    gvfalb = gvfalb / azimuthA.__len__()
+
+    gvfLupE = gvfLupE / (azimuthA.__len__() / 2) + SBC * emis_grid * (Ta + 273.15) ** 4
+    gvfLupS = gvfLupS / (azimuthA.__len__() / 2) + SBC * emis_grid * (Ta + 273.15) ** 4
+    gvfLupW = gvfLupW / (azimuthA.__len__() / 2) + SBC * emis_grid * (Ta + 273.15) ** 4
+    gvfLupN = gvfLupN / (azimuthA.__len__() / 2) + SBC * emis_grid * (Ta + 273.15) ** 4
+
+    gvfalbE = gvfalbE / (azimuthA.__len__() / 2)
+    gvfalbS = gvfalbS / (azimuthA.__len__() / 2)
+    gvfalbW = gvfalbW / (azimuthA.__len__() / 2)
+    gvfalbN = gvfalbN / (azimuthA.__len__() / 2)
+
+    gvfNorm = gvfSum / (azimuthA.__len__())
+    gvfNorm[buildings == 0] = 1
+
+    return gvfLup, gvfalb, geometry.gvfalbnosh, gvfLupE, gvfalbE, geometry.gvfalbnoshE, gvfLupS, gvfalbS, \
+        geometry.gvfalbnoshS, gvfLupW, gvfalbW, geometry.gvfalbnoshW, gvfLupN, gvfalbN, geometry.gvfalbnoshN, \
+        gvfSum, gvfNorm
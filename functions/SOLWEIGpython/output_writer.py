@@ -0,0 +1,186 @@
+# Writer for the SOLWEIG output grids (Tmrt, Kup, Kdown, Lup, Ldown, Shadow, Kdiff).
+# Grids are handed over to a background thread that writes and compresses them
+# while the radiation of the next time step is calculated.
+
+import threading
+import queue
+import datetime
+import numpy as np
+
+try:
+    from osgeo import gdal
+except ImportError:
+    gdal = None
+
+try:
+    import netCDF4
+except ImportError:
+    netCDF4 = None
+
+# outputformat in configsolweig.ini
+OUTPUT_GEOTIFF = 0  # one GeoTIFF per variable and time step (default)
+OUTPUT_MULTIBAND_GEOTIFF = 1  # one tiled and compressed GeoTIFF per variable, one band per time step
+OUTPUT_NETCDF = 2  # one compressed NetCDF per variable with a time dimension
+OUTPUT_FORMATS = ['GeoTIFF per time step', 'Multiband GeoTIFF per variable', 'NetCDF per variable']
+
+
+class SolweigOutputWriter:
+    """
+    Writes output grids of a SOLWEIG run in a background thread.
+
+    output_dir: output folder
+    outputformat: OUTPUT_GEOTIFF, OUTPUT_MULTIBAND_GEOTIFF or OUTPUT_NETCDF
+    times: list of datetimes of the time steps
+    geotransform, projection: GDAL geotransform and WKT of the grids
+    savefunction: savefunction(filename, grid) used for OUTPUT_GEOTIFF
+    queuesize: number of grids waiting to be written before write() blocks
+    """
+
+    def __init__(self, output_dir, outputformat, times, rows, cols, geotransform, projection,
+                 savefunction=None, queuesize=8):
+        self.output_dir = output_dir
+        self.outputformat = int(outputformat)
+        self.times = times
+        self.rows = rows
+        self.cols = cols
+        self.geotransform = tuple(geotransform)
+        self.projection = projection
+        self.savefunction = savefunction
+        self.datasets = {}
+        self.error = None
+
+        if self.outputformat == OUTPUT_NETCDF and netCDF4 is None:
+            raise ImportError('NetCDF output requires the netCDF4 python package')
+
+        self.queue = queue.Queue(maxsize=queuesize)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def write(self, name, index, time_code, grid):
+        # Queue grid of variable name (e.g. 'Tmrt') for time step index. time_code (e.g. 2020_172_1200D)
+        # is used in file names (GeoTIFF per time step) or as band description (multiband GeoTIFF)
+        if self.error is not None:
+            self._raise_error()
+        if self.outputformat == OUTPUT_GEOTIFF:
+            grid = np.array(grid, copy=True)
+        else:
+            grid = np.asarray(grid, dtype=np.float32).copy()
+        self.queue.put((name, index, time_code, grid))
+
+    def close(self):
+        # Write remaining grids and close all files
+        self.queue.put(None)
+        self.thread.join()
+        for dataset in self.datasets.values():
+            try:
+                self._close_dataset(dataset)
+            except Exception as e:
+                if self.error is None:
+                    self.error = e
+        self.datasets = {}
+        if self.error is not None:
+            self._raise_error()
+
+    def _raise_error(self):
+        error = self.error
+        self.error = None
+        raise RuntimeError('Writing SOLWEIG output failed: ' + str(error)) from error
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            if self.error is not None:
+                continue  # keep emptying the queue, the error is raised in the main thread
+            try:
+                self._write(*item)
+            except Exception as e:
+                self.error = e
+
+    def _write(self, name, index, time_code, grid):
+        if self.outputformat == OUTPUT_GEOTIFF:
+            self.savefunction(self.output_dir + '/' + name + '_' + time_code + '.tif', grid)
+            return
+
+        if name not in self.datasets:
+            if self.outputformat == OUTPUT_MULTIBAND_GEOTIFF:
+                self.datasets[name] = self._create_geotiff(name)
+            else:
+                self.datasets[name] = self._create_netcdf(name)
+        dataset = self.datasets[name]
+
+        if self.outputformat == OUTPUT_MULTIBAND_GEOTIFF:
+            if gdal is not None:
+                band = dataset.GetRasterBand(index + 1)
+                band.WriteArray(grid, 0, 0)
+                band.SetDescription(time_code)
+            else:
+                dataset.write(grid, index + 1)
+                dataset.set_band_description(index + 1, time_code)
+        else:
+            dataset.variables[name][index, :, :] = grid
+
+    def _create_geotiff(self, name):
+        filename = self.output_dir + '/' + name + '.tif'
+        blocksize = 256
+        if gdal is not None:
+            options = ['COMPRESS=DEFLATE', 'PREDICTOR=3', 'TILED=YES', 'BLOCKXSIZE=' + str(blocksize),
+                       'BLOCKYSIZE=' + str(blocksize), 'INTERLEAVE=BAND', 'BIGTIFF=IF_SAFER']
+            dataset = gdal.GetDriverByName('GTiff').Create(filename, self.cols, self.rows, len(self.times),
+                                                           gdal.GDT_Float32, options)
+            dataset.SetGeoTransform(self.geotransform)
+            dataset.SetProjection(self.projection)
+            for band in range(1, len(self.times) + 1):
+                dataset.GetRasterBand(band).SetNoDataValue(-9999)
+            return dataset
+        else:
+            # standalone, without the GDAL python bindings
+            import rasterio
+            from rasterio.transform import Affine
+            return rasterio.open(filename, 'w', driver='GTiff', width=self.cols, height=self.rows,
+                                 count=len(self.times), dtype='float32', nodata=-9999,
+                                 crs=rasterio.crs.CRS.from_wkt(self.projection),
+                                 transform=Affine.from_gdal(*self.geotransform), compress='deflate', predictor=3,
+                                 tiled=True, blockxsize=blocksize, blockysize=blocksize, interleave='band',
+                                 BIGTIFF='IF_SAFER')
+
+    def _create_netcdf(self, name):
+        filename = self.output_dir + '/' + name + '.nc'
+        dataset = netCDF4.Dataset(filename, 'w', format='NETCDF4')
+        dataset.createDimension('time', len(self.times))
+        dataset.createDimension('y', self.rows)
+        dataset.createDimension('x', self.cols)
+
+        # coordinates of cell centres
+        x0, dx, _, y0, _, dy = self.geotransform
+        x = dataset.createVariable('x', 'f8', ('x',))
+        x[:] = x0 + dx * (np.arange(self.cols) + 0.5)
+        y = dataset.createVariable('y', 'f8', ('y',))
+        y[:] = y0 + dy * (np.arange(self.rows) + 0.5)
+        time = dataset.createVariable('time', 'f8', ('time',))
+        time.units = 'minutes since 1900-01-01 00:00:00'
+        time.calendar = 'standard'
+        time[:] = netCDF4.date2num(self.times, time.units, time.calendar)
+
+        crs = dataset.createVariable('crs', 'i4')
+        crs.spatial_ref = self.projection
+        crs.GeoTransform = ' '.join(str(value) for value in self.geotransform)
+
+        chunks = (1, min(self.rows, 512), min(self.cols, 512))
+        grid = dataset.createVariable(name, 'f4', ('time', 'y', 'x'), zlib=True, complevel=4, shuffle=True,
+                                      chunksizes=chunks, fill_value=-9999.)
+        grid.grid_mapping = 'crs'
+        return dataset
+
+    def _close_dataset(self, dataset):
+        if self.outputformat == OUTPUT_MULTIBAND_GEOTIFF and gdal is not None:
+            dataset.FlushCache()
+        else:
+            dataset.close()
+
+
+def solweig_output_times(YYYY, DOY, hours, minu):
+    # datetimes of the time steps in the met file
+    return [datetime.datetime(int(YYYY[i]), 1, 1) + datetime.timedelta(days=int(DOY[i]) - 1, hours=int(hours[i]),
+                                                                    minutes=int(minu[i])) for i in range(len(DOY))]
@@ -0,0 +1,72 @@
+import numpy as np
+
+from .Kvikt_veg import Kvikt_veg
+from .Lvikt_veg import Lvikt_veg
+
+# Grids of the SOLWEIG time loop (Solweig_2025a_calc) that only depend on the sky view factors and are the same
+# for all time steps. They are calculated once per run so that each time step only calculates the terms that
+# depend on the sun position and the weather. The results are identical to calculating them in each time step.
+
+
+class SolweigGeometry:
+    """
+    Sky view factor derived grids used in each time step of Solweig_2025a_calc.
+
+    svfalfa: SVF recalculated to angle (cylindric_wedge)
+    svfE, svfS, svfW, svfN (and veg, aveg): directional sky view factors (Kside_veg_v2022a, Lside_veg_v2022a)
+    svf, svfveg, svfaveg: sky view factors (Ldown)
+    """
+
+    def __init__(self, svf, svfveg, svfaveg, svfE, svfS, svfW, svfN, svfEveg, svfSveg, svfWveg, svfNveg,
+                 svfEaveg, svfSaveg, svfWaveg, svfNaveg, svfalfa, rows, cols):
+        vikttot = 4.4897
+
+        # cylindric_wedge
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.tanalfa = np.tan(np.zeros((rows, cols)) + svfalfa)
+            self.ba = 1. / self.tanalfa
+            self.twoba = 2. * self.ba
+            self.twopiba = 2 * np.pi * self.ba
+
+        # Ldown, sky, vegetation and wall, wall and reflected parts of the hemisphere
+        self.svfsky = svf + svfveg - 1
+        self.svfvegwall = 2 - svfveg - svfaveg
+        self.svfwall = svfaveg - svf
+        self.svfrefl = 2 - svf - svfveg
+
+        # Kside_veg_v2022a and Lside_veg_v2022a, east, south, west, north
+        self.kvikt = [Kvikt_veg(svfE, svfEveg, vikttot), Kvikt_veg(svfS, svfSveg, vikttot),
+                      Kvikt_veg(svfW, svfWveg, vikttot), Kvikt_veg(svfN, svfNveg, vikttot)]
+        self.lvikt = [Lvikt_veg(svfE, svfEveg, svfEaveg, vikttot), Lvikt_veg(svfS, svfSveg, svfSaveg, vikttot),
+                      Lvikt_veg(svfW, svfWveg, svfWaveg, vikttot), Lvikt_veg(svfN, svfNveg, svfNaveg, vikttot)]
+        # Building height angle from svf
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.svfalfaside = [np.arcsin(np.exp((np.log(1 - svfE)) / 2)), np.arcsin(np.exp((np.log(1 - svfS)) / 2)),
+                                np.arcsin(np.exp((np.log(1 - svfW)) / 2)), np.arcsin(np.exp((np.log(1 - svfN)) / 2))]
+        self.alfaB = [np.arctan(svfalfa) for svfalfa in self.svfalfaside]
+
+
+def cylindric_wedge_geometry(geometry, zen):
+    # Same as cylindric_wedge(zen, svfalfa, rows, cols) with the svfalfa terms of SolweigGeometry
+    with np.errstate(divide='ignore', invalid='ignore'):
+        beta = zen
+        ba = geometry.ba
+
+        ha = 2. / (geometry.tanalfa * np.tan(beta))
+        xa = 1 - ha
+        hkil = geometry.twoba * ha
+
+        wedge = xa < 0
+        qa = np.tan(beta) / 2
+        Za = ((ba[wedge] ** 2) - ((qa ** 2) / 4)) ** 0.5
+        phi = np.arctan(Za / qa)
+        A = (np.sin(phi) - phi * np.cos(phi)) / (1 - np.cos(phi))
+
+        ukil = np.zeros(ba.shape)
+        ukil[wedge] = geometry.twoba[wedge] * xa[wedge] * A
+
+        Ssurf = hkil + ukil
+
+        F_sh = (geometry.twopiba - Ssurf) / geometry.twopiba  # Xa
+
+    return F_sh
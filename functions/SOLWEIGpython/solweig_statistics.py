@@ -0,0 +1,179 @@
+# Aggregation of SOLWEIG output grids (Tmrt, Ldown, Lup, Kdown, Kup, Shadow) over time.
+# All statistics are accumulated in one pass over the time steps. The grids are read in
+# blocks of rows so that memory use does not depend on the number of time steps.
+
+import os
+import numpy as np
+from osgeo import gdal
+
+# statistics in the order of the options in the SOLWEIG Analyzer
+STATISTICS = ['mean', 'daymean', 'nightmean', 'max', 'min']
+
+# Histogram (min, max, bin width) used for the approximate percentiles of each variable.
+# Values outside the range are counted in the first or last bin.
+PERCENTILE_BINS = {'Tmrt': (-60., 100., 0.25),
+                   'Ldown': (0., 800., 1.),
+                   'Lup': (0., 1000., 1.),
+                   'Kdown': (0., 1500., 2.),
+                   'Kup': (0., 1000., 2.),
+                   'Shadow': (0., 1., 0.01)}
+
+
+def solweig_output_sources(solweigDir, var):
+    # List of (filename, band, daytime) for all time steps of variable var in a SOLWEIG output folder.
+    # Reads GeoTIFFs per time step (e.g. Tmrt_2020_172_1200D.tif) or a multiband GeoTIFF per variable
+    # (Tmrt.tif) where the band descriptions hold the time codes.
+    sources = []
+    for file in sorted(os.listdir(solweigDir)):
+        if file.startswith(var + '_') and file.endswith('.tif') and not file.endswith('_average.tif'):
+            sources.append((solweigDir + '/' + file, 1, file.endswith('D.tif')))
+
+    if not sources and os.path.isfile(solweigDir + '/' + var + '.tif'):
+        filename = solweigDir + '/' + var + '.tif'
+        dataset = gdal.Open(filename)
+        for band in range(1, dataset.RasterCount + 1):
+            sources.append((filename, band, dataset.GetRasterBand(band).GetDescription().endswith('D')))
+        dataset = None
+
+    return sources
+
+
+class GridStatistics:
+    """
+    Accumulates statistics of a sequence of grids (or blocks of grids) in float32.
+
+    statistics: list of names in STATISTICS
+    thresType: 0 (none), 1 (fraction of time >= threshold) or 2 (fraction of time < threshold)
+    percentiles: list of percentiles (0-100), estimated from a histogram with bins (min, max, width)
+    """
+
+    def __init__(self, shape, statistics, thresType=0, threshold=0., percentiles=(), bins=None):
+        self.statistics = statistics
+        self.thresType = thresType
+        self.threshold = threshold
+        self.percentiles = list(percentiles)
+        self.shape = shape
+        self.count = 0
+        self.daycount = 0
+        self.nightcount = 0
+
+        if 'mean' in statistics:
+            self.sum = np.zeros(shape, dtype=np.float32)
+        if 'daymean' in statistics:
+            self.daysum = np.zeros(shape, dtype=np.float32)
+        if 'nightmean' in statistics:
+            self.nightsum = np.zeros(shape, dtype=np.float32)
+        if 'max' in statistics:
+            self.max = np.full(shape, -np.inf, dtype=np.float32)
+        if 'min' in statistics:
+            self.min = np.full(shape, np.inf, dtype=np.float32)
+        if thresType > 0:
+            self.thres = np.zeros(shape, dtype=np.int32)
+        if self.percentiles:
+            self.binmin, binmax, self.binwidth = bins
+            self.nbins = int(np.ceil((binmax - self.binmin) / self.binwidth))
+            # counts per pixel and bin, bins last so that the cumulative sum is contiguous
+            self.hist = np.zeros((shape[0] * shape[1], self.nbins), dtype=np.int32)
+            self.pixels = np.arange(shape[0] * shape[1]) * self.nbins
+
+    def add(self, grid, daytime):
+        grid = np.asarray(grid, dtype=np.float32)
+        self.count += 1
+        if 'mean' in self.statistics:
+            self.sum += grid
+        if 'daymean' in self.statistics and daytime:
+            self.daysum += grid
+            self.daycount += 1
+        if 'nightmean' in self.statistics and not daytime:
+            self.nightsum += grid
+            self.nightcount += 1
+        if 'max' in self.statistics:
+            np.maximum(self.max, grid, out=self.max)
+        if 'min' in self.statistics:
+            np.minimum(self.min, grid, out=self.min)
+        if self.thresType == 1:
+            self.thres += grid >= self.threshold
+        elif self.thresType == 2:
+            self.thres += grid < self.threshold
+        if self.percentiles:
+            bin = np.floor((grid.ravel() - self.binmin) / self.binwidth)
+            bin = np.clip(bin, 0, self.nbins - 1).astype(np.intp)
+            # each pixel gets one count, so the flat indices are unique
+            self.hist.ravel()[self.pixels + bin] += 1
+
+    def results(self):
+        # dict of statistic name -> float32 grid. Threshold is 'threshold', percentiles e.g. 'p90'
+        with np.errstate(divide='ignore', invalid='ignore'):
+            result = {}
+            if 'mean' in self.statistics:
+                result['mean'] = self.sum / np.float32(self.count)
+            if 'daymean' in self.statistics:
+                result['daymean'] = self.daysum / np.float32(self.daycount)
+            if 'nightmean' in self.statistics:
+                result['nightmean'] = self.nightsum / np.float32(self.nightcount)
+            if 'max' in self.statistics:
+                result['max'] = self.max
+            if 'min' in self.statistics:
+                result['min'] = self.min
+            if self.thresType > 0:
+                result['threshold'] = (self.thres / np.float32(self.count)).astype(np.float32)
+            for percentile in self.percentiles:
+                result['p' + format(percentile, 'g')] = self.percentile(percentile)
+
+        return result
+
+    def percentile(self, percentile):
+        # Linear interpolation within the histogram bin where the cumulative count reaches the percentile
+        cumulative = np.cumsum(self.hist, axis=1)
+        target = percentile / 100. * self.count
+        bin = np.minimum((cumulative < target).sum(axis=1), self.nbins - 1)
+        rows = np.arange(self.hist.shape[0])
+        below = cumulative[rows, bin] - self.hist[rows, bin]
+        within = self.hist[rows, bin]
+        fraction = np.where(within > 0, (target - below) / np.maximum(within, 1), 0.5)
+        value = self.binmin + (bin + fraction) * self.binwidth
+        return value.astype(np.float32).reshape(self.shape)
+
+
+def solweig_statistics(sources, statistics, thresType=0, threshold=0., percentiles=(), bins=None,
+                       maxcells=2 ** 26, feedback=None):
+    """
+    Statistics of the SOLWEIG output grids in sources (see solweig_output_sources) calculated
+    in one read of each grid. Returns a dict of statistic name -> float32 grid (see GridStatistics.results).
+    Rows are processed in blocks so that the percentile histograms hold at most maxcells counts.
+    """
+    dataset = gdal.Open(sources[0][0])
+    rows = dataset.RasterYSize
+    cols = dataset.RasterXSize
+    dataset = None
+
+    if percentiles:
+        nbins = int(np.ceil((bins[1] - bins[0]) / bins[2]))
+        blockrows = int(min(rows, max(1, maxcells // (cols * nbins))))
+    else:
+        blockrows = rows
+
+    result = {}
+    blocks = range(0, rows, blockrows)
+    total = len(blocks) * len(sources)
+    index = 0
+    for yoff in blocks:
+        nrows = min(blockrows, rows - yoff)
+        stats = GridStatistics((nrows, cols), statistics, thresType, threshold, percentiles, bins)
+        for filename, band, daytime in sources:
+            if feedback is not None:
+                if feedback.isCanceled():
+                    feedback.setProgressText("Calculation cancelled")
+                    return None
+                feedback.setProgress(int(index * 100. / total))
+            dataset = gdal.Open(filename)
+            stats.add(dataset.GetRasterBand(band).ReadAsArray(0, yoff, cols, nrows), daytime)
+            dataset = None
+            index += 1
+
+        for name, grid in stats.results().items():
+            if name not in result:
+                result[name] = np.zeros((rows, cols), dtype=np.float32)
+            result[name][yoff:yoff + nrows, :] = grid
+
+    return result
@@ -5,6 +5,7 @@ from ...TreeGenerator import makevegdems
 from ..TreePlanter.TreePlanterClasses import Treerasters
 from ..TreePlanter.TreePlanterClasses import Position
 from ..TreePlanter.TreePlanterTreeshade import tree_slice
+from ..TreePlanter.TreePlanterScoring import wall_buffer, tree_buffer, tmrt_sums, window_slices
 
 def greedyplanter(treeinput,treedata,treerasters,tmrt_1d,trees,feedback):
 
@@ -16,24 +17,11 @@ def greedyplanter(treeinput,treedata,treerasters,tmrt_1d,trees,feedback):
     bd_b = np.int_( np.ceil( (treedata.dia / 2) / treeinput.gt[1] ) )
 
     # Buffer on building raster so that trees can't be planted next to walls. Can be planted one radius from walls.
-    for i1 in range(bd_b):
-        walls = np.zeros((treeinput.rows, treeinput.cols))
-        domain = np.array([[0, 1, 0], [1, 0, 1], [0, 1, 0]])
-        for i in range(1, treeinput.cols - 1):
-            for j in range(1, treeinput.rows - 1):
-                dom = bld_copy[j - 1:j + 2, i - 1:i + 2]
-                walls[j, i] = np.min(dom[np.where(domain == 1)])
-
-        walls = bld_copy - walls
-        bld_copy = 1 - bld_copy
-        bld_copy = bld_copy + walls
-        bld_copy = 1 - bld_copy
+    bld_copy = wall_buffer(bld_copy, bd_b)
 
     # Remove all possible positions outside selected area
     bld_copy = bld_copy * treeinput.selected_area
 
-    # This loop pastes the tree shadow into all possible positions and calculates the sum of Tmrt under the shadow and
-    # the sum Tmrt for the same area but sunlit
     best_y = np.zeros((trees))
     best_x = np.zeros((trees))
     # index = 0
@@ -48,31 +36,19 @@ def greedyplanter(treeinput,treedata,treerasters,tmrt_1d,trees,feedback):
     sum_tmrt = np.zeros((treeinput.rows, treeinput.cols))  # Empty matrix for sum of Tmrt in sun under tree shadow
 
     res_y, res_x = np.where(bld_copy == 1)  # Coordinates for where it is possible to plant a tree (buildings, area of interest excluded)
+    yslice2, xslice2 = window_slices(res_y, res_x)
 
     for tree in range(trees):
         if feedback.isCanceled():
             break
-        for i in range(res_y.__len__()):
 
-            if feedback.isCanceled():
-                break
-
-            y1 = np.int_(res_y[i] - treerasters.buffer_y[0])
-            y2 = np.int_(res_y[i] + treerasters.buffer_y[1])
-            x1 = np.int_(res_x[i] - treerasters.buffer_x[0])
-            x2 = np.int_(res_x[i] + treerasters.buffer_x[1])
-
-            yslice1, xslice1, yslice2, xslice2 = tree_slice(y1,y2,x1,x2,treeinput,treerasters)
-
-            ts_temp1 = np.zeros((treeinput.rows, treeinput.cols))
-            ts_temp1[yslice2, xslice2] = treerasters.treeshade[yslice1, xslice1]
-
-            # Estimating Tmrt in tree shade and in sun
-            for j in range(tmrt_1d.__len__()):
-                ts_temp2 = np.zeros((treeinput.rows, treeinput.cols))
-                ts_temp2[yslice2, xslice2] = treerasters.treeshade_bool[yslice1, xslice1, j]
-                sum_tmrt[res_y[i],res_x[i]] += np.sum(ts_temp2 * treeinput.buildings * shadows_copy[:,:,j] * tmrt_copy[:,:,j])
-                sum_tmrt_tsh[res_y[i], res_x[i]] += np.sum(ts_temp2 * treeinput.buildings * shadows_copy[:,:,j] * tmrt_1d[j,0])
+        # Sum of Tmrt under the tree shadow and the sum of Tmrt for the same area but sunlit, for all possible positions
+        # in the window (all positions for the first tree, around the last added tree afterwards)
+        sum_tmrt_w, sum_tmrt_tsh_w = tmrt_sums(treeinput.buildings, shadows_copy, tmrt_copy, tmrt_1d, treerasters,
+                                               yslice2, xslice2)
+        possible = bld_copy[yslice2, xslice2] == 1
+        sum_tmrt[yslice2, xslice2] = sum_tmrt_w * possible
+        sum_tmrt_tsh[yslice2, xslice2] = sum_tmrt_tsh_w * possible
 
         # Adding sum_tmrt and sum_tmrt_tsh to the Treerasters class as well as calculating the difference between sunlit and shaded
         treerasters.tmrt(sum_tmrt, sum_tmrt_tsh)
@@ -96,12 +72,9 @@ def greedyplanter(treeinput,treedata,treerasters,tmrt_1d,trees,feedback):
 
         yslice1, xslice1, yslice2, xslice2 = tree_slice(y1,y2,x1,x2,treeinput,treerasters)
 
-        for j in range(tmrt_1d.__len__()):
-            temp_shadow = np.zeros((treeinput.rows,treeinput.cols))
-            temp_shadow[yslice2, xslice2] = treerasters.treeshade_bool[yslice1 , xslice1, j]
-            temp_shadow = 1 - temp_shadow
-            shadows_copy[:,:,j] = shadows_copy[:,:,j] * temp_shadow
-            tmrt_copy[:,:,j] = tmrt_copy[:,:,j] * temp_shadow
+        temp_shadow = 1 - treerasters.treeshade_bool[yslice1, xslice1, :]
+        shadows_copy[yslice2, xslice2, :] = shadows_copy[yslice2, xslice2, :] * temp_shadow
+        tmrt_copy[yslice2, xslice2, :] = tmrt_copy[yslice2, xslice2, :] * temp_shadow
 
         # Determine where to recalcaulate d_tmrt
         y1 = np.int_(temp_y[0] - treerasters.buffer_y[0] - treerasters.buffer_y[1])
@@ -110,6 +83,7 @@ def greedyplanter(treeinput,treedata,treerasters,tmrt_1d,trees,feedback):
         x2 = np.int_(temp_x[0] + treerasters.buffer_x[1] + treerasters.buffer_x[0])
 
         _, __, yslice2, xslice2 = tree_slice(y1,y2,x1,x2,treeinput,treerasters)
+        recalc_y, recalc_x = yslice2, xslice2
    
         recalc_positions = np.zeros((bld_copy.shape[0], bld_copy.shape[1])) 
         recalc_positions[yslice2, xslice2] = 1                                   
@@ -130,20 +104,12 @@ def greedyplanter(treeinput,treedata,treerasters,tmrt_1d,trees,feedback):
         added_tree = added_tree > 0
         added_tree = 1 - added_tree
 
-        for i1 in range(bd_b):
-            walls = np.ones((treeinput.rows, treeinput.cols))
-            domain = np.array([[0, 1, 0], [1, 0, 1], [0, 1, 0]])
-            for i in range(1, treeinput.cols - 1):
-                for j in range(1, treeinput.rows - 1):
-                    dom = added_tree[j - 1:j + 2, i - 1:i + 2]
-                    walls[j, i] = np.min(dom[np.where(domain == 1)])
-            
-            added_tree = added_tree * walls
+        added_tree = tree_buffer(added_tree, bd_b)
 
         bld_copy = bld_copy * added_tree
 
         recalc_positions = recalc_positions * bld_copy
-        res_y, res_x = np.where(recalc_positions == 1)
+        yslice2, xslice2 = recalc_y, recalc_x
             
         if (np.max(recalc_positions) == 0) & (tree != trees-1):
             best_bool = (best_y > 0) & (best_x > 0)
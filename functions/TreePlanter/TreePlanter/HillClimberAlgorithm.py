@@ -5,11 +5,12 @@ from scipy.ndimage import label
 from ..TreePlanter.TreePlanterTreeshade import tsh_gen
 from ..TreePlanter.TreePlanterTreeshade import tsh_gen_ts
 from ..TreePlanter.TreePlanterTreeshade import tsh_gen_mt1, tsh_gen_mt2
+from ..TreePlanter.TreePlanterTreeshade import Shadowcounts
 import itertools
 
 # This function will look for better shading position for a tree by looking one pixel east, west, north, south of it's
 # current position. It will compare it's position to the other trees in the study area, i.e. other moving trees.
-def topt(y, x, treerasters, treeinput, dia, shadow_rg, tmrt_1d, positions, ti, pos_m_pad, p_tmrt):
+def topt(y, x, treerasters, treeinput, dia, shadow_rg, tmrt_1d, positions, ti, pos_m_pad, p_tmrt, shadows=None):
 
     # x = x positions of trees
     # y = y positions of trees
@@ -19,6 +20,8 @@ def topt(y, x, treerasters, treeinput, dia, shadow_rg, tmrt_1d, positions, ti, p
     # shadow_rg = vector with which timesteps shade which pixels
     # tmrt from SOLWEIG
     # i = which tree to move
+    # shadows = Shadowcounts with the shadows of all trees, kept between calls so that only the windows of moved trees
+    # are updated
 
     t_y = y[ti]    # y-position of tree to move
     t_x = x[ti]    # x-position of tree to move
@@ -41,21 +44,8 @@ def topt(y, x, treerasters, treeinput, dia, shadow_rg, tmrt_1d, positions, ti, p
     t_pos = t_pos * domain
     t_pos = t_pos.flatten()
     t_pos = t_pos[t_pos != 0]
-    t_yx = np.zeros((t_pos.shape[0],2))
-    for i in range(t_pos.shape[0]):
-        t_yx[i,0] = positions.pos[positions.pos[:, 0] == t_pos[i], 2]
-        t_yx[i,1] = positions.pos[positions.pos[:, 0] == t_pos[i], 1]
-
-    t_yx = np.int_(t_yx)
-
-    # Check if it is possible to move to all positions
-    pos_bool = np.zeros((t_yx.shape[0]))
-    for i in range(t_yx.shape[0]):
-        if np.any(positions.pos[((positions.pos[:, 1] == t_yx[i,1]) & (positions.pos[:, 2] == t_yx[i,0])), 0]):
-            pos_bool[i] = 1
-
-    pos_bool = np.bool_(pos_bool)
-    t_yx = t_yx[pos_bool,:]
+    # Position ids are 1 to number of positions, see TreePlanterPrepare
+    t_yx = np.int_(positions.pos[np.int_(t_pos) - 1][:, [2, 1]])
 
     # Where not to move, i.e. positions of all other trees
     not_t = ((x[:] != t_x) | (y[:] != t_y))
@@ -63,40 +53,23 @@ def topt(y, x, treerasters, treeinput, dia, shadow_rg, tmrt_1d, positions, ti, p
     y_n = y[not_t]    # y position of trees that are not moving
     x_n = x[not_t]    # x position of trees that are not moving
 
+    # Shadows of trees that are not moving
+    if shadows is None:
+        shadows = Shadowcounts(y, x, treerasters, treeinput, tmrt_1d)
+    shadows.update(y, x)
+    shadows.remove(ti)
+
     # Check euclidean distance between  moving tree and none-moving trees, i.e. where possible to move.
     # Also checking for canopy diameter / 2 to see if tree fits
-    eucl = np.zeros((y_n.shape[0],t_yx.shape[0]))
-    e_bool = np.ones((t_yx.shape[0]))
-    e_bool_sh = np.zeros((t_yx.shape[0]))
-    for i in range(y_n.shape[0]):
-        yx_temp = np.array((y_n[i], x_n[i]))
-        for j in range(t_yx.shape[0]):
-            eucl[i,j] = np.linalg.norm(t_yx[j,:] - yx_temp)
-            if (eucl[i,j] < dia):
-                e_bool[j] = 0
-            if (eucl[i,j] < treerasters.euclidean_d):
-                e_bool_sh[j] = 1
-
-    e_bool = np.bool_(e_bool)   # Boolean of where it's possible and not to move
+    yx_n = np.column_stack((y_n, x_n))
+    eucl = np.sqrt(np.sum((t_yx[np.newaxis, :, :] - yx_n[:, np.newaxis, :]) ** 2, axis=2))
+    e_bool = ~np.any(eucl < dia, axis=0)   # Boolean of where it's possible and not to move
     t_yx = t_yx[e_bool,:]  # Positions where it's possible to move to
-    e_bool_sh = np.bool_(e_bool_sh)
+    e_bool_sh = np.any(eucl < treerasters.euclidean_d, axis=0)
 
     # Checking euclidean distance between none-moving trees
-    yx_nmt = tuple(itertools.combinations(np.arange(y_n.shape[0]), 2))
-    e_bool_nmt = np.zeros((yx_nmt.__len__()))
-    e_nmt = np.zeros((yx_nmt.__len__()))
-    for i in range(e_bool_nmt.shape[0]):
-        ax = x_n[yx_nmt[i][0]]
-        ay = y_n[yx_nmt[i][0]]
-        a = np.array(([ay, ax]))
-        bx = x_n[yx_nmt[i][1]]
-        by = y_n[yx_nmt[i][1]]
-        b = np.array(([by, bx]))
-        e_nmt[i] = np.linalg.norm(a - b)
-        if (e_nmt[i] < treerasters.euclidean_d):
-            e_bool_nmt[i] = 1
-
-    e_bool_nmt = np.bool_(e_bool_nmt)
+    e_nmt = np.sqrt(np.sum((yx_n[np.newaxis, :, :] - yx_n[:, np.newaxis, :]) ** 2, axis=2))
+    e_bool_nmt = e_nmt[np.triu_indices(y_n.shape[0], 1)] < treerasters.euclidean_d
 
     tree_tmrt = np.zeros((t_yx.shape[0] + 1, 5))  # y, x, tmrt shade, tmrt sun, tmrt diff, sum tmrt all trees
     tree_tmrt[-1, :] = p_tmrt
@@ -106,43 +79,33 @@ def topt(y, x, treerasters, treeinput, dia, shadow_rg, tmrt_1d, positions, ti, p
     if ((np.any(e_bool_nmt == 1)) | (np.any(e_bool_sh == 1))):
 
     # Check if tree shadows overlap
-        treesh_ts_bool_pad, treesh_ts_bool_pad_large, compare = tsh_gen_ts(y_n, x_n, treerasters, treeinput)  # Boolean tree shadows for trees that are not moving
-
-        if (compare == 0):    # If none of the none-moving trees overlap, go in here
-            treesh_bool_mt = tsh_gen_mt1(t_yx[:,0], t_yx[:,1], treerasters, treeinput)
-            if np.any(((treesh_bool_mt == 1) & (treesh_ts_bool_pad_large == 1))):
-                for j in range(t_yx.shape[0]):
-                    if (e_bool_sh[j] == 1):   # If boolean distance between coming position of the moving tree possibly have overlapping shadows with the other trees, continue
-                        y_t = np.array([t_yx[j, 0]])    # Y-position of the current position of the currently moving tree
-                        x_t = np.array([t_yx[j, 1]])    # X-position of the current position of the currently moving tree
-                        treesh_bool_mt_pad, treesh_bool_mt_pad_large, _ = tsh_gen_ts(y_t, x_t, treerasters, treeinput)    # Boolean tree shadows for moving tree
-                        if np.any(((treesh_ts_bool_pad_large == 1) & (treesh_bool_mt_pad_large == 1))):
-                            for ij in range(treesh_bool_mt_pad.shape[2]):   # Check if timesteps overlap
-                                temp_bool = ((treesh_ts_bool_pad[:,:,ij] == 1) | (treesh_bool_mt_pad[:,:,ij] == 1)) * (treeinput.shadow[:,:,ij] == 1) * (treeinput.buildings == 1)
-                                tree_tmrt[j,0] += np.sum(temp_bool * tmrt_1d[ij, 0])
-                                tree_tmrt[j,1] += np.sum(temp_bool * treeinput.tmrt_ts[:,:,ij])
-                                compare_mt[j] = 1
-
-                    tree_tmrt[j,2] = tree_tmrt[j,1] - tree_tmrt[j,0]
+        compare = np.int_(shadows.overlaps > 0)
 
-        else:
-            for j in range(t_yx.shape[0]):
-                if (e_bool_sh[j] == 1):
-                    y_t = np.array([t_yx[j, 0]])
-                    x_t = np.array([t_yx[j, 1]])
-                    treesh_bool_mt_pad = tsh_gen_mt2(y_t, x_t, treerasters, treeinput)    # Boolean tree shadows for moving tree
-                    for ij in range(treesh_bool_mt_pad.shape[2]):
-                        temp_bool = ((treesh_ts_bool_pad[:, :, ij] == 1) | (treesh_bool_mt_pad[:, :, ij] == 1)) * (
-                                    treeinput.shadow[:, :, ij] == 1) * (treeinput.buildings == 1)
-                        tree_tmrt[j, 0] += np.sum(temp_bool * tmrt_1d[ij, 0])
-                        tree_tmrt[j, 1] += np.sum(temp_bool * treeinput.tmrt_ts[:, :, ij])
-                        compare_mt[j] = 1
-                tree_tmrt[j, 2] = tree_tmrt[j, 1] - tree_tmrt[j, 0]
+        for j in range(t_yx.shape[0]):
+            # If boolean distance between coming position of the moving tree possibly have overlapping shadows with the
+            # other trees, calculate Tmrt for the union of the tree shadows (only changes in the window of the moving tree)
+            if (e_bool_sh[j] == 1):
+                if (compare == 1) or shadows.overlap_large(t_yx[j, 0], t_yx[j, 1]):
+                    tmrt_shade, tmrt_sun = shadows.gain(t_yx[j, 0], t_yx[j, 1])
+                    tree_tmrt[j, 0] = shadows.tmrt_shade + tmrt_shade
+                    tree_tmrt[j, 1] = shadows.tmrt_sun + tmrt_sun
+                    compare_mt[j] = 1
+            tree_tmrt[j, 2] = tree_tmrt[j, 1] - tree_tmrt[j, 0]
+
+    # Tmrt for trees that are not moving, used when the shadow of the moving tree does not overlap with them
+    if (compare == 1):
+        tmrt_n = np.array([shadows.tmrt_shade_sh, shadows.tmrt_sun_sh, 0.])
+    else:
+        tmrt_n = np.zeros((3))
+        for j in range(y_n.shape[0]):
+            tmrt_n[0] += treerasters.tmrt_shade[y_n[j], x_n[j]]   # Tree shade
+            tmrt_n[1] += treerasters.tmrt_sun[y_n[j], x_n[j]]     # Sunlit
+            tmrt_n[2] += treerasters.d_tmrt[y_n[j], x_n[j]]       # Sunlit - Tree shade
 
     # Calculation of shadows for the currently moving tree
     for i in range(t_yx.shape[0]):
-        y_t = np.array([t_yx[i,0]])
-        x_t = np.array([t_yx[i,1]])
+        y_t = t_yx[i,0]
+        x_t = t_yx[i,1]
 
         tree_tmrt[i, 3] = y_t               # y position of currently moving tree
         tree_tmrt[i, 4] = x_t               # x position of  currently moving tree
@@ -152,25 +115,15 @@ def topt(y, x, treerasters, treeinput, dia, shadow_rg, tmrt_1d, positions, ti, p
 
         # If any of the none-moving trees are overlapping with each other but the moving tree is not overlapping with them
         if ((compare == 1) & (compare_mt[i] == 0)):
-            start_time = time.time()
-            for j in range(treesh_ts_bool_pad.shape[2]):
-                tree_bool_temp = treesh_ts_bool_pad[:,:,j] * treeinput.shadow[:,:,j] * treeinput.buildings
-                tree_tmrt[i, 0] += np.sum(tree_bool_temp * tmrt_1d[j, 0])
-                tree_tmrt[i, 1] += np.sum(tree_bool_temp * treeinput.tmrt_ts[:,:,j])
-            tree_tmrt[i, 0] += treerasters.tmrt_shade[y_t, x_t]
-            tree_tmrt[i, 1] += treerasters.tmrt_sun[y_t, x_t]
+            tree_tmrt[i, 0] = tmrt_n[0] + treerasters.tmrt_shade[y_t, x_t]
+            tree_tmrt[i, 1] = tmrt_n[1] + treerasters.tmrt_sun[y_t, x_t]
             tree_tmrt[i, 2] = tree_tmrt[i, 1] - tree_tmrt[i, 0]
 
         # If no trees are overlapping
         elif ((compare == 0) & (compare_mt[i] == 0)):
-            start_time = time.time()
-            for j in range(y_n.shape[0]):
-                tree_tmrt[i, 0] += treerasters.tmrt_shade[y_n[j], x_n[j]]   # Tree shade
-                tree_tmrt[i, 1] += treerasters.tmrt_sun[y_n[j], x_n[j]]     # Sunlit
-                tree_tmrt[i, 2] += treerasters.d_tmrt[y_n[j], x_n[j]]       # Sunlit - Tree shade
-            tree_tmrt[i,0] += treerasters.tmrt_shade[y_t,x_t]    # Potential decrease in Tmrt from shade due to other trees
-            tree_tmrt[i,1] += treerasters.tmrt_sun[y_t,x_t]      # Tmrt in sun for the tree shadow
-            tree_tmrt[i,2] += treerasters.d_tmrt[y_t,x_t]        # Difference in Tmrt between sunlit and shaded
+            tree_tmrt[i,0] = tmrt_n[0] + treerasters.tmrt_shade[y_t,x_t]    # Potential decrease in Tmrt from shade due to other trees
+            tree_tmrt[i,1] = tmrt_n[1] + treerasters.tmrt_sun[y_t,x_t]      # Tmrt in sun for the tree shadow
+            tree_tmrt[i,2] = tmrt_n[2] + treerasters.d_tmrt[y_t,x_t]        # Difference in Tmrt between sunlit and shaded
 
     nc = 0 # no change
 
@@ -202,4 +155,6 @@ def topt(y, x, treerasters, treeinput, dia, shadow_rg, tmrt_1d, positions, ti, p
         t_out = tree_tmrt                             # If tree can't move because of other trees, no move
         nc = 1
 
+    shadows.place(ti, y[ti], x[ti])
+
     return t_out, nc, y, x
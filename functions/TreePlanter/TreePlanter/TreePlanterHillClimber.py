@@ -1,18 +1,59 @@
 import numpy as np
 import itertools
+import copy
 from scipy.ndimage import label
 import time
 import datetime
 from ..TreePlanter import HillClimberAlgorithm
 from ..TreePlanter.TreePlanterTreeshade import tsh_gen
 from ..TreePlanter.TreePlanterTreeshade import tsh_gen_ts
+from ..TreePlanter.TreePlanterTreeshade import Shadowcounts
 from ..TreePlanter.adjustments import treenudge
 from ..TreePlanter import StartingPositions
+from ....util import parallel
+from concurrent.futures import ProcessPoolExecutor, wait
 
 def combine(tup, t):
     return tuple(itertools.combinations(tup, t))
 
-def treeoptinit(treerasters, treeinput, positions, treedata, shadow_rg, tmrt_1d, trees, r_iters, sa, feedback):
+def treeoptinit(treerasters, treeinput, positions, treedata, shadow_rg, tmrt_1d, trees, r_iters, sa, feedback, workers=1, seed=None):
+
+    # workers = number of processes running the restarts in parallel. Each process runs its share of the r_iters
+    # restarts with its own seed (created from seed, random if None)
+
+    if (workers > 1) & (r_iters > 1):
+        i_tmrt, i_y, i_x = hillclimb_parallel(treerasters, treeinput, positions, treedata, shadow_rg, tmrt_1d, trees,
+                                              r_iters, sa, feedback, workers, seed)
+    else:
+        if seed is not None:
+            np.random.seed(restart_seeds(seed, 1)[0])
+        i_tmrt, i_y, i_x, crowded = hillclimb(treerasters, treeinput, positions, treedata, shadow_rg, tmrt_1d, trees,
+                                              r_iters, sa, feedback)
+
+    # Save locations for occurrence map
+    i_y_all = i_y.copy()
+    i_x_all = i_x.copy()
+
+    # Finding best position from all r_iters iteration, i.e. if r_iters = 1000 then best position out of 1000 runs
+    t_max = np.max(i_tmrt)
+    y = np.where(i_tmrt == t_max)
+
+    # Calculate heat map for best 33 % positions
+
+    # Returns all the unique positions found by the algorithm and the potential decrease in tmrt
+    #from misc import max_tmrt
+    #unique_tmrt, unique_tmrt_max = max_tmrt(i_y, i_x, i_tmrt, trees, positions.pos)
+
+    # Optimal positions of trees
+    i_y = i_y[y[0][0], :]
+    i_x = i_x[y[0][0], :]
+
+    return i_y, i_x, t_max, i_y_all, i_x_all
+    #return i_y, i_x, unique_tmrt, unique_tmrt_max, tree_paths
+
+def hillclimb(treerasters, treeinput, positions, treedata, shadow_rg, tmrt_1d, trees, r_iters, sa, feedback):
+    # Runs r_iters restarts of the hill climber. Returns the decrease in Tmrt and the positions of the trees for each
+    # restart and whether the planting area was too small for the trees
 
     #time_sum = 0
 
@@ -29,6 +70,7 @@ def treeoptinit(treerasters, treeinput, positions, treedata, shadow_rg, tmrt_1d,
                        constant_values=0)
 
     break_loop = 0
+    tp_c = 0
 
     #sa = 0  # Hill-climbing with random restarts
     #sa = 1  # Genetic x or y random
@@ -121,6 +163,9 @@ def treeoptinit(treerasters, treeinput, positions, treedata, shadow_rg, tmrt_1d,
 
         t1 = np.zeros((1,5))
 
+        # Number of tree shadows on each pixel, updated as trees move
+        shadows = Shadowcounts(tree_pos_y, tree_pos_x, treerasters, treeinput, tmrt_1d)
+
         # Moving trees, i.e. optimization
         while np.sum(tp_nc[:,0]) < trees:
 
@@ -128,7 +173,7 @@ def treeoptinit(treerasters, treeinput, positions, treedata, shadow_rg, tmrt_1d,
 
             # Running optimizer
             # t1 = best shading position
-            t1, nc, y_out, x_out = HillClimberAlgorithm.topt(tree_pos_y, tree_pos_x, treerasters, treeinput, dia, shadow_rg, tmrt_1d, positions, i, pos_m_pad_t, t1)
+            t1, nc, y_out, x_out = HillClimberAlgorithm.topt(tree_pos_y, tree_pos_x, treerasters, treeinput, dia, shadow_rg, tmrt_1d, positions, i, pos_m_pad_t, t1, shadows)
             tp_nc[i, 0] = nc
 
             if (tp_nc[i,0] == 0):
@@ -178,23 +223,113 @@ def treeoptinit(treerasters, treeinput, positions, treedata, shadow_rg, tmrt_1d,
         # Progress bar
         feedback.setProgress(int(counter * (100 / r_iters)))
 
-    # Save locations for occurrence map
-    i_y_all = i_y.copy()
-    i_x_all = i_x.copy()
-
-    # Finding best position from all r_iters iteration, i.e. if r_iters = 1000 then best position out of 1000 runs
-    t_max = np.max(i_tmrt)
-    y = np.where(i_tmrt == t_max)
-
-    # Calculate heat map for best 33 % positions
+    return i_tmrt, i_y, i_x, (tp_c == 100)
+
+def restart_seeds(seed, runs):
+    # Seeds for the random number generator of each of runs parallel hill climbing runs, the same for the same seed
+    return [np.uint32(child.generate_state(1)[0]) for child in np.random.SeedSequence(seed).spawn(runs)]
+
+class Sharedinput():
+    '''Input rasters used by the hill climber in worker processes, attached to shared memory'''
+    __slots__ = ('buildings', 'shadow', 'tmrt_ts', 'rows', 'cols')
+    def __init__(self, buildings, shadow, tmrt_ts):
+        self.buildings = buildings
+        self.shadow = shadow
+        self.tmrt_ts = tmrt_ts
+        self.rows = buildings.shape[0]
+        self.cols = buildings.shape[1]
+
+class Workerfeedback():
+    '''Feedback for hill climbing runs in worker processes. Cancelling is shared with the main process through an event
+    and hillclimb calls setProgress once for each finished restart, which is counted in a shared value'''
+    def __init__(self, cancel, done):
+        self.cancel = cancel
+        self.done = done
+
+    def isCanceled(self):
+        return self.cancel.is_set()
+
+    def setProgressText(self, text):
+        pass
+
+    def setProgress(self, progress):
+        with self.done.get_lock():
+            self.done.value += 1
+
+# Worker state for parallel hill climbing, set by _hillclimb_worker_init in each worker process
+_hillclimb_worker = {}
+
+def _hillclimb_worker_init(specs, treerasters, positions, treedata, shadow_rg, tmrt_1d, cancel, done):
+    blocks = []
+    grids = []
+    for spec in specs:
+        shm, grid = parallel.attach_array(spec)
+        blocks.append(shm)
+        grids.append(grid)
+    # The Tmrt grids of treerasters and the position matrix are attached to shared memory as well
+    treerasters.tmrt_sun, treerasters.tmrt_shade, treerasters.d_tmrt, positions.pos_m = grids[3:]
+    _hillclimb_worker['blocks'] = blocks
+    _hillclimb_worker['treeinput'] = Sharedinput(*grids[:3])
+    _hillclimb_worker['treerasters'] = treerasters
+    _hillclimb_worker['positions'] = positions
+    _hillclimb_worker['treedata'] = treedata
+    _hillclimb_worker['shadow_rg'] = shadow_rg
+    _hillclimb_worker['tmrt_1d'] = tmrt_1d
+    _hillclimb_worker['feedback'] = Workerfeedback(cancel, done)
+
+def _hillclimb_worker_task(trees, r_iters, sa, seed):
+    np.random.seed(seed)
+    return hillclimb(_hillclimb_worker['treerasters'], _hillclimb_worker['treeinput'], _hillclimb_worker['positions'],
+                     _hillclimb_worker['treedata'], _hillclimb_worker['shadow_rg'], _hillclimb_worker['tmrt_1d'], trees,
+                     r_iters, sa, _hillclimb_worker['feedback'])
+
+def hillclimb_parallel(treerasters, treeinput, positions, treedata, shadow_rg, tmrt_1d, trees, r_iters, sa, feedback,
+                       workers, seed=None):
+    '''Process-pool version of hillclimb. The restarts are split in one share per worker, each run with its own seed
+    (with the genetic algorithm each share is a population of its own). The results are merged in the order of the
+    shares, so that the best solution only depends on seed and workers and not on which process finishes first'''
+    runs = np.array_split(np.arange(r_iters), min(workers, r_iters))
+    seeds = restart_seeds(seed, len(runs))
+
+    blocks = []
+    specs = []
+    for grid in (treeinput.buildings, treeinput.shadow, treeinput.tmrt_ts, treerasters.tmrt_sun,
+                 treerasters.tmrt_shade, treerasters.d_tmrt, positions.pos_m):
+        shm, _, spec = parallel.share_array(grid)
+        blocks.append(shm)
+        specs.append(spec)
+
+    # Copies without the shared grids, so that these are not pickled for each worker
+    workerrasters = copy.copy(treerasters)
+    workerrasters.tmrt_sun = workerrasters.tmrt_shade = workerrasters.d_tmrt = None
+    workerpositions = copy.copy(positions)
+    workerpositions.pos_m = None
+
+    feedback.setProgressText('Running ' + str(r_iters) + ' restarts in ' + str(len(runs)) + ' parallel processes...')
+
+    ctx = parallel.process_context()
+    cancel = ctx.Event()
+    done = ctx.Value('i', 0)
+
+    pool = ProcessPoolExecutor(max_workers=len(runs), mp_context=ctx, initializer=_hillclimb_worker_init,
+                               initargs=(specs, workerrasters, workerpositions, treedata, shadow_rg, tmrt_1d, cancel,
+                                         done))
+    try:
+        tasks = [pool.submit(_hillclimb_worker_task, trees, run.shape[0], sa, seeds[i]) for i, run in enumerate(runs)]
+        while wait(tasks, timeout=1.)[1]:
+            if feedback.isCanceled():
+                cancel.set()
+            feedback.setProgress(int(done.value * (100 / r_iters)))
+        results = [task.result() for task in tasks]
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+        parallel.release_shared(blocks)
 
-    # Returns all the unique positions found by the algorithm and the potential decrease in tmrt
-    #from misc import max_tmrt
-    #unique_tmrt, unique_tmrt_max = max_tmrt(i_y, i_x, i_tmrt, trees, positions.pos)
+    if any(result[3] for result in results):
+        feedback.setProgressText('Possibly too many trees to fit in planting area. Try a lower number.')
 
-    # Optimal positions of trees
-    i_y = i_y[y[0][0], :]
-    i_x = i_x[y[0][0], :]
+    i_tmrt = np.concatenate([result[0] for result in results])
+    i_y = np.concatenate([result[1] for result in results])
+    i_x = np.concatenate([result[2] for result in results])
 
-    return i_y, i_x, t_max, i_y_all, i_x_all
-    #return i_y, i_x, unique_tmrt, unique_tmrt_max, tree_paths
+    return i_tmrt, i_y, i_x
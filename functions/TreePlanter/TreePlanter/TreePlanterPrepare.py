@@ -4,7 +4,7 @@ from ...TreeGenerator import makevegdems
 # from ..TreeGeneratorTemp import makevegdems
 from ..TreePlanter.TreePlanterClasses import Treerasters
 from ..TreePlanter.TreePlanterClasses import Position
-from ..TreePlanter.TreePlanterTreeshade import tree_slice
+from ..TreePlanter.TreePlanterScoring import wall_buffer, tmrt_sums, window_slices
 
 def treeplanter(treeinput,treedata,treerasters,tmrt_1d):
 
@@ -16,18 +16,7 @@ def treeplanter(treeinput,treedata,treerasters,tmrt_1d):
     bd_b = np.int_( np.ceil( (treedata.dia / 2) / treeinput.gt[1] ) )
 
     # Buffer on building raster so that trees can't be planted next to walls. Can be planted one radius from walls.
-    for i1 in range(bd_b):
-        walls = np.zeros((treeinput.rows, treeinput.cols))
-        domain = np.array([[0, 1, 0], [1, 0, 1], [0, 1, 0]])
-        for i in range(1, treeinput.cols - 1):
-            for j in range(1, treeinput.rows - 1):
-                dom = bld_copy[j - 1:j + 2, i - 1:i + 2]
-                walls[j, i] = np.min(dom[np.where(domain == 1)])
-
-        walls = bld_copy - walls
-        bld_copy = 1 - bld_copy
-        bld_copy = bld_copy + walls
-        bld_copy = 1 - bld_copy
+    bld_copy = wall_buffer(bld_copy, bd_b)
 
     # Remove all possible positions outside selected area
     bld_copy = bld_copy * treeinput.selected_area
@@ -40,36 +29,18 @@ def treeplanter(treeinput,treedata,treerasters,tmrt_1d):
 
     pos_ls = np.zeros((res_y.__len__(), 6))      # Length of vectors with y and x positions. Will have x and y positions, tmrt in shade and in sun and an id for each position
 
-    index = 0
-
-    # This loop pastes the tree shadow into all possible positions and calculates the sum of Tmrt under the shadow and
-    # the sum Tmrt for the same area but sunlit
-    for i in range(res_y.__len__()):
-        y1 = np.int_(res_y[i] - treerasters.buffer_y[0])
-        y2 = np.int_(res_y[i] + treerasters.buffer_y[1])
-        x1 = np.int_(res_x[i] - treerasters.buffer_x[0])
-        x2 = np.int_(res_x[i] + treerasters.buffer_x[1])
-
-        yslice1, xslice1, yslice2, xslice2 = tree_slice(y1,y2,x1,x2,treeinput,treerasters)
-
-        ts_temp1 = np.zeros((treeinput.rows, treeinput.cols))
-        ts_temp1[yslice2, xslice2] = treerasters.treeshade[yslice1, xslice1]
-
-        # Klistra in skugga!! Fixa för TreePlanterTreeshade.py
-        # Gör samma som i TreePlanterOptimizer (regional groups, etc)
-        for j in range(tmrt_1d.__len__()):
-            ts_temp2 = np.zeros((treeinput.rows, treeinput.cols))
-            ts_temp2[yslice2, xslice2] = treerasters.treeshade_bool[yslice1, xslice1, j]
-            sum_tmrt[res_y[i],res_x[i]] += np.sum(ts_temp2 * treeinput.buildings * treeinput.shadow[:,:,j] * treeinput.tmrt_ts[:,:,j])
-            sum_tmrt_tsh[res_y[i], res_x[i]] += np.sum(ts_temp2 * treeinput.buildings * treeinput.shadow[:,:,j] * tmrt_1d[j,0])
-
-        pos_ls[index, 1] = res_x[i]                         # X position of tree
-        pos_ls[index, 2] = res_y[i]                         # Y position of tree
-        pos_ls[index, 3] = sum_tmrt_tsh[res_y[i], res_x[i]] # Sum of Tmrt in tree shade - vector
-        pos_ls[index, 4] = sum_tmrt[res_y[i], res_x[i]]     # Sum of Tmrt in same area as tree shade but sunlit - vector
-        pos_ls[index, 5] = 1
-
-        index += 1
+    # Sum of Tmrt under the tree shadow and the sum Tmrt for the same area but sunlit, for all possible positions at once
+    yslice2, xslice2 = window_slices(res_y, res_x)
+    sum_tmrt_w, sum_tmrt_tsh_w = tmrt_sums(treeinput.buildings, treeinput.shadow, treeinput.tmrt_ts, tmrt_1d,
+                                           treerasters, yslice2, xslice2)
+    sum_tmrt[res_y, res_x] = sum_tmrt_w[res_y - yslice2.start, res_x - xslice2.start]
+    sum_tmrt_tsh[res_y, res_x] = sum_tmrt_tsh_w[res_y - yslice2.start, res_x - xslice2.start]
+
+    pos_ls[:, 1] = res_x                        # X position of tree
+    pos_ls[:, 2] = res_y                        # Y position of tree
+    pos_ls[:, 3] = sum_tmrt_tsh[res_y, res_x]   # Sum of Tmrt in tree shade - vector
+    pos_ls[:, 4] = sum_tmrt[res_y, res_x]       # Sum of Tmrt in same area as tree shade but sunlit - vector
+    pos_ls[:, 5] = 1
 
     pos_bool = pos_ls[:,3] != 0
     pos_ls = pos_ls[pos_bool,:]
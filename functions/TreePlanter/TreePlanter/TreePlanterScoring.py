@@ -0,0 +1,85 @@
+import numpy as np
+from scipy import ndimage, signal
+
+# Four neighbours (north, south, west, east) of a pixel, the pixel itself excluded
+CROSS = np.array([[0, 1, 0], [1, 0, 1], [0, 1, 0]], dtype=bool)
+
+def cross_minimum(grid, border):
+    '''Minimum of the four neighbours of each pixel. Pixels on the edge of the raster are set to border'''
+    walls = ndimage.minimum_filter(np.asarray(grid, dtype=float), footprint=CROSS, mode='constant', cval=border)
+    walls[0, :] = border
+    walls[-1, :] = border
+    walls[:, 0] = border
+    walls[:, -1] = border
+
+    return walls
+
+def wall_buffer(buildings, iterations):
+    '''Buffer on building raster so that trees can't be planted next to walls (one pixel per iteration)'''
+    bld = buildings
+    for i in range(iterations):
+        bld = cross_minimum(bld, 0.)
+
+    return bld
+
+def tree_buffer(added_tree, iterations):
+    '''Buffer around the canopy of a planted tree (added_tree is 0 under the canopy, 1 elsewhere)'''
+    for i in range(iterations):
+        added_tree = added_tree * cross_minimum(added_tree, 1.)
+
+    return added_tree
+
+def padded_window(grid, r0, r1, c0, c1):
+    '''Rows r0:r1 and cols c0:c1 of grid, zeros outside of the raster'''
+    window = np.zeros((r1 - r0, c1 - c0) + grid.shape[2:])
+    gr0 = max(r0, 0); gr1 = min(r1, grid.shape[0])
+    gc0 = max(c0, 0); gc1 = min(c1, grid.shape[1])
+    if (gr1 > gr0) & (gc1 > gc0):
+        window[gr0 - r0:gr1 - r0, gc0 - c0:gc1 - c0] = grid[gr0:gr1, gc0:gc1]
+
+    return window
+
+def tmrt_sums(buildings, shadow, tmrt_ts, tmrt_1d, treerasters, yslice, xslice):
+    '''Sum of Tmrt in the sun (sum_tmrt) and in tree shade (sum_tmrt_tsh) under the shadow of a tree planted at each
+    position of the window yslice, xslice. For each timestep the tree shadow (treerasters.treeshade_bool) is
+    cross-correlated with the sunlit Tmrt, so that all positions are calculated at once. This gives the same sums as
+    pasting the tree shadow into each position with tree_slice (the shadow is cut at the edges of the raster).'''
+    by0 = np.int_(treerasters.buffer_y[0])
+    bx0 = np.int_(treerasters.buffer_x[0])
+    kr, kc = treerasters.treeshade_bool.shape[:2]
+
+    sum_tmrt = np.zeros((yslice.stop - yslice.start, xslice.stop - xslice.start))
+    sum_tmrt_tsh = np.zeros(sum_tmrt.shape)
+    if sum_tmrt.size == 0:
+        return sum_tmrt, sum_tmrt_tsh
+
+    # Part of the rasters that can be shaded by a tree in the window
+    r0 = yslice.start - by0; r1 = yslice.stop - by0 + kr - 1
+    c0 = xslice.start - bx0; c1 = xslice.stop - bx0 + kc - 1
+    bld = padded_window(np.asarray(buildings, dtype=float), r0, r1, c0, c1)
+    sh = padded_window(shadow, r0, r1, c0, c1)
+    tmrt = padded_window(tmrt_ts, r0, r1, c0, c1)
+
+    for j in range(tmrt_1d.__len__()):
+        kernel = treerasters.treeshade_bool[:, :, j]
+        if not np.any(kernel):
+            continue
+        sunlit = bld * sh[:, :, j]
+        sum_tmrt += snap(signal.correlate(sunlit * tmrt[:, :, j], kernel, mode='valid'), sunlit * tmrt[:, :, j], kernel)
+        sum_tmrt_tsh += snap(signal.correlate(sunlit, kernel, mode='valid'), sunlit, kernel) * tmrt_1d[j, 0]
+
+    return sum_tmrt, sum_tmrt_tsh
+
+def snap(result, grid, kernel):
+    '''Set to zero the round-off left by FFT correlation where there is no overlap between grid and kernel'''
+    tolerance = 1e-10 * np.abs(grid).max() * np.abs(kernel).sum()
+    result[np.abs(result) <= tolerance] = 0.
+
+    return result
+
+def window_slices(rows, cols):
+    '''Smallest window containing all positions where rows, cols (from np.where) are found'''
+    if rows.__len__() == 0:
+        return slice(0, 0), slice(0, 0)
+
+    return slice(int(rows.min()), int(rows.max()) + 1), slice(int(cols.min()), int(cols.max()) + 1)
@@ -91,6 +91,97 @@ def tsh_gen_mt2(y,x,treerasters,treeinput):
 
     return tsh_bool_pad
 
+class Shadowcounts():
+    '''Number of tree shadows on each pixel and timestep for the trees of one hill climbing run. Moving a tree only
+    updates the window of its shadow, so that the shadows of all trees do not have to be recreated for each move.
+    tmrt_shade and tmrt_sun are the sums of Tmrt in tree shade and sunlit under the union of all tree shadows, for
+    sunlit pixels (shadow == 1). tmrt_shade_sh and tmrt_sun_sh are the same sums weighted by the shadow rasters'''
+    __slots__ = ('treerasters', 'treeinput', 'tmrt_1d', 'counts', 'counts_large', 'overlaps', 'y', 'x',
+                 'tmrt_shade', 'tmrt_sun', 'tmrt_shade_sh', 'tmrt_sun_sh')
+    def __init__(self, y, x, treerasters, treeinput, tmrt_1d):
+        self.treerasters = treerasters
+        self.treeinput = treeinput
+        self.tmrt_1d = tmrt_1d[:, 0]
+        self.counts = np.zeros((treeinput.rows, treeinput.cols, treerasters.treeshade_bool.shape[2]), dtype=np.int16)
+        self.counts_large = np.zeros((treeinput.rows, treeinput.cols), dtype=np.int16)
+        self.overlaps = 0       # Number of pixels and timesteps with more than one tree shadow
+
+        self.tmrt_shade = 0.
+        self.tmrt_sun = 0.
+        self.tmrt_shade_sh = 0.
+        self.tmrt_sun_sh = 0.
+        self.y = np.array(y, dtype=int)
+        self.x = np.array(x, dtype=int)
+        for i in range(self.y.shape[0]):
+            self.add(self.y[i], self.x[i], 1)
+
+    def window(self, y, x):
+        y1 = np.int_(y - self.treerasters.buffer_y[0])
+        y2 = np.int_(y + self.treerasters.buffer_y[1])
+        x1 = np.int_(x - self.treerasters.buffer_x[0])
+        x2 = np.int_(x + self.treerasters.buffer_x[1])
+
+        return tree_slice(y1, y2, x1, x2, self.treeinput, self.treerasters)
+
+    def sunlit(self, yslice, xslice, weighted):
+        '''Sunlit pixels outside buildings in a window, either 0/1 (shadow == 1) or weighted by the shadow rasters'''
+        buildings = self.treeinput.buildings[yslice, xslice, np.newaxis]
+        if weighted:
+            return self.treeinput.shadow[yslice, xslice, :] * buildings
+        else:
+            return (self.treeinput.shadow[yslice, xslice, :] == 1) * (buildings == 1)
+
+    def gain(self, y, x):
+        '''Tmrt in tree shade and sunlit for the pixels that a tree in y,x would add to the union of tree shadows'''
+        yslice1, xslice1, yslice2, xslice2 = self.window(y, x)
+        new = (self.treerasters.treeshade_bool[yslice1, xslice1, :] > 0) & (self.counts[yslice2, xslice2, :] == 0)
+        new = new * self.sunlit(yslice2, xslice2, False)
+
+        return np.sum(new * self.tmrt_1d), np.sum(new * self.treeinput.tmrt_ts[yslice2, xslice2, :])
+
+    def overlap_large(self, y, x):
+        '''True if the shadow (all timesteps) of a tree in y,x overlaps with the shadows of the trees'''
+        yslice1, xslice1, yslice2, xslice2 = self.window(y, x)
+
+        return np.any((self.treerasters.treeshade_rg[yslice1, xslice1] > 0) & (self.counts_large[yslice2, xslice2] > 0))
+
+    def add(self, y, x, n):
+        '''Add (n = 1) or remove (n = -1) the shadow of a tree in y,x'''
+        yslice1, xslice1, yslice2, xslice2 = self.window(y, x)
+        tsh = self.treerasters.treeshade_bool[yslice1, xslice1, :] > 0
+        counts = self.counts[yslice2, xslice2, :]
+
+        # Pixels that enter (n = 1) or leave (n = -1) the union of tree shadows
+        edge = tsh & (counts == (0 if n > 0 else 1))
+        tmrt_ts = self.treeinput.tmrt_ts[yslice2, xslice2, :]
+        sunlit = edge * self.sunlit(yslice2, xslice2, False)
+        self.tmrt_shade += n * np.sum(sunlit * self.tmrt_1d)
+        self.tmrt_sun += n * np.sum(sunlit * tmrt_ts)
+        sunlit = edge * self.sunlit(yslice2, xslice2, True)
+        self.tmrt_shade_sh += n * np.sum(sunlit * self.tmrt_1d)
+        self.tmrt_sun_sh += n * np.sum(sunlit * tmrt_ts)
+
+        overlaps = np.sum(counts > 1)
+        counts += n * tsh
+        self.overlaps += np.sum(counts > 1) - overlaps
+        self.counts_large[yslice2, xslice2] += n * (self.treerasters.treeshade_rg[yslice1, xslice1] > 0)
+
+    def remove(self, i):
+        '''Remove the shadow of tree i, e.g. while it is moving'''
+        self.add(self.y[i], self.x[i], -1)
+
+    def place(self, i, y, x):
+        '''Add the shadow of tree i in y,x (after remove)'''
+        self.y[i] = y
+        self.x[i] = x
+        self.add(y, x, 1)
+
+    def update(self, y, x):
+        '''Move the shadows of trees that have been moved elsewhere, e.g. by treenudge'''
+        for i in np.where((self.y != np.int_(y)) | (self.x != np.int_(x)))[0]:
+            self.remove(i)
+            self.place(i, np.int_(y[i]), np.int_(x[i]))
+
 ''' Slicing to fit shadows, cdsm, etc, into larger rasters'''
 def tree_slice(y1,y2,x1,x2,treeinput,treerasters):
     if y1 < 0:
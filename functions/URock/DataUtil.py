@@ -255,6 +255,29 @@ def windDirectionFromXY(windSpeedEast, windSpeedNorth):
     
     return radAngle
 
+def seriesToGrid(series, shape):
+    """ Convert a Series indexed by (i, j, k) grid coordinates into a 3D array
+    (the cells missing in the Series are set to nan).
+    
+    Parameters
+    _ _ _ _ _ _ _ _ _ _ 
+        series: pd.Series
+            Values indexed by a 3 levels MultiIndex (i, j, k)
+        shape: tuple of int
+            (nx, ny, nz) shape of the grid
+    
+    Returns
+    -------
+        3D np.array of the values
+    """
+    values = series.to_numpy()
+    grid = np.full(shape, np.nan, dtype = np.result_type(values.dtype, np.float64))
+    grid[series.index.get_level_values(0).to_numpy(),
+         series.index.get_level_values(1).to_numpy(),
+         series.index.get_level_values(2).to_numpy()] = values
+    
+    return grid
+
 def getExtremumPoint(pointsTable, axis, extremum, secondAxisExtremum, cursor, prefix_name):
     """ Identify the point geometry being an extremum ("MIN" or "MAX"") of a polygon
     along a given axis ("X" or "Y"). If two points are at the same "X" (or "Y"),
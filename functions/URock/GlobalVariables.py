@@ -50,6 +50,8 @@ OUTPUT_FILENAME = "UROCK_OUTPUT"
 OUTPUT_RASTER_EXTENSION = ".tif"
 OUTPUT_VECTOR_EXTENSION = ".fgb"
 OUTPUT_NETCDF_EXTENSION = ".nc"
+# Suffix of the NetCDF file containing all the cases of a wind rose calculation
+WIND_ROSE_SUFFIX = "_windrose"
 VECTOR_STYLE_FILENAME = "vectorStyle.qml"
 
 # List of vertical height for the output horizontal wind
@@ -77,6 +79,15 @@ ONLY_INITIALIZATION = False
 SAVE_ROCKLE_ZONES = False
 MAX_ITERATIONS = 500      # Based on QUIC-URB default values (2021)
 THRESHOLD_ITERATIONS = 1e-4 # Based on QUIC-URB default values (2021)
+# Wind solver methods: SOR sweeping the cells in lexicographic order,
+# red-black (checkerboard) ordered SOR updating all cells of one color at once
+# or conjugate gradient preconditioned by multigrid on the sparse lambda equation
+# (thresholdIterations is then the relative residual at which iterations stop)
+SOLVER_SOR = "SOR"
+SOLVER_RED_BLACK_SOR = "RED_BLACK_SOR"
+SOLVER_MULTIGRID_CG = "MULTIGRID_CG"
+SOLVER_METHODS = [SOLVER_SOR, SOLVER_RED_BLACK_SOR, SOLVER_MULTIGRID_CG]
+SOLVER_METHOD = SOLVER_SOR
 
 # Note that the number of points of an ellipse is only used to identify whether
 # the upper or lower part of an ellipse should be used (fro displacement zones),
@@ -95,7 +95,7 @@ def downloadH2gis(dbDirectory):
 def startH2gisInstance(dbDirectory, dbInstanceDir = TEMPO_DIRECTORY, 
                        instanceName = INSTANCE_NAME, suffix = "", 
                        instanceId=INSTANCE_ID, 
-                       instancePass = INSTANCE_PASS):
+                       instancePass = INSTANCE_PASS, newDB = NEW_DB):
     """ Start an H2GIS spatial database instance (used for Röckle zone calculation)
     For more information about use with Python: https://github.com/orbisgis/h2gis/wiki/4.4-Use-H2GIS-with-Python
 
@@ -114,6 +114,9 @@ def startH2gisInstance(dbDirectory, dbInstanceDir = TEMPO_DIRECTORY,
                 ID used to connect to the database
             instancePass: String, default INSTANCE_PASS
                 password used to connect to the database
+            newDB: boolean, default NEW_DB
+                Whether or not an existing database should be deleted (if False,
+                the tables of the existing database are kept)
         
 		Returns
 		_ _ _ _ _ _ _ _ _ _ 
@@ -135,7 +138,7 @@ def startH2gisInstance(dbDirectory, dbInstanceDir = TEMPO_DIRECTORY,
     print (localH2JarDir)
 
     # If the DB already exists and if 'newDB' is set to True, delete all the DB files
-    if isDbExist:
+    if isDbExist and newDB:
         os.remove(localH2InstanceDir+DB_EXTENSION)
         if os.path.exists(localH2InstanceDir+DB_TRACE_EXTENSION):
             os.remove(localH2InstanceDir+DB_TRACE_EXTENSION)
@@ -179,6 +182,21 @@ def closeAndRemoveH2gisInstance(localH2InstanceDir, conn, cur):
     # Close cursor and connection and then delete the H2GIS database file
     cur.close()
     conn.close()
+    removeH2gisInstance(localH2InstanceDir = localH2InstanceDir)
+
+def removeH2gisInstance(localH2InstanceDir):
+    """ Remove the files of an H2GIS database (the connection should be closed)
+
+		Parameters
+		_ _ _ _ _ _ _ _ _ _ 
+
+            localH2InstanceDir: String
+                File directory of the database to delete (without extension)
+        
+		Returns
+		_ _ _ _ _ _ _ _ _ _ 
+
+            None"""
     if os.path.exists(localH2InstanceDir + DB_EXTENSION):
         os.remove(localH2InstanceDir + DB_EXTENSION)
     if os.path.exists(localH2InstanceDir + DB_TRACE_EXTENSION):
@@ -24,8 +24,10 @@ except ImportError:
     exit("'numba' Python package is missing")
 #import copy as cp
 from pathlib import Path
-from qgis.core import QgsProcessingException
-from shutil import rmtree
+from shutil import rmtree, copyfile
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from scipy import ndimage
+from ...util import parallel
 import uuid
 
 import os
@@ -54,6 +56,7 @@ def main(javaEnvironmentPath,
          onlyInitialization = ONLY_INITIALIZATION,
          maxIterations = MAX_ITERATIONS,
          thresholdIterations = THRESHOLD_ITERATIONS,
+         solverMethod = SOLVER_METHOD,
          idFieldBuild = ID_FIELD_BUILD,
          buildingHeightField = HEIGHT_FIELD,
          vegetationBaseHeight = VEGETATION_CROWN_BASE_HEIGHT,
@@ -70,6 +73,79 @@ def main(javaEnvironmentPath,
          debug = DEBUG,
          profileType = PROFILE_TYPE,
          verticalProfileFile = None):
+    obstacles = prepareObstacles(pluginDirectory = pluginDirectory,
+                                 outputFilePath = outputFilePath,
+                                 buildingFilePath = buildingFilePath,
+                                 srid = srid,
+                                 vegetationFilePath = vegetationFilePath,
+                                 prefix = prefix,
+                                 idFieldBuild = idFieldBuild,
+                                 buildingHeightField = buildingHeightField,
+                                 vegetationBaseHeight = vegetationBaseHeight,
+                                 vegetationTopHeight = vegetationTopHeight,
+                                 idVegetation = idVegetation,
+                                 vegetationAttenuationFactor = vegetationAttenuationFactor,
+                                 saveRockleZones = saveRockleZones,
+                                 feedback = feedback,
+                                 debug = debug)
+    if obstacles is None:
+        return {}
+    
+    return calculatesWindField(**obstacles,
+                               outputFilePath = outputFilePath,
+                               srid = srid,
+                               outputFilename = outputFilename,
+                               z_ref = z_ref,
+                               v_ref = v_ref,
+                               windDirection = windDirection,
+                               prefix = prefix,
+                               meshSize = meshSize,
+                               dz = dz,
+                               alongWindZoneExtend = alongWindZoneExtend,
+                               crossWindZoneExtend = crossWindZoneExtend,
+                               verticalExtend = verticalExtend,
+                               onlyInitialization = onlyInitialization,
+                               maxIterations = maxIterations,
+                               thresholdIterations = thresholdIterations,
+                               solverMethod = solverMethod,
+                               saveRockleZones = saveRockleZones,
+                               z_out = z_out,
+                               outputRaster = outputRaster,
+                               feedback = feedback,
+                               saveRaster = saveRaster,
+                               saveVector = saveVector,
+                               saveNetcdf = saveNetcdf,
+                               debug = debug,
+                               profileType = profileType,
+                               verticalProfileFile = verticalProfileFile)
+
+def prepareObstacles(pluginDirectory,
+                     outputFilePath,
+                     buildingFilePath,
+                     srid,
+                     vegetationFilePath = "",
+                     prefix = PREFIX_NAME,
+                     idFieldBuild = ID_FIELD_BUILD,
+                     buildingHeightField = HEIGHT_FIELD,
+                     vegetationBaseHeight = VEGETATION_CROWN_BASE_HEIGHT,
+                     vegetationTopHeight = VEGETATION_CROWN_TOP_HEIGHT,
+                     idVegetation = ID_VEGETATION,
+                     vegetationAttenuationFactor = VEGETATION_ATTENUATION_FACTOR,
+                     saveRockleZones = SAVE_ROCKLE_ZONES,
+                     feedback = None,
+                     debug = DEBUG):
+    """ Start an H2GIS instance, load the input data and create the stacked 
+    blocks used as obstacles (independent of the wind direction).
+    
+		Returns
+		_ _ _ _ _ _ _ _ _ _ 
+
+            obstacles: dictionary
+                Database connection ("cursor", "conn", "localH2InstanceDir"), 
+                temporary and output directories ("tmp_dir_unique", "outputDataAbs"),
+                stacked block table name ("stackedBlockTable") and start time
+                of the calculation ("timeStartCalculation"). None if the 
+                calculation has been cancelled"""
     # If the function is called within QGIS, a feedback is sent into the QGIS interface
     if feedback:
         feedback.setProgressText('Initiating algorithm')
@@ -132,7 +208,7 @@ def main(javaEnvironmentPath,
         if feedback.isCanceled():
             cursor.close()
             feedback.setProgressText("Calculation cancelled by user")
-            return {}
+            return None
     #Download H2GIS
     #H2gisConnection.downloadH2gis(dbDirectory = pluginDirectory)
     #Initialize a H2GIS database connection
@@ -171,7 +247,7 @@ def main(javaEnvironmentPath,
         if feedback.isCanceled():
             cursor.close()
             feedback.setProgressText("Calculation cancelled by user")
-            return {}
+            return None
     # Create the stacked blocks
     blockTable, stackedBlockTable = \
         Obstacles.createsBlocks(cursor = cursor, 
@@ -185,6 +261,51 @@ def main(javaEnvironmentPath,
         saveData.saveTable(cursor = cursor                          , tableName = VEGETATION_TABLE_NAME,
                            filedir = outputDataAbs["vegetation"]    , delete = True)
     
+    return {"cursor": cursor,
+            "conn": conn,
+            "localH2InstanceDir": localH2InstanceDir,
+            "tmp_dir_unique": tmp_dir_unique,
+            "outputDataAbs": outputDataAbs,
+            "stackedBlockTable": stackedBlockTable,
+            "timeStartCalculation": timeStartCalculation}
+
+def calculatesWindField(cursor,
+                        conn,
+                        localH2InstanceDir,
+                        tmp_dir_unique,
+                        outputDataAbs,
+                        stackedBlockTable,
+                        timeStartCalculation,
+                        outputFilePath,
+                        srid,
+                        outputFilename = OUTPUT_FILENAME,
+                        z_ref = Z_REF,
+                        v_ref = V_REF,
+                        windDirection = WIND_DIRECTION,
+                        prefix = PREFIX_NAME,
+                        meshSize = MESH_SIZE,
+                        dz = DZ,
+                        alongWindZoneExtend = ALONG_WIND_ZONE_EXTEND,
+                        crossWindZoneExtend = CROSS_WIND_ZONE_EXTEND,
+                        verticalExtend = VERTICAL_EXTEND,
+                        onlyInitialization = ONLY_INITIALIZATION,
+                        maxIterations = MAX_ITERATIONS,
+                        thresholdIterations = THRESHOLD_ITERATIONS,
+                        solverMethod = SOLVER_METHOD,
+                        saveRockleZones = SAVE_ROCKLE_ZONES,
+                        z_out = Z_OUT,
+                        outputRaster = None,
+                        feedback = None,
+                        saveRaster = True,
+                        saveVector = True,
+                        saveNetcdf = True,
+                        debug = DEBUG,
+                        profileType = PROFILE_TYPE,
+                        verticalProfileFile = None):
+    """ Calculates the wind field for one wind direction and one reference
+    wind speed from the stacked blocks created by prepareObstacles: rotation
+    of the obstacles, Röckle zones, wind initialization, wind solver and 
+    outputs. The database connection is closed at the end (if not debug)."""
     # -----------------------------------------------------------------------------------
     # 3. ROTATES OBSTACLES TO THE RIGHT DIRECTION AND CALCULATES GEOMETRY PROPERTIES ----
     # -----------------------------------------------------------------------------------
@@ -677,21 +798,20 @@ def main(javaEnvironmentPath,
             return {}
     # Set the ground as "building" (understand solid wall) - after getting grid size
     nx, ny, nz = nPoints.values()
-    df_gridBuil = df_gridBuil.reindex(df_gridBuil.index.append(pd.MultiIndex.from_product([range(1,nx-1),
-                                                                                          range(1,ny-1),
-                                                                                          [0]])))
 
     # Set the buildGrid3D object to zero when a cell intersect a building 
-    buildGrid3D = pd.Series(1, index = df_wind0.index, dtype = np.int32)
-    buildGrid3D.loc[df_gridBuil.index] = 0
+    buildGrid3D = np.ones((nx, ny, nz), dtype = np.int32)
+    buildGrid3D[df_gridBuil.index.get_level_values(0).to_numpy(),
+                df_gridBuil.index.get_level_values(1).to_numpy(),
+                df_gridBuil.index.get_level_values(2).to_numpy()] = 0
+    buildGrid3D[1:nx-1, 1:ny-1, 0] = 0
     
-    # Convert building coordinates and wind speeds to numpy matrix...
+    # Convert wind speeds to numpy matrix...
     # (note that v axis direction is changed since we first use Röckle schemes
     # considering wind speed coming from North thus axis facing South)
-    buildGrid3D = np.array([buildGrid3D.xs(i, level = 0).unstack().values for i in range(0,nx)])
-    u0 = np.array([df_wind0[U].xs(i, level = 0).unstack().values for i in range(0,nx)])
-    v0 = -np.array([df_wind0[V].xs(i, level = 0).unstack().values for i in range(0,nx)])
-    w0 = np.array([df_wind0[W].xs(i, level = 0).unstack().values for i in range(0,nx)])
+    u0 = DataUtil.seriesToGrid(df_wind0[U], (nx, ny, nz))
+    v0 = -DataUtil.seriesToGrid(df_wind0[V], (nx, ny, nz))
+    w0 = DataUtil.seriesToGrid(df_wind0[W], (nx, ny, nz))
     
     # Identify all cells needing to be updated by the wind solver and store
     # their coordinates in a 1D array
@@ -749,7 +869,7 @@ def main(javaEnvironmentPath,
                                 u0 = u0                     , v0 = v0               , w0 = w0, cursor = cursor,
                                 buildingCoordinates = buildingCoordinates   , cells4Solver = cells4Solver,
                                 maxIterations = maxIterations, thresholdIterations = thresholdIterations,
-                                feedback = feedback)
+                                feedback = feedback, solverMethod = solverMethod)
     else:
         u = u0
         v = v0
@@ -875,6 +995,366 @@ def main(javaEnvironmentPath,
             buildingCoordinates, cursor, rotated_grid, rotationCenterCoordinates,\
             verticalWindProfile, dicVectorTables, netcdf_path, netcdf_path_ini
 
+def mainBatch(javaEnvironmentPath,
+              pluginDirectory,
+              outputFilePath,
+              buildingFilePath,
+              srid,
+              windCases,
+              outputFilename = OUTPUT_FILENAME,
+              vegetationFilePath = "",
+              z_ref = Z_REF,
+              prefix = PREFIX_NAME,
+              meshSize = MESH_SIZE,
+              dz = DZ,
+              alongWindZoneExtend = ALONG_WIND_ZONE_EXTEND,
+              crossWindZoneExtend = CROSS_WIND_ZONE_EXTEND,
+              verticalExtend = VERTICAL_EXTEND,
+              onlyInitialization = ONLY_INITIALIZATION,
+              maxIterations = MAX_ITERATIONS,
+              thresholdIterations = THRESHOLD_ITERATIONS,
+              solverMethod = SOLVER_METHOD,
+              idFieldBuild = ID_FIELD_BUILD,
+              buildingHeightField = HEIGHT_FIELD,
+              vegetationBaseHeight = VEGETATION_CROWN_BASE_HEIGHT,
+              vegetationTopHeight = VEGETATION_CROWN_TOP_HEIGHT,
+              idVegetation = ID_VEGETATION,
+              vegetationAttenuationFactor = VEGETATION_ATTENUATION_FACTOR,
+              z_out = Z_OUT,
+              outputRaster = None,
+              feedback = None,
+              debug = DEBUG,
+              profileType = PROFILE_TYPE,
+              verticalProfileFile = None,
+              saveRaster = False,
+              workers = None):
+    """ Calculates the wind field for several wind cases (wind rose). The 
+    input data are loaded and the stacked blocks created only once. The 
+    rotation, Röckle zones and wind solver of each wind direction are then 
+    run in a separate worker process. Since the wind field is linear in the
+    reference wind speed, a single calculation is done per wind direction and
+    the other wind speeds are obtained by rescaling the solution. The 
+    horizontal wind fields of all cases are saved in a single NetCDF file.
+    
+		Parameters
+		_ _ _ _ _ _ _ _ _ _ 
+
+            windCases: list of tuple
+                (wind direction (° clock-wise from North), reference wind speed)
+                of each case
+            saveRaster: boolean, default False
+                Whether or not the wind speeds are also saved in a raster per 
+                level and per variable (one band per case)
+            workers: int, default None
+                Maximum number of worker processes (default: number of CPUs)
+            
+            The other parameters are the same as in main()
+        
+		Returns
+		_ _ _ _ _ _ _ _ _ _ 
+
+            netcdf_path: String
+                Path of the NetCDF file where are saved the wind fields of all
+                cases (None if the calculation has been cancelled)
+            rasterPaths: dictionary
+                Path of the raster file of each wind speed variable for each
+                level (empty if saveRaster is False, None if the calculation
+                has been cancelled)"""
+    obstacles = prepareObstacles(pluginDirectory = pluginDirectory,
+                                 outputFilePath = outputFilePath,
+                                 buildingFilePath = buildingFilePath,
+                                 srid = srid,
+                                 vegetationFilePath = vegetationFilePath,
+                                 prefix = prefix,
+                                 idFieldBuild = idFieldBuild,
+                                 buildingHeightField = buildingHeightField,
+                                 vegetationBaseHeight = vegetationBaseHeight,
+                                 vegetationTopHeight = vegetationTopHeight,
+                                 idVegetation = idVegetation,
+                                 vegetationAttenuationFactor = vegetationAttenuationFactor,
+                                 saveRockleZones = False,
+                                 feedback = feedback,
+                                 debug = debug)
+    if obstacles is None:
+        return None, None
+    
+    # The connection is closed to have a complete database file which is
+    # copied by each of the worker processes
+    obstacles["cursor"].close()
+    obstacles["conn"].close()
+    localH2InstanceDir = obstacles["localH2InstanceDir"]
+    
+    # A single calculation per wind direction, at the highest wind speed, 
+    # except for a user profile which does not scale with the reference
+    # wind speed (one calculation per case)
+    solvedSpeeds = {}
+    for windDirection, v_ref in windCases:
+        key = windCaseKey(windDirection, v_ref, profileType)
+        solvedSpeeds[key] = max(float(v_ref), solvedSpeeds.get(key, 0))
+    keys = list(solvedSpeeds.keys())
+    
+    if feedback:
+        feedback.setProgressText('Calculates the wind field for {0} wind case(s)'.format(len(keys)))
+    calculation = {"dBDir": os.path.join(Path(pluginDirectory).parent, 'functions','URock'),
+                   "dbFile": localH2InstanceDir + H2gisConnection.DB_EXTENSION,
+                   "stackedBlockTable": obstacles["stackedBlockTable"],
+                   "outputDataAbs": obstacles["outputDataAbs"],
+                   "tmpDirectory": obstacles["tmp_dir_unique"],
+                   "z_out": z_out,
+                   "srid": srid,
+                   "z_ref": z_ref,
+                   "prefix": prefix,
+                   "meshSize": meshSize,
+                   "dz": dz,
+                   "alongWindZoneExtend": alongWindZoneExtend,
+                   "crossWindZoneExtend": crossWindZoneExtend,
+                   "verticalExtend": verticalExtend,
+                   "onlyInitialization": onlyInitialization,
+                   "maxIterations": maxIterations,
+                   "thresholdIterations": thresholdIterations,
+                   "solverMethod": solverMethod,
+                   "profileType": profileType,
+                   "verticalProfileFile": verticalProfileFile}
+    if workers is None:
+        workers = parallel.default_workers()
+    pool = ProcessPoolExecutor(max_workers = max(1, min(workers, len(keys))),
+                               mp_context = parallel.process_context())
+    cancelled = False
+    try:
+        tasks = [pool.submit(calculatesWindDirection,
+                             windDirection = key[0],
+                             v_ref = solvedSpeeds[key],
+                             caseName = "case{0}".format(i),
+                             **calculation) for i, key in enumerate(keys)]
+        pending = set(tasks)
+        while pending:
+            done, pending = wait(pending, timeout = 1, return_when = FIRST_COMPLETED)
+            if feedback:
+                if feedback.isCanceled():
+                    feedback.setProgressText("Calculation cancelled by user")
+                    cancelled = True
+                    return None, None
+                feedback.setProgress(int(100 * (len(tasks) - len(pending)) / len(tasks)))
+        results = {key: task.result() for key, task in zip(keys, tasks)}
+    finally:
+        # The running calculations are stopped rather than waited for when cancelled
+        if cancelled:
+            parallel.terminate(pool)
+        else:
+            pool.shutdown(wait = True, cancel_futures = True)
+        H2gisConnection.removeH2gisInstance(localH2InstanceDir = localH2InstanceDir)
+    
+    # Common grid of the outputs (cell centers): the output raster if any,
+    # else the union of the grids of all cases
+    if outputRaster:
+        extent = outputRaster.extent()
+        xres = (extent.xMaximum() - extent.xMinimum()) / outputRaster.width()
+        yres = (extent.yMaximum() - extent.yMinimum()) / outputRaster.height()
+        x = extent.xMinimum() + (np.arange(outputRaster.width()) + 0.5) * xres
+        y = extent.yMaximum() - (np.arange(outputRaster.height()) + 0.5) * yres
+    else:
+        xmin = min(results[key]["x"].min() for key in keys)
+        xmax = max(results[key]["x"].max() for key in keys)
+        ymin = min(results[key]["y"].min() for key in keys)
+        ymax = max(results[key]["y"].max() for key in keys)
+        x = xmin + np.arange(int(round((xmax - xmin) / meshSize)) + 1) * meshSize
+        y = ymax - np.arange(int(round((ymax - ymin) / meshSize)) + 1) * meshSize
+        xres = yres = meshSize
+    
+    # Interpolate each calculation on the common grid and rescale for each wind speed
+    u = np.zeros((len(windCases), len(z_out), y.size, x.size))
+    v = np.zeros(u.shape)
+    w = np.zeros(u.shape)
+    for key in keys:
+        interpolated = {var: interpolateOnGrid(x_rot = results[key]["x"],
+                                               y_rot = results[key]["y"],
+                                               values = results[key][var],
+                                               x = x,
+                                               y = y) for var in ["u", "v", "w"]}
+        for i, (windDirection, v_ref) in enumerate(windCases):
+            if windCaseKey(windDirection, v_ref, profileType) == key:
+                if key[1] is not None:
+                    factor = 1
+                elif solvedSpeeds[key] == 0:
+                    factor = 0
+                else:
+                    factor = float(v_ref) / solvedSpeeds[key]
+                u[i] = factor * interpolated["u"]
+                v[i] = factor * interpolated["v"]
+                w[i] = factor * interpolated["w"]
+    
+    # Save all cases in a NetCDF file
+    netcdf_base_dir_name = os.path.join(outputFilePath, 
+                                        DataUtil.prefix(outputFilename, prefix) + WIND_ROSE_SUFFIX)
+    if os.path.isfile(netcdf_base_dir_name + OUTPUT_NETCDF_EXTENSION):
+        if DELETE_OUTPUT_IF_EXISTS:
+            os.remove(netcdf_base_dir_name + OUTPUT_NETCDF_EXTENSION)
+        else:
+            netcdf_base_dir_name = saveData.renameFileIfExists(filedir = netcdf_base_dir_name,
+                                                               extension = OUTPUT_NETCDF_EXTENSION)
+    netcdf_path = saveData.saveWindRoseToNetCDF(x = x,
+                                                y = y,
+                                                z_out = z_out,
+                                                directions = np.array([float(c[0]) for c in windCases]),
+                                                v_refs = np.array([float(c[1]) for c in windCases]),
+                                                u = u,
+                                                v = v,
+                                                w = w,
+                                                path = netcdf_base_dir_name,
+                                                urock_srid = srid,
+                                                horizontal_res = meshSize,
+                                                vertical_res = dz)
+    if saveRaster:
+        rasterPaths = saveData.saveWindRoseRasters(x = x,
+                                                   y = y,
+                                                   z_out = z_out,
+                                                   directions = np.array([float(c[0]) for c in windCases]),
+                                                   v_refs = np.array([float(c[1]) for c in windCases]),
+                                                   u = u,
+                                                   v = v,
+                                                   w = w,
+                                                   outputFilePath = outputFilePath,
+                                                   outputFilename = outputFilename,
+                                                   prefix_name = prefix,
+                                                   urock_srid = srid,
+                                                   xres = xres,
+                                                   yres = yres)
+    else:
+        rasterPaths = {}
+    if not debug:
+        rmtree(obstacles["tmp_dir_unique"], ignore_errors = True)
+    
+    return netcdf_path, rasterPaths
+
+def windCaseKey(windDirection, v_ref, profileType):
+    """ Identifies the wind cases which can be obtained from the same 
+    calculation: (wind direction, None) if the wind field scales with the
+    reference wind speed, else (wind direction, reference wind speed)"""
+    if profileType == "user":
+        return (float(windDirection), float(v_ref))
+    else:
+        return (float(windDirection), None)
+
+def calculatesWindDirection(dBDir, dbFile, stackedBlockTable, outputDataAbs,
+                            tmpDirectory, caseName, windDirection, v_ref, 
+                            z_out, dz, **calculation):
+    """ Calculates the wind field of a single wind direction in a worker 
+    process, using a copy of the database containing the stacked blocks.
+    
+		Parameters
+		_ _ _ _ _ _ _ _ _ _ 
+
+            dBDir: String
+                Directory where is stored the H2GIS jar
+            dbFile: String
+                Database file containing the stacked blocks and the vegetation
+            stackedBlockTable: String
+                Name of the stacked block table
+            outputDataAbs: dictionary
+                Paths of the intermediate files of the calculation (the files
+                are moved into the directory of the wind case)
+            tmpDirectory: String
+                Directory where is created the directory of the wind case
+            caseName: String
+                Name of the directory of the wind case
+            windDirection: float
+                Wind direction (° clock-wise from North)
+            v_ref: float
+                Reference wind speed
+            z_out: list of float
+                Heights of the horizontal levels to return
+            dz: float
+                Vertical resolution
+            calculation: dictionary
+                Other parameters of calculatesWindField
+        
+		Returns
+		_ _ _ _ _ _ _ _ _ _ 
+
+            result: dictionary
+                Coordinates of the grid "x" and "y" (2D - X, Y) and wind speed
+                along East, North and vertical axis "u", "v" and "w" 
+                (3D - z_out, X, Y)"""
+    caseDir = os.path.join(tmpDirectory, caseName)
+    if os.path.exists(caseDir):
+        rmtree(caseDir, ignore_errors = True)
+    os.mkdir(caseDir)
+    instanceName = os.path.basename(dbFile)[:-len(H2gisConnection.DB_EXTENSION)]
+    copyfile(dbFile, os.path.join(caseDir, os.path.basename(dbFile)))
+    cursor, conn, localH2InstanceDir = \
+        H2gisConnection.startH2gisInstance(dbDirectory = dBDir,
+                                           dbInstanceDir = caseDir,
+                                           instanceName = instanceName,
+                                           newDB = False)
+    
+    u_rot, v_rot, w, u0_rot, v0_rot, w0, x_rot, y_rot, z,\
+    buildingCoordinates, cursor, rotated_grid, rotationCenterCoordinates,\
+    verticalWindProfile, dicVectorTables, netcdf_path, netcdf_path_ini = \
+        calculatesWindField(cursor = cursor,
+                            conn = conn,
+                            localH2InstanceDir = localH2InstanceDir,
+                            tmp_dir_unique = caseDir,
+                            outputDataAbs = {i : os.path.join(caseDir, os.path.basename(outputDataAbs[i]))
+                                             for i in outputDataAbs},
+                            stackedBlockTable = stackedBlockTable,
+                            timeStartCalculation = time.time(),
+                            outputFilePath = caseDir,
+                            windDirection = windDirection,
+                            v_ref = v_ref,
+                            dz = dz,
+                            z_out = z_out,
+                            saveRockleZones = False,
+                            saveRaster = False,
+                            saveVector = False,
+                            saveNetcdf = False,
+                            debug = False,
+                            **calculation)
+    
+    levels = [saveData.horizontalLevel(u = u_rot, v = v_rot, w = w, z_i = z_i, dz = dz)
+              for z_i in z_out]
+    rmtree(caseDir, ignore_errors = True)
+    
+    return {"x": x_rot,
+            "y": y_rot,
+            "u": np.array([level[0] for level in levels]),
+            "v": np.array([level[1] for level in levels]),
+            "w": np.array([level[2] for level in levels])}
+
+def interpolateOnGrid(x_rot, y_rot, values, x, y):
+    """ Bilinear interpolation of horizontal wind fields from a (rotated) 
+    URock grid to a regular grid (nan outside of the URock grid).
+    
+		Parameters
+		_ _ _ _ _ _ _ _ _ _ 
+
+            x_rot: np.array (2D - X, Y)
+                X coordinates of the URock grid
+            y_rot: np.array (2D - X, Y)
+                Y coordinates of the URock grid
+            values: np.array (3D - level, X, Y)
+                Values to interpolate
+            x: np.array (1D)
+                X coordinates of the regular grid
+            y: np.array (1D)
+                Y coordinates of the regular grid
+        
+		Returns
+		_ _ _ _ _ _ _ _ _ _ 
+
+            np.array (3D - level, y, x) of the interpolated values"""
+    # The URock grid is regular in its own (rotated) referential: the 
+    # fractional indices of each point of the regular grid are obtained by
+    # inverting the affine relation between indices and coordinates
+    base = np.array([[x_rot[1, 0] - x_rot[0, 0], x_rot[0, 1] - x_rot[0, 0]],
+                     [y_rot[1, 0] - y_rot[0, 0], y_rot[0, 1] - y_rot[0, 0]]])
+    X, Y = np.meshgrid(x, y)
+    indices = np.linalg.solve(base, np.array([X.ravel() - x_rot[0, 0],
+                                              Y.ravel() - y_rot[0, 0]]))
+    
+    return np.array([ndimage.map_coordinates(level, indices, order = 1,
+                                             mode = "constant", cval = np.nan).reshape(X.shape)
+                     for level in values])
+
 @jit(nopython=True)
 def rotateData(theta, nx, ny, nz, x, y, x_rot, y_rot, u, v):
     u_rot = np.zeros(u.shape)
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Multigrid preconditioned conjugate gradient used by the wind solver to solve
+the sparse lambda equation (7-point operator on the cells of the solver).
+
+The grid hierarchy is built geometrically: the cells of the solver are
+aggregated by blocks of 2 x 2 x 2 cells, the prolongation is smoothed by one
+Jacobi step (smoothed aggregation) and the coarse operators are obtained by
+Galerkin products.
+"""
+import numpy as np
+from scipy import sparse
+from scipy.sparse import linalg
+
+# Minimum number of cells of the coarsest grid (solved by a direct method)
+COARSEST_SIZE = 2000
+# Damping factor of the Jacobi smoother and of the prolongation smoothing
+JACOBI_WEIGHT = 2. / 3
+# Number of Jacobi sweeps before and after each coarse grid correction
+SMOOTHING_SWEEPS = 2
+
+
+class CalculationCancelled(Exception):
+    """ Raised within the conjugate gradient iterations when the user
+    cancels the calculation"""
+    pass
+
+
+def multigridHierarchy(matrix, coordinates, coarsestSize = COARSEST_SIZE):
+    """ Build the grid levels used by the multigrid V-cycle.
+
+    		Parameters
+    		_ _ _ _ _ _ _ _ _ _
+
+            matrix: scipy.sparse matrix
+                Symmetric positive definite operator of the finest grid
+            coordinates: 2D array
+                (i, j, k) cell coordinates of each unknown of the finest grid
+            coarsestSize: int, default COARSEST_SIZE
+                Coarsening stops when a grid has fewer unknowns
+
+    		Returns
+    		_ _ _ _ _ _ _ _ _ _
+
+            levels: list of dict
+                For each level: operator "A", inverse diagonal "Dinv" and
+                prolongation "P" to this level from the next coarser one
+                (the coarsest level holds the LU factorization "lu" instead)"""
+    levels = []
+    matrix = sparse.csr_matrix(matrix)
+    coordinates = np.asarray(coordinates)
+    while True:
+        level = {"A": matrix, "Dinv": 1. / matrix.diagonal()}
+        levels.append(level)
+
+        if matrix.shape[0] <= coarsestSize:
+            level["lu"] = linalg.splu(sparse.csc_matrix(matrix))
+            break
+
+        # Aggregate blocks of 2 x 2 x 2 cells
+        coordinates, aggregate = np.unique(coordinates // 2, axis = 0,
+                                           return_inverse = True)
+        aggregate = aggregate.ravel()
+        if coordinates.shape[0] == matrix.shape[0]:
+            level["lu"] = linalg.splu(sparse.csc_matrix(matrix))
+            break
+        tentative = sparse.csr_matrix((np.ones(aggregate.size),
+                                       (np.arange(aggregate.size), aggregate)),
+                                      shape = (aggregate.size, coordinates.shape[0]))
+
+        # Smoothed prolongation and Galerkin coarse operator
+        prolongation = tentative - JACOBI_WEIGHT * sparse.diags(level["Dinv"]) @ (matrix @ tentative)
+        level["P"] = sparse.csr_matrix(prolongation)
+        level["R"] = sparse.csr_matrix(prolongation.T)
+        matrix = sparse.csr_matrix(level["R"] @ matrix @ level["P"])
+
+    return levels
+
+def vCycle(levels, rhs, level = 0):
+    """ Approximate solution of levels[level]["A"] x = rhs by one multigrid
+    V-cycle (symmetric, hence usable as a conjugate gradient preconditioner)"""
+    current = levels[level]
+    if "lu" in current:
+        return current["lu"].solve(rhs)
+
+    A = current["A"]
+    Dinv = current["Dinv"]
+    x = JACOBI_WEIGHT * Dinv * rhs
+    for sweep in range(SMOOTHING_SWEEPS - 1):
+        x += JACOBI_WEIGHT * Dinv * (rhs - A @ x)
+    x += current["P"] @ vCycle(levels, current["R"] @ (rhs - A @ x), level + 1)
+    for sweep in range(SMOOTHING_SWEEPS):
+        x += JACOBI_WEIGHT * Dinv * (rhs - A @ x)
+
+    return x
+
+def solveMultigridCG(matrix, rhs, coordinates, x0 = None, tolerance = 1e-6,
+                     maxIterations = 500, callback = None):
+    """ Solve matrix x = rhs using the conjugate gradient method
+    preconditioned by a multigrid V-cycle.
+
+    		Parameters
+    		_ _ _ _ _ _ _ _ _ _
+
+            matrix: scipy.sparse matrix
+                Symmetric positive definite operator
+            rhs: 1D array
+                Right-hand side
+            coordinates: 2D array
+                (i, j, k) cell coordinates of each unknown
+            x0: 1D array, default None
+                Initial guess
+            tolerance: float, default 1e-6
+                Relative residual norm at which the iterations stop
+            maxIterations: int, default 500
+                Maximum number of conjugate gradient iterations
+            callback: function, default None
+                Called as callback(iteration, x) after each iteration. It
+                may raise CalculationCancelled to stop the iterations.
+
+    		Returns
+    		_ _ _ _ _ _ _ _ _ _
+
+            x: 1D array
+                Solution (or last iterate if the calculation has been cancelled)
+            nIterations: int
+                Number of conjugate gradient iterations"""
+    levels = multigridHierarchy(matrix, coordinates)
+    preconditioner = linalg.LinearOperator(matrix.shape,
+                                           matvec = lambda r: vCycle(levels, r),
+                                           dtype = float)
+    state = {"iteration": 0, "x": x0}
+
+    def cgCallback(x):
+        state["iteration"] += 1
+        state["x"] = x
+        if callback is not None:
+            callback(state["iteration"], x)
+
+    try:
+        try:
+            x, info = linalg.cg(levels[0]["A"], rhs, x0 = x0, rtol = tolerance,
+                                maxiter = maxIterations, M = preconditioner,
+                                callback = cgCallback)
+        except TypeError:
+            # scipy < 1.12 names the relative tolerance 'tol'
+            x, info = linalg.cg(levels[0]["A"], rhs, x0 = x0, tol = tolerance,
+                                maxiter = maxIterations, M = preconditioner,
+                                callback = cgCallback)
+    except CalculationCancelled:
+        x = state["x"] if state["x"] is not None else np.zeros(rhs.size)
+
+    return x, state["iteration"]
@@ -13,16 +13,18 @@ Created on Mon Mar 29 14:57:25 2021
 """
 import numpy as np
 import time
-from .GlobalVariables import MAX_ITERATIONS, THRESHOLD_ITERATIONS, DESCENDING_Y
+from .GlobalVariables import MAX_ITERATIONS, THRESHOLD_ITERATIONS, DESCENDING_Y, \
+    SOLVER_METHOD, SOLVER_RED_BLACK_SOR, SOLVER_MULTIGRID_CG
 try:
     from numba import jit
 except ImportError:
     exit("'numba' Python package is missing")
-import pandas as pd
+from scipy import sparse
+from . import Multigrid
 
 def solver(x, y, z, dx, dy, dz, u0, v0, w0, buildingCoordinates, cells4Solver, cursor,
            maxIterations = MAX_ITERATIONS, thresholdIterations = THRESHOLD_ITERATIONS,
-           feedback = None):
+           feedback = None, solverMethod = SOLVER_METHOD):
     """ Use the mass-balance solver minimizing the modification of the initial
     wind speed field. The method used is based on Pardyjak and Brown (2003).
     
@@ -64,6 +66,9 @@ def solver(x, y, z, dx, dy, dz, u0, v0, w0, buildingCoordinates, cells4Solver, c
                 threshold, the wind solver stops
             feedback: Qgis.core class QgsProcessingFeedback
                 Base class for providing feedback to QGIS from a processing algorithm (if not in standalone mode).
+            solverMethod: str, default SOLVER_METHOD
+                Order of the SOR updates: SOLVER_SOR (cell by cell) or
+                SOLVER_RED_BLACK_SOR (all cells of one color of a checkerboard at once)
         
     		Returns
     		_ _ _ _ _ _ _ _ _ _ 
@@ -139,118 +144,120 @@ def solver(x, y, z, dx, dy, dz, u0, v0, w0, buildingCoordinates, cells4Solver, c
     q = np.ones([nx, ny, nz])
     
     # Identify index having wall below AND (front, left, right or behind)
-    indBelow = pd.MultiIndex.from_tuples(list(zip(*[buildingCoordinates[0], 
-                                                    buildingCoordinates[1], 
-                                                    buildingCoordinates[2] + 1])))
-    indAbove = pd.MultiIndex.from_tuples(list(zip(*[buildingCoordinates[0], 
-                                                    buildingCoordinates[1], 
-                                                    buildingCoordinates[2] - 1])))
-    indFront = pd.MultiIndex.from_tuples(list(zip(*[buildingCoordinates[0], 
-                                                    buildingCoordinates[1] - 1, 
-                                                    buildingCoordinates[2]])))
-    indBehind = pd.MultiIndex.from_tuples(list(zip(*[buildingCoordinates[0], 
-                                                    buildingCoordinates[1] + 1, 
-                                                    buildingCoordinates[2]])))
-    indLeft = pd.MultiIndex.from_tuples(list(zip(*[buildingCoordinates[0] + 1, 
-                                                    buildingCoordinates[1], 
-                                                    buildingCoordinates[2]])))
-    indRight = pd.MultiIndex.from_tuples(list(zip(*[buildingCoordinates[0] - 1, 
-                                                    buildingCoordinates[1], 
-                                                    buildingCoordinates[2]])))
-    indBelowRight = indBelow.intersection(indRight)
-    indBelowLeft = indBelow.intersection(indLeft)
-    indBelowFront = indBelow.intersection(indFront)
-    indBelowBehind = indBelow.intersection(indBehind)
-    
-    indE = indBelowRight.union(indRight)
-    indF = indBelowLeft.union(indLeft)
-    indG = indBelowFront.union(indFront)
-    indH = indBelowBehind.union(indBehind)
+    # (boolean masks of the grid padded by one cell on each side since the
+    # neighbours of building cells located on the grid border are outside)
+    indBelow = neighbourMask(buildingCoordinates, (0, 0, 1), nx, ny, nz)
+    indAbove = neighbourMask(buildingCoordinates, (0, 0, -1), nx, ny, nz)
+    indFront = neighbourMask(buildingCoordinates, (0, -1, 0), nx, ny, nz)
+    indBehind = neighbourMask(buildingCoordinates, (0, 1, 0), nx, ny, nz)
+    indLeft = neighbourMask(buildingCoordinates, (1, 0, 0), nx, ny, nz)
+    indRight = neighbourMask(buildingCoordinates, (-1, 0, 0), nx, ny, nz)
+    indBelowRight = indBelow & indRight
+    indBelowLeft = indBelow & indLeft
+    indBelowFront = indBelow & indFront
+    indBelowBehind = indBelow & indBehind
+    
+    indE = indBelowRight | indRight
+    indF = indBelowLeft | indLeft
+    indG = indBelowFront | indFront
+    indH = indBelowBehind | indBehind
     indM = indAbove
-    indN = indBelow.union(indBelowFront).union(indBelowLeft)\
-        .union(indBelowRight).union(indBelowBehind)
-    indO = indRight.union(indLeft).union(indBelowLeft).union(indBelowRight)
-    indP = indBehind.union(indFront).union(indBelowBehind).union(indBelowFront)
-    indQ = indBelow.union(indAbove).union(indBelowFront).union(indBelowLeft)\
-        .union(indBelowRight).union(indBelowBehind)
+    indN = indBelow | indBelowFront | indBelowLeft | indBelowRight | indBelowBehind
+    indO = indRight | indLeft | indBelowLeft | indBelowRight
+    indP = indBehind | indFront | indBelowBehind | indBelowFront
+    indQ = indBelow | indAbove | indBelowFront | indBelowLeft | indBelowRight | indBelowBehind
     
     # Go descending order along y
     if DESCENDING_Y:
-        e[indF.get_level_values(0), indF.get_level_values(1), indF.get_level_values(2)] = 0.
-        f[indE.get_level_values(0), indE.get_level_values(1), indE.get_level_values(2)] = 0. 
-        g[indH.get_level_values(0), indH.get_level_values(1), indH.get_level_values(2)] = 0.
-        h[indG.get_level_values(0), indG.get_level_values(1), indG.get_level_values(2)] = 0.
-        m[indM.get_level_values(0), indM.get_level_values(1), indM.get_level_values(2)] = 0.
-        n[indN.get_level_values(0), indN.get_level_values(1), indN.get_level_values(2)] = 0.
+        e[maskCoordinates(indF)] = 0.
+        f[maskCoordinates(indE)] = 0. 
+        g[maskCoordinates(indH)] = 0.
+        h[maskCoordinates(indG)] = 0.
+        m[maskCoordinates(indM)] = 0.
+        n[maskCoordinates(indN)] = 0.
     else:    
-        e[indE.get_level_values(0), indE.get_level_values(1), indE.get_level_values(2)] = 0.
-        f[indF.get_level_values(0), indF.get_level_values(1), indF.get_level_values(2)] = 0. 
-        g[indG.get_level_values(0), indG.get_level_values(1), indG.get_level_values(2)] = 0.
-        h[indH.get_level_values(0), indH.get_level_values(1), indH.get_level_values(2)] = 0.
-        m[indM.get_level_values(0), indM.get_level_values(1), indM.get_level_values(2)] = 0.
-        n[indN.get_level_values(0), indN.get_level_values(1), indN.get_level_values(2)] = 0.
-    
-    o[indO.get_level_values(0), indO.get_level_values(1), indO.get_level_values(2)] = 0.5
-    p[indP.get_level_values(0), indP.get_level_values(1), indP.get_level_values(2)] = 0.5
-    q[indQ.get_level_values(0), indQ.get_level_values(1), indQ.get_level_values(2)] = 0.5
+        e[maskCoordinates(indE)] = 0.
+        f[maskCoordinates(indF)] = 0. 
+        g[maskCoordinates(indG)] = 0.
+        h[maskCoordinates(indH)] = 0.
+        m[maskCoordinates(indM)] = 0.
+        n[maskCoordinates(indN)] = 0.
+    
+    o[maskCoordinates(indO)] = 0.5
+    p[maskCoordinates(indP)] = 0.5
+    q[maskCoordinates(indQ)] = 0.5
+    
+    if solverMethod == SOLVER_RED_BLACK_SOR:
+        redBlackCoef = redBlackCoefficients(cells4Solver, omega, alpha1, u0, v0, w0,
+                                            dx, dy, dz, e, f, g, h, m, n, o, p, q,
+                                            DESCENDING_Y, A, B)
         
-    for N in range(maxIterations):
-        print("Iteration {0} (max {1})".format( N + 1, 
-                                                maxIterations))
-        lambdaN = np.copy(lambdaN1)
+    if solverMethod == SOLVER_MULTIGRID_CG:
+        lambdaN1 = solveLambdaMultigridCG(cells4Solver, lambdaN1, alpha1, u0, v0, w0,
+                                          dx, dy, dz, e, f, g, h, m, n, o, p, q,
+                                          DESCENDING_Y, A, B, maxIterations,
+                                          thresholdIterations, feedback)
+    else:
+        for N in range(maxIterations):
+            print("Iteration {0} (max {1})".format( N + 1, 
+                                                    maxIterations))
+            lambdaN = np.copy(lambdaN1)
         
-        # ########################################################################
-        # # Only used for debug
-        # if DESCENDING_Y:
-        #     for k, j, i in np.flip(cells4Solver):
-        #         lambdaN1[i, j, k] = omega * (
-        #             ((-1.) * (dx ** 2 * (-2. * alpha1 ** 2) * (((u0[i, j, k] - u0[i + 1, j, k]) / (dx) + (
-        #                     v0[i, j, k] - v0[i, j + 1, k]) / (dy) +
-        #                                                         (w0[i, j, k] - w0[i, j, k + 1]) / (dz)))) + (
-        #                       e[i, j, k] * lambdaN[i - 1, j, k] + f[i, j, k] * lambdaN1[i + 1, j, k] + A * (
-        #                       g[i, j, k] * lambdaN[i, j - 1, k] + h[i, j, k] * lambdaN1[i, j + 1, k]) + B * (
-        #                               m[i, j, k] * lambdaN[i, j, k - 1] + n[i, j, k] * lambdaN1[i, j, k + 1]))) / (
-        #                     2. * (o[i, j, k] + A * p[i, j, k] + B * q[i, j, k]))) + (1 - omega) * lambdaN1[i, j, k]  
+            # ########################################################################
+            # # Only used for debug
+            # if DESCENDING_Y:
+            #     for k, j, i in np.flip(cells4Solver):
+            #         lambdaN1[i, j, k] = omega * (
+            #             ((-1.) * (dx ** 2 * (-2. * alpha1 ** 2) * (((u0[i, j, k] - u0[i + 1, j, k]) / (dx) + (
+            #                     v0[i, j, k] - v0[i, j + 1, k]) / (dy) +
+            #                                                         (w0[i, j, k] - w0[i, j, k + 1]) / (dz)))) + (
+            #                       e[i, j, k] * lambdaN[i - 1, j, k] + f[i, j, k] * lambdaN1[i + 1, j, k] + A * (
+            #                       g[i, j, k] * lambdaN[i, j - 1, k] + h[i, j, k] * lambdaN1[i, j + 1, k]) + B * (
+            #                               m[i, j, k] * lambdaN[i, j, k - 1] + n[i, j, k] * lambdaN1[i, j, k + 1]))) / (
+            #                     2. * (o[i, j, k] + A * p[i, j, k] + B * q[i, j, k]))) + (1 - omega) * lambdaN1[i, j, k]  
                                           
-        # else:
-        #     for i, j, k in cells4Solver:
-        #         if i == 115 and j == 214:
-        #             print("ok")
-        #         lambdaN1[i, j, k] = omega * (
-        #             ((-1.) * (dx ** 2 * (-2. * alpha1 ** 2) * (((u0[i + 1, j, k] - u0[i, j, k]) / (dx) + (
-        #                     v0[i, j + 1, k] - v0[i, j, k]) / (dy) +
-        #                                                         (w0[i, j, k + 1] - w0[i, j, k]) / (dz)))) + (
-        #                       e[i, j, k] * lambdaN[i + 1, j, k] + f[i, j, k] * lambdaN1[i - 1, j, k] + A * (
-        #                       g[i, j, k] * lambdaN[i, j + 1, k] + h[i, j, k] * lambdaN1[i, j - 1, k]) + B * (
-        #                               m[i, j, k] * lambdaN[i, j, k + 1] + n[i, j, k] * lambdaN1[i, j, k - 1]))) / (
-        #                     2. * (o[i, j, k] + A * p[i, j, k] + B * q[i, j, k]))) + (1 - omega) * lambdaN1[i, j, k]  
-        # # end of debug
-        # ########################################################################
+            # else:
+            #     for i, j, k in cells4Solver:
+            #         if i == 115 and j == 214:
+            #             print("ok")
+            #         lambdaN1[i, j, k] = omega * (
+            #             ((-1.) * (dx ** 2 * (-2. * alpha1 ** 2) * (((u0[i + 1, j, k] - u0[i, j, k]) / (dx) + (
+            #                     v0[i, j + 1, k] - v0[i, j, k]) / (dy) +
+            #                                                         (w0[i, j, k + 1] - w0[i, j, k]) / (dz)))) + (
+            #                       e[i, j, k] * lambdaN[i + 1, j, k] + f[i, j, k] * lambdaN1[i - 1, j, k] + A * (
+            #                       g[i, j, k] * lambdaN[i, j + 1, k] + h[i, j, k] * lambdaN1[i, j - 1, k]) + B * (
+            #                               m[i, j, k] * lambdaN[i, j, k + 1] + n[i, j, k] * lambdaN1[i, j, k - 1]))) / (
+            #                     2. * (o[i, j, k] + A * p[i, j, k] + B * q[i, j, k]))) + (1 - omega) * lambdaN1[i, j, k]  
+            # # end of debug
+            # ########################################################################
                                           
-        lambdaN1 = calcLambda(cells4Solver, lambdaN, lambdaN1, omega, alpha1,
-                              u0, v0, w0, dx, dy, dz, e, f, g, h, m, n, o, p, q,
-                              DESCENDING_Y, A, B)
+            if solverMethod == SOLVER_RED_BLACK_SOR:
+                lambdaN1 = calcLambdaRedBlack(lambdaN1, omega, redBlackCoef)
+            else:
+                lambdaN1 = calcLambda(cells4Solver, lambdaN, lambdaN1, omega, alpha1,
+                                      u0, v0, w0, dx, dy, dz, e, f, g, h, m, n, o, p, q,
+                                      DESCENDING_Y, A, B)
         
-        # Calculate how much lambda evolves between 2 consecutive iterations                                      
-        eps = np.sum(np.abs(lambdaN1 - lambdaN)) / np.sum(np.abs(lambdaN1))
+            # Calculate how much lambda evolves between 2 consecutive iterations                                      
+            eps = np.sum(np.abs(lambdaN1 - lambdaN)) / np.sum(np.abs(lambdaN1))
         
-        # Check if the condition for ending process is reached
-        if eps < thresholdIterations:
-            break
-        else:
-            print("   eps = {0} >= {1}".format(np.round(eps,6),
-                                               thresholdIterations))
-            # Feedback to QGIS every 50 iterations
-            if (N % 50 == 0) & (feedback is not None):
-                textToSend = """Iteration {0} (max {1}) - eps = {2} >= {3}
-                            """.format( N + 1, 
-                                        maxIterations,
-                                        np.round(eps,6),
-                                        thresholdIterations)
-                feedback.setProgressText(textToSend)
-                if feedback.isCanceled():
-                    feedback.setProgressText("Calculation cancelled by user")
-                    break
+            # Check if the condition for ending process is reached
+            if eps < thresholdIterations:
+                break
+            else:
+                print("   eps = {0} >= {1}".format(np.round(eps,6),
+                                                   thresholdIterations))
+                # Feedback to QGIS every 50 iterations
+                if (N % 50 == 0) & (feedback is not None):
+                    textToSend = """Iteration {0} (max {1}) - eps = {2} >= {3}
+                                """.format( N + 1, 
+                                            maxIterations,
+                                            np.round(eps,6),
+                                            thresholdIterations)
+                    feedback.setProgressText(textToSend)
+                    if feedback.isCanceled():
+                        feedback.setProgressText("Calculation cancelled by user")
+                        break
             
     
     # Calculates the final wind speed
@@ -283,6 +290,38 @@ def solver(x, y, z, dx, dy, dz, u0, v0, w0, buildingCoordinates, cells4Solver, c
     
     return u, v, w
 
+def neighbourMask(buildingCoordinates, offset, nx, ny, nz):
+    """ Boolean mask of the cells located at a given offset from building cells.
+    
+    		Parameters
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            buildingCoordinates: 2D array
+                (i, j, k) coordinates of the building cells (3 rows)
+            offset: tuple of int
+                (di, dj, dk) offset of the neighbour cells
+            nx, ny, nz: int
+                Number of cells of the grid along each axis
+    
+    		Returns
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            mask: 3D boolean array
+                Mask of the grid padded by one cell on each side (the cell 
+                (i, j, k) is mask[i + 1, j + 1, k + 1])"""
+    mask = np.zeros((nx + 2, ny + 2, nz + 2), dtype = bool)
+    mask[buildingCoordinates[0] + offset[0] + 1,
+         buildingCoordinates[1] + offset[1] + 1,
+         buildingCoordinates[2] + offset[2] + 1] = True
+    
+    return mask
+
+def maskCoordinates(mask):
+    """ (i, j, k) coordinates of the cells of a padded mask (see neighbourMask),
+    -1 being the cells before the first one of an axis (hence the last one
+    when used as index, as with the coordinates themselves)"""
+    return tuple(coordinates - 1 for coordinates in np.nonzero(mask))
+
 @jit(nopython=True)
 def calcLambda(cells4Solver, lambdaN, lambdaN1, omega, alpha1, u0, v0, w0, dx, dy, dz, e, f, g, h, m, n, o, p, q, DESCENDING_Y, A, B):
     # Go descending order along y
@@ -308,4 +347,197 @@ def calcLambda(cells4Solver, lambdaN, lambdaN1, omega, alpha1, u0, v0, w0, dx, d
                                   m[i, j, k] * lambdaN[i, j, k + 1] + n[i, j, k] * lambdaN1[i, j, k - 1]))) / (
                         2. * (o[i, j, k] + A * p[i, j, k] + B * q[i, j, k]))) + (1 - omega) * lambdaN1[i, j, k]  
                                       
-    return lambdaN1
\ No newline at end of file
+    return lambdaN1
+
+
+def lambdaEquation(alpha1, u0, v0, w0, dx, dy, dz,
+                   e, f, g, h, m, n, o, p, q, DESCENDING_Y, A, B):
+    """ Terms of the lambda equation of calcLambda for the inner cells of the
+    grid (without the sketch boundaries), written as
+        diagonal * lambda - sum(coef * lambda of neighbour) = source
+    
+    		Parameters
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            (parameters are the ones of calcLambda)
+        
+    		Returns
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            source: 3D array
+                Divergence term of the inner cells
+            diagonal: 3D array
+                Coefficient of the cell itself
+            neighbours: list of tuples
+                (coefficient 3D array, (di, dj, dk) offset of the neighbour)"""
+    inner = innerSlices((0, 0, 0))
+    
+    # Go descending order along y
+    if DESCENDING_Y:
+        div = (u0[inner] - u0[innerSlices((1, 0, 0))]) / dx \
+            + (v0[inner] - v0[innerSlices((0, 1, 0))]) / dy \
+            + (w0[inner] - w0[innerSlices((0, 0, 1))]) / dz
+        sign = -1
+    else:
+        div = (u0[innerSlices((1, 0, 0))] - u0[inner]) / dx \
+            + (v0[innerSlices((0, 1, 0))] - v0[inner]) / dy \
+            + (w0[innerSlices((0, 0, 1))] - w0[inner]) / dz
+        sign = 1
+    
+    source = (-1.) * (dx ** 2 * (-2. * alpha1 ** 2) * div)
+    diagonal = 2. * (o[inner] + A * p[inner] + B * q[inner])
+    neighbours = [(e[inner], (sign, 0, 0)), (f[inner], (-sign, 0, 0)),
+                  (A * g[inner], (0, sign, 0)), (A * h[inner], (0, -sign, 0)),
+                  (B * m[inner], (0, 0, sign)), (B * n[inner], (0, 0, -sign))]
+    
+    return source, diagonal, neighbours
+
+def innerSlices(offset):
+    """ Slices of a 3D grid giving, for each inner cell, its neighbour at 
+    offset (di, dj, dk)"""
+    return tuple(slice(1 + d, -1 + d if d < 1 else None) for d in offset)
+
+def redBlackCoefficients(cells4Solver, omega, alpha1, u0, v0, w0, dx, dy, dz,
+                         e, f, g, h, m, n, o, p, q, DESCENDING_Y, A, B):
+    """ Prepare the red-black ordered SOR: the equation of calcLambda is 
+    written for the inner cells of the grid as
+        lambda = source + sum(coef * lambda of neighbour) + (1 - omega) * lambda
+    
+    		Parameters
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            cells4Solver: 1D array
+                Array of 3D cell coordinates for which the wind solver is applied
+            (other parameters are the ones of calcLambda)
+        
+    		Returns
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            source: 3D array
+                Divergence term of the inner cells
+            neighbours: list of tuples
+                (coefficient 3D array, slice of lambda giving the neighbour of the inner cells)
+            colors: list of 2 3D boolean arrays
+                Inner cells to update for each color (red and black)"""
+    nx, ny, nz = u0.shape
+    inner = innerSlices((0, 0, 0))
+    source, diagonal, neighbours = lambdaEquation(alpha1, u0, v0, w0, dx, dy, dz,
+                                                  e, f, g, h, m, n, o, p, q,
+                                                  DESCENDING_Y, A, B)
+    weight = omega / diagonal
+    source = weight * source
+    neighbours = [(weight * coef, innerSlices(offset)) for coef, offset in neighbours]
+    
+    # Cells of the solver on each color of the checkerboard
+    isSolved = np.zeros(u0.shape, dtype=bool)
+    isSolved[cells4Solver[:, 0], cells4Solver[:, 1], cells4Solver[:, 2]] = True
+    i, j, k = np.ogrid[0:nx, 0:ny, 0:nz]
+    isRed = (i + j + k) % 2 == 0
+    colors = [(isSolved & isRed)[inner], (isSolved & ~isRed)[inner]]
+    
+    return source, neighbours, colors
+
+def calcLambdaRedBlack(lambdaN1, omega, redBlackCoef):
+    """ One red-black ordered SOR iteration: all red cells are updated at once
+    from their (black) neighbours, then all black cells from the updated red ones"""
+    source, neighbours, colors = redBlackCoef
+    lambdaInner = lambdaN1[innerSlices((0, 0, 0))]
+    
+    for color in colors:
+        lambdaColor = source + (1 - omega) * lambdaInner
+        for coef, neighbour in neighbours:
+            lambdaColor += coef * lambdaN1[neighbour]
+        np.copyto(lambdaInner, lambdaColor, where = color)
+                                      
+    return lambdaN1
+
+def assembleLambdaMatrix(cells4Solver, lambdaN1, alpha1, u0, v0, w0, dx, dy, dz,
+                         e, f, g, h, m, n, o, p, q, DESCENDING_Y, A, B):
+    """ Sparse 7-point operator of the lambda equation on the cells of the 
+    solver. Lambda of the other cells (sketch boundaries and buildings) is 
+    fixed to its value in lambdaN1 and moved to the right-hand side.
+    
+    		Parameters
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            cells4Solver: 1D array
+                Array of 3D cell coordinates for which the wind solver is applied
+            lambdaN1: 3D array
+                Initial lambda (gives the value of the cells which are not solved)
+            (other parameters are the ones of calcLambda)
+        
+    		Returns
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            matrix: scipy.sparse.csr_matrix
+                Operator (one row per cell of cells4Solver)
+            rhs: 1D array
+                Right-hand side"""
+    nx, ny, nz = u0.shape
+    source, diagonal, neighbours = lambdaEquation(alpha1, u0, v0, w0, dx, dy, dz,
+                                                  e, f, g, h, m, n, o, p, q,
+                                                  DESCENDING_Y, A, B)
+    nCells = cells4Solver.shape[0]
+    cellId = np.full(u0.shape, -1, dtype = np.int64)
+    cellId[cells4Solver[:, 0], cells4Solver[:, 1], cells4Solver[:, 2]] = np.arange(nCells)
+    
+    # Position of the cells in the inner grid
+    i = cells4Solver[:, 0] - 1
+    j = cells4Solver[:, 1] - 1
+    k = cells4Solver[:, 2] - 1
+    rhs = source[i, j, k].copy()
+    rows = [np.arange(nCells)]
+    cols = [np.arange(nCells)]
+    values = [diagonal[i, j, k]]
+    for coef, offset in neighbours:
+        coefCells = coef[i, j, k]
+        iN = cells4Solver[:, 0] + offset[0]
+        jN = cells4Solver[:, 1] + offset[1]
+        kN = cells4Solver[:, 2] + offset[2]
+        idN = cellId[iN, jN, kN]
+        isSolved = (idN >= 0) & (coefCells != 0)
+        rows.append(np.arange(nCells)[isSolved])
+        cols.append(idN[isSolved])
+        values.append(-coefCells[isSolved])
+        rhs += np.where(idN < 0, coefCells * lambdaN1[iN, jN, kN], 0.)
+    
+    matrix = sparse.csr_matrix((np.concatenate(values),
+                                (np.concatenate(rows), np.concatenate(cols))),
+                               shape = (nCells, nCells))
+    
+    return matrix, rhs
+
+def solveLambdaMultigridCG(cells4Solver, lambdaN1, alpha1, u0, v0, w0, dx, dy, dz,
+                           e, f, g, h, m, n, o, p, q, DESCENDING_Y, A, B,
+                           maxIterations, thresholdIterations, feedback):
+    """ Solve the lambda equation of all cells of the solver at once using a
+    conjugate gradient preconditioned by a multigrid V-cycle. The iterations 
+    stop when the relative residual goes under thresholdIterations.
+    
+    		Returns
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            lambdaN1: 3D array
+                lambdaN1 updated on the cells of the solver"""
+    matrix, rhs = assembleLambdaMatrix(cells4Solver, lambdaN1, alpha1, u0, v0, w0,
+                                       dx, dy, dz, e, f, g, h, m, n, o, p, q,
+                                       DESCENDING_Y, A, B)
+    
+    def callback(N, x):
+        print("Iteration {0} (max {1})".format(N, maxIterations))
+        # Feedback to QGIS every 10 iterations
+        if (N % 10 == 0) & (feedback is not None):
+            feedback.setProgressText("Iteration {0} (max {1})".format(N, maxIterations))
+            if feedback.isCanceled():
+                feedback.setProgressText("Calculation cancelled by user")
+                raise Multigrid.CalculationCancelled()
+    
+    x0 = lambdaN1[cells4Solver[:, 0], cells4Solver[:, 1], cells4Solver[:, 2]]
+    x, nIterations = Multigrid.solveMultigridCG(matrix, rhs, cells4Solver, x0 = x0,
+                                                tolerance = thresholdIterations,
+                                                maxIterations = maxIterations,
+                                                callback = callback)
+    lambdaN1[cells4Solver[:, 0], cells4Solver[:, 1], cells4Solver[:, 2]] = x
+    
+    return lambdaN1
+
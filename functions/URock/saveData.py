@@ -16,18 +16,17 @@ import numpy as np
 from .DataUtil import radToDeg, windDirectionFromXY, createIndex, prefix
 from .Obstacles import windRotation
 from osgeo.osr import SpatialReference
-from osgeo.gdal import Grid, GridOptions, FillNodata, Open, GA_Update, GetDriverByName
+from osgeo.gdal import Grid, GridOptions, FillNodata, Open, GA_Update, GetDriverByName, GDT_Float32
 from .GlobalVariables import HORIZ_WIND_DIRECTION, HORIZ_WIND_SPEED, WIND_SPEED,\
     ID_POINT, TEMPO_DIRECTORY, TEMPO_HORIZ_WIND_FILE, VERT_WIND_SPEED, GEOM_FIELD,\
     OUTPUT_DIRECTORY, MESH_SIZE, OUTPUT_FILENAME, DELETE_OUTPUT_IF_EXISTS,\
     OUTPUT_RASTER_EXTENSION, OUTPUT_VECTOR_EXTENSION, OUTPUT_NETCDF_EXTENSION,\
     WIND_GROUP, WINDSPEED_PROFILE, RLON, RLAT, LON, LAT, LEVELS, WINDSPEED_X,\
     WINDSPEED_Y, WINDSPEED_Z, VERT_WIND, Z, OUTPUT_FILENAME, PREFIX_NAME,\
-    BASE_HEIGHT_FIELD, HEIGHT_FIELD
+    BASE_HEIGHT_FIELD, HEIGHT_FIELD, WIND_ROSE_SUFFIX
 from datetime import datetime
 import netCDF4 as nc4
 import os
-import processing
 
 def saveBasicOutputs(cursor, z_out, dz, u, v, w, gridName,
                      verticalWindProfile, outputFilePath, meshSize,
@@ -91,19 +90,7 @@ def saveBasicOutputs(cursor, z_out, dz, u, v, w, gridName,
         # Keep only wind field for a single horizontal plan (and convert carthesian
         # wind speed into polar at least for horizontal)
         tempoTable = "TEMPO_HORIZ"
-        if z_i % dz % (dz / 2) == 0:
-            n_lev = int(z_i / dz) + 1
-            ufin = u[:,:,n_lev]
-            vfin = v[:,:,n_lev]
-            wfin = w[:,:,n_lev]
-        else:
-            n_lev = int((z_i + dz /2) / dz)
-            n_lev1 = n_lev + 1
-            weight1 = (z_i - (n_lev - 0.5) * dz) / dz
-            weight = 1 - weight1
-            ufin = (weight * u[:,:,n_lev] + weight1 * u[:,:,n_lev1])
-            vfin = (weight * v[:,:,n_lev] + weight1 * v[:,:,n_lev1])
-            wfin = (weight * w[:,:,n_lev] + weight1 * w[:,:,n_lev1])
+        ufin, vfin, wfin = horizontalLevel(u = u, v = v, w = w, z_i = z_i, dz = dz)
         df = pd.DataFrame({HORIZ_WIND_SPEED: ((ufin ** 2 + vfin ** 2) ** 0.5).flatten("F"),
                            WIND_SPEED: ((ufin ** 2 + vfin ** 2 + wfin ** 2) ** 0.5).flatten("F"), 
                            HORIZ_WIND_DIRECTION: radToDeg(windDirectionFromXY(ufin, vfin)).flatten("F"), 
@@ -175,6 +162,45 @@ def saveBasicOutputs(cursor, z_out, dz, u, v, w, gridName,
 
     return horizOutputUrock, final_netcdf_path
     
+def horizontalLevel(u, v, w, z_i, dz):
+    """ Extract the wind field at a given height from the 3D wind field
+    (linear interpolation between the two closest levels if z_i is not
+    the center of a cell).
+    
+    Parameters
+    _ _ _ _ _ _ _ _ _ _ 
+        u: np.array (3D)
+            Wind speed along East axis
+        v: np.array (3D)
+            Wind speed along North axis
+        w: np.array (3D)
+            Wind speed along vertical axis
+        z_i: float
+            Height of the horizontal level (m)
+        dz: float
+            Vertical resolution (m)
+    
+    Returns
+    _ _ _ _ _ _ _ _ _ _ 
+        ufin, vfin, wfin: np.array (2D)
+            Wind speed along East, North and vertical axis at z_i
+    """
+    if z_i % dz % (dz / 2) == 0:
+        n_lev = int(z_i / dz) + 1
+        ufin = u[:,:,n_lev]
+        vfin = v[:,:,n_lev]
+        wfin = w[:,:,n_lev]
+    else:
+        n_lev = int((z_i + dz /2) / dz)
+        n_lev1 = n_lev + 1
+        weight1 = (z_i - (n_lev - 0.5) * dz) / dz
+        weight = 1 - weight1
+        ufin = (weight * u[:,:,n_lev] + weight1 * u[:,:,n_lev1])
+        vfin = (weight * v[:,:,n_lev] + weight1 * v[:,:,n_lev1])
+        wfin = (weight * w[:,:,n_lev] + weight1 * w[:,:,n_lev1])
+    
+    return ufin, vfin, wfin
+
 def saveToNetCDF(longitude,
                  latitude,
                  x,
@@ -293,6 +319,90 @@ def saveToNetCDF(longitude,
     
     return path + OUTPUT_NETCDF_EXTENSION
     
+def saveWindRoseToNetCDF(x, y, z_out, directions, v_refs, u, v, w, path,
+                         urock_srid, horizontal_res, vertical_res):
+    """
+    Create a netCDF file where are stacked the horizontal wind fields of
+    several wind cases (wind direction and reference wind speed) calculated
+    on a common grid.
+    
+    Parameters
+    _ _ _ _ _ _ _ _ _ _ 
+        x: np.array (1D)
+            X coordinates (in the URock srid) of the cell centers
+        y: np.array (1D)
+            Y coordinates (in the URock srid) of the cell centers
+        z_out: list of float
+            Heights of the horizontal levels
+        directions: np.array (1D)
+            Wind direction of each case (° clock-wise from North)
+        v_refs: np.array (1D)
+            Reference wind speed of each case
+        u: np.array (4D - case, z, y, x)
+            Wind speed along East axis (nan outside the grid of a case)
+        v: np.array (4D - case, z, y, x)
+            Wind speed along North axis
+        w: np.array (4D - case, z, y, x)
+            Wind speed along vertical axis
+        path: String
+            Path and filename to save NetCDF file
+        urock_srid: int
+            EPSG code initially used for the URock calculations
+    
+    Returns
+    -------
+        String being the path, filename and extension of the netCdf file where
+        are stored the results
+    """
+    f = nc4.Dataset(path + OUTPUT_NETCDF_EXTENSION, 'w', format='NETCDF4')
+    
+    f.createDimension('case', len(directions))
+    f.createDimension('z', len(z_out))
+    f.createDimension('y', len(y))
+    f.createDimension('x', len(x))
+    
+    # Coordinates and description of each case
+    x_var = f.createVariable('x', 'f8', 'x')
+    y_var = f.createVariable('y', 'f8', 'y')
+    z_var = f.createVariable(Z, 'f4', 'z')
+    direction = f.createVariable('direction', 'f4', 'case')
+    v_ref = f.createVariable('v_ref', 'f4', 'case')
+    x_var[:] = x
+    y_var[:] = y
+    z_var[:] = z_out
+    direction[:] = directions
+    v_ref[:] = v_refs
+    
+    # Horizontal and 3D wind speed, wind direction and vertical wind speed
+    horizWindSpeed = (u ** 2 + v ** 2) ** 0.5
+    windFields = {WIND_SPEED: (horizWindSpeed ** 2 + w ** 2) ** 0.5,
+                  HORIZ_WIND_SPEED: horizWindSpeed,
+                  HORIZ_WIND_DIRECTION: radToDeg(windDirectionFromXY(u, v)),
+                  VERT_WIND_SPEED: w}
+    chunks = (1, 1, len(y), len(x))
+    for var in windFields:
+        ncVar = f.createVariable(var, 'f4', ('case', 'z', 'y', 'x'), zlib = True,
+                                 chunksizes = chunks, fill_value = np.nan)
+        ncVar[:] = windFields[var]
+        ncVar.units = 'degree clock-wise from North' if var == HORIZ_WIND_DIRECTION\
+            else 'meter per second'
+    
+    # ADD METADATA
+    x_var.units = 'meters'
+    y_var.units = 'meters'
+    z_var.units = 'meters'
+    direction.units = 'degree clock-wise from North'
+    v_ref.units = 'meter per second'
+    f.description = "URock dataset containing the horizontal wind fields of several wind cases (wind rose)"
+    f.history = "Created " + datetime.today().strftime("%y-%m-%d")
+    f.urock_srid = urock_srid
+    f.horizontal_res = horizontal_res
+    f.vertical_res = vertical_res
+    
+    f.close()
+    
+    return path + OUTPUT_NETCDF_EXTENSION
+
 def saveTable(cursor, tableName, filedir, delete = False, 
               rotationCenterCoordinates = None, rotateAngle = None):
     """ Save a table in .geojson or .shp (the table can be rotated before saving if needed).
@@ -381,6 +491,92 @@ def renameFileIfExists(filedir, extension):
     return newFileDir
 
 
+def saveWindRoseRasters(x, y, z_out, directions, v_refs, u, v, w, outputFilePath,
+                        outputFilename, prefix_name, urock_srid, xres, yres):
+    """
+    Save the horizontal wind fields of several wind cases (calculated on a
+    common grid) into raster files: for each horizontal level, a raster
+    per wind speed variable with one band per case.
+    
+    Parameters
+    _ _ _ _ _ _ _ _ _ _ 
+        x: np.array (1D)
+            X coordinates (in the URock srid) of the cell centers
+        y: np.array (1D)
+            Y coordinates (in the URock srid) of the cell centers (decreasing)
+        z_out: list of float
+            Heights of the horizontal levels
+        directions: np.array (1D)
+            Wind direction of each case (° clock-wise from North)
+        v_refs: np.array (1D)
+            Reference wind speed of each case
+        u: np.array (4D - case, z, y, x)
+            Wind speed along East axis (nan outside the grid of a case)
+        v: np.array (4D - case, z, y, x)
+            Wind speed along North axis
+        w: np.array (4D - case, z, y, x)
+            Wind speed along vertical axis
+        outputFilePath: String
+            Directory where are created the directories of each level
+        outputFilename: String
+            Base name of the output files
+        prefix_name: String
+            Prefix added to the output file names
+        urock_srid: int
+            EPSG code used for the URock calculations
+        xres: float
+            Resolution of the grid along the X axis
+        yres: float
+            Resolution of the grid along the Y axis
+    
+    Returns
+    -------
+        rasterPaths: dictionary
+            Path, filename and extension of the raster file of each wind 
+            speed variable (values) for each level (keys)
+    """
+    horizWindSpeed = (u ** 2 + v ** 2) ** 0.5
+    windFields = {WIND_SPEED: (horizWindSpeed ** 2 + w ** 2) ** 0.5,
+                  HORIZ_WIND_SPEED: horizWindSpeed,
+                  VERT_WIND_SPEED: w}
+    
+    srs = SpatialReference()
+    srs.ImportFromEPSG(int(urock_srid))
+    driver = GetDriverByName("GTiff")
+    
+    rasterPaths = {}
+    for k, z_i in enumerate(z_out):
+        outputDir_zi = os.path.join(outputFilePath, 
+                                    "z" + str(z_i).replace(".","_"))
+        if not os.path.exists(outputDir_zi):
+            os.mkdir(outputDir_zi)
+        rasterPaths[z_i] = {}
+        for var in windFields:
+            outputFilePathAndNameBaseRaster = os.path.join(outputDir_zi,
+                                                           prefix(outputFilename, prefix_name)\
+                                                           + WIND_ROSE_SUFFIX + var)
+            if (os.path.isfile(outputFilePathAndNameBaseRaster + OUTPUT_RASTER_EXTENSION)) \
+                and (not DELETE_OUTPUT_IF_EXISTS):
+                outputFilePathAndNameBaseRaster = renameFileIfExists(filedir = outputFilePathAndNameBaseRaster,
+                                                                     extension = OUTPUT_RASTER_EXTENSION)
+            output_ds = driver.Create(outputFilePathAndNameBaseRaster + OUTPUT_RASTER_EXTENSION,
+                                      len(x), len(y), len(directions), GDT_Float32)
+            output_ds.SetGeoTransform((x[0] - float(xres) / 2, xres, 0,
+                                       y[0] + float(yres) / 2, 0, -yres))
+            output_ds.SetProjection(srs.ExportToWkt())
+            # One band per case, described by its "direction:speed"
+            for i in range(len(directions)):
+                band = output_ds.GetRasterBand(i + 1)
+                band.SetNoDataValue(np.nan)
+                band.SetDescription("{0:g}:{1:g}".format(directions[i], v_refs[i]))
+                band.WriteArray(windFields[var][i, k])
+            
+            # Release the dataset
+            output_ds = output_ds.FlushCache()
+            rasterPaths[z_i][var] = outputFilePathAndNameBaseRaster + OUTPUT_RASTER_EXTENSION
+    
+    return rasterPaths
+
 def saveRasterFile(cursor, outputVectorFile, outputFilePathAndNameBase, 
                    horizOutputUrock, outputRaster, z_i, meshSize, var2save,
                    stacked_blocks, srid, tmp_dir):
@@ -553,6 +749,10 @@ def interp_vec_to_rast(outputVectorFile, stacked_blocks, outputFilePathAndNameBa
     #                     count=1, dtype=grid_values.dtype, crs=gdf.crs, transform=transform) as dst:
     #     dst.write(grid_values, 1)
     
+    # QGIS processing is only imported here since the module is also used
+    # by worker processes running outside of QGIS
+    import processing
+    
     # Change the order of the points to make the TIN interpolation faster and working for all conditions
     order_changed = processing.run("native:orderbyexpression", 
                                    {'INPUT':outputVectorFile,
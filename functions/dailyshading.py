@@ -4,12 +4,17 @@ from builtins import range
 from ..util import shadowingfunctions as shadow
 from ..util.SEBESOLWEIGCommonFiles.shadowingfunction_wallheight_13 import shadowingfunction_wallheight_13
 from ..util.SEBESOLWEIGCommonFiles.shadowingfunction_wallheight_23 import shadowingfunction_wallheight_23
-from ..util.misc import saveraster
+from ..util.SEBESOLWEIGCommonFiles.shadow_cache import ShadowCache
+from ..util.misc import saveraster, createraster
 from ..util.SEBESOLWEIGCommonFiles import sun_position as sp
+from ..util.SEBESOLWEIGCommonFiles.Solweig_v2015_metdata_noload import sun_position_time
 import numpy as np
 
 
-def dailyshading(dsm, vegdsm, vegdsm2, scale, lon, lat, sizex, sizey, tv, UTC, usevegdem, timeInterval, onetime, feedback, folder, gdal_data, trans, dst, wallshadow, wheight, waspect):
+def dailyshading(dsm, vegdsm, vegdsm2, scale, lon, lat, sizex, sizey, tv, UTC, usevegdem, timeInterval, onetime, feedback, folder, gdal_data, trans, dst, wallshadow, wheight, waspect, shadowcache=None):
+
+    if shadowcache is None:
+        shadowcache = ShadowCache(None)
 
     # lon = lonlat[0]
     # lat = lonlat[1]
@@ -108,14 +113,14 @@ def dailyshading(dsm, vegdsm, vegdsm2, scale, lon, lat, sizex, sizey, tv, UTC, u
         if alt[i] > 0:
             if wallshadow == 1: # Include wall shadows (Issue #121)
                 if usevegdem == 1:
-                    vegsh, sh, _, wallsh, _, wallshve, _, _ = shadowingfunction_wallheight_23(dsm, vegdem, vegdem2,
+                    vegsh, sh, _, wallsh, _, wallshve, _, _ = shadowcache.shadowingfunction_wallheight_23(dsm, vegdem, vegdem2,
                                                 azi[i], alt[i], scale, amaxvalue, bush, walls, dirwalls * np.pi / 180.)
                     sh = sh - (1 - vegsh) * (1 - psi)
                     if onetime == 0:
                         filenamewallshve = folder + '/Facadeshadow_fromvegetation_' + timestr + '_LST.tif'
                         saveraster(gdal_data, filenamewallshve, wallshve)
                 else:
-                    sh, wallsh, _, _, _ = shadowingfunction_wallheight_13(dsm, azi[i], alt[i], scale,
+                    sh, wallsh, _, _, _ = shadowcache.shadowingfunction_wallheight_13(dsm, azi[i], alt[i], scale,
                                                                                         walls, dirwalls * np.pi / 180.)
                     # shtot = shtot + sh
                 
@@ -128,10 +133,10 @@ def dailyshading(dsm, vegdsm, vegdsm2, scale, lon, lat, sizex, sizey, tv, UTC, u
 
             else:
                 if usevegdem == 0:
-                    sh = shadow.shadowingfunctionglobalradiation(dsm, azi[i], alt[i], scale, feedback, 0)
+                    sh = shadowcache.shadowingfunctionglobalradiation(dsm, azi[i], alt[i], scale, feedback, 0)
                     # shtot = shtot + sh
                 else:
-                    shadowresult = shadow.shadowingfunction_20(dsm, vegdem, vegdem2, azi[i], alt[i], scale, amaxvalue,
+                    shadowresult = shadowcache.shadowingfunction_20(dsm, vegdem, vegdem2, azi[i], alt[i], scale, amaxvalue,
                                                             bush, feedback, 0)
                     vegsh = shadowresult["vegsh"]
                     sh = shadowresult["sh"]
@@ -159,6 +164,143 @@ def dailyshading(dsm, vegdsm, vegdsm2, scale, lon, lat, sizex, sizey, tv, UTC, u
 
     return shadowresult
 
+def daterangeshading(dsm, vegdsm, vegdsm2, scale, lon, lat, sizex, sizey, startdate, enddate, UTC, usevegdem,
+                     timeInterval, feedback, folder, gdal_data, trans, dst, wallshadow, wheight, waspect,
+                     tolerance=0., savesteps=False, shadowcache=None):
+    """
+    Shadows for every timeInterval (minutes) of all days from startdate to enddate (datetime.date, inclusive).
+
+    The sun positions of all time steps are calculated at once and night steps are skipped. Sun positions that
+    are rounded to the same multiple of tolerance (degrees) share one shadow, cast at the rounded position
+    (0 casts a shadow for each distinct sun position). Shade hours (hours in shadow, vegetation shadows
+    weighted by the transmissivity) are saved in the folder, and with savesteps the shadows of all daytime
+    steps are saved as bands of one raster (and the facade shadows in two more rasters with wallshadow).
+    """
+
+    if shadowcache is None:
+        shadowcache = ShadowCache(None)
+
+    alt = np.median(dsm)
+    location = {'longitude': lon, 'latitude': lat, 'altitude': alt}
+    psi = trans
+    vegdem = vegdem2 = amaxvalue = bush = None
+    if usevegdem == 1:
+        # amaxvalue
+        vegmax = vegdsm.max()
+        amaxvalue = dsm.max() - dsm.min()
+        amaxvalue = np.maximum(amaxvalue, vegmax)
+
+        # Elevation vegdsms if buildingDSM includes ground heights
+        vegdem = vegdsm + dsm
+        vegdem[vegdem == dsm] = 0
+        vegdem2 = vegdsm2 + dsm
+        vegdem2[vegdem2 == dsm] = 0
+
+        # Bush separation
+        bush = np.logical_not((vegdem2*vegdem))*vegdem
+
+    if wallshadow == 1:
+        walls = wheight
+        dirwalls = waspect
+    else:
+        walls = np.zeros((sizex, sizey))
+        dirwalls = np.zeros((sizex, sizey))
+
+    # Time steps in local standard time (as dailyshading) of all days
+    itera = int(1440 / timeInterval)
+    days = (enddate - startdate).days + 1
+    steps = [dt.datetime(startdate.year, startdate.month, startdate.day) + dt.timedelta(days=d, hours=-dst,
+             minutes=int(timeInterval * i)) for d in range(days) for i in range(itera)]
+
+    sun = sp.sun_position(sun_position_time(steps, UTC), location)
+    altitude = 90. - np.asarray(sun['zenith'])
+    azimuth = np.asarray(sun['azimuth'])
+
+    # Daytime steps and the sun positions shared within the tolerance
+    daytime = np.nonzero(altitude > 0)[0]
+    if tolerance > 0:
+        positions = np.round(np.stack((azimuth[daytime], altitude[daytime]), axis=1) / tolerance)
+    else:
+        positions = np.stack((azimuth[daytime], altitude[daytime]), axis=1)
+    positions, shared = np.unique(positions, axis=0, return_inverse=True)
+    shared = shared.ravel()
+    if tolerance > 0:
+        positions = positions * tolerance
+    feedback.setProgressText(str(len(steps)) + ' time steps, ' + str(daytime.shape[0]) + ' in daytime, ' +
+                             str(positions.shape[0]) + ' shadows cast')
+
+    period = startdate.strftime("%Y%m%d") + '_' + enddate.strftime("%Y%m%d")
+    if savesteps and daytime.shape[0] > 0:
+        stepnames = [steps[i].strftime("%Y%m%d_%H%M") for i in daytime]
+        stacks = [createraster(gdal_data, folder + '/Shadow_steps_' + period + '_LST.tif', daytime.shape[0])]
+        if wallshadow == 1:
+            stacks.append(createraster(gdal_data, folder + '/Facadeshadow_frombuilding_steps_' + period + '_LST.tif',
+                                       daytime.shape[0]))
+            if usevegdem == 1:
+                stacks.append(createraster(gdal_data, folder + '/Facadeshadow_fromvegetation_steps_' + period +
+                                           '_LST.tif', daytime.shape[0]))
+        for stack in stacks:
+            for band, stepname in enumerate(stepnames):
+                stack.GetRasterBand(band + 1).SetDescription(stepname)
+    else:
+        stacks = []
+
+    shtot = np.zeros((sizex, sizey))
+    shadehours = np.zeros((sizex, sizey))
+    for position in range(positions.shape[0]):
+        if feedback.isCanceled():
+            feedback.setProgressText("Calculation cancelled")
+            break
+        feedback.setProgress(int(position * 100. / positions.shape[0]))
+
+        shadows = cast_shadow(shadowcache, dsm, vegdem, vegdem2, positions[position, 0], positions[position, 1],
+                              scale, amaxvalue, bush, psi, usevegdem, wallshadow, walls, dirwalls, feedback)
+        members = np.nonzero(shared == position)[0]
+        shtot = shtot + shadows[0] * members.shape[0]
+        shadehours = shadehours + (1 - shadows[0]) * (members.shape[0] * timeInterval / 60.)
+        for stack, grid in zip(stacks, shadows):
+            for band in members:
+                stack.GetRasterBand(int(band) + 1).WriteArray(grid, 0, 0)
+
+    for stack in stacks:
+        stack.FlushCache()
+    stacks = None
+
+    saveraster(gdal_data, folder + '/Shadehours_' + period + '_LST.tif', shadehours)
+
+    shfinal = shtot / max(daytime.shape[0], 1)
+
+    shadowresult = {'shfinal': shfinal, 'shadehours': shadehours, 'time_vector': steps[-1]}
+
+    return shadowresult
+
+
+def cast_shadow(shadowcache, dsm, vegdem, vegdem2, azimuth, altitude, scale, amaxvalue, bush, psi, usevegdem,
+                wallshadow, walls, dirwalls, feedback):
+    # Ground shadow (1 sunlit, 0 shadow, vegetation shadows weighted by the transmissivity psi) as in dailyshading,
+    # followed by the facade shadows from buildings and vegetation with wallshadow
+    if wallshadow == 1:  # Include wall shadows (Issue #121)
+        if usevegdem == 1:
+            vegsh, sh, _, wallsh, _, wallshve, _, _ = shadowcache.shadowingfunction_wallheight_23(dsm, vegdem, vegdem2,
+                                        azimuth, altitude, scale, amaxvalue, bush, walls, dirwalls * np.pi / 180.)
+            sh = sh - (1 - vegsh) * (1 - psi)
+            return sh, wallsh, wallshve
+        else:
+            sh, wallsh, _, _, _ = shadowcache.shadowingfunction_wallheight_13(dsm, azimuth, altitude, scale,
+                                                                                walls, dirwalls * np.pi / 180.)
+            return sh, wallsh
+    else:
+        if usevegdem == 0:
+            sh = shadowcache.shadowingfunctionglobalradiation(dsm, azimuth, altitude, scale, feedback, 0)
+        else:
+            shadowresult = shadowcache.shadowingfunction_20(dsm, vegdem, vegdem2, azimuth, altitude, scale, amaxvalue,
+                                                            bush, feedback, 0)
+            vegsh = shadowresult["vegsh"]
+            sh = shadowresult["sh"]
+            sh = sh - (1-vegsh)*(1-psi)
+        return sh,
+
+
 def day_of_year(yy, month, day):
     if (yy % 4) == 0:
         if (yy % 100) == 0:
@@ -1,13 +1,19 @@
 import numpy as np
+import os
+import zipfile
 from ..util import shadowingfunctions as shadow
 from ..util.SEBESOLWEIGCommonFiles.create_patches import create_patches
+from ..util.SEBESOLWEIGCommonFiles.shadowmatrices import pack_shadowmatrix
 # from ..functions.wallalgorithms import findwalls
 from ..functions import wallalgorithms as wa
 from ..functions import svf_for_voxels as svfv
 from ..util.SEBESOLWEIGCommonFiles import shadowingfunction_wallheight_13 as shb
 from ..util.SEBESOLWEIGCommonFiles import shadowingfunction_wallheight_23 as shbv
+from ..util import parallel
+from concurrent.futures import ProcessPoolExecutor
 # remove
 from ..util.misc import saveraster
+from ..util import misc
 from osgeo import gdal, osr
 from osgeo.gdalconst import *
 
@@ -50,7 +56,108 @@ def svf_angles_100121():
     return angleresult
 
 
-def svfForProcessing153(dsm, vegdem, vegdem2, scale, usevegdem, pixel_resolution, wallScheme, demlayer, feedback):
+# Worker state for parallel SVF, set by _svf_worker_init in each worker process
+_svf_worker = {}
+
+
+def _svf_worker_init(dsm_spec, vegdem_spec, vegdem2_spec, bush_spec, out_spec, scale, amaxvalue):
+    blocks = []
+    grids = []
+    for spec in (dsm_spec, vegdem_spec, vegdem2_spec, bush_spec, out_spec):
+        if spec is None:
+            grids.append(None)
+        else:
+            shm, grid = parallel.attach_array(spec)
+            blocks.append(shm)
+            grids.append(grid)
+    _svf_worker['blocks'] = blocks
+    _svf_worker['dsm'], _svf_worker['vegdem'], _svf_worker['vegdem2'], _svf_worker['bush'], _svf_worker['out'] = grids
+    _svf_worker['scale'] = scale
+    _svf_worker['amaxvalue'] = amaxvalue
+
+
+def _svf_worker_task(half, slots, azimuths, altitudes):
+    # Casts shadows for a group of directions and writes them into the shared output slots (shadows are 0 or 1)
+    out = _svf_worker['out'][half]
+    if _svf_worker['vegdem'] is not None:
+        shadows = shadow.shadowingfunction_20_batch(_svf_worker['dsm'], _svf_worker['vegdem'], _svf_worker['vegdem2'],
+                                                    azimuths, altitudes, _svf_worker['scale'], _svf_worker['amaxvalue'],
+                                                    _svf_worker['bush'])
+        for index, shadowresult in shadows:
+            out[0, slots[index]] = shadowresult['sh']
+            out[1, slots[index]] = shadowresult['vegsh']
+            out[2, slots[index]] = shadowresult['vbshvegsh']
+    else:
+        shadows = shadow.shadowingfunctionglobalradiation_batch(_svf_worker['dsm'], azimuths, altitudes, _svf_worker['scale'],
+                                                                amaxvalue=_svf_worker['amaxvalue'])
+        for index, sh in shadows:
+            out[0, slots[index]] = sh
+
+
+def svf_shadows_parallel(dsm, vegdem, vegdem2, azimuths, altitudes, scale, amaxvalue, bush, usevegdem, workers,
+                         shmat=None, vegshmat=None, vbshvegshmat=None):
+    """
+    Process-pool version of the batched shadow engines used for SVF.
+
+    DSM/CDSM/TDSM are shared with the workers through shared memory. Directions are
+    cast in rounds of a few per worker (see parallel.rounds) and yielded in direction
+    order, in the same form as shadowingfunction_20_batch (usevegdem == 1) or
+    shadowingfunctionglobalradiation_batch, so the svf sums are reduced in the same
+    order as in a serial run and results are bit-identical. The shadows are passed
+    back as uint8.
+    """
+    rows = dsm.shape[0]
+    cols = dsm.shape[1]
+    ndirections = len(azimuths)
+    nlayers = 3 if usevegdem == 1 else 1
+    roundsize = parallel.round_size(workers, ndirections, nlayers * rows * cols, perworker=4)
+
+    blocks = []
+    shm, _, dsm_spec = parallel.share_array(dsm)
+    blocks.append(shm)
+    if usevegdem == 1:
+        specs = []
+        for grid in (vegdem, vegdem2, bush):
+            shm, _, spec = parallel.share_array(grid)
+            blocks.append(shm)
+            specs.append(spec)
+        vegdem_spec, vegdem2_spec, bush_spec = specs
+    else:
+        vegdem_spec, vegdem2_spec, bush_spec = None, None, None
+    shm, out, out_spec = parallel.empty_shared_array((2, nlayers, roundsize, rows, cols), np.uint8)
+    blocks.append(shm)
+
+    sh = np.zeros((rows, cols))
+    vegsh = np.zeros((rows, cols))
+    vbshvegsh = np.zeros((rows, cols))
+    shadowresult = {'sh': sh, 'vegsh': vegsh, 'vbshvegsh': vbshvegsh}
+
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=parallel.process_context(), initializer=_svf_worker_init,
+                               initargs=(dsm_spec, vegdem_spec, vegdem2_spec, bush_spec, out_spec, scale, amaxvalue))
+    try:
+        for half, start, stop in parallel.rounds(pool, _svf_worker_task, ndirections, roundsize, workers, azimuths,
+                                                 altitudes):
+            for index in range(start, stop):
+                sh[:, :] = out[half, 0, index - start]
+                if shmat is not None:
+                    shmat[:, :, index] = sh
+                if usevegdem == 1:
+                    vegsh[:, :] = out[half, 1, index - start]
+                    vbshvegsh[:, :] = out[half, 2, index - start]
+                    if vegshmat is not None:
+                        vegshmat[:, :, index] = vegsh
+                    if vbshvegshmat is not None:
+                        vbshvegshmat[:, :, index] = vbshvegsh
+                    yield index, shadowresult
+                else:
+                    yield index, sh
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+        del out
+        parallel.release_shared(blocks)
+
+
+def svfForProcessing153(dsm, vegdem, vegdem2, scale, usevegdem, pixel_resolution, wallScheme, demlayer, feedback, workers=1, amaxvalue=None):
     rows = dsm.shape[0]
     cols = dsm.shape[1]
     svf = np.zeros([rows, cols])
@@ -69,10 +176,11 @@ def svfForProcessing153(dsm, vegdem, vegdem2, scale, usevegdem, pixel_resolution
     svfWaveg = np.zeros((rows, cols))
     svfNaveg = np.zeros((rows, cols))
 
-    # % amaxvalue
-    vegmax = vegdem.max()
-    amaxvalue = dsm.max()
-    amaxvalue = np.maximum(amaxvalue, vegmax)
+    # % amaxvalue (given when dsm is a tile of a larger grid, see svfForProcessingTiled)
+    if amaxvalue is None:
+        vegmax = vegdem.max()
+        amaxvalue = dsm.max()
+        amaxvalue = np.maximum(amaxvalue, vegmax)
 
     # % Elevation vegdems if buildingDSM inclused ground heights
     vegdem = vegdem + dsm
@@ -123,6 +231,19 @@ def svfForProcessing153(dsm, vegdem, vegdem2, scale, usevegdem, pixel_resolution
                 iazimuth[index] = iazimuth[index] - 360.
             index = index + 1
     aziintervalaniso = np.ceil(aziinterval / 2.0)
+
+    # Shadows for all patches are cast by the batched engine, sharing march schedules and buffers
+    if not wallScheme:
+        patch_altitudes = np.repeat(skyvaultaltint, aziinterval)
+        if workers > 1:
+            shadows = svf_shadows_parallel(dsm, vegdem, vegdem2, iazimuth, patch_altitudes, scale, amaxvalue, bush,
+                                           usevegdem, workers, shmat, vegshmat, vbshvegshmat)
+        elif usevegdem == 1:
+            shadows = shadow.shadowingfunction_20_batch(dsm, vegdem, vegdem2, iazimuth, patch_altitudes, scale,
+                                                        amaxvalue, bush, shmat, vegshmat, vbshvegshmat)
+        else:
+            shadows = shadow.shadowingfunctionglobalradiation_batch(dsm, iazimuth, patch_altitudes, scale, shmat, amaxvalue)
+
     index = int(0)
     for i in range(0, skyvaultaltint.shape[0]):
         for j in np.arange(0, (aziinterval[int(i)])):
@@ -144,20 +265,18 @@ def svfForProcessing153(dsm, vegdem, vegdem2, scale, usevegdem, pixel_resolution
                     vbshvegsh = np.ones((sh.shape[0], sh.shape[1])).astype(float)
                     vegshmat[:, :, index] = vegsh
                     vbshvegshmat[:, :, index] = vbshvegsh
+                shmat[:, :, index] = sh
             else:
+                # Stacks are filled by the batched engine
                 if usevegdem == 1:
-                    shadowresult = shadow.shadowingfunction_20(dsm, vegdem, vegdem2, azimuth, altitude,
-                                                            scale, amaxvalue, bush, feedback, 1)
+                    shadowresult = next(shadows)[1]
                     vegsh = shadowresult["vegsh"]
                     vbshvegsh = shadowresult["vbshvegsh"]
-                    vegshmat[:, :, index] = vegsh
-                    vbshvegshmat[:, :, index] = vbshvegsh
                     sh = shadowresult["sh"]
                 else:
-                    sh = shadow.shadowingfunctionglobalradiation(dsm, azimuth, altitude, scale, feedback, 1)
+                    sh = next(shadows)[1]
+
 
-            shmat[:, :, index] = sh
-            
             # Wall temperature scheme, i.e. finding out which voxel is seen from each pixel, where direction is patch azimuth and altitude
             if wallScheme:
                 all_buildIDSeen[:,:, index], all_voxelHeight[:,:, index], all_voxelId[:,:, index] = shadow.shadowingfunction_findwallID(dsm, azimuth, altitude, scale, walls, uniqueWallIDs, demlayer, wall2d_id, voxel_height, voxelId_list, facesh, wall_dict, sh)
@@ -199,6 +318,9 @@ def svfForProcessing153(dsm, vegdem, vegdem2, scale, usevegdem, pixel_resolution
             index += 1
             feedback.setProgress(int(index * (100. / np.sum(aziinterval))))
 
+    if not wallScheme:
+        shadows.close()  # shuts down the process pool of a parallel run, also after cancelling
+
     svfS = svfS + 3.0459e-004
     svfW = svfW + 3.0459e-004
     # % Last azimuth is 90. Hence, manual add of last annuli for svfS and SVFW
@@ -239,7 +361,7 @@ def svfForProcessing153(dsm, vegdem, vegdem2, scale, usevegdem, pixel_resolution
     return svfresult
 
 
-def svfForProcessing655(dsm, vegdem, vegdem2, scale, usevegdem, feedback):
+def svfForProcessing655(dsm, vegdem, vegdem2, scale, usevegdem, feedback, workers=1, amaxvalue=None):
     rows = dsm.shape[0]
     cols = dsm.shape[1]
     svf = np.zeros([rows, cols])
@@ -258,10 +380,11 @@ def svfForProcessing655(dsm, vegdem, vegdem2, scale, usevegdem, feedback):
     svfWaveg = np.zeros((rows, cols))
     svfNaveg = np.zeros((rows, cols))
 
-    # % amaxvalue
-    vegmax = vegdem.max()
-    amaxvalue = dsm.max()
-    amaxvalue = np.maximum(amaxvalue, vegmax)
+    # % amaxvalue (given when dsm is a tile of a larger grid, see svfForProcessingTiled)
+    if amaxvalue is None:
+        vegmax = vegdem.max()
+        amaxvalue = dsm.max()
+        amaxvalue = np.maximum(amaxvalue, vegmax)
 
     # % Elevation vegdems if buildingDSM inclused ground heights
     vegdem = vegdem + dsm
@@ -283,6 +406,20 @@ def svfForProcessing655(dsm, vegdem, vegdem2, scale, usevegdem, feedback):
     aziinterval = angleresult["aziinterval"]
     iazimuth = angleresult["iazimuth"]
     aziintervalaniso = np.ceil((aziinterval/2.))
+
+    # Shadows for all directions are cast by the batched engine, sharing march schedules and buffers
+    ndirections = int(np.sum(aziinterval[:-1]))
+    altitudes = np.repeat(iangle[:-1], aziinterval[:-1].astype(int))
+    if workers > 1:
+        shadows = svf_shadows_parallel(dsm, vegdem, vegdem2, iazimuth[:ndirections], altitudes, scale, amaxvalue, bush,
+                                       usevegdem, workers)
+    elif usevegdem == 1:
+        shadows = shadow.shadowingfunction_20_batch(dsm, vegdem, vegdem2, iazimuth[:ndirections], altitudes, scale,
+                                                    amaxvalue, bush)
+    else:
+        shadows = shadow.shadowingfunctionglobalradiation_batch(dsm, iazimuth[:ndirections], altitudes, scale,
+                                                                amaxvalue=amaxvalue)
+
     index = 1.
 
     for i in np.arange(0, iangle.shape[0]-1):
@@ -295,13 +432,12 @@ def svfForProcessing655(dsm, vegdem, vegdem2, scale, usevegdem, feedback):
 
             # Casting shadow
             if usevegdem == 1:
-                shadowresult = shadow.shadowingfunction_20(dsm, vegdem, vegdem2, azimuth, altitude,
-                                                            scale, amaxvalue, bush, feedback, 1)
+                shadowresult = next(shadows)[1]
                 vegsh = shadowresult["vegsh"]
                 vbshvegsh = shadowresult["vbshvegsh"]
                 sh = shadowresult["sh"]
             else:
-                sh = shadow.shadowingfunctionglobalradiation(dsm, azimuth, altitude, scale, feedback, 1)
+                sh = next(shadows)[1]
 
             # Calculate svfs
             for k in np.arange(annulino[int(i)]+1, (annulino[int(i+1.)])+1):
@@ -340,6 +476,8 @@ def svfForProcessing655(dsm, vegdem, vegdem2, scale, usevegdem, feedback):
             index += 1
             feedback.setProgress(int(index * (100. / 655.)))
 
+    shadows.close()  # shuts down the process pool of a parallel run, also after cancelling
+
     svfS = svfS + 3.0459e-004
     svfW = svfW + 3.0459e-004
     # % Last azimuth is 90. Hence, manual add of last annuli for svfS and SVFW
@@ -375,3 +513,126 @@ def svfForProcessing655(dsm, vegdem, vegdem2, scale, usevegdem, feedback):
                     'svfWaveg': svfWaveg, 'svfNaveg': svfNaveg}
 
     return svfresult
+
+
+def svf_min_altitude(aniso):
+    # Lowest sky direction used by svfForProcessing153 (aniso) or svfForProcessing655
+    if aniso:
+        skyvaultaltint = create_patches(2)[3]
+        return float(skyvaultaltint.min())
+    else:
+        step = 89. / 19.
+        return step / 2.
+
+
+def svf_tile_halo(heightrange, scale, min_altitude):
+    # Longest shadow (in pixels) that can be cast at the lowest altitude, plus the extra step
+    # taken by the shadow march. Pixels further away than this never shade a tile pixel.
+    return int(np.ceil(heightrange * scale / np.tan(min_altitude * np.pi / 180.))) + 1
+
+
+def svfForProcessingTiled(dsm, vegdem, vegdem2, scale, usevegdem, aniso, trans, tilesize, gdal_dsm, outputDir, outputFile, feedback, workers=1):
+    """
+    Tiled SVF calculation for grids where the shadow matrices do not fit in memory.
+
+    The grid is split into tilesize x tilesize tiles. Each tile is calculated
+    together with a halo wide enough to hold every obstacle that can shade it,
+    and only the tile interior is written to the output GeoTIFFs in outputDir,
+    the total SVF raster (outputFile) and, if aniso, to the shadow matrices
+    (bit-packed, written via on-disk memmaps and zipped into shadowmats.npz).
+    Peak memory is thereby bounded by the tile size instead of the grid size.
+    Results are identical to an untiled run.
+    """
+    rows = dsm.shape[0]
+    cols = dsm.shape[1]
+
+    # The shadow march of each tile uses the absolute maximum height (as an untiled run), while the halo only
+    # depends on the height range: an obstacle never shades pixels lower than the lowest one of the grid
+    amaxvalue = np.maximum(dsm.max(), vegdem.max())
+    halo = svf_tile_halo(amaxvalue - dsm.min(), scale, svf_min_altitude(aniso))
+
+    svfnames = ['svf', 'svfE', 'svfS', 'svfW', 'svfN']
+    if usevegdem == 1:
+        svfnames = svfnames + ['svfveg', 'svfEveg', 'svfSveg', 'svfWveg', 'svfNveg',
+                               'svfaveg', 'svfEaveg', 'svfSaveg', 'svfWaveg', 'svfNaveg']
+    svfrasters = {}
+    for name in svfnames:
+        svfrasters[name] = misc.createraster(gdal_dsm, outputDir + '/' + name + '.tif')
+    totalraster = misc.createraster(gdal_dsm, outputFile)
+
+    if aniso:
+        patches = int(np.sum(create_patches(2)[4]))
+        matnames = {'shmat': 'shadowmat', 'vegshmat': 'vegshadowmat', 'vbshvegshmat': 'vbshmat'}
+        mats = {}
+        for key in matnames:
+            mats[key] = np.lib.format.open_memmap(outputDir + '/' + matnames[key] + '.npy', mode='w+', dtype=np.uint8,
+                                                  shape=(rows, cols, int(np.ceil(patches / 8.))))
+
+    tilerows = range(0, rows, tilesize)
+    tilecols = range(0, cols, tilesize)
+    ntiles = len(tilerows) * len(tilecols)
+    tile = 0
+    for r0 in tilerows:
+        for c0 in tilecols:
+            if feedback.isCanceled():
+                feedback.setProgressText("Calculation cancelled")
+                break
+            tile += 1
+            feedback.setProgressText('Calculating tile ' + str(tile) + ' of ' + str(ntiles))
+
+            # Tile interior and tile with halo
+            r1 = min(r0 + tilesize, rows)
+            c1 = min(c0 + tilesize, cols)
+            hr0 = max(r0 - halo, 0)
+            hr1 = min(r1 + halo, rows)
+            hc0 = max(c0 - halo, 0)
+            hc1 = min(c1 + halo, cols)
+
+            if usevegdem == 1:
+                tilevegdem = vegdem[hr0:hr1, hc0:hc1]
+                tilevegdem2 = vegdem2[hr0:hr1, hc0:hc1]
+            else:
+                tilevegdem = np.zeros((hr1 - hr0, hc1 - hc0))
+                tilevegdem2 = 0.
+
+            if aniso:
+                ret = svfForProcessing153(dsm[hr0:hr1, hc0:hc1], tilevegdem, tilevegdem2, scale, usevegdem, 1. / scale, False, None, feedback, workers, amaxvalue)
+            else:
+                ret = svfForProcessing655(dsm[hr0:hr1, hc0:hc1], tilevegdem, tilevegdem2, scale, usevegdem, feedback, workers, amaxvalue)
+
+            interior = (slice(r0 - hr0, r1 - hr0), slice(c0 - hc0, c1 - hc0))
+            for name in svfnames:
+                svfrasters[name].GetRasterBand(1).WriteArray(ret[name][interior], c0, r0)
+
+            if usevegdem == 0:
+                svftotal = ret['svf'][interior]
+            else:
+                svftotal = (ret['svf'][interior] - (1 - ret['svfveg'][interior]) * (1 - trans))
+            totalraster.GetRasterBand(1).WriteArray(svftotal, c0, r0)
+
+            if aniso:
+                for key in matnames:
+                    mats[key][r0:r1, c0:c1, :] = pack_shadowmatrix(ret[key][interior])
+
+    for name in svfnames:
+        svfrasters[name].FlushCache()
+    totalraster.FlushCache()
+    svfrasters = None
+    totalraster = None
+
+    if aniso:
+        # Same layout as np.savez_compressed, without holding the matrices in memory
+        for key in matnames:
+            mats[key].flush()
+        mats = None
+        np.save(outputDir + '/' + 'patches.npy', patches)
+        if os.path.isfile(outputDir + '/' + 'shadowmats.npz'):
+            os.remove(outputDir + '/' + 'shadowmats.npz')
+        zippo = zipfile.ZipFile(outputDir + '/' + 'shadowmats.npz', 'w', compression=zipfile.ZIP_DEFLATED, allowZip64=True)
+        for name in list(matnames.values()) + ['patches']:
+            zippo.write(outputDir + '/' + name + '.npy', name + '.npy')
+        zippo.close()
+        for name in list(matnames.values()) + ['patches']:
+            os.remove(outputDir + '/' + name + '.npy')
+
+    return svfnames
@@ -56,16 +56,13 @@ def findwalls(a, walllimit, feedback, total):
     row = a.shape[1]
     walls = np.zeros((col, row))
     domain = np.array([[0, 1, 0], [1, 0, 1], [0, 1, 0]])
-    index = 0
-    for i in np.arange(1, row-1):
-        if feedback.isCanceled():
-            feedback.setProgressText("Calculation cancelled")
-            break
-        for j in np.arange(1, col-1):
-            dom = a[j-1:j+2, i-1:i+2]
-            walls[j, i] = np.max(dom[np.where(domain == 1)])  # new 20171006
-            index = index + 1
-            feedback.setProgress(int(index * total))
+    if feedback.isCanceled():
+        feedback.setProgressText("Calculation cancelled")
+        return walls
+    # Maximum of the four cardinal neighbours of each inner pixel (new 20171006)
+    if col > 2 and row > 2:
+        walls[1:col - 1, 1:row - 1] = maximum_filter(a, footprint=domain, mode='nearest')[1:col - 1, 1:row - 1]
+    feedback.setProgress(int((col - 2) * (row - 2) * total))
 
     walls = np.copy(walls - a)  # new 20171006
     walls[(walls < walllimit)] = 0
@@ -78,6 +75,40 @@ def findwalls(a, walllimit, feedback, total):
     return walls
 
 
+def goodwin_filters(filtmatrix, buildfilt, h):
+    # Line filter and building side filter (1 and 2 on either side of the wall) rotated h degrees
+    n = filtmatrix.shape[0] - 1
+    filtmatrix1temp = sc.rotate(filtmatrix, h, order=1, reshape=False, mode='nearest')  # bilinear
+    filtmatrix1 = np.round(filtmatrix1temp)
+    # filtmatrix1temp = sc.imrotate(filtmatrix, h, 'bilinear')
+    # filtmatrix1 = np.round(filtmatrix1temp / 255.)
+    # filtmatrixbuildtemp = sc.imrotate(buildfilt, h, 'nearest')
+    filtmatrixbuildtemp = sc.rotate(buildfilt, h, order=0, reshape=False, mode='nearest')  # Nearest neighbor
+    # filtmatrixbuild = np.round(filtmatrixbuildtemp / 127.)
+    filtmatrixbuild = np.round(filtmatrixbuildtemp)
+    index = 270 - h
+    if h == 150:
+        filtmatrixbuild[:, n] = 0
+    if h == 30:
+        filtmatrixbuild[:, n] = 0
+    if index == 225:
+        filtmatrix1[0, 0] = 1
+        filtmatrix1[n, n] = 1
+    if index == 135:
+        filtmatrix1[0, n] = 1
+        filtmatrix1[n, 0] = 1
+    return filtmatrix1, filtmatrixbuild
+
+
+def window_sums(a, i, j, filt, filthalvefloor):
+    # Sum of a in the windows centred on pixels (i, j) where filt is True, summed in the same order as
+    # np.sum(a[window][filt]) so that the result is identical
+    di, dj = np.nonzero(filt)
+    cut = a[i[:, np.newaxis] + (di - filthalvefloor)[np.newaxis, :],
+            j[:, np.newaxis] + (dj - filthalvefloor)[np.newaxis, :]]
+    return np.sum(cut, axis=1)
+
+
 def filter1Goodwin_as_aspect_v3(walls_for_dir, scale, a, feedback, total):
     """
     tThis function applies the filter processing presented in Goodwin et al (2010) but instead for removing
@@ -88,6 +119,9 @@ def filter1Goodwin_as_aspect_v3(walls_for_dir, scale, a, feedback, total):
 
     Translated: 2015-09-15
 
+    The line filter is correlated with the wall pixels for each angle and each wall pixel keeps the first angle
+    with the largest response. The building side is then tested once per wall pixel for that angle.
+
     :param walls:
     :param scale:
     :param a:
@@ -114,57 +148,40 @@ def filter1Goodwin_as_aspect_v3(walls_for_dir, scale, a, feedback, total):
     buildfilt = np.zeros((int(filtersize), int(filtersize)))
 
     filtmatrix[:, filthalveceil - 1] = 1
-    n = filtmatrix.shape[0] - 1
     buildfilt[filthalveceil - 1, 0:filthalvefloor] = 1
     buildfilt[filthalveceil - 1, filthalveceil: int(filtersize)] = 2
 
     y = np.zeros((row, col))  # final direction
     z = np.zeros((row, col))  # temporary direction
     x = np.zeros((row, col))  # building side
+    best = np.full((row, col), -1)  # rotation (degrees) of the final direction
     walls[walls > 0] = 1
 
+    # Wall pixels far enough from the edges for the filter
+    inner = np.zeros((row, col), dtype=bool)
+    inner[filthalveceil - 1:row - filthalveceil - 1, filthalveceil - 1:col - filthalveceil - 1] = True
+    inner &= walls == 1
+
     for h in range(0, 180):  # =0:1:180 #%increased resolution to 1 deg 20140911
         if feedback is not None:
             feedback.setProgress(int(h * total))
             if feedback.isCanceled():
                 feedback.setProgressText("Calculation cancelled")
                 break
-        filtmatrix1temp = sc.rotate(filtmatrix, h, order=1, reshape=False, mode='nearest')  # bilinear
-        filtmatrix1 = np.round(filtmatrix1temp)
-        # filtmatrix1temp = sc.imrotate(filtmatrix, h, 'bilinear')
-        # filtmatrix1 = np.round(filtmatrix1temp / 255.)
-        # filtmatrixbuildtemp = sc.imrotate(buildfilt, h, 'nearest')
-        filtmatrixbuildtemp = sc.rotate(buildfilt, h, order=0, reshape=False, mode='nearest')  # Nearest neighbor
-        # filtmatrixbuild = np.round(filtmatrixbuildtemp / 127.)
-        filtmatrixbuild = np.round(filtmatrixbuildtemp)
-        index = 270 - h
-        if h == 150:
-            filtmatrixbuild[:, n] = 0
-        if h == 30:
-            filtmatrixbuild[:, n] = 0
-        if index == 225:
-            # n = filtmatrix.shape[0] - 1  # length(filtmatrix);
-            filtmatrix1[0, 0] = 1
-            filtmatrix1[n, n] = 1
-        if index == 135:
-            # n = filtmatrix.shape[0] - 1  # length(filtmatrix);
-            filtmatrix1[0, n] = 1
-            filtmatrix1[n, 0] = 1
-
-        for i in range(int(filthalveceil) - 1, row - int(filthalveceil) - 1):  # i=filthalveceil:sizey-filthalveceil
-            for j in range(int(filthalveceil) - 1, col - int(filthalveceil) - 1):  # (j=filthalveceil:sizex-filthalveceil
-                if walls[i, j] == 1:
-                    wallscut = walls[i - filthalvefloor:i + filthalvefloor + 1,
-                               j - filthalvefloor:j + filthalvefloor + 1] * filtmatrix1
-                    dsmcut = a[i - filthalvefloor:i + filthalvefloor + 1, j - filthalvefloor:j + filthalvefloor + 1]
-                    if z[i, j] < wallscut.sum():  # sum(sum(wallscut))
-                        z[i, j] = wallscut.sum()  # sum(sum(wallscut));
-                        if np.sum(dsmcut[filtmatrixbuild == 1]) > np.sum(dsmcut[filtmatrixbuild == 2]):
-                            x[i, j] = 1
-                        else:
-                            x[i, j] = 2
-
-                        y[i, j] = index
+        filtmatrix1, _ = goodwin_filters(filtmatrix, buildfilt, h)
+        wallssum = sc.correlate(walls, filtmatrix1, mode='constant', cval=0.)
+        larger = inner & (z < wallssum)
+        z[larger] = wallssum[larger]
+        best[larger] = h
+
+    # Building side for the final direction of each wall pixel
+    for h in np.unique(best[best >= 0]):
+        i, j = np.nonzero(best == h)
+        _, filtmatrixbuild = goodwin_filters(filtmatrix, buildfilt, h)
+        side1 = window_sums(a, i, j, filtmatrixbuild == 1, filthalvefloor)
+        side2 = window_sums(a, i, j, filtmatrixbuild == 2, filthalvefloor)
+        x[i, j] = np.where(side1 > side2, 1, 2)
+        y[i, j] = 270 - h
 
     y[(x == 1)] = y[(x == 1)] - 180
     y[(y < 0)] = y[(y < 0)] + 360
@@ -22,6 +22,7 @@ from qgis.core import (QgsProcessing,
                        QgsVectorFileWriter,
                        QgsVectorDataProvider,
                        QgsProcessingParameterFile,
+                       QgsProcessingParameterString,
                        QgsProcessingParameterDefinition)
 from qgis.PyQt.QtGui import QIcon
 from osgeo import gdal, osr, ogr
@@ -31,7 +32,9 @@ import numpy as np
 import inspect
 from pathlib import Path
 import sys
-from ..util.misc import saveraster
+from ..util.misc import saveraster, createraster
+from ..functions.SOLWEIGpython.solweig_statistics import (STATISTICS, PERCENTILE_BINS, solweig_output_sources,
+                                                          solweig_statistics)
 
 
 class ProcessingSolweigAnalyzerAlgorithm(QgsProcessingAlgorithm):
@@ -49,6 +52,7 @@ class ProcessingSolweigAnalyzerAlgorithm(QgsProcessingAlgorithm):
     # SPECTIME_MAX = 'SPECTIME_MAX'
     THRES_TYPE = 'THRES_TYPE'
     TMRT_THRES_NUM = 'TMRT_THRES_NUM'
+    PERCENTILES = 'PERCENTILES'
 
     # Output
     STAT_OUT = 'STAT_OUT'
@@ -79,9 +83,10 @@ class ProcessingSolweigAnalyzerAlgorithm(QgsProcessingAlgorithm):
                          (self.tr('Maximum'), '3'),
                          (self.tr('Minimun'), '4'))
         self.addParameter(QgsProcessingParameterEnum(self.STAT_TYPE,
-                                                     self.tr('Statistic measure'),
+                                                     self.tr('Statistic measure (several measures are saved as bands of one raster)'),
                                                      options=[i[0] for i in self.statType],
-                                                     defaultValue=1))
+                                                     allowMultiple=True,
+                                                     defaultValue=[1]))
 
         self.thresType = ((self.tr(' '), '0'),
                          (self.tr('Above'), '1'),
@@ -96,6 +101,12 @@ class ProcessingSolweigAnalyzerAlgorithm(QgsProcessingAlgorithm):
                                                        QgsProcessingParameterNumber.Double,
                                                        QVariant(55), 
                                                        False))
+        percentiles = QgsProcessingParameterString(self.PERCENTILES,
+                                                   self.tr('Approximate percentiles added as bands to the statistics raster, separated by "," (e.g. 50,90)'),
+                                                   '',
+                                                   optional=True)
+        percentiles.setFlags(percentiles.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(percentiles)
 
         # Output
         self.addParameter(QgsProcessingParameterRasterDestination(self.STAT_OUT,
@@ -113,27 +124,23 @@ class ProcessingSolweigAnalyzerAlgorithm(QgsProcessingAlgorithm):
         solweigDir = self.parameterAsString(parameters, self.SOLWEIG_DIR, context)
         variaIn = self.parameterAsString(parameters, self.VARIA_IN, context)
         buildings = self.parameterAsRasterLayer(parameters, self.BUILDINGS, context) 
-        statTypeStr = self.parameterAsString(parameters, self.STAT_TYPE, context)
+        statTypes = self.parameterAsEnums(parameters, self.STAT_TYPE, context)
         thresTypeStr = self.parameterAsString(parameters, self.THRES_TYPE, context)
         thresNum = self.parameterAsDouble(parameters, self.TMRT_THRES_NUM, context)
+        percentileStr = self.parameterAsString(parameters, self.PERCENTILES, context)
         outputStat = self.parameterAsOutputLayer(parameters, self.STAT_OUT, context)
         outputTMRT = None
 
         feedback.setProgressText("Initializing...")
 
-        statType = int(statTypeStr)
-        thresType = int(thresTypeStr)
+        thresType = int(thresTypeStr) if thresTypeStr else 0
+        try:
+            percentiles = [float(i) for i in percentileStr.split(',') if i.strip()]
+        except ValueError:
+            raise QgsProcessingException('Percentiles should be numbers separated by ",".')
+        if any(i < 0 or i > 100 for i in percentiles):
+            raise QgsProcessingException('Percentiles should be between 0 and 100.')
 
-        self.posAll = []
-        self.posDay = []
-        self.posNight = []
-        # self.posSpecMean = []
-        # self.posSpecMax = []
-        # self.posSpecMin = []
-
-        # SOLWEIGANALYZER CODE
-        self.l = os.listdir(solweigDir)
-        
         if variaIn == '0':
             self.var = 'Tmrt'
         elif variaIn == '1':
@@ -147,27 +154,11 @@ class ProcessingSolweigAnalyzerAlgorithm(QgsProcessingAlgorithm):
         elif variaIn == '5':
             self.var = 'Shadow'
 
-        if not self.var in str(self.l):
+        # time steps as GeoTIFFs (Tmrt_2020_172_1200D.tif) or as bands of a multiband GeoTIFF (Tmrt.tif)
+        sources = solweig_output_sources(solweigDir, self.var)
+        if not sources:
             raise QgsProcessingException('Filename starting with "' + self.var + '" is not found in SOLWEIG output folder.')
 
-        index = 0
-        for file in self.l:
-            if file.startswith(self.var + '_'):
-                if not file.endswith('_average.tif'):
-                    if not file.endswith('.xml'): # response to issue #196
-                        self.posAll.append(index)
-                if file.endswith('D.tif'):
-                    self.posDay.append(index)
-                if file.endswith('N.tif'):
-                    self.posNight.append(index)
-                # if file[-9:-5] == self.dlg.comboBoxSpecificMean.currentText():
-                #     self.posSpecMean.append(index)
-                # if file[-9:-5] == self.dlg.comboBoxSpecificMax.currentText():
-                #     self.posSpecMax.append(index)
-                # if file[-9:-5] == self.dlg.comboBoxSpecificMin.currentText():
-                #     self.posSpecMin.append(index)
-            index += 1
-
         # Exclude buildings
         if buildings is None:
                 feedback.setProgressText("No building raster loaded.")
@@ -178,107 +169,45 @@ class ProcessingSolweigAnalyzerAlgorithm(QgsProcessingAlgorithm):
             self.build = self.gdal_dsm.ReadAsArray().astype(float)
             geotransform = self.gdal_dsm.GetGeoTransform()
             self.scale = 1 / geotransform[1]
-        
-        # Diurnal mean
-        if statType == 0:
-            feedback.setProgressText('Calculating ' + self.var + ' diurnal mean.')
-            index = 0
-            for i in self.posAll:
-                gdal_dsm = gdal.Open(solweigDir + '/' + self.l[i])
-                grid = gdal_dsm.ReadAsArray().astype(float)
-                if index == 0:
-                    sizex = grid.shape[0]
-                    sizey = grid.shape[1]
-                    gridall = np.zeros((sizex, sizey))
-                gridall += grid
-                index += 1
-
-            gridall = gridall / index
-
-            if buildings is not None:
-                gridall[self.build == 0] = -9999
-
-            saveraster(gdal_dsm, outputStat, gridall)
-
-        # Daytime mean
-        if statType == 1:
-            feedback.setProgressText('Calculating ' + self.var + ' daytime mean.')
-            index = 0
-            for i in self.posDay:
-                gdal_dsm = gdal.Open(solweigDir + '/' + self.l[i])
-                grid = gdal_dsm.ReadAsArray().astype(float)
-                if index == 0:
-                    sizex = grid.shape[0]
-                    sizey = grid.shape[1]
-                    daymean = np.zeros((sizex, sizey))
-                daymean += grid
-                index += 1
-
-            daymean = daymean / index
-
-            if buildings is not None:
-                daymean[self.build == 0] = -9999
-
-            saveraster(gdal_dsm, outputStat, daymean)
-
-        # Nighttime mean
-        if statType == 2:
-            feedback.setProgressText('Calculating ' + self.var + ' nighttime mean.')
-            index = 0
-            for i in self.posNight:
-                gdal_dsm = gdal.Open(solweigDir + '/' + self.l[i])
-                grid = gdal_dsm.ReadAsArray().astype(float)
-                if index == 0:
-                    sizex = grid.shape[0]
-                    sizey = grid.shape[1]
-                    daymean = np.zeros((sizex, sizey))
-                daymean += grid
-                index += 1
-
-            daymean = daymean / index
 
-            if buildings is not None:
-                daymean[self.build == 0] = -9999
-
-            saveraster(gdal_dsm, outputStat, daymean)
-
-        # Max
-        if statType == 3:
-            feedback.setProgressText('Calculating ' + self.var + ' max.')
-            index = 0
-            for i in self.posAll:
-                gdal_dsm = gdal.Open(solweigDir + '/' + self.l[i])
-                grid = gdal_dsm.ReadAsArray().astype(float)
-                if index == 0:
-                    sizex = grid.shape[0]
-                    sizey = grid.shape[1]
-                    gridall = np.zeros((sizex, sizey)) - 100.
-                gridall = np.maximum(gridall, grid)
-                index += 1
+        # All statistics in one read of each time step
+        statistics = [STATISTICS[i] for i in statTypes]
+        if not statistics and not percentiles and thresType == 0:
+            raise QgsProcessingException('No statistic measure, percentile or threshold analysis selected.')
+        if statistics or percentiles:
+            feedback.setProgressText('Calculating ' + self.var + ' ' +
+                                     ', '.join([self.statType[i][0].lower() for i in statTypes] +
+                                               [format(i, 'g') + 'th percentile' for i in percentiles]) + '.')
+        if thresType == 1:
+            feedback.setProgressText('Calculating Tmrt percent time above ' + str(thresNum) + ' degC.')
+        elif thresType == 2:
+            feedback.setProgressText('Calculating Tmrt percent time below ' + str(thresNum) + ' degC.')
 
-            if buildings is not None:
-                gridall[self.build == 0] = -9999
-
-            saveraster(gdal_dsm, outputStat, gridall)
-
-        # Min
-        if statType == 4:
-            feedback.setProgressText('Calculating ' + self.var + ' min.')
-            index = 0
-            for i in self.posAll:
-                gdal_dsm = gdal.Open(solweigDir + '/' + self.l[i])
-                grid = gdal_dsm.ReadAsArray().astype(float)
-                if index == 0:
-                    sizex = grid.shape[0]
-                    sizey = grid.shape[1]
-                    gridall = np.zeros((sizex, sizey)) + 100.
-                gridall = np.minimum(gridall, grid)
-                index += 1
+        result = solweig_statistics(sources, statistics, thresType, thresNum, percentiles, PERCENTILE_BINS[self.var],
+                                    feedback=feedback)
+        if result is None:
+            return {}
 
+        for grid in result.values():
             if buildings is not None:
-                gridall[self.build == 0] = -9999
-
-            saveraster(gdal_dsm, outputStat, gridall)
+                grid[self.build == 0] = -9999
+
+        gdal_dsm = gdal.Open(sources[0][0])
+        names = statistics + ['p' + format(i, 'g') for i in percentiles]
+        if len(names) == 1:
+            saveraster(gdal_dsm, outputStat, result[names[0]])
+        elif len(names) > 1:
+            descriptions = [self.statType[i][0] for i in statTypes] + [format(i, 'g') + 'th percentile' for i in percentiles]
+            outDs = createraster(gdal_dsm, outputStat, len(names))
+            for band, name in enumerate(names):
+                outBand = outDs.GetRasterBand(band + 1)
+                outBand.WriteArray(result[name], 0, 0)
+                outBand.SetDescription(descriptions[band])
+            outDs = None
+
+        if thresType > 0:
+            outputTMRT = self.parameterAsOutputLayer(parameters, self.TMRT_STAT_OUT, context)
+            saveraster(gdal_dsm, outputTMRT, result['threshold'])  # response to issue #218
 
         # # Specific time mean
         # if not self.dlg.comboBoxSpecificMean.currentText() == 'Not Specified':
@@ -347,59 +276,9 @@ class ProcessingSolweigAnalyzerAlgorithm(QgsProcessingAlgorithm):
         #     if self.dlg.checkBoxIntoCanvas.isChecked():
         #         self.intoCanvas(self.folderPathSave[0] + '/' + self.var + '_' + self.dlg.comboBoxSpecificMin.currentText() + '_min.tif')
 
-        # Tmrt threshold above
-        if thresType == 1:
-            feedback.setProgressText('Calculating Tmrt percent time above ' + str(thresNum) + ' degC.')
-            outputTMRT = self.parameterAsOutputLayer(parameters, self.TMRT_STAT_OUT, context)
-            index = 0
-            for i in self.posAll:
-                gdal_dsm = gdal.Open(solweigDir + '/' + self.l[i])
-                grid = gdal_dsm.ReadAsArray().astype(float)
-                if index == 0:
-                    sizex = grid.shape[0]
-                    sizey = grid.shape[1]
-                    daymean = np.zeros((sizex, sizey))
-
-                tempgrid = (grid >= thresNum)
-                daymean = daymean + tempgrid
-                index += 1
-
-            daymean = daymean / index
-
-            if buildings is not None:
-                daymean[self.build == 0] = -9999
-
-            saveraster(gdal_dsm, outputTMRT, daymean) # response to issue #218
-
-        # Tmrt threshold below
-        if thresType == 2:
-            feedback.setProgressText('Calculating Tmrt percent time below ' + str(thresNum) + ' degC.')
-            outputTMRT = self.parameterAsOutputLayer(parameters, self.TMRT_STAT_OUT, context)
-            index = 0
-            for i in self.posAll:
-                gdal_dsm = gdal.Open(solweigDir + '/' + self.l[i])
-                grid = gdal_dsm.ReadAsArray().astype(float)
-                if index == 0:
-                    sizex = grid.shape[0]
-                    sizey = grid.shape[1]
-                    daymean = np.zeros((sizex, sizey))
-                tempgrid = (grid < thresNum)
-                daymean = daymean + tempgrid
-                index += 1
-
-            daymean = daymean / index
-
-            if buildings is not None:
-                daymean[self.build == 0] = -9999
-
-            saveraster(gdal_dsm, outputTMRT, daymean)  # response to issue #218
-
-        del self.posAll[:]
-
-
         feedback.setProgressText("Processing finished.")
 
-        return {self.STAT_OUT: outputTMRT, self.TMRT_STAT_OUT: outputTMRT}
+        return {self.STAT_OUT: outputStat, self.TMRT_STAT_OUT: outputTMRT}
     
     def name(self):
         return 'Outdoor Thermal Comfort: SOLWEIG Analyzer'
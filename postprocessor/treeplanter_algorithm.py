@@ -60,6 +60,7 @@ import inspect
 from pathlib import Path
 import sys
 from ..util import misc
+from ..util import parallel
 # from ..util import RoughnessCalcFunctionV2 as rg
 # from ..util import imageMorphometricParms_v1 as morph
 
@@ -123,6 +124,8 @@ class ProcessingTreePlanterAlgorithm(QgsProcessingAlgorithm):
     INCLUDE_OUTSIDE = 'INCLUDE_OUTSIDE'
     RANDOM_STARTING = 'RANDOM_STARTING'
     GREEDY_ALGORITHM = 'GREEDY_ALGORITHM'
+    WORKERS = 'WORKERS'
+    RANDOM_SEED = 'RANDOM_SEED'
 
     # Output
     OUTPUT_CDSM = 'OUTPUT_CDSM'
@@ -221,6 +224,18 @@ class ProcessingTreePlanterAlgorithm(QgsProcessingAlgorithm):
         greedyAlgorithm.setFlags(greedyAlgorithm.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
         self.addParameter(greedyAlgorithm)
 
+        workers = QgsProcessingParameterNumber(self.WORKERS,
+            self.tr("Number of parallel processes used for the restart iterations (1 = no parallel computation)"),
+            QgsProcessingParameterNumber.Integer, defaultValue=1, minValue=1, maxValue=parallel.default_workers())
+        workers.setFlags(workers.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(workers)
+
+        randomSeed = QgsProcessingParameterNumber(self.RANDOM_SEED,
+            self.tr("Seed for the random starting positions, to reproduce a result (-1 = random)"),
+            QgsProcessingParameterNumber.Integer, defaultValue=-1, minValue=-1)
+        randomSeed.setFlags(randomSeed.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(randomSeed)
+
     def processAlgorithm(self, parameters, context, feedback):
         # InputParameters 
 
@@ -249,6 +264,10 @@ class ProcessingTreePlanterAlgorithm(QgsProcessingAlgorithm):
         outside_selected = self.parameterAsBoolean(parameters, self.INCLUDE_OUTSIDE, context)
         greedy = self.parameterAsBoolean(parameters, self.GREEDY_ALGORITHM, context)
         starting_algorithm = self.parameterAsBoolean(parameters, self.RANDOM_STARTING, context)
+        workers = self.parameterAsInt(parameters, self.WORKERS, context)
+        seed = self.parameterAsInt(parameters, self.RANDOM_SEED, context)
+        if seed < 0:
+            seed = None
 
         # inputPolygonlayer = parameters[self.INPUT_POLYGONLAYER]
         inputPolygonlayer = self.parameterAsVectorLayer(parameters, self.INPUT_POLYGONLAYER, context).dataProvider().dataSourceUri()
@@ -410,7 +429,8 @@ class ProcessingTreePlanterAlgorithm(QgsProcessingAlgorithm):
                 feedback.setProgressText(str(possible_locations) + " possible locations for trees...")
                 # Running tree planter
                 t_y, t_x, tmrt_max, t_y_all, t_x_all = TreePlanterHillClimber.treeoptinit(treerasters, cropped_rasters, positions, treedata,
-                                                                                                    shadow_rg, tmrt_1d, nTree, ITERATIONS, sa, feedback)
+                                                                                                    shadow_rg, tmrt_1d, nTree, ITERATIONS, sa, feedback,
+                                                                                                    workers, seed)
                 
                 if outputOccurrence:
                     # Create occurrence map
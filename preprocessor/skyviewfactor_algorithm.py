@@ -52,8 +52,10 @@ from pathlib import Path
 import zipfile
 import sys
 from ..util import misc
+from ..util import parallel
 from ..functions import svf_functions as svf
 from ..functions import svf_for_voxels as svfv
+from ..util.SEBESOLWEIGCommonFiles.shadowmatrices import pack_shadowmatrix
 import time
 import pandas as pd
 
@@ -75,6 +77,8 @@ class ProcessingSkyViewFactorAlgorithm(QgsProcessingAlgorithm):
     WALL_SCHEME = 'WALL_SCHEME'
     INPUT_DEM = 'INPUT_DEM'
     INPUT_SVFHEIGHT = 'INPUT_SVFHEIGHT'
+    WORKERS = 'WORKERS'
+    TILE_SIZE = 'TILE_SIZE'
     OUTPUT_DIR = 'OUTPUT_DIR'
     OUTPUT_FILE = 'OUTPUT_FILE'
     
@@ -136,6 +140,23 @@ class ProcessingSkyViewFactorAlgorithm(QgsProcessingAlgorithm):
         wall_svfheight.setFlags(wall_svfheight.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
         self.addParameter(wall_svfheight) 
 
+        # Parallel computation
+        workers = QgsProcessingParameterNumber(self.WORKERS,
+            self.tr("Number of parallel processes used to cast shadows (1 = no parallel computation)"),
+            QgsProcessingParameterNumber.Integer,
+            QVariant(1),
+            True, minValue=1, maxValue=parallel.default_workers())
+        workers.setFlags(workers.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(workers)
+
+        tile_size = QgsProcessingParameterNumber(self.TILE_SIZE,
+            self.tr("Tile size (pixels) for large rasters. Tiles are calculated one by one to limit memory use (0 = no tiling)"),
+            QgsProcessingParameterNumber.Integer,
+            QVariant(0),
+            True, minValue=0)
+        tile_size.setFlags(tile_size.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(tile_size)
+
         # Output
         self.addParameter(QgsProcessingParameterFolderDestination(self.OUTPUT_DIR, 
         'Output folder for individual raster files'))
@@ -162,6 +183,8 @@ class ProcessingSkyViewFactorAlgorithm(QgsProcessingAlgorithm):
         kmeans = self.parameterAsBool(parameters, self.KMEANS, context) # If K-means will be used or not (true or false)
         clusters = self.parameterAsInt(parameters, self.CLUSTERS, context) + 1 # + 1 because ground areas will be one cluster when dsm - dem
         wallScheme = self.parameterAsBool(parameters, self.WALL_SCHEME, context)
+        workers = self.parameterAsInt(parameters, self.WORKERS, context)
+        tileSize = self.parameterAsInt(parameters, self.TILE_SIZE, context)
 
         feedback.setProgressText('Initiating algorithm')
 
@@ -254,12 +277,29 @@ class ProcessingSkyViewFactorAlgorithm(QgsProcessingAlgorithm):
             vegdsm2 = 0.
             usevegdem = 0
 
-        if aniso == 1:
+        if workers > 1:
+            if wallScheme:
+                feedback.setProgressText('Wall surface temperature scheme activated: parallel computation not available')
+            else:
+                feedback.setProgressText('Casting shadows using ' + str(workers) + ' parallel processes')
+
+        if tileSize > 0 and wallScheme:
+            feedback.setProgressText('Wall surface temperature scheme activated: tiling not available')
+            tileSize = 0
+
+        if tileSize > 0:
+            feedback.setProgressText('Calculating SVF in tiles of ' + str(tileSize) + ' x ' + str(tileSize) + ' pixels')
+            if not os.path.exists(outputDir):
+                os.makedirs(outputDir)
+            svfnames = svf.svfForProcessingTiled(dsm, vegdsm, vegdsm2, scale, usevegdem, aniso, transVeg / 100.0, tileSize,
+                                                 gdal_dsm, outputDir, outputFile, feedback, workers)
+            ret = None
+        elif aniso == 1:
             feedback.setProgressText('Calculating SVF using 153 iterations')
-            ret = svf.svfForProcessing153(dsm, vegdsm, vegdsm2, scale, usevegdem, pixel_resolution, wallScheme, dem, feedback)
+            ret = svf.svfForProcessing153(dsm, vegdsm, vegdsm2, scale, usevegdem, pixel_resolution, wallScheme, dem, feedback, workers)
         else:
             feedback.setProgressText('Calculating SVF using 655 iterations')
-            ret = svf.svfForProcessing655(dsm, vegdsm, vegdsm2, scale, usevegdem, feedback)
+            ret = svf.svfForProcessing655(dsm, vegdsm, vegdsm2, scale, usevegdem, feedback, workers)
 
         # print('Time to finish first SVF calculation = ' + str(run_time))
         if wallScheme == 1:
@@ -416,7 +456,9 @@ class ProcessingSkyViewFactorAlgorithm(QgsProcessingAlgorithm):
                 # wallshvemat = ret["wallshvemat"]
                 # facesunmat = ret["facesunmat"]
 
-                np.savez_compressed(outputDir + '/' + "shadowmats.npz", shadowmat=shmat, vegshadowmat=vegshmat, vbshmat=vbshvegshmat) #,
+                # Bit-packed along the patch axis, see util/SEBESOLWEIGCommonFiles/shadowmatrices.py
+                np.savez_compressed(outputDir + '/' + "shadowmats.npz", shadowmat=pack_shadowmatrix(shmat), vegshadowmat=pack_shadowmatrix(vegshmat),
+                                    vbshmat=pack_shadowmatrix(vbshvegshmat), patches=shmat.shape[2]) #,
                                     # vbshvegshmat=vbshvegshmat, wallshmat=wallshmat, wallsunmat=wallsunmat,
                                     # facesunmat=facesunmat, wallshvemat=wallshvemat)
             
@@ -425,6 +467,18 @@ class ProcessingSkyViewFactorAlgorithm(QgsProcessingAlgorithm):
                 voxelTable = ret['voxelTable']
 
                 np.savez_compressed(outputDir + '/' + 'wallScheme.npz', voxelId=voxelId, voxelTable=voxelTable)
+        else:
+            # Tiled calculation, rasters and shadow matrices are already written to outputDir
+            if os.path.isfile(outputDir + '/' + 'svfs.zip'):
+                os.remove(outputDir + '/' + 'svfs.zip')
+
+            zippo = zipfile.ZipFile(outputDir + '/' + 'svfs.zip', 'a')
+            for name in svfnames:
+                zippo.write(outputDir + '/' + name + '.tif', name + '.tif')
+            zippo.close()
+
+            for name in svfnames:
+                os.remove(outputDir + '/' + name + '.tif')
 
         feedback.setProgressText("Sky View Factor: SVF grid(s) successfully generated")
 
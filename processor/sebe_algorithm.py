@@ -40,6 +40,7 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterRasterDestination,
                        QgsProcessingParameterFileDestination,
                        QgsProcessingParameterFile,
+                       QgsProcessingParameterDefinition,
                        QgsProcessingException,
                        QgsProcessingParameterRasterLayer)
 from processing.gui.wrappers import WidgetWrapper
@@ -55,7 +56,9 @@ from ..functions.SEBEfiles import SEBE_2015a_calc_forprocessing as sebe
 from ..functions.SEBEfiles.sunmapcreator_2015a import sunmapcreator_2015a
 from ..functions.SEBEfiles import WriteMetaDataSEBE
 from ..util.SEBESOLWEIGCommonFiles.Solweig_v2015_metdata_noload import Solweig_2015a_metdata_noload
-from ..util.misc import get_ders, saveraster, createTSlist
+from ..util.misc import get_ders, saveraster, createraster, createTSlist
+from ..util.SEBESOLWEIGCommonFiles.shadow_cache import ShadowCache
+from ..util import parallel
 
 
 class ProcessingSEBEAlgorithm(QgsProcessingAlgorithm):
@@ -82,6 +85,9 @@ class ProcessingSEBEAlgorithm(QgsProcessingAlgorithm):
     IRR_FILE = 'IRR_FILE'
     OUTPUT_DIR = 'OUTPUT_DIR'
     OUTPUT_ROOF = 'OUTPUT_ROOF'
+    SHADOW_CACHE = 'SHADOW_CACHE'
+    TIME_BINS = 'TIME_BINS'
+    WORKERS = 'WORKERS'
     
 
     def initAlgorithm(self, config):
@@ -118,6 +124,9 @@ class ProcessingSEBEAlgorithm(QgsProcessingAlgorithm):
                                                 self.tr('Coordinated Universal Time (UTC) '),
                                                 options=[i[0] for i in lista],
                                                 defaultValue=14))
+        self.addParameter(QgsProcessingParameterEnum(self.TIME_BINS,
+            self.tr('Irradiance per time bin (multiband roof raster and wall table with one column per bin)'),
+            ['None', 'Monthly', 'Hour of day'], defaultValue=0))
         self.addParameter(QgsProcessingParameterBoolean(self.SAVESKYIRR,
             self.tr("Save sky irradiance distribution"), defaultValue=False))
         self.addParameter(QgsProcessingParameterFileDestination(self.IRR_FILE,
@@ -127,6 +136,17 @@ class ProcessingSEBEAlgorithm(QgsProcessingAlgorithm):
         self.addParameter(QgsProcessingParameterRasterDestination(self.OUTPUT_ROOF,
             self.tr("Roof irradiance raster (kWh)"), optional=True,
             createByDefault=False))
+        shadowCache = QgsProcessingParameterBoolean(self.SHADOW_CACHE,
+            self.tr("Cache shadows on disk to reuse them in later runs on the same grids"), defaultValue=False)
+        shadowCache.setFlags(shadowCache.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(shadowCache)
+        workers = QgsProcessingParameterNumber(self.WORKERS,
+            self.tr("Number of parallel processes used to cast shadows (1 = no parallel computation)"),
+            QgsProcessingParameterNumber.Integer,
+            QVariant(1),
+            True, minValue=1, maxValue=parallel.default_workers())
+        workers.setFlags(workers.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(workers)
 
     def processAlgorithm(self, parameters, context, feedback):
         # InputParameters
@@ -143,6 +163,9 @@ class ProcessingSEBEAlgorithm(QgsProcessingAlgorithm):
         albedo = self.parameterAsDouble(parameters, self.ALBEDO, context)
         inputMet = self.parameterAsString(parameters, self.INPUT_MET, context)
         saveskyirr = self.parameterAsBool(parameters, self.SAVESKYIRR, context)
+        shadowCache = self.parameterAsBool(parameters, self.SHADOW_CACHE, context)
+        timeBins = self.parameterAsInt(parameters, self.TIME_BINS, context)
+        workers = self.parameterAsInt(parameters, self.WORKERS, context)
         irrFile = self.parameterAsFileOutput(parameters, self.IRR_FILE, context)
         outputRoof = self.parameterAsOutputLayer(parameters, self.OUTPUT_ROOF, context)
 
@@ -320,7 +343,13 @@ class ProcessingSEBEAlgorithm(QgsProcessingAlgorithm):
             Solweig_2015a_metdata_noload(self.metdata, location, utc)
 
         feedback.setProgressText("Distributing irradiance on sky vault")
-        output = {'energymonth': 0, 'energyyear': 1, 'suitmap': 0}
+        output = {'energymonth': int(timeBins == 1), 'energyhour': int(timeBins == 2), 'energyyear': 1, 'suitmap': 0}
+        if timeBins == 1:
+            binnames = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+        elif timeBins == 2:
+            binnames = ['{:02d}'.format(hour) for hour in range(24)]
+        else:
+            binnames = []
         radmatI, radmatD, radmatR = sunmapcreator_2015a(self.metdata, altitude, azimuth,
                                                         onlyglobal, output, jday, albedo, location, zen)
 
@@ -342,9 +371,12 @@ class ProcessingSEBEAlgorithm(QgsProcessingAlgorithm):
 
         # Main function
         feedback.setProgressText("Executing main model")
+        if workers > 1:
+            feedback.setProgressText('Casting shadows using ' + str(workers) + ' parallel processes')
         seberesult = sebe.SEBE_2015a_calc(self.dsm, self.scale, building_slope,
                     building_aspect, voxelheight, sizey, sizex, vegdsm, vegdsm2, wheight,
-                    waspect, albedo, psi, radmatI, radmatD, radmatR, usevegdem, feedback, wallmaxheight)
+                    waspect, albedo, psi, radmatI, radmatD, radmatR, usevegdem, feedback, wallmaxheight,
+                    ShadowCache() if shadowCache else None, len(binnames), workers)
 
         Energyyearroof = seberesult["Energyyearroof"]
         Energyyearwall = seberesult["Energyyearwall"]
@@ -363,6 +395,19 @@ class ProcessingSEBEAlgorithm(QgsProcessingAlgorithm):
         header = '%row col irradiance'
         numformat = '%4d %4d ' + '%6.2f ' * (Energyyearwall.shape[1] - 2)
         np.savetxt(filenamewall, Energyyearwall, fmt=numformat, header=header, comments='')
+        if binnames:
+            Energyroofbins = seberesult["Energyroofbins"]
+            roofbins = createraster(self.gdal_dsm, outputDir + '/Energyroofbins.tif', len(binnames))
+            for band, binname in enumerate(binnames):
+                roofbins.GetRasterBand(band + 1).WriteArray(Energyroofbins[:, :, band], 0, 0)
+                roofbins.GetRasterBand(band + 1).SetDescription(binname)
+            roofbins = None
+
+            filenamewall = outputDir + '/Energywallbins.txt'
+            header = '%row col ' + ' '.join(binnames)
+            numformat = '%4d %4d ' + '%6.2f ' * len(binnames)
+            np.savetxt(filenamewall, seberesult["Energywallbins"], fmt=numformat, header=header, comments='')
+
         if usevegdem == 1:
             filenamewall = outputDir + '/Vegetationdata.txt'
             header = '%row col height'
@@ -39,6 +39,7 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterNumber,
                        QgsProcessingParameterFolderDestination,
                        QgsProcessingParameterRasterDestination,
+                       QgsProcessingParameterDefinition,
                        QgsProcessingException,
                        QgsProcessingParameterDateTime,               
                        QgsProcessingParameterRasterLayer)
@@ -55,6 +56,7 @@ import inspect
 from pathlib import Path
 import datetime
 from ..util.misc import createTSlist
+from ..util.SEBESOLWEIGCommonFiles.shadow_cache import ShadowCache
 
 
 class ProcessingShadowGeneratorAlgorithm(QgsProcessingAlgorithm):
@@ -76,11 +78,16 @@ class ProcessingShadowGeneratorAlgorithm(QgsProcessingAlgorithm):
     ONE_SHADOW = 'ONE_SHADOW'
     ITERTIME = 'ITERTIME'
     DATEINI = 'DATEINI'
+    DATE_RANGE = 'DATE_RANGE'
+    DATEEND = 'DATEEND'
+    SUN_TOLERANCE = 'SUN_TOLERANCE'
+    SAVE_STEPS = 'SAVE_STEPS'
     TIMEINI = 'TIMEINI'
     UTC = 'UTC'
     DST = 'DST'
     OUTPUT_DIR = 'OUTPUT_DIR'
     OUTPUT_FILE = 'OUTPUT_FILE'
+    SHADOW_CACHE = 'SHADOW_CACHE'
 
     def initAlgorithm(self, config):
         self.addParameter(
@@ -153,6 +160,15 @@ class ProcessingShadowGeneratorAlgorithm(QgsProcessingAlgorithm):
         self.addParameter(QgsProcessingParameterDateTime(self.DATEINI,
             self.tr('Date'),
             QgsProcessingParameterDateTime.Date))
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                self.DATE_RANGE,
+                self.tr("Calculate shade hours for all days from Date to End date"),
+                defaultValue=False))
+        self.addParameter(QgsProcessingParameterDateTime(self.DATEEND,
+            self.tr('End date (date range)'),
+            QgsProcessingParameterDateTime.Date,
+            optional=True))
         self.addParameter(
             QgsProcessingParameterNumber(
                 self.ITERTIME,
@@ -180,6 +196,27 @@ class ProcessingShadowGeneratorAlgorithm(QgsProcessingAlgorithm):
                 self.tr("Aggregated (or single) shadow raster"), 
                 optional=True,
                 createByDefault=False))
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                self.SAVE_STEPS,
+                self.tr("Save the shadows of all time steps in one multiband raster (date range)"),
+                defaultValue=False))
+        sunTolerance = QgsProcessingParameterNumber(
+                self.SUN_TOLERANCE,
+                self.tr('Sun positions within this angle (degrees) share one shadow (date range, 0 = exact)'),
+                QgsProcessingParameterNumber.Double,
+                QVariant(0.25),
+                True,
+                minValue=0.0,
+                maxValue=5.0)
+        sunTolerance.setFlags(sunTolerance.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(sunTolerance)
+        shadowCache = QgsProcessingParameterBoolean(
+                self.SHADOW_CACHE,
+                self.tr("Cache shadows on disk to reuse them in later runs on the same grids"),
+                defaultValue=False)
+        shadowCache.setFlags(shadowCache.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(shadowCache)
 
 
     def processAlgorithm(self, parameters, context, feedback):
@@ -196,9 +233,14 @@ class ProcessingShadowGeneratorAlgorithm(QgsProcessingAlgorithm):
         utcpos = self.parameterAsString(parameters, self.UTC, context) 
         dst = self.parameterAsBool(parameters, self.DST, context)
         myDate = self.parameterAsString(parameters, self.DATEINI, context)
+        dateRange = self.parameterAsBool(parameters, self.DATE_RANGE, context)
+        myDateEnd = self.parameterAsString(parameters, self.DATEEND, context)
+        saveSteps = self.parameterAsBool(parameters, self.SAVE_STEPS, context)
+        sunTolerance = self.parameterAsDouble(parameters, self.SUN_TOLERANCE, context)
         oneShadow = self.parameterAsDouble(parameters, self.ONE_SHADOW, context) 
         myTime = self.parameterAsString(parameters, self.TIMEINI, context)
         iterShadow = self.parameterAsDouble(parameters, self.ITERTIME, context)
+        shadowCache = self.parameterAsBool(parameters, self.SHADOW_CACHE, context)
 
         if parameters['OUTPUT_DIR'] == 'TEMPORARY_OUTPUT':
             if not os.path.isdir(outputDir):
@@ -354,9 +396,22 @@ class ProcessingShadowGeneratorAlgorithm(QgsProcessingAlgorithm):
             tv = [year, month, day, hour, minu, sec]
 
             timeInterval = iterShadow # self.dlg.intervalTimeEdit.time()
-            shadowresult = dsh.dailyshading(dsm, vegdsm, vegdsm2, scale, lon, lat, sizex, sizey, tv, utc, usevegdem,
-                                            timeInterval, onetime, feedback, outputDir, gdal_dsm, trans,
-                                            dst, wallsh, wheight, waspect)
+            if dateRange:
+                if not myDateEnd:
+                    raise QgsProcessingException("Error: No end date selected for the date range")
+                endDate = datetime.datetime.strptime(myDateEnd[:10], '%Y-%m-%d')
+                if endDate < startDate:
+                    raise QgsProcessingException("Error: The end date is before the start date")
+                shadowresult = dsh.daterangeshading(dsm, vegdsm, vegdsm2, scale, lon, lat, sizex, sizey,
+                                                    startDate.date(), endDate.date(), utc, usevegdem, timeInterval,
+                                                    feedback, outputDir, gdal_dsm, trans, dst, wallsh, wheight,
+                                                    waspect, sunTolerance, saveSteps,
+                                                    ShadowCache() if shadowCache else None)
+            else:
+                shadowresult = dsh.dailyshading(dsm, vegdsm, vegdsm2, scale, lon, lat, sizex, sizey, tv, utc, usevegdem,
+                                                timeInterval, onetime, feedback, outputDir, gdal_dsm, trans,
+                                                dst, wallsh, wheight, waspect,
+                                                ShadowCache() if shadowCache else None)
             
             shfinal = shadowresult["shfinal"]
 
@@ -406,6 +461,9 @@ class ProcessingShadowGeneratorAlgorithm(QgsProcessingAlgorithm):
                'building digital surface models (DSM). Optionally, vegetation DSMs could also be used. '
                'The methodology that is used to generate shadows originates from Ratti and Richens (1990) '
                'and is further developed and described in Lindberg and Grimmond (2011).<br>'
+               'With a date range, the shadows of all days from Date to End date are cast in one run and the '
+               'number of hours in shadow is saved (Shadehours_*.tif). Sun positions that are nearly identical on '
+               'different days share one shadow.<br>'
                '\n'
                '------------------<br>'
                'Lindberg, F., Grimmond, C.S.B., 2011a. The influence of vegetation and building morphology on shadow patterns and mean radiant temperatures in urban areas: model development and evaluation. Theoret. Appl. Climatol. 105, 311–323 <br>'
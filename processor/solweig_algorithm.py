@@ -56,6 +56,7 @@ from ..util.misc import xy2latlon_fromraster
 import zipfile
 from ..util.umep_solweig_export_component import read_solweig_config, write_solweig_config
 from ..functions.SOLWEIGpython import Solweig_run as sr
+from ..functions.SOLWEIGpython.output_writer import OUTPUT_FORMATS
 import json
 
 
@@ -131,6 +132,8 @@ class ProcessingSOLWEIGAlgorithm(QgsProcessingAlgorithm):
     OUTPUT_LDOWN = 'OUTPUT_LDOWN'
     OUTPUT_SH = 'OUTPUT_SH'
     OUTPUT_TREEPLANTER = 'OUTPUT_TREEPLANTER'
+    OUTPUT_FORMAT = 'OUTPUT_FORMAT'
+    SHADOW_CACHE = 'SHADOW_CACHE'
 
 
     def initAlgorithm(self, config):
@@ -296,6 +299,15 @@ class ProcessingSOLWEIGAlgorithm(QgsProcessingAlgorithm):
             self.tr("Save shadow raster(s)"), defaultValue=False))
         self.addParameter(QgsProcessingParameterBoolean(self.OUTPUT_TREEPLANTER,
             self.tr("Save necessary raster(s) for the TreePlanter and Spatial TC tools"), defaultValue=False))
+        outputFormat = QgsProcessingParameterEnum(self.OUTPUT_FORMAT,
+            self.tr('Format of output rasters (TreePlanter and Spatial TC tools require GeoTIFF per time step)'),
+            OUTPUT_FORMATS, optional=True, defaultValue=0)
+        outputFormat.setFlags(outputFormat.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(outputFormat)
+        shadowCache = QgsProcessingParameterBoolean(self.SHADOW_CACHE,
+            self.tr('Cache shadows on disk to reuse them in later runs on the same grids'), defaultValue=False)
+        shadowCache.setFlags(shadowCache.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(shadowCache)
         self.addParameter(QgsProcessingParameterFolderDestination(self.OUTPUT_DIR,
                                                      'Output folder'))
 
@@ -381,6 +393,8 @@ class ProcessingSOLWEIGAlgorithm(QgsProcessingAlgorithm):
         outputLup = self.parameterAsBool(parameters, self.OUTPUT_LUP, context)
         outputLdown = self.parameterAsBool(parameters, self.OUTPUT_LDOWN, context)
         outputTreeplanter = self.parameterAsBool(parameters, self.OUTPUT_TREEPLANTER, context)
+        outputFormat = self.parameterAsInt(parameters, self.OUTPUT_FORMAT, context)
+        shadowCache = self.parameterAsBool(parameters, self.SHADOW_CACHE, context)
         outputKdiff = False
         #outputSstr = False
 
@@ -395,6 +409,9 @@ class ProcessingSOLWEIGAlgorithm(QgsProcessingAlgorithm):
             saveBuild = True
             outputKdiff = True
             #outputSstr = True
+            if outputFormat != 0:
+                feedback.pushWarning('TreePlanter and Spatial TC tools require GeoTIFF per time step. Output format changed.')
+                outputFormat = 0
 
         if parameters['OUTPUT_DIR'] == 'TEMPORARY_OUTPUT':
             if not (os.path.isdir(outputDir)):
@@ -720,6 +737,8 @@ class ProcessingSOLWEIGAlgorithm(QgsProcessingAlgorithm):
         'savebuild': int(saveBuild), 
         'outputkdiff': int(outputKdiff), 
         'outputtreeplanter': int(outputTreeplanter), 
+        'outputformat': int(outputFormat), 
+        'shadowcache': int(shadowCache), 
         'wallnetcdf': int(wallNetCDF), 
         'date1': '2018,5,1,0', # used in standalone
         'date2': '2018,8,1,18' # used in standalone
@@ -48,6 +48,7 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingContext,
                        QgsProcessingParameterEnum,
                        QgsProcessingParameterFile,
+                       QgsProcessingParameterDefinition,
                        QgsProcessingException)
 from qgis.PyQt.QtWidgets import QMessageBox
 # qgis.utils import iface
@@ -108,6 +109,9 @@ class URockAlgorithm(QgsProcessingAlgorithm):
     INPUT_PROFILE_TYPE = "INPUT_PROFILE_TYPE"
     INPUT_PROFILE_FILE = "INPUT_PROFILE_FILE"
     LIST_OF_PROFILES = pd.Series(['power', 'urban', 'user'])
+    WIND_SOLVER = "WIND_SOLVER"
+    LIST_OF_SOLVERS = pd.Series(SOLVER_METHODS)
+    WIND_ROSE = "WIND_ROSE"
 
     # Output variables    
     OUTPUT_DIRECTORY = "UROCK_OUTPUT"
@@ -193,6 +197,14 @@ class URockAlgorithm(QgsProcessingAlgorithm):
                self.LIST_OF_PROFILES.values,
                defaultValue=0,
                optional = True))
+        windSolver = QgsProcessingParameterEnum(
+               self.WIND_SOLVER, 
+               self.tr('Wind solver (multigrid conjugate gradient recommended for fine resolutions)'),
+               ['SOR', 'Red-black SOR', 'Multigrid preconditioned conjugate gradient'],
+               defaultValue=SOLVER_METHODS.index(SOLVER_METHOD),
+               optional = True)
+        windSolver.setFlags(windSolver.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(windSolver)
         self.addParameter(
             QgsProcessingParameterNumber(
                 self.INPUT_WIND_HEIGHT,
@@ -214,6 +226,13 @@ class URockAlgorithm(QgsProcessingAlgorithm):
                 QgsProcessingParameterNumber.Double,
                 45,
                 False))
+        windRose = QgsProcessingParameterString(
+                self.WIND_ROSE,
+                self.tr('Wind rose cases "direction:speed" separated by "," (e.g. "0:2,45:2,45:5"), replaces the wind direction and speed above'),
+                defaultValue = "",
+                optional = True)
+        windRose.setFlags(windRose.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(windRose)
         self.addParameter(
             QgsProcessingParameterRasterLayer(
                 self.RASTER_OUTPUT,
@@ -339,6 +358,16 @@ class URockAlgorithm(QgsProcessingAlgorithm):
         dz = self.parameterAsInt(parameters, self.VERTICAL_RESOLUTION, context)
         profileType = self.LIST_OF_PROFILES.loc[self.parameterAsInt(parameters, self.INPUT_PROFILE_TYPE, context)]
         profileFile = self.parameterAsString(parameters, self.INPUT_PROFILE_FILE, context)
+        solverMethod = self.LIST_OF_SOLVERS.loc[self.parameterAsInt(parameters, self.WIND_SOLVER, context)]
+        windRose = self.parameterAsString(parameters, self.WIND_ROSE, context).strip()
+        windCases = []
+        if windRose:
+            try:
+                for case in windRose.split(","):
+                    direction, speed = case.split(":")
+                    windCases.append((float(direction), float(speed)))
+            except ValueError:
+                raise QgsProcessingException('Wind rose cases should be given as "direction:speed" separated by ","')
         
         # Get building layer and then file directory
         inputBuildinglayer = self.parameterAsVectorLayer(parameters, self.BUILDING_TABLE_NAME, context)
@@ -440,6 +469,64 @@ class URockAlgorithm(QgsProcessingAlgorithm):
                                         profileFile,
                                         meshSize, dz)
         
+        # Make the calculations for all the cases of the wind rose
+        if windCases:
+            if saveVector:
+                feedback.pushWarning("Vector outputs are not available for a wind rose, only raster and NetCDF outputs are saved")
+            netcdf_path, rasterPaths = \
+                MainCalculation.mainBatch(javaEnvironmentPath = javaEnvVar,
+                                          pluginDirectory = plugin_directory,
+                                          outputFilePath = outputDirectory,
+                                          outputFilename = outputFilename,
+                                          buildingFilePath = build_file,
+                                          vegetationFilePath = veg_file,
+                                          srid = srid_out,
+                                          windCases = windCases,
+                                          z_ref = z_ref,
+                                          prefix = '', #prefix,
+                                          meshSize = meshSize,
+                                          dz = dz,
+                                          alongWindZoneExtend = ALONG_WIND_ZONE_EXTEND,
+                                          crossWindZoneExtend = CROSS_WIND_ZONE_EXTEND,
+                                          verticalExtend = VERTICAL_EXTEND,
+                                          onlyInitialization = ONLY_INITIALIZATION,
+                                          maxIterations = MAX_ITERATIONS,
+                                          thresholdIterations = THRESHOLD_ITERATIONS,
+                                          solverMethod = solverMethod,
+                                          idFieldBuild = None, # idBuild,
+                                          buildingHeightField = heightBuild,
+                                          vegetationBaseHeight = baseHeightVeg,
+                                          vegetationTopHeight = topHeightVeg,
+                                          idVegetation = None, #idVeg,
+                                          vegetationAttenuationFactor = attenuationVeg,
+                                          outputRaster = outputRaster,
+                                          feedback = feedback,
+                                          z_out = z_out,
+                                          debug = DEBUG,
+                                          profileType = profileType,
+                                          verticalProfileFile = profileFile,
+                                          saveRaster = saveRaster)
+            if netcdf_path:
+                feedback.pushInfo("Wind fields of the {0} wind rose cases saved in {1}".format(len(windCases), netcdf_path))
+            
+            # Load the wind speed rasters (one band per case) into QGIS if user set it
+            if loadOutput and rasterPaths:
+                for z_i in z_out:
+                    loadedRaster = QgsRasterLayer(rasterPaths[z_i][WIND_SPEED],
+                                                  "Wind rose wind speed at {0} m".format(z_i),
+                                                  "gdal")
+                    if not loadedRaster.isValid():
+                        feedback.pushWarning("Raster layer failed to load!")
+                        break
+                    else:
+                        context.addLayerToLoadOnCompletion(loadedRaster.id(),
+                                                           QgsProcessingContext.LayerDetails("Wind rose wind speed at {0} m".format(z_i),
+                                                                                             QgsProject.instance(),
+                                                                                             ''))
+                        context.temporaryLayerStore().addMapLayer(loadedRaster)
+            return {self.OUTPUT_DIRECTORY: outputDirectory,
+                    self.OUTPUT_FILENAME: outputFilename}
+        
         # Make the calculations
         u, v, w, u0, v0, w0, x, y, z, buildingCoordinates, cursor, gridName,\
         rotationCenterCoordinates, verticalWindProfile, dicVectorTables,\
@@ -466,6 +553,7 @@ class URockAlgorithm(QgsProcessingAlgorithm):
                                  onlyInitialization = ONLY_INITIALIZATION,
                                  maxIterations = MAX_ITERATIONS,
                                  thresholdIterations = THRESHOLD_ITERATIONS,
+                                 solverMethod = solverMethod,
                                  idFieldBuild = None, # idBuild,
                                  buildingHeightField = heightBuild,
                                  vegetationBaseHeight = baseHeightVeg,
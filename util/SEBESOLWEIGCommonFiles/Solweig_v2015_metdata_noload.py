@@ -1,12 +1,23 @@
 from __future__ import absolute_import
 # from importdata import importdata
 from . import sun_position as sp
+from .shadow_cache import evict
 #import sun_position as sp
 import numpy as np
 import datetime
-import calendar
+import hashlib
+import os
+import tempfile
 
-def Solweig_2015a_metdata_noload(inputdata, location, UTC):
+# Processed met data is cached on disk, keyed by the met data, location and UTC offset,
+# so that repeated runs on the same met file do not have to recalculate sun positions. As for the shadow cache
+# (see shadow_cache.py), the least recently used files are removed when the cache folder gets larger than maxbytes.
+METDATA_CACHE_DIR = os.path.join(tempfile.gettempdir(), 'umep_metdata_cache')
+METDATA_CACHE_MAXBYTES = 32 * 1024 ** 2
+METDATA_CACHE_VERSION = 1
+
+
+def Solweig_2015a_metdata_noload(inputdata, location, UTC, cachedir=METDATA_CACHE_DIR, maxbytes=METDATA_CACHE_MAXBYTES):
     """
     This function is used to process the input meteorological file.
     It also calculates Sun position based on the time specified in the met-file
@@ -14,9 +25,24 @@ def Solweig_2015a_metdata_noload(inputdata, location, UTC):
     :param inputdata:
     :param location:
     :param UTC:
+    :param cachedir: folder for cached results, None to disable the cache
+    :param maxbytes: size of the cache folder above which the least recently used results are removed
     :return:
     """
 
+    if cachedir is not None:
+        cachefile = metdata_cache_file(inputdata, location, UTC, cachedir)
+        if os.path.isfile(cachefile):
+            try:
+                with np.load(cachefile) as cached:
+                    result = cached['YYYY'], cached['altitude'], cached['azimuth'], cached['zen'], cached['jday'], \
+                             cached['leafon'], cached['dectime'], cached['altmax']
+                # Mark as recently used
+                os.utime(cachefile)
+                return result
+            except (OSError, ValueError, KeyError):
+                pass
+
     met = inputdata
     data_len = len(met[:, 0])
     dectime = met[:, 1]+met[:, 2] / 24 + met[:, 3] / (60*24.)
@@ -25,10 +51,6 @@ def Solweig_2015a_metdata_noload(inputdata, location, UTC):
         halftimestepdec = 0
     else:
         halftimestepdec = (dectime[1] - dectime[0]) / 2.
-    time = dict()
-    time['sec'] = 0
-    time['UTC'] = UTC
-    sunmaximum = 0.
     leafon1 = 97  #TODO this should change
     leafoff1 = 300  #TODO this should change
 
@@ -41,62 +63,103 @@ def Solweig_2015a_metdata_noload(inputdata, location, UTC):
     leafon = np.empty(shape=(1, data_len))
     altmax = np.empty(shape=(1, data_len))
 
-    sunmax = dict()
-
-    for i, row in enumerate(met[:, 0]):
-        if met[i, 1] == 221:
-            test = 4
-        YMD = datetime.datetime(int(met[i, 0]), 1, 1) + datetime.timedelta(int(met[i, 1]) - 1)
-        # Finding maximum altitude in 15 min intervals (20141027)
-        if (i == 0) or (np.mod(dectime[i], np.floor(dectime[i])) == 0):
-            fifteen = 0.
-            sunmaximum = -90.
-            sunmax['zenith'] = 90.
-            while sunmaximum <= 90. - sunmax['zenith']:
-                sunmaximum = 90. - sunmax['zenith']
-                fifteen = fifteen + 15. / 1440.
-                HM = datetime.timedelta(days=(60*10)/1440.0 + fifteen)
-                YMDHM = YMD + HM
-                time['year'] = YMDHM.year
-                time['month'] = YMDHM.month
-                time['day'] = YMDHM.day
-                time['hour'] = YMDHM.hour
-                time['min'] = YMDHM.minute
-                sunmax = sp.sun_position(time,location)
-        altmax[0, i] = sunmaximum
-
-        half = datetime.timedelta(days=halftimestepdec)
-        H = datetime.timedelta(hours=met[i, 2])
-        M = datetime.timedelta(minutes=met[i, 3])
-        YMDHM = YMD + H + M - half
-        time['year'] = YMDHM.year
-        time['month'] = YMDHM.month
-        time['day'] = YMDHM.day
-        time['hour'] = YMDHM.hour
-        time['min'] = YMDHM.minute
-        sun = sp.sun_position(time, location)
-        if (sun['zenith'] > 89.0) & (sun['zenith'] <= 90.0):    # Hopefully fixes weird values in Perez et al. when altitude < 1.0, i.e. close to sunrise/sunset
-            sun['zenith'] = 89.0
-        altitude[0, i] = 90. - sun['zenith']
-        zen[0, i] = sun['zenith'] * (np.pi/180.)
-        azimuth[0, i] = sun['azimuth']
-
-        # day of year and check for leap year
-        if calendar.isleap(time['year']):
-            dayspermonth = np.atleast_2d([31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])
-        else:
-            dayspermonth = np.atleast_2d([31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])
-        # jday[0, i] = np.sum(dayspermonth[0, 0:time['month']-1]) + time['day'] # bug when a new day 20191015
-        YYYY[0, i] = met[i, 0]
-        doy = YMD.timetuple().tm_yday
-        jday[0, i] = doy
-        if (doy > leafon1) | (doy < leafoff1):
-            leafon[0, i] = 1
-        else:
-            leafon[0, i] = 0
+    YMD = [datetime.datetime(int(met[i, 0]), 1, 1) + datetime.timedelta(int(met[i, 1]) - 1) for i in range(data_len)]
+
+    # Finding maximum altitude in 15 min intervals (20141027), at the first time step and at each new day
+    newday = np.mod(dectime, np.floor(dectime)) == 0
+    newday[0] = True
+    searchrows = np.flatnonzero(newday)
+    days = sorted(set(YMD[i] for i in searchrows))
+    sunmaximum = dict(zip(days, sun_maximum_altitude(days, location, UTC)))
+    lastsearch = searchrows[np.cumsum(newday) - 1]
+    altmax[0, :] = [sunmaximum[YMD[i]] for i in lastsearch]
+
+    # Sun position in the middle of each time step
+    half = datetime.timedelta(days=halftimestepdec)
+    YMDHM = [YMD[i] + datetime.timedelta(hours=met[i, 2]) + datetime.timedelta(minutes=met[i, 3]) - half
+             for i in range(data_len)]
+    sun = sp.sun_position(sun_position_time(YMDHM, UTC), location)
+    # Hopefully fixes weird values in Perez et al. when altitude < 1.0, i.e. close to sunrise/sunset
+    sun['zenith'][(sun['zenith'] > 89.0) & (sun['zenith'] <= 90.0)] = 89.0
+    altitude[0, :] = 90. - sun['zenith']
+    zen[0, :] = sun['zenith'] * (np.pi/180.)
+    azimuth[0, :] = sun['azimuth']
+
+    # day of year
+    YYYY[0, :] = met[:, 0]
+    doy = np.array([ymd.timetuple().tm_yday for ymd in YMD])
+    jday[0, :] = doy
+    leafon[0, :] = (doy > leafon1) | (doy < leafoff1)
+
+    if cachedir is not None:
+        save_metdata_cache(cachefile, maxbytes, YYYY=YYYY, altitude=altitude, azimuth=azimuth, zen=zen, jday=jday,
+                           leafon=leafon, dectime=dectime, altmax=altmax)
 
     return YYYY, altitude, azimuth, zen, jday, leafon, dectime, altmax
 
 
+def sun_position_time(datetimes, UTC):
+    # time dictionary of arrays for sp.sun_position from a list of datetimes
+    time = dict()
+    time['year'] = np.array([d.year for d in datetimes])
+    time['month'] = np.array([d.month for d in datetimes])
+    time['day'] = np.array([d.day for d in datetimes])
+    time['hour'] = np.array([d.hour for d in datetimes])
+    time['min'] = np.array([d.minute for d in datetimes])
+    time['sec'] = 0
+    time['UTC'] = UTC
+    return time
+
+
+def sun_maximum_altitude(days, location, UTC, chunk=96):
+    """
+    Maximum sun altitude for each day (datetime at midnight). Starting at 10:15 the sun
+    position is evaluated in 15 min steps until the altitude decreases, for all days at
+    once in chunks of steps.
+    """
+    days = list(days)
+    sunmaximum = np.zeros(len(days))
+    previous = np.zeros(len(days))  # altitude before the first step
+    pending = np.arange(len(days))
+    fifteen = 0.
+    while pending.shape[0] > 0:
+        steps = []
+        for k in range(chunk):
+            fifteen = fifteen + 15. / 1440.
+            steps.append(datetime.timedelta(days=(60*10)/1440.0 + fifteen))
+        YMDHM = [days[d] + HM for d in pending for HM in steps]
+        sunmax = sp.sun_position(sun_position_time(YMDHM, UTC), location)
+        alt = 90. - sunmax['zenith'].reshape(pending.shape[0], chunk)
+        prev = np.column_stack((previous[pending], alt[:, :-1]))
+        # the search stops at the first step where the altitude is not increasing
+        stop = ~(prev <= alt)
+        found = stop.any(axis=1)
+        first = np.argmax(stop, axis=1)
+        sunmaximum[pending[found]] = prev[found, first[found]]
+        previous[pending] = alt[:, -1]
+        pending = pending[~found]
+
+    return sunmaximum
+
+
+def metdata_cache_file(inputdata, location, UTC, cachedir):
+    key = hashlib.sha1()
+    key.update(np.ascontiguousarray(inputdata, dtype=float).tobytes())
+    key.update(np.array(inputdata.shape, dtype=np.int64).tobytes())
+    key.update(np.hstack((location['latitude'], location['longitude'], location['altitude'], UTC,
+                          METDATA_CACHE_VERSION)).astype(float).tobytes())
+    return os.path.join(cachedir, 'metdata_' + key.hexdigest() + '.npz')
 
 
+def save_metdata_cache(cachefile, maxbytes, **arrays):
+    # The cache is optional, a failing write (e.g. read-only temp folder) is ignored
+    try:
+        if not os.path.isdir(os.path.dirname(cachefile)):
+            os.makedirs(os.path.dirname(cachefile))
+        tmpfile = cachefile + '.' + str(os.getpid()) + '.tmp'
+        with open(tmpfile, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(tmpfile, cachefile)
+        evict(os.path.dirname(cachefile), maxbytes)
+    except OSError:
+        pass
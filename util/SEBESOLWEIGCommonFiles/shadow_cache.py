@@ -0,0 +1,200 @@
+import hashlib
+import os
+import tempfile
+import numpy as np
+
+from .shadowingfunction_wallheight_13 import shadowingfunction_wallheight_13
+from .shadowingfunction_wallheight_23 import shadowingfunction_wallheight_23
+from .. import shadowingfunctions
+
+# Shadows only depend on the grids (DSM, CDSM, walls...) and the sun position. They are cached on disk, keyed by a
+# hash of the grids and the sun position rounded to a resolution, so that repeated runs on the same grids (e.g.
+# SOLWEIG with other met data, or SEBE and Shadow Generator scenarios) do not have to cast the shadows again.
+# Grids with only zeros and ones are stored bit-packed and all files are compressed. The least recently used
+# files are removed when the cache folder gets larger than maxbytes.
+SHADOW_CACHE_DIR = os.path.join(tempfile.gettempdir(), 'umep_shadow_cache')
+SHADOW_CACHE_VERSION = 1
+
+
+class ShadowCache:
+    """
+    Disk cache of shadows for the shadowing functions, which have the same arguments and results as the
+    functions in shadowingfunction_wallheight_13, shadowingfunction_wallheight_23 and shadowingfunctions.
+
+    cachedir: folder for cached results, None to disable the cache (shadows are always calculated at the exact
+              sun position)
+    maxbytes: size of the cache folder above which the least recently used results are removed
+    resolution: the sun position (degrees) is rounded to this resolution before the shadows are calculated,
+                so that nearly identical sun positions (e.g. the same time of year in another year) share the
+                same shadows. 0 uses the exact sun position.
+    """
+
+    def __init__(self, cachedir=SHADOW_CACHE_DIR, maxbytes=2 * 1024 ** 3, resolution=0.01):
+        self.cachedir = cachedir
+        self.maxbytes = maxbytes
+        self.resolution = resolution
+        self.hits = 0
+        self.misses = 0
+        self.cachebytes = None
+
+    def shadowingfunction_wallheight_13(self, a, azimuth, altitude, scale, walls, aspect, walls_scheme=False,
+                                        aspect_scheme=False):
+        return self.shadows('wallheight_13', azimuth, altitude,
+                            lambda azimuth, altitude: shadowingfunction_wallheight_13(a, azimuth, altitude, scale,
+                                walls, aspect, walls_scheme, aspect_scheme),
+                            a, scale, walls, aspect, walls_scheme, aspect_scheme)
+
+    def shadowingfunction_wallheight_23(self, a, vegdem, vegdem2, azimuth, altitude, scale, amaxvalue, bush, walls,
+                                        aspect, walls_scheme=False, aspect_scheme=False):
+        return self.shadows('wallheight_23', azimuth, altitude,
+                            lambda azimuth, altitude: shadowingfunction_wallheight_23(a, vegdem, vegdem2, azimuth,
+                                altitude, scale, amaxvalue, bush, walls, aspect, walls_scheme, aspect_scheme),
+                            a, vegdem, vegdem2, scale, amaxvalue, bush, walls, aspect, walls_scheme, aspect_scheme)
+
+    def shadowingfunction_20(self, a, vegdem, vegdem2, azimuth, altitude, scale, amaxvalue, bush, feedback, forsvf):
+        return self.shadows('shadowingfunction_20', azimuth, altitude,
+                            lambda azimuth, altitude: shadowingfunctions.shadowingfunction_20(a, vegdem, vegdem2,
+                                azimuth, altitude, scale, amaxvalue, bush, feedback, forsvf),
+                            a, vegdem, vegdem2, scale, amaxvalue, bush)
+
+    def shadowingfunctionglobalradiation(self, a, azimuth, altitude, scale, feedback, forsvf):
+        return self.shadows('globalradiation', azimuth, altitude,
+                            lambda azimuth, altitude: shadowingfunctions.shadowingfunctionglobalradiation(a, azimuth,
+                                altitude, scale, feedback, forsvf),
+                            a, scale)
+
+    def shadows(self, name, azimuth, altitude, calculate, *grids):
+        '''Result of calculate(azimuth, altitude) at the rounded sun position, read from the cache if available.
+        grids are all other inputs of calculate.'''
+        if self.cachedir is None:
+            return calculate(azimuth, altitude)
+
+        if self.resolution > 0:
+            azimuth = int(np.round(azimuth / self.resolution))
+            altitude = int(np.round(altitude / self.resolution))
+            sunkey = str(azimuth) + '_' + str(altitude)
+            azimuth = azimuth * self.resolution
+            altitude = altitude * self.resolution
+        else:
+            sunkey = np.array([azimuth, altitude], dtype=float).tobytes().hex()
+
+        cachefile = os.path.join(self.cachedir, name + '_' + grid_key(self.resolution, *grids) + '_' + sunkey + '.npz')
+        result = load_shadows(cachefile)
+        if result is not None:
+            self.hits += 1
+            return result
+
+        self.misses += 1
+        result = calculate(azimuth, altitude)
+        self.save(cachefile, result)
+        return result
+
+    def save(self, cachefile, result):
+        # The cache is optional, a failing write (e.g. read-only temp folder) is ignored
+        try:
+            if not os.path.isdir(self.cachedir):
+                os.makedirs(self.cachedir)
+            tmpfile = cachefile + '.' + str(os.getpid()) + '.tmp'
+            with open(tmpfile, 'wb') as f:
+                np.savez_compressed(f, **pack_shadows(result))
+            os.replace(tmpfile, cachefile)
+
+            if self.cachebytes is None:
+                self.cachebytes = sum(size for _, size, _ in cache_files(self.cachedir))
+            else:
+                self.cachebytes += os.path.getsize(cachefile)
+            if self.cachebytes > self.maxbytes:
+                self.cachebytes = evict(self.cachedir, self.maxbytes)
+        except OSError:
+            pass
+
+
+def grid_key(*grids):
+    key = hashlib.sha1()
+    key.update(np.array(SHADOW_CACHE_VERSION, dtype=np.int64).tobytes())
+    for grid in grids:
+        grid = np.ascontiguousarray(grid)
+        key.update(grid.dtype.str.encode())
+        key.update(np.array(grid.shape, dtype=np.int64).tobytes())
+        key.update(grid.tobytes())
+    return key.hexdigest()
+
+
+def pack_shadows(result):
+    # Results are tuples of grids (shadowingfunction_wallheight_13/23), dicts of grids (shadowingfunction_20) or
+    # a grid (shadowingfunctionglobalradiation). Grids with only zeros and ones are stored as bits.
+    if isinstance(result, dict):
+        names = list(result.keys())
+        grids = list(result.values())
+    elif isinstance(result, np.ndarray):
+        names = []
+        grids = [result]
+    else:
+        names = []
+        grids = list(result)
+
+    arrays = {'names': np.array(names, dtype=str), 'single': np.array(isinstance(result, np.ndarray))}
+    for i, grid in enumerate(grids):
+        grid = np.asarray(grid)
+        if grid.ndim > 0 and np.all((grid == 0) | (grid == 1)):
+            arrays['bits' + str(i)] = np.packbits(grid == 1)
+            arrays['shape' + str(i)] = np.array(grid.shape, dtype=np.int64)
+            arrays['dtype' + str(i)] = np.array(grid.dtype.str)
+        else:
+            arrays['grid' + str(i)] = grid
+    arrays['count'] = np.array(len(grids))
+    return arrays
+
+
+def load_shadows(cachefile):
+    if not os.path.isfile(cachefile):
+        return None
+    try:
+        with np.load(cachefile) as cached:
+            grids = []
+            for i in range(int(cached['count'])):
+                if ('bits' + str(i)) in cached.files:
+                    shape = tuple(cached['shape' + str(i)])
+                    bits = np.unpackbits(cached['bits' + str(i)], count=int(np.prod(shape)))
+                    grids.append(bits.reshape(shape).astype(str(cached['dtype' + str(i)])))
+                else:
+                    grids.append(cached['grid' + str(i)])
+            names = list(cached['names'])
+            single = bool(cached['single'])
+        # Mark as recently used
+        os.utime(cachefile)
+    except (OSError, ValueError, KeyError):
+        return None
+
+    if single:
+        return grids[0]
+    elif names:
+        return dict(zip(names, grids))
+    else:
+        return tuple(grids)
+
+
+def cache_files(cachedir):
+    # (path, size, last use) of the cached results
+    files = []
+    with os.scandir(cachedir) as entries:
+        for entry in entries:
+            if entry.name.endswith('.npz') and entry.is_file():
+                stat = entry.stat()
+                files.append((entry.path, stat.st_size, stat.st_mtime))
+    return files
+
+
+def evict(cachedir, maxbytes):
+    # Removes the least recently used results until the cache is smaller than maxbytes. Returns the new size.
+    files = sorted(cache_files(cachedir), key=lambda file: file[2])
+    cachebytes = sum(size for _, size, _ in files)
+    for path, size, _ in files:
+        if cachebytes <= maxbytes:
+            break
+        try:
+            os.remove(path)
+            cachebytes -= size
+        except OSError:
+            pass
+    return cachebytes
@@ -0,0 +1,100 @@
+import numpy as np
+
+# Storage of the shadow matrices (shadowmat, vegshadowmat, vbshmat) used by the anisotropic sky scheme.
+# The matrices only hold 0/1 values (rows x cols x patches). They are stored bit-packed along the patch
+# axis (np.packbits) as uint8, i.e. 64 times smaller than float64, and only the requested patches are
+# unpacked when the matrix is indexed. Older float64 shadowmats.npz files can still be read.
+
+
+def pack_shadowmatrix(shmat):
+    # rows x cols x patches of 0/1 -> rows x cols x ceil(patches / 8) uint8
+    return np.packbits(shmat > 0.5, axis=2)
+
+
+class PackedShadowMatrix:
+    """
+    Read-only view of a bit-packed shadow matrix. Indexing unpacks the selected patches to float64,
+    so it can be used in place of the float matrix ([:, :, patch] being the fast path).
+    """
+
+    def __init__(self, packed, patches):
+        self.packed = packed
+        self.patches = int(patches)
+        self.shape = (packed.shape[0], packed.shape[1], self.patches)
+        self.dtype = np.dtype(float)
+
+    def patch(self, idx):
+        if idx < 0:
+            idx = idx + self.patches
+        if not 0 <= idx < self.patches:
+            raise IndexError('Patch ' + str(idx) + ' is out of bounds for ' + str(self.patches) + ' patches')
+        # np.packbits is big endian, i.e. patch 0 is the most significant bit of byte 0
+        bits = np.right_shift(self.packed[:, :, idx >> 3], 7 - (idx & 7))
+        return np.bitwise_and(bits, 1).astype(float)
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple) and len(key) == 3 and key[0] == slice(None) and key[1] == slice(None) \
+                and isinstance(key[2], (int, np.integer)):
+            return self.patch(int(key[2]))
+
+        if not isinstance(key, tuple):
+            key = (key,)
+        if len(key) > 3 or any(k is Ellipsis or k is None for k in key):
+            raise IndexError('Unsupported index for a packed shadow matrix: ' + repr(key))
+        key = key + (slice(None),) * (3 - len(key))
+
+        # Only the bytes from the first to the last selected patch are unpacked. The patch index is shifted
+        # to these bytes keeping its kind (int, slice or array), so that the result is the same as indexing
+        # the float matrix with key.
+        patches = np.arange(self.patches)[key[2]]
+        if patches.size > 0:
+            first = int(patches.min()) >> 3
+            last = int(patches.max()) >> 3
+        else:
+            first = last = 0
+        unpacked = np.unpackbits(self.packed[:, :, first:last + 1], axis=2)
+        offset = 8 * first
+        if isinstance(key[2], slice):
+            if patches.size > 0:
+                step = 1 if key[2].step is None else key[2].step
+                stop = int(patches[-1]) - offset + (1 if step > 0 else -1)
+                patchkey = slice(int(patches[0]) - offset, stop if stop >= 0 else None, step)
+            else:
+                patchkey = slice(0, 0)
+        elif np.ndim(patches) == 0:
+            patchkey = int(patches) - offset
+        else:
+            patchkey = patches - offset
+        return unpacked[key[0], key[1], patchkey].astype(float)
+
+
+class DiffuseShadowMatrix:
+    """
+    diffsh used in the anisotropic sky scheme, shmat - (1 - vegshmat) * (1 - transVeg),
+    evaluated per patch instead of being stored for all patches.
+    """
+
+    def __init__(self, shmat, vegshmat, transVeg):
+        self.shmat = shmat
+        self.vegshmat = vegshmat
+        self.transVeg = transVeg
+        self.shape = shmat.shape
+        self.dtype = np.dtype(float)
+
+    def __getitem__(self, key):
+        return self.shmat[key] - (1 - self.vegshmat[key]) * (1 - self.transVeg)  # changes in psi not implemented yet
+
+
+def load_shadowmatrices(filename):
+    # Returns shmat, vegshmat, vbshvegshmat from a shadowmats.npz file written by the Sky View Factor tool.
+    data = np.load(filename)
+    shmat = data['shadowmat']
+    vegshmat = data['vegshadowmat']
+    vbshvegshmat = data['vbshmat']
+    if 'patches' in data.files:
+        patches = int(data['patches'])
+        shmat = PackedShadowMatrix(shmat, patches)
+        vegshmat = PackedShadowMatrix(vegshmat, patches)
+        vbshvegshmat = PackedShadowMatrix(vbshvegshmat, patches)
+
+    return shmat, vegshmat, vbshvegshmat
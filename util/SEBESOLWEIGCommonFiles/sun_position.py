@@ -42,6 +42,9 @@ def sun_position(time, location):
     %       time.min: minute [0-59]
     %       time.sec: second [0-59]
     %       time.UTC: offset hour from UTC. Local time = Greenwich time + time.UTC
+    %   year, month, day, hour, min and sec can also be numpy arrays of the same shape,
+    %   in which case the sun position is calculated for all times at once and
+    %   sun.zenith and sun.azimuth are arrays of that shape.
     %   This input can also be passed using the Matlab time format ('dd-mmm-yyyy HH:MM:SS').
     %   In that case, the time has to be specified as UTC time (time.UTC = 0)
     %
@@ -180,6 +183,9 @@ def julian_calculation(t_input):
     else:
         time = t_input
 
+    if np.ndim(time['year']) > 0:
+        return julian_calculation_array(time)
+
     if time['month'] == 1 or time['month'] == 2:
         Y = time['year'] - 1
         M = time['month'] + 12
@@ -226,6 +232,49 @@ def julian_calculation(t_input):
     return julian
 
 
+def julian_calculation_array(time):
+    """
+    Array version of julian_calculation for a time dictionary holding arrays.
+    Dates between 5 and 14 October 1582 (which never existed) are not moved
+    to 4 October as in julian_calculation.
+    """
+    year = np.asarray(time['year'])
+    month = np.asarray(time['month'])
+    day = np.asarray(time['day'])
+
+    janfeb = (month == 1) | (month == 2)
+    Y = np.where(janfeb, year - 1, year)
+    M = np.where(janfeb, month + 12, month)
+
+    ut_time = ((time['hour'] - time['UTC'])/24) + (time['min']/(60*24)) + (time['sec']/(60*60*24))   # time of day in UT time.
+    D = day + ut_time
+
+    # Gregorian calendar from October 15, 1582, Julian calendar before that
+    A = np.floor(Y/100)
+    B = 2 - A + np.floor(A/4)
+    juliancalendar = (year < 1582) | ((year == 1582) & ((month < 10) | ((month == 10) & (day < 15))))
+    B = np.where(juliancalendar, 0, B)
+
+    julian = dict()
+    julian['day'] = D + B + np.floor(365.25*(Y+4716)) + np.floor(30.6001*(M+1)) - 1524.5
+
+    delta_t = 0   # 33.184;
+    julian['ephemeris_day'] = (julian['day']) + (delta_t/86400)
+    julian['century'] = (julian['day'] - 2451545) / 36525
+    julian['ephemeris_century'] = (julian['ephemeris_day'] - 2451545) / 36525
+    julian['ephemeris_millenium'] = (julian['ephemeris_century']) / 10
+
+    return julian
+
+
+def periodic_terms_sum(A, B, C, JME):
+    """
+    Sum of A * cos(B + C * JME) over the tabulated terms, for a scalar JME or
+    for each element of an array of JME.
+    """
+    return np.sum(A * np.cos(B + np.multiply.outer(JME, C)), axis=-1)
+
+
 def earth_heliocentric_position_calculation(julian):
     """
     % This function compute the earth position relative to the sun, using
@@ -398,12 +447,12 @@ def earth_heliocentric_position_calculation(julian):
     JME = julian['ephemeris_millenium']
 
     # Compute the Earth Heliochentric longitude from the tabulated values.
-    L0 = np.sum(A0 * np.cos(B0 + (C0 * JME)))
-    L1 = np.sum(A1 * np.cos(B1 + (C1 * JME)))
-    L2 = np.sum(A2 * np.cos(B2 + (C2 * JME)))
-    L3 = np.sum(A3 * np.cos(B3 + (C3 * JME)))
-    L4 = np.sum(A4 * np.cos(B4 + (C4 * JME)))
-    L5 = A5 * np.cos(B5 + (C5 * JME))
+    L0 = periodic_terms_sum(A0, B0, C0, JME)
+    L1 = periodic_terms_sum(A1, B1, C1, JME)
+    L2 = periodic_terms_sum(A2, B2, C2, JME)
+    L3 = periodic_terms_sum(A3, B3, C3, JME)
+    L4 = periodic_terms_sum(A4, B4, C4, JME)
+    L5 = periodic_terms_sum(A5, B5, C5, JME)
 
     earth_heliocentric_position = dict()
     earth_heliocentric_position['longitude'] = (L0 + (L1 * JME) + (L2 * np.power(JME, 2)) +
@@ -435,8 +484,8 @@ def earth_heliocentric_position_calculation(julian):
     B1 = B1_terms[:, 1]
     C1 = B1_terms[:, 2]
     
-    L0 = np.sum(A0 * np.cos(B0 + (C0 * JME)))
-    L1 = np.sum(A1 * np.cos(B1 + (C1 * JME)))
+    L0 = periodic_terms_sum(A0, B0, C0, JME)
+    L1 = periodic_terms_sum(A1, B1, C1, JME)
 
     earth_heliocentric_position['latitude'] = (L0 + (L1 * JME)) / 1e8
 
@@ -534,11 +583,11 @@ def earth_heliocentric_position_calculation(julian):
     C4 = R4_terms[:, 2]
 
     # Compute the Earth heliocentric radius vector
-    L0 = np.sum(A0 * np.cos(B0 + (C0 * JME)))
-    L1 = np.sum(A1 * np.cos(B1 + (C1 * JME)))
-    L2 = np.sum(A2 * np.cos(B2 + (C2 * JME)))
-    L3 = np.sum(A3 * np.cos(B3 + (C3 * JME)))
-    L4 = A4 * np.cos(B4 + (C4 * JME))
+    L0 = periodic_terms_sum(A0, B0, C0, JME)
+    L1 = periodic_terms_sum(A1, B1, C1, JME)
+    L2 = periodic_terms_sum(A2, B2, C2, JME)
+    L3 = periodic_terms_sum(A3, B3, C3, JME)
+    L4 = periodic_terms_sum(A4, B4, C4, JME)
 
     # Units are in AU
     earth_heliocentric_position['radius'] = (L0 + (L1 * JME) + (L2 * np.power(JME, 2)) +
@@ -738,17 +787,21 @@ def nutation_calculation(julian):
     # delta_obliquity.
     Xi = np.array([X0, X1, X2, X3, X4])    # a col mat in octave
 
-    tabulated_argument = Y_terms.dot(np.transpose(Xi)) * (np.pi/180)
+    tabulated_argument = Y_terms.dot(Xi) * (np.pi/180)
+
+    if np.ndim(JCE) > 0:
+        # terms x times when calculated for an array of times
+        nutation_terms = nutation_terms[:, :, np.newaxis]
 
     delta_longitude = (nutation_terms[:, 0] + (nutation_terms[:, 1] * JCE)) * np.sin(tabulated_argument)
     delta_obliquity = (nutation_terms[:, 2] + (nutation_terms[:, 3] * JCE)) * np.cos(tabulated_argument)
 
     nutation = dict()    # init nutation dictionary
     # Nutation in longitude
-    nutation['longitude'] = np.sum(delta_longitude) / 36000000
+    nutation['longitude'] = np.sum(delta_longitude, axis=0) / 36000000
 
     # Nutation in obliquity
-    nutation['obliquity'] = np.sum(delta_obliquity) / 36000000
+    nutation['obliquity'] = np.sum(delta_obliquity, axis=0) / 36000000
 
     return nutation
 
@@ -995,7 +1048,9 @@ def set_to_range(var, min_interval, max_interval):
     """
     var = var - max_interval * np.floor(var/max_interval)
 
-    if var < min_interval:
+    if np.ndim(var) > 0:
+        var = np.where(var < min_interval, var + max_interval, var)
+    elif var < min_interval:
         var = var + max_interval
     return var
 
@@ -62,6 +62,21 @@ def saverasternd(gdal_data, filename, raster):
     outDs.SetGeoTransform(gdal_data.GetGeoTransform())
     outDs.SetProjection(gdal_data.GetProjection())
 
+def createraster(gdal_data, filename, bands=1):
+    # Empty Float32 GeoTIFF with the extent of gdal_data, for writing in blocks with WriteArray(block, xoff, yoff)
+    rows = gdal_data.RasterYSize
+    cols = gdal_data.RasterXSize
+
+    outDs = gdal.GetDriverByName("GTiff").Create(filename, cols, rows, int(bands), GDT_Float32)
+    for band in range(1, int(bands) + 1):
+        outDs.GetRasterBand(band).SetNoDataValue(-9999)
+
+    # georeference the image and set the projection
+    outDs.SetGeoTransform(gdal_data.GetGeoTransform())
+    outDs.SetProjection(gdal_data.GetProjection())
+
+    return outDs
+
 def xy2latlon(crsWtkIn, x, y):
     old_cs = osr.SpatialReference()
     old_cs.ImportFromWkt(crsWtkIn)
@@ -0,0 +1,116 @@
+# Helpers for running UMEP calculations in a process pool. Large grids are
+# placed in shared memory so that worker processes can read (and write) them
+# without having them pickled for every task.
+
+import os
+import sys
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+
+
+def python_executable():
+    # Inside QGIS, sys.executable is the QGIS binary and not a Python interpreter
+    executable = sys.executable
+    if os.path.basename(executable).lower().startswith('python'):
+        return executable
+
+    if sys.platform == 'win32':
+        candidate = os.path.join(sys.exec_prefix, 'python.exe')
+    else:
+        candidate = os.path.join(sys.exec_prefix, 'bin', 'python3')
+
+    if os.path.isfile(candidate):
+        return candidate
+    else:
+        return executable
+
+
+def process_context():
+    # spawn is used on all platforms since fork is unsafe from within the QGIS process
+    ctx = multiprocessing.get_context('spawn')
+    ctx.set_executable(python_executable())
+    return ctx
+
+
+def default_workers():
+    return max(os.cpu_count() or 1, 1)
+
+
+def share_array(array):
+    # Copy array into a new shared memory block. Returns the block (keep a reference
+    # in the parent and release it when done) and a picklable spec for attach_array.
+    array = np.ascontiguousarray(array)
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    shared = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)
+    shared[...] = array
+    spec = (shm.name, array.shape, array.dtype.str)
+    return shm, shared, spec
+
+
+def empty_shared_array(shape, dtype=float):
+    dtype = np.dtype(dtype)
+    shm = shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape)) * dtype.itemsize, 1))
+    shared = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    shared[...] = 0
+    spec = (shm.name, tuple(shape), dtype.str)
+    return shm, shared, spec
+
+
+def attach_array(spec):
+    # Used in worker processes. Keep the returned block referenced as long as the array is used.
+    name, shape, dtype = spec
+    shm = shared_memory.SharedMemory(name=name)
+    array = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+    return shm, array
+
+
+def release_shared(blocks):
+    for shm in blocks:
+        shm.close()
+        shm.unlink()
+
+
+def terminate(pool):
+    # Shuts down a ProcessPoolExecutor without waiting for the running tasks (e.g. when the calculation is cancelled):
+    # the pending tasks are cancelled and the worker processes stopped
+    processes = list((pool._processes or {}).values())
+    pool.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        if process.is_alive():
+            process.terminate()
+
+
+# Size of the shared output buffers (both halves, see rounds) above which rounds are made smaller
+SHARED_OUTPUT_BYTES = 512 * 1024 ** 2
+
+
+def round_size(workers, count, slotbytes, perworker=2):
+    # Number of items (e.g. directions or sky patches) per round for rounds of a few items per worker, with
+    # slotbytes of shared output per item. Large grids get smaller rounds, but at least one item per worker.
+    size = min(workers * perworker, max(SHARED_OUTPUT_BYTES // (2 * max(slotbytes, 1)), workers))
+    return max(min(size, count), 1)
+
+
+def rounds(pool, task, count, roundsize, workers, *itemargs):
+    '''Runs task(half, slots, *items) in pool for rounds of roundsize items, split in one group per worker. slots
+    are the positions of the items in the round and items the values of itemargs for them. The rounds alternate
+    between the two halves (0, 1) of the shared output, so that the next round is calculated while the caller
+    reads the results of a round. Yields (half, start, stop) when the items start:stop are finished.'''
+    def submit(start):
+        stop = min(start + roundsize, count)
+        half = (start // roundsize) % 2
+        tasks = []
+        for group in np.array_split(np.arange(start, stop), workers):
+            if group.shape[0] > 0:
+                tasks.append(pool.submit(task, half, [int(index - start) for index in group],
+                                         *[[itemarg[index] for index in group] for itemarg in itemargs]))
+        return half, start, stop, tasks
+
+    pending = submit(0) if count > 0 else None
+    while pending is not None:
+        half, start, stop, tasks = pending
+        for finished in tasks:
+            finished.result()
+        pending = submit(stop) if stop < count else None
+        yield half, start, stop
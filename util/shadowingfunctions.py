@@ -2,7 +2,7 @@
 # Ready for python action!
 import numpy as np
 from math import radians
-import matplotlib.pylab as plt
+# import matplotlib.pylab as plt
 # from numba import jit
 
 def shadowingfunctionglobalradiation(a, azimuth, altitude, scale, feedback, forsvf):
@@ -84,79 +84,72 @@ def shadowingfunctionglobalradiation(a, azimuth, altitude, scale, feedback, fors
 # @jit(nopython=True)
 def shadowingfunction_20(a, vegdem, vegdem2, azimuth, altitude, scale, amaxvalue, bush, feedback, forsvf):
 
-    # plt.ion()
-    # fig = plt.figure(figsize=(24, 7))
-    # plt.axis('image')
-    # ax1 = plt.subplot(2, 3, 1)
-    # ax2 = plt.subplot(2, 3, 2)
-    # ax3 = plt.subplot(2, 3, 3)
-    # ax4 = plt.subplot(2, 3, 4)
-    # ax5 = plt.subplot(2, 3, 5)
-    # ax6 = plt.subplot(2, 3, 6)
-    # ax1.title.set_text('fabovea')
-    # ax2.title.set_text('gabovea')
-    # ax3.title.set_text('vegsh at ' + str(altitude))
-    # ax4.title.set_text('lastfabovea')
-    # ax5.title.set_text('lastgabovea')
-    # ax6.title.set_text('vegdem')
-
     # This function casts shadows on buildings and vegetation units.
     # New capability to deal with pergolas 20210827
+    # The march schedule is computed once and only the shifted sub-window is updated
+    # at each step, see shadow_march_20.
 
-    # conversion
-    degrees = np.pi/180.
-    azimuth = azimuth * degrees
-    altitude = altitude * degrees
-    
     # measure the size of grid
     sizex = a.shape[0]
     sizey = a.shape[1]
-    
+
     # progressbar for svf plugin
+    total = None
     if forsvf == 0:
         barstep = np.max([sizex, sizey])
         total = 100. / barstep
         feedback.setProgress(0)
-        # dlg.progressBar.setRange(0, barstep)
-        # dlg.progressBar.setValue(0)
+    else:
+        feedback = None
 
-    # initialise parameters
-    dx = 0.
-    dy = 0.
-    dz = 0.
-    temp = np.zeros((sizex, sizey))
-    tempvegdem = np.zeros((sizex, sizey))
-    tempvegdem2 = np.zeros((sizex, sizey))
-    templastfabovea = np.zeros((sizex, sizey))
-    templastgabovea = np.zeros((sizex, sizey))
-    bushplant = bush > 1.
-    sh = np.zeros((sizex, sizey)) #shadows from buildings
-    vbshvegsh = np.zeros((sizex, sizey)) #vegetation blocking buildings
-    vegsh = np.add(np.zeros((sizex, sizey)), bushplant, dtype=float) #vegetation shadow
-    f = a
+    steps = shadow_march_steps(shadow_march_schedule(azimuth, sizex, sizey), altitude, scale, amaxvalue)
 
+    f = a.astype(float)
+    shbool = np.zeros((sizex, sizey), dtype=bool)
+    vegshbool = np.zeros((sizex, sizey), dtype=bool)
+    vegshbool[:, :] = bush > 1.
+    vbshbool = np.zeros((sizex, sizey), dtype=bool)
+    shadow_march_20(a, vegdem, vegdem2, steps, f, shbool, vegshbool, vbshbool, shadow_march_buffers(sizex, sizey),
+                    feedback, total)
+
+    sh = 1. - shbool
+    vbshvegsh = 1. - np.subtract(vbshbool, vegshbool, dtype=float)
+    vegsh = 1. - vegshbool
+
+    shadowresult = {'sh': sh, 'vegsh': vegsh, 'vbshvegsh': vbshvegsh}
+
+    return shadowresult
+
+
+def shadow_march_schedule(azimuth, sizex, sizey):
+    """
+    Shift offsets of the shadow casting march for one azimuth (degrees).
+
+    dx, dy and the incremental distance ds only depend on azimuth and grid size,
+    so the schedule can be shared by all sky directions with the same azimuth.
+    The schedule ends at the first step that leaves the grid, as the while loop
+    in shadowingfunction_20 does.
+    """
+    azimuth = azimuth * (np.pi / 180.)
     pibyfour = np.pi / 4.
     threetimespibyfour = 3. * pibyfour
-    fivetimespibyfour = 5.* pibyfour
+    fivetimespibyfour = 5. * pibyfour
     seventimespibyfour = 7. * pibyfour
     sinazimuth = np.sin(azimuth)
     cosazimuth = np.cos(azimuth)
     tanazimuth = np.tan(azimuth)
     signsinazimuth = np.sign(sinazimuth)
     signcosazimuth = np.sign(cosazimuth)
-    dssin = np.abs((1./sinazimuth))
-    dscos = np.abs((1./cosazimuth))
-    tanaltitudebyscale = np.tan(altitude) / scale
-    # index = 1
-    index = 0
+    dssin = np.abs((1. / sinazimuth))
+    dscos = np.abs((1. / cosazimuth))
 
-    # new case with pergola (thin vertical layer of vegetation), August 2021
-    dzprev = 0
-
-    # main loop
-    while (amaxvalue >= dz) and (np.abs(dx) < sizex) and (np.abs(dy) < sizey):
-        if forsvf == 0:
-            feedback.setProgress(int(index * total)) #dlg.progressBar.setValue(index)
+    dxs = []
+    dys = []
+    dss = []
+    dx = 0.
+    dy = 0.
+    index = 0.
+    while (np.abs(dx) < sizex) and (np.abs(dy) < sizey):
         if ((pibyfour <= azimuth) and (azimuth < threetimespibyfour) or (fivetimespibyfour <= azimuth) and (azimuth < seventimespibyfour)):
             dy = signsinazimuth * index
             dx = -1. * signcosazimuth * np.abs(np.round(index / tanazimuth))
@@ -165,13 +158,35 @@ def shadowingfunction_20(a, vegdem, vegdem2, azimuth, altitude, scale, amaxvalue
             dy = signsinazimuth * np.abs(np.round(index * tanazimuth))
             dx = -1. * signcosazimuth * index
             ds = dscos
-        # note: dx and dy represent absolute values while ds is an incremental value
-        dz = (ds * index) * tanaltitudebyscale
-        tempvegdem[0:sizex, 0:sizey] = 0.
-        tempvegdem2[0:sizex, 0:sizey] = 0.
-        temp[0:sizex, 0:sizey] = 0.
-        templastfabovea[0:sizex, 0:sizey] = 0.
-        templastgabovea[0:sizex, 0:sizey] = 0.
+        dxs.append(dx)
+        dys.append(dy)
+        dss.append(ds)
+        index += 1.
+
+    schedule = {'dx': np.array(dxs), 'dy': np.array(dys), 'ds': np.array(dss), 'sizex': sizex, 'sizey': sizey}
+
+    return schedule
+
+
+def shadow_march_steps(schedule, altitude, scale, amaxvalue):
+    """
+    March steps of one sky direction taken from a shared azimuth schedule.
+
+    Returns a list of (xc1, xc2, yc1, yc2, xp1, xp2, yp1, yp2, dz, dzprev), cut off
+    where the while loop in shadowingfunction_20 would stop (amaxvalue < dz).
+    """
+    sizex = schedule['sizex']
+    sizey = schedule['sizey']
+    tanaltitudebyscale = np.tan(altitude * (np.pi / 180.)) / scale
+    steps = []
+    dz = 0.
+    dzprev = 0.
+    for index in range(schedule['dx'].shape[0]):
+        if not (amaxvalue >= dz):
+            break
+        dx = schedule['dx'][index]
+        dy = schedule['dy'][index]
+        dz = (schedule['ds'][index] * float(index)) * tanaltitudebyscale
         absdx = np.abs(dx)
         absdy = np.abs(dy)
         xc1 = int((dx+absdx)/2.)
@@ -182,79 +197,225 @@ def shadowingfunction_20(a, vegdem, vegdem2, azimuth, altitude, scale, amaxvalue
         xp2 = int(sizex-(dx+absdx)/2.)
         yp1 = int(-((dy-absdy)/2.))
         yp2 = int(sizey-(dy+absdy)/2.)
+        steps.append((xc1, xc2, yc1, yc2, xp1, xp2, yp1, yp2, dz, dzprev))
+        dzprev = dz
 
-        tempvegdem[xp1:xp2, yp1:yp2] = vegdem[xc1:xc2, yc1:yc2] - dz
-        tempvegdem2[xp1:xp2, yp1:yp2] = vegdem2[xc1:xc2, yc1:yc2] - dz
-        temp[xp1:xp2, yp1:yp2] = a[xc1:xc2, yc1:yc2]-dz
+    return steps
 
-        f = np.fmax(f, temp) #Moving building shadow
-        sh[(f > a)] = 1.
-        sh[(f <= a)] = 0.
-        fabovea = tempvegdem > a #vegdem above DEM
-        gabovea = tempvegdem2 > a #vegdem2 above DEM
-        
-        #new pergola condition
-        templastfabovea[xp1:xp2, yp1:yp2] = vegdem[xc1:xc2, yc1:yc2]-dzprev
-        templastgabovea[xp1:xp2, yp1:yp2] = vegdem2[xc1:xc2, yc1:yc2]-dzprev
-        lastfabovea = templastfabovea > a
-        lastgabovea = templastgabovea > a
-        dzprev = dz
-        vegsh2 = np.add(np.add(np.add(fabovea, gabovea, dtype=float),lastfabovea, dtype=float),lastgabovea, dtype=float)
-        vegsh2[vegsh2 == 4] = 0.
-        # vegsh2[vegsh2 == 1] = 0. # This one is the ultimate question...
-        vegsh2[vegsh2 > 0] = 1.
 
-        vegsh = np.fmax(vegsh, vegsh2)
-        vegsh[(vegsh * sh > 0.)] = 0.
-        vbshvegsh = vegsh + vbshvegsh # removing shadows 'behind' buildings
-
-        # im1 = ax1.imshow(fabovea)
-        # im2 = ax2.imshow(gabovea)
-        # im3 = ax3.imshow(vegsh)
-        # im4 = ax4.imshow(lastfabovea)
-        # im5 = ax5.imshow(lastgabovea)
-        # im6 = ax6.imshow(vegshtest)
-        # im1 = ax1.imshow(tempvegdem)
-        # im2 = ax2.imshow(tempvegdem2)
-        # im3 = ax3.imshow(vegsh)
-        # im4 = ax4.imshow(templastfabovea)
-        # im5 = ax5.imshow(templastgabovea)
-        # im6 = ax6.imshow(vegshtest)
-        # plt.show()
-        # plt.pause(0.05)
+def shadow_march_buffers(sizex, sizey, vegetation=True):
+    # Scratch buffers for shadow_march_20/shadow_march_buildings, large enough for any window of the grid
+    size = sizex * sizey
+    buffers = {'temp': np.zeros(size)}
+    if vegetation:
+        for name in ('fabovea', 'gabovea', 'lastfabovea', 'lastgabovea', 'vegsh2'):
+            buffers[name] = np.zeros(size, dtype=bool)
 
-        index += 1.
+    return buffers
 
-    sh = 1.-sh
-    vbshvegsh[(vbshvegsh > 0.)] = 1.
-    vbshvegsh = vbshvegsh-vegsh
-    vegsh = 1.-vegsh
-    vbshvegsh = 1.-vbshvegsh
 
-    # plt.close()
-    # plt.ion()
-    # fig = plt.figure(figsize=(24, 7))
-    # plt.axis('image')
-    # ax1 = plt.subplot(1, 3, 1)
-    # im1 = ax1.imshow(vegsh)
-    # plt.colorbar(im1)
-
-    # ax2 = plt.subplot(1, 3, 2)
-    # im2 = ax2.imshow(vegdem2)
-    # plt.colorbar(im2)
-    # plt.title('TDSM')
-
-    # ax3 = plt.subplot(1, 3, 3)
-    # im3 = ax3.imshow(vegdem)
-    # plt.colorbar(im3)
-    # plt.tight_layout()
-    # plt.title('CDSM')
-    # plt.show()
-    # plt.pause(0.05)
+def _window_buffer(buffer, shape):
+    # Contiguous view of the first part of a flat scratch buffer
+    return buffer[:shape[0] * shape[1]].reshape(shape)
+
+
+def _exposed_strips(previous, window):
+    # Parts of the previous shifted window that are outside the current (smaller) one
+    px1, px2, py1, py2 = previous
+    x1, x2, y1, y2 = window
+    strips = []
+    if x1 > px1:
+        strips.append((slice(px1, x1), slice(py1, py2)))
+    if x2 < px2:
+        strips.append((slice(x2, px2), slice(py1, py2)))
+    if y1 > py1:
+        strips.append((slice(x1, x2), slice(py1, y1)))
+    if y2 < py2:
+        strips.append((slice(x1, x2), slice(y2, py2)))
+
+    return strips
+
 
+def shadow_march_20(a, vegdem, vegdem2, steps, f, shbool, vegshbool, vbshbool, buffers, feedback=None, total=None):
+    """
+    Shadow casting march of shadowingfunction_20 for one sky direction, updated in place.
+
+    f, shbool, vegshbool and vbshbool have to be set to a, False, bush > 1. and False
+    before the call. steps is the march schedule from shadow_march_steps and buffers
+    come from shadow_march_buffers.
+
+    Only the shifted sub-window is updated at each step. Outside of it the shifted grids
+    of shadowingfunction_20 are zero, so the cells that leave the window are updated once
+    with zero heights and are not affected by later steps, as the window only shrinks.
+    """
+    sizex = a.shape[0]
+    sizey = a.shape[1]
+    previous = (0, sizex, 0, sizey)
+    for index, (xc1, xc2, yc1, yc2, xp1, xp2, yp1, yp2, dz, dzprev) in enumerate(steps):
+        if feedback is not None:
+            feedback.setProgress(int(index * total))
+
+        for strip in _exposed_strips(previous, (xp1, xp2, yp1, yp2)):
+            fs = f[strip]
+            shs = shbool[strip]
+            vegshs = vegshbool[strip]
+            np.fmax(fs, 0., out=fs)
+            np.greater(fs, a[strip], out=shs)
+            np.greater(vegshs, shs, out=vegshs)  # vegsh and not sh
+            np.logical_or(vbshbool[strip], vegshs, out=vbshbool[strip])
+        previous = (xp1, xp2, yp1, yp2)
+
+        window = (slice(xp1, xp2), slice(yp1, yp2))
+        shifted = (slice(xc1, xc2), slice(yc1, yc2))
+        shape = (xp2 - xp1, yp2 - yp1)
+        temp = _window_buffer(buffers['temp'], shape)
+        fabovea = _window_buffer(buffers['fabovea'], shape)
+        gabovea = _window_buffer(buffers['gabovea'], shape)
+        lastfabovea = _window_buffer(buffers['lastfabovea'], shape)
+        lastgabovea = _window_buffer(buffers['lastgabovea'], shape)
+        vegsh2 = _window_buffer(buffers['vegsh2'], shape)
+        aw = a[window]
+        fw = f[window]
+        shw = shbool[window]
+        vegshw = vegshbool[window]
+
+        np.subtract(a[shifted], dz, out=temp)
+        np.fmax(fw, temp, out=fw)  # Moving building shadow
+        np.greater(fw, aw, out=shw)
+        np.subtract(vegdem[shifted], dz, out=temp)
+        np.greater(temp, aw, out=fabovea)  # vegdem above DEM
+        np.subtract(vegdem2[shifted], dz, out=temp)
+        np.greater(temp, aw, out=gabovea)  # vegdem2 above DEM
+
+        # pergola condition (thin vertical layer of vegetation), August 2021
+        np.subtract(vegdem[shifted], dzprev, out=temp)
+        np.greater(temp, aw, out=lastfabovea)
+        np.subtract(vegdem2[shifted], dzprev, out=temp)
+        np.greater(temp, aw, out=lastgabovea)
+
+        # vegsh2 is one where 1-3 of the four conditions hold, zero where none or all four do
+        np.logical_or(fabovea, gabovea, out=vegsh2)
+        np.logical_or(vegsh2, lastfabovea, out=vegsh2)
+        np.logical_or(vegsh2, lastgabovea, out=vegsh2)
+        np.logical_and(fabovea, gabovea, out=fabovea)
+        np.logical_and(fabovea, lastfabovea, out=fabovea)
+        np.logical_and(fabovea, lastgabovea, out=fabovea)
+        np.greater(vegsh2, fabovea, out=vegsh2)
+
+        np.logical_or(vegshw, vegsh2, out=vegshw)
+        np.greater(vegshw, shw, out=vegshw)
+        vbshw = vbshbool[window]
+        np.logical_or(vbshw, vegshw, out=vbshw)  # removing shadows 'behind' buildings
+
+
+def shadow_march_buildings(a, steps, f, buffers):
+    """
+    Building shadow march of shadowingfunctionglobalradiation for one sky direction.
+    f has to be set to a before the call and holds the shadow casting heights afterwards.
+    Only the shifted sub-window is updated at each step, see shadow_march_20.
+    """
+    sizex = a.shape[0]
+    sizey = a.shape[1]
+    previous = (0, sizex, 0, sizey)
+    for xc1, xc2, yc1, yc2, xp1, xp2, yp1, yp2, dz, dzprev in steps:
+        for strip in _exposed_strips(previous, (xp1, xp2, yp1, yp2)):
+            np.fmax(f[strip], 0., out=f[strip])
+        previous = (xp1, xp2, yp1, yp2)
+
+        temp = _window_buffer(buffers['temp'], (xp2 - xp1, yp2 - yp1))
+        fw = f[xp1:xp2, yp1:yp2]
+        np.subtract(a[xc1:xc2, yc1:yc2], dz, out=temp)
+        np.fmax(fw, temp, out=fw)
+
+
+def shadowingfunction_20_batch(a, vegdem, vegdem2, azimuths, altitudes, scale, amaxvalue, bush,
+                               shmat=None, vegshmat=None, vbshvegshmat=None):
+    """
+    Batched version of shadowingfunction_20 for many sky directions on the same grids.
+
+    March schedules are shared between directions with the same azimuth and all
+    scratch buffers are allocated once and reused for every direction. If the
+    shadow stacks (rows x cols x directions) are given, each result is written
+    straight into its layer.
+
+    Generator yielding (index, shadowresult) in the order of azimuths/altitudes.
+    The arrays in shadowresult are reused buffers, valid until the next iteration.
+    """
+    sizex = a.shape[0]
+    sizey = a.shape[1]
+
+    buffers = shadow_march_buffers(sizex, sizey)
+    f = np.zeros((sizex, sizey))
+    shbool = np.zeros((sizex, sizey), dtype=bool)
+    vegshbool = np.zeros((sizex, sizey), dtype=bool)
+    vbshbool = np.zeros((sizex, sizey), dtype=bool)
+    bushplant = bush > 1.
+
+    sh = np.zeros((sizex, sizey))
+    vegsh = np.zeros((sizex, sizey))
+    vbshvegsh = np.zeros((sizex, sizey))
     shadowresult = {'sh': sh, 'vegsh': vegsh, 'vbshvegsh': vbshvegsh}
 
-    return shadowresult
+    schedules = {}
+    for index in range(len(azimuths)):
+        azimuth = azimuths[index]
+        if azimuth not in schedules:
+            schedules[azimuth] = shadow_march_schedule(azimuth, sizex, sizey)
+        steps = shadow_march_steps(schedules[azimuth], altitudes[index], scale, amaxvalue)
+
+        f[:, :] = a
+        shbool[:, :] = False
+        vegshbool[:, :] = bushplant
+        vbshbool[:, :] = False
+        shadow_march_20(a, vegdem, vegdem2, steps, f, shbool, vegshbool, vbshbool, buffers)
+
+        np.subtract(1., shbool, out=sh)
+        np.subtract(1., np.subtract(vbshbool, vegshbool, dtype=float), out=vbshvegsh)
+        np.subtract(1., vegshbool, out=vegsh)
+
+        if shmat is not None:
+            shmat[:, :, index] = sh
+        if vegshmat is not None:
+            vegshmat[:, :, index] = vegsh
+        if vbshvegshmat is not None:
+            vbshvegshmat[:, :, index] = vbshvegsh
+
+        yield index, shadowresult
+
+
+def shadowingfunctionglobalradiation_batch(a, azimuths, altitudes, scale, shmat=None, amaxvalue=None):
+    """
+    Batched version of shadowingfunctionglobalradiation (buildings only) for many sky directions.
+
+    Shares march schedules between directions with the same azimuth and reuses
+    all buffers. Generator yielding (index, sh); sh is a reused buffer.
+    amaxvalue defaults to a.max(), but can be set when a is a tile of a larger grid.
+    """
+    sizex = a.shape[0]
+    sizey = a.shape[1]
+    if amaxvalue is None:
+        amaxvalue = a.max()
+
+    buffers = shadow_march_buffers(sizex, sizey, vegetation=False)
+    f = np.zeros((sizex, sizey))
+    sh = np.zeros((sizex, sizey))
+
+    schedules = {}
+    for index in range(len(azimuths)):
+        azimuth = azimuths[index]
+        if azimuth not in schedules:
+            schedules[azimuth] = shadow_march_schedule(azimuth, sizex, sizey)
+        steps = shadow_march_steps(schedules[azimuth], altitudes[index], scale, amaxvalue)
+
+        f[:, :] = a
+        shadow_march_buildings(a, steps, f, buffers)
+
+        np.equal(f, a, out=sh, casting='unsafe')
+
+        if shmat is not None:
+            shmat[:, :, index] = sh
+
+        yield index, sh
 
 
 def shadowingfunction_20_old(a, vegdem, vegdem2, azimuth, altitude, scale, amaxvalue, bush, dlg, forsvf):
@@ -99,6 +99,10 @@ def write_solweig_config(configDict, refdir):
     f.write("savebuild={}\n".format(configDict['savebuild']))   
     f.write("outputkdiff={}\n".format(configDict['outputkdiff']))       
     f.write("outputtreeplanter={}\n".format(configDict['outputtreeplanter']))   
+    f.write("# format of output rasters: GeoTIFF per time step (0), multiband GeoTIFF per variable (1), NetCDF per variable (2)\n")
+    f.write("outputformat={}\n".format(configDict.get('outputformat', 0)))
+    f.write("# cache shadows on disk to reuse them in later runs on the same grids (1) or not (0)\n")
+    f.write("shadowcache={}\n".format(configDict.get('shadowcache', 0)))
     f.write("wallnetcdf={}\n".format(configDict['wallnetcdf']))   
     f.write("#-------------------------------------------------------\n")
     f.write("# dates - used if an EPW-file is used\n")    